@@ -7,7 +7,12 @@ def create_app() -> Flask:
     CORS(app)
     return app
 
-# Re-export the WSGI app so `gunicorn app:app` works
-from .main import app as app  # noqa: E402,F401
+# Re-export the WSGI app so `gunicorn app:app` works. Resolved lazily so that
+# importing `app.services.*` from tools and benchmarks doesn't load models or hit Mongo.
+def __getattr__(name):
+    if name == "app":
+        from .main import app
+        return app
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
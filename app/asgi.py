@@ -0,0 +1,646 @@
+"""
+ASGI serving mode: the routes and JSON contracts of app.main on Starlette, with Motor
+for MongoDB.
+
+Request handling never blocks the event loop: uploads are read asynchronously,
+decoding, gallery searches, image writes and file deletes run on the default thread
+pool, model calls on a dedicated pool of ASGI_INFERENCE_THREADS threads, and Mongo
+round trips are awaited. While one request is in the model or scanning the gallery,
+others are reading their upload, waiting on Mongo or cleaning up files in the same
+process. Validation and response bodies are app.handlers, shared with app.main.
+
+    uvicorn app.asgi:app --host 0.0.0.0 --port 8000
+
+Bulk enrollment jobs and the admin migrations are the same thread-based jobs as in
+app.main and use the synchronous driver, off the event loop.
+"""
+import asyncio
+import datetime
+import json
+import os
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from typing import Dict, Optional
+
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.requests import Request
+from starlette.responses import JSONResponse, Response, StreamingResponse
+from starlette.routing import Route
+
+from app import config, handlers, runtime
+from app.db.mongo import get_async_db, get_db, paginate_async
+from app.handlers import UPLOAD_FOLDER
+from app.models.user import PROFILE_PROJECTION, response_projection, user_to_response
+from app.services.batching import BatchingFaceDetector
+from app.services.dedup import describe_matches
+from app.services.enrollment import ImageSource
+from app.services.gallery_sync import TOMBSTONES, insert_stamped, tombstone
+from app.services.image_io import ImageWriter, aiter_frames, decode_base64_image, decode_image
+from app.services.inference_pool import InferencePool, PoolBusyError
+from app.services.lifecycle import Deferred, NotReadyError, readiness
+from app.services.metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, REGISTRY
+from app.tools.migrate_embeddings import migrate_embeddings
+from app.tools.migrate_timestamps import migrate_timestamps
+
+os.makedirs(UPLOAD_FOLDER, exist_ok=True)
+
+image_writer = ImageWriter(asynchronous=config.PERSIST_UPLOADS_ASYNC)
+face_store = runtime.build_face_store(image_writer)
+adb = get_async_db()
+users_col = adb["users"]
+# Deletions, read by the GallerySync of every process
+tombstones_col = adb[TOMBSTONES]
+# Thread-based jobs (enrollment, migrations), the gallery load and its sync keep the synchronous driver
+sync_db = get_db()
+
+# Loaded per STARTUP_MODE, see app.main; handlers await loaded() before using them on the loop
+face_detector, gallery = runtime.deferred_components(sync_db)
+recognize_cache, profile_cache = runtime.build_caches()
+runtime.register_metrics(face_detector, gallery, recognize_cache, profile_cache)
+
+# Registrations and deletions handled by the other workers (or CLI jobs) reach this process's gallery too;
+# polled on a thread with the synchronous driver
+gallery_sync = runtime.start_gallery_sync(sync_db, gallery, recognize_cache, profile_cache)
+
+inference_executor = ThreadPoolExecutor(max_workers=config.ASGI_INFERENCE_THREADS, thread_name_prefix="inference")
+
+
+async def infer(fn, *args):
+    """Run a model call on the inference threads"""
+    return await asyncio.get_running_loop().run_in_executor(inference_executor, fn, *args)
+
+
+async def blocking_io(fn, *args):
+    """Run decoding, gallery searches and file work on the default thread pool"""
+    return await asyncio.to_thread(fn, *args)
+
+
+async def loaded(deferred: Deferred):
+    """
+    The object behind a Deferred; a load still running is waited for off the event loop,
+    for at most READY_WAIT_S (then NotReadyError, answered 503)
+    """
+    if deferred.ready:
+        return deferred.target
+    return await blocking_io(deferred.get, config.READY_WAIT_S)
+
+
+class RequestMetrics:
+    """
+    ASGI middleware: one RequestTimer per HTTP request, labelled with the matched
+    endpoint. No slow-request profiler here: the event loop thread interleaves
+    requests, so its stack samples can't be attributed to one of them.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        timer = runtime.request_timer("unmatched")
+        scope.setdefault("state", {})["request_timer"] = timer
+        status = 500
+
+        async def send_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_status)
+        finally:
+            # The router stores the matched endpoint in the scope
+            timer.route = getattr(scope.get("endpoint"), "__name__", "unmatched")
+            timer.finish(status)
+
+
+def stage(request: Request, name: str):
+    """Time a stage of this request (face_api_stage_seconds{route, stage})"""
+    timer = request.state.request_timer
+    timer.route = request.scope["endpoint"].__name__
+    return timer.stage(name)
+
+
+def answer(result) -> JSONResponse:
+    """(body, status) from app.handlers as a JSONResponse"""
+    body, status = result
+    return JSONResponse(body, status_code=status)
+
+
+def error(message: str, status: int, **extra) -> JSONResponse:
+    return answer(handlers.error(message, status, **extra))
+
+
+async def read_image_field(form) -> Optional[bytes]:
+    """
+    The 'image' upload or the 'image_base64' field, like request.files / request.form in app.main.
+    :return: encoded bytes, or None if neither was sent; raises ValueError on bad base64
+    """
+    image_file = form.get("image")
+    if image_file is not None and not isinstance(image_file, str):
+        return await image_file.read()
+    image_base64 = form.get("image_base64")
+    if image_base64:
+        return decode_base64_image(image_base64)
+    return None
+
+
+# ----------------- Helper functions -----------------
+async def find_user_profile(user_id: str) -> Optional[Dict]:
+    """User doc without embeddings, by user_id or legacy uuid (cached)"""
+    user = profile_cache.get(("user", user_id))
+    if user is not None:
+        return user
+    user = await users_col.find_one({"user_id": user_id}, PROFILE_PROJECTION)
+    if not user:
+        # legacy records keyed by uuid
+        user = await users_col.find_one({"uuid": user_id}, PROFILE_PROJECTION)
+    if user:
+        profile_cache.set(("user", user_id), user)
+    return user
+
+
+async def find_student_profile(student_id: str) -> Optional[Dict]:
+    """User doc without embeddings, by student_id (cached)"""
+    user = profile_cache.get(("student", student_id))
+    if user is None:
+        user = await users_col.find_one({"profile.student_id": student_id}, PROFILE_PROJECTION)
+        if not user:
+            # try legacy
+            user = await users_col.find_one({"student_id": student_id}, PROFILE_PROJECTION)
+        if user:
+            profile_cache.set(("student", student_id), user)
+    return user
+
+
+async def find_user_profiles(user_ids) -> Dict[str, Dict]:
+    """Several user docs keyed by user_id (or legacy uuid); cache misses are read in one query"""
+    found = {}
+    for user_id in set(user_ids):
+        user = profile_cache.get(("user", user_id))
+        if user is not None:
+            found[user_id] = user
+    missing = [i for i in set(user_ids) if i not in found]
+    if missing:
+        fetched = {doc["user_id"]: doc async for doc in users_col.find({"user_id": {"$in": missing}},
+                                                                       PROFILE_PROJECTION)}
+        legacy = [i for i in missing if i not in fetched]
+        if legacy:
+            fetched.update({doc["uuid"]: doc async for doc in users_col.find({"uuid": {"$in": legacy}},
+                                                                             PROFILE_PROJECTION)})
+        for user_id, doc in fetched.items():
+            profile_cache.set(("user", user_id), doc)
+        found.update(fetched)
+    return found
+
+
+def invalidate_user_caches(doc: Dict) -> None:
+    runtime.invalidate_user_caches(recognize_cache, profile_cache, doc)
+
+
+# Bulk enrollment jobs: inputs, state and error reports survive restarts (resume with the same job id)
+enrollment_jobs = runtime.build_enrollment_jobs(sync_db["users"], sync_db["enrollment_jobs"], face_detector, gallery,
+                                                face_store, image_writer, recognize_cache, profile_cache)
+
+
+# ----------------- Routes -----------------
+async def home(request: Request):
+    return JSONResponse({"message": "Face Detection API (InsightFace) is running!"})
+
+
+async def register_user(request: Request):
+    """Same contract as app.main register_user()"""
+    form = await request.form()
+    profile = handlers.profile_form(form.get)
+    student_id = profile["student_id"]
+    images_files = [f for f in form.getlist("images") if not isinstance(f, str) and f.filename]
+    image_file = form.get("image")
+    image_base64 = form.get("image_base64")
+
+    has_file = image_file is not None and not isinstance(image_file, str) and image_file.filename
+    invalid = handlers.invalid_registration(profile, bool(images_files or has_file or image_base64))
+    if invalid:
+        return answer(invalid)
+    # 503 before anything is decoded or written while the model or gallery is still loading
+    detector, resident = await loaded(face_detector), await loaded(gallery)
+
+    with stage(request, "read"):
+        if images_files:
+            uploads = [await f.read() for f in images_files]
+        elif has_file:
+            uploads = [await image_file.read()]
+        else:
+            try:
+                uploads = [decode_base64_image(image_base64)]
+            except Exception as e:
+                return error(f"Invalid image_base64 data: {str(e)}", 400)
+
+    # Decode every upload in parallel, then detect on the inference threads
+    with stage(request, "decode"):
+        images = await asyncio.gather(*(blocking_io(decode_image, data) for data in uploads))
+    pairs = [(data, img) for data, img in zip(uploads, images) if img is not None]
+    with stage(request, "inference"):
+        faces = await asyncio.gather(*(infer(detector.get_best_face, img) for _, img in pairs))
+    detected_faces = [{"face": face, "data": data, "image": img} for (data, img), face in zip(pairs, faces)
+                      if face and not face.get("rejected")]
+    if not detected_faces:
+        rejected_faces = [face for face in faces if face and face.get("rejected")]
+        return answer(handlers.nothing_to_register(rejected_faces, request.scope["endpoint"].__name__))
+
+    # Gallery work (the duplicate scan is a matrix product over every face) runs off the loop
+    with stage(request, "duplicates"):
+        matches = await blocking_io(handlers.duplicate_matches, resident, detected_faces)
+        duplicates = describe_matches(matches, await find_user_profiles([user_id for user_id, _ in matches]),
+                                      student_id) if matches else []
+    rejection = handlers.duplicate_rejection(duplicates, form.get("allow_duplicate"))
+    if rejection:
+        return answer(rejection)
+
+    # Persist only the faces that will be enrolled (chip encoding and writes off the loop), their
+    # chips keyed by the new user's id
+    user_id = str(uuid.uuid4())
+    with stage(request, "persist"):
+        await asyncio.gather(*(blocking_io(handlers.persist_face, face_store, image_writer, item, student_id,
+                                           user_id) for item in detected_faces))
+
+    user_doc = handlers.new_user_document(profile, detected_faces, datetime.datetime.now().isoformat(), user_id)
+    with stage(request, "insert"):
+        # embeddings_updated_at set by the server, for the other processes' GallerySync
+        await users_col.update_one(*insert_stamped(user_doc), upsert=True)
+    with stage(request, "gallery"):
+        await blocking_io(resident.add_user, user_doc)
+    invalidate_user_caches(user_doc)
+    return answer(handlers.registered(user_doc, duplicates))
+
+
+async def enroll_bulk(request: Request):
+    """Start a bulk enrollment job, see app.main enroll_bulk()"""
+    form = await request.form()
+    archive = form.get("archive")
+    roster = form.get("roster")
+    if archive is None or roster is None or isinstance(archive, str) or isinstance(roster, str):
+        return error("Both 'archive' (zip) and 'roster' (CSV) files are required", 400)
+
+    job_id = enrollment_jobs.new_job_id()
+    source_path, roster_path = handlers.enrollment_upload_paths(enrollment_jobs.job_dir(job_id))
+
+    def write(path: str, data: bytes) -> None:
+        with open(path, "wb") as f:
+            f.write(data)
+
+    await blocking_io(write, source_path, await archive.read())
+    await blocking_io(write, roster_path, await roster.read())
+    try:
+        await blocking_io(lambda: ImageSource(source_path).close())
+    except Exception:
+        return error("'archive' must be a zip file", 400)
+
+    return answer(handlers.enrollment_accepted(
+        job_id, await blocking_io(enrollment_jobs.submit, job_id, source_path, roster_path)))
+
+
+async def enroll_job_status(request: Request):
+    job = await blocking_io(enrollment_jobs.get, request.path_params["job_id"])
+    if not job:
+        return error("Job not found", 404)
+    return JSONResponse(job)
+
+
+async def enroll_job_resume(request: Request):
+    job = await blocking_io(enrollment_jobs.resume, request.path_params["job_id"])
+    if not job:
+        return error("Job not found", 404)
+    return JSONResponse(job, status_code=202)
+
+
+async def get_all_users(request: Request):
+    """Legacy full list without parameters, keyset pages with ?limit= / ?after= / ?fields= (see app.main)"""
+    limit, after, fields = (request.query_params.get("limit"), request.query_params.get("after"),
+                            request.query_params.get("fields"))
+    if limit is not None or after is not None or fields is not None:
+        try:
+            limit, wanted = handlers.page_request(limit, fields)
+            docs, next_cursor = await paginate_async(users_col, {}, response_projection(wanted), limit, after or None)
+        except ValueError as e:
+            return error(str(e), 400)
+        return JSONResponse(handlers.users_page(docs, wanted, next_cursor))
+
+    resp = profile_cache.get(("list",))
+    if resp is None:
+        resp = [user_to_response(u) async for u in users_col.find({}, PROFILE_PROJECTION)]
+        profile_cache.set(("list",), resp)
+    return JSONResponse(resp)
+
+
+async def get_user_by_student_id(request: Request):
+    user = await find_student_profile(request.path_params["student_id"])
+    if not user:
+        return error("User not found", 404)
+    return JSONResponse(user_to_response(user))
+
+
+async def get_user_by_userid(request: Request):
+    user = await find_user_profile(request.path_params["user_id"])
+    if not user:
+        return error("User not found", 404)
+    return JSONResponse(user_to_response(user))
+
+
+async def delete_user_by_userid(request: Request):
+    """Delete a user and, off the event loop, their face images and the chips no other user shares"""
+    user_id = request.path_params["user_id"]
+    try:
+        user = await users_col.find_one({"user_id": user_id}, handlers.DELETE_PROJECTION)
+        if not user:
+            return error("User not found", 404)
+
+        result = await users_col.delete_one({"user_id": user_id})
+        if result.deleted_count == 0:
+            return error("Failed to delete user", 500)
+        await tombstones_col.update_one(*tombstone(user_id), upsert=True)
+        if gallery.ready:
+            # Still loading: the load, or GallerySync after it, drops the user
+            await blocking_io(gallery.target.remove_user, user_id)
+        invalidate_user_caches(user)
+
+        # The chips still in use are asked with the synchronous driver, on the same thread as the deletes
+        files = await blocking_io(handlers.remove_user_files, sync_db["users"], face_store, user)
+        return answer(handlers.user_deleted(user_id, files))
+    except Exception as e:
+        return error(f"Error deleting user: {str(e)}", 500)
+
+
+async def ping(request: Request):
+    return JSONResponse({"status": "ok", "message": "Server is running"})
+
+
+async def livez(request: Request):
+    return JSONResponse({"status": "ok"})
+
+
+async def readyz(request: Request):
+    """200 once the model is warm and the gallery loaded, 503 before (see app.main)"""
+    if config.STARTUP_MODE == "lazy":
+        face_detector.start()
+        gallery.start()
+    body = readiness([face_detector, gallery])
+    return JSONResponse(body, status_code=200 if body["ready"] else 503)
+
+
+async def inference_stats(request: Request):
+    return JSONResponse(handlers.inference_stats(await loaded(face_detector)))
+
+
+async def cache_stats(request: Request):
+    return JSONResponse({"recognize": recognize_cache.stats(), "profiles": profile_cache.stats()})
+
+
+async def migrate_timestamps_route(request: Request):
+    try:
+        return JSONResponse(handlers.timestamps_migrated(await blocking_io(migrate_timestamps, sync_db["users"])))
+    except Exception as e:
+        return error(f"Migration failed: {str(e)}", 500)
+
+
+async def migrate_embeddings_route(request: Request):
+    dtype = request.query_params.get("dtype") or config.EMBEDDING_DTYPE
+    if dtype not in ("float32", "float16"):
+        return error("dtype must be float32 or float16", 400)
+    try:
+        stats = await blocking_io(migrate_embeddings, sync_db["users"], dtype)
+        return JSONResponse(handlers.embeddings_migrated(stats))
+    except Exception as e:
+        return error(f"Migration failed: {str(e)}", 500)
+
+
+async def reembed_jobs(request: Request):
+    jobs = await adb["reembed_jobs"].find({}, {"_id": 0, "last_id": 0}).to_list(None)
+    return JSONResponse({"active_version": config.EMBEDDING_VERSION, "jobs": jobs})
+
+
+async def read_image(request: Request):
+    """:return: (decoded image, form) or (None, error response)"""
+    with stage(request, "read"):
+        form = await request.form()
+        try:
+            data = await read_image_field(form)
+        except Exception as e:
+            return None, error(f"Invalid image_base64 data: {str(e)}", 400)
+    if data is None:
+        return None, error("No image provided", 400)
+    with stage(request, "decode"):
+        img = await blocking_io(decode_image, data)
+    if img is None:
+        return None, error("Could not read uploaded image", 400)
+    return img, form
+
+
+async def detect_faces(request: Request):
+    img, form = await read_image(request)
+    if img is None:
+        return form
+    faces = await infer((await loaded(face_detector)).detect_boxes, img)
+    return JSONResponse(handlers.detection(img, faces))
+
+
+async def recognize_face(request: Request):
+    img, form = await read_image(request)
+    if img is None:
+        return form
+    room = form.get("room")
+    try:
+        # A resent frame is answered from the cache: no inference, no Mongo read
+        with stage(request, "cache"):
+            # A registration or delete after this point makes the answer computed below stale
+            generation = recognize_cache.generation
+            cache_key = await blocking_io(handlers.recognize_cache_key, img, room)
+            cached = recognize_cache.get(cache_key)
+        if cached is not None:
+            body, status = cached
+            return JSONResponse(body, status_code=status)
+
+        def respond(result) -> JSONResponse:
+            recognize_cache.set(cache_key, result, generation=generation)
+            return answer(result)
+
+        detector, resident = await loaded(face_detector), await loaded(gallery)
+        with stage(request, "inference"):
+            best_face = await infer(detector.get_best_face, img)
+        if not best_face:
+            return respond(handlers.no_face())
+        if best_face.get("rejected"):
+            return respond(handlers.quality_rejection(request.scope["endpoint"].__name__, best_face))
+
+        with stage(request, "search"):
+            match = await blocking_io(resident.search, handlers.probe_embedding(best_face), room or None)
+        matched_user = None
+        matched_id = handlers.recognized_user_id(match)
+        if matched_id:
+            with stage(request, "profile"):
+                matched_user = await find_user_profile(matched_id)
+        return respond(handlers.recognition(match, matched_user))
+    except (PoolBusyError, NotReadyError):
+        raise
+    except Exception as e:
+        return error(f"Error processing face: {str(e)}", 500)
+
+
+async def verify_face(request: Request):
+    """1:1 verification against the claimed user_id / student_id (see app.main)"""
+    img, form = await read_image(request)
+    if img is None:
+        return form
+    user_id = (form.get("user_id") or "").strip()
+    student_id = (form.get("student_id") or "").strip()
+    if not user_id and not student_id:
+        return error("Missing required field: user_id or student_id", 400)
+    try:
+        with stage(request, "profile"):
+            user = await find_user_profile(user_id) if user_id else await find_student_profile(student_id)
+        if not user:
+            return error("User not found", 404)
+
+        detector, resident = await loaded(face_detector), await loaded(gallery)
+        with stage(request, "inference"):
+            best_face = await infer(detector.get_best_face, img)
+        if not best_face:
+            return answer(handlers.no_face())
+        if best_face.get("rejected"):
+            return answer(handlers.quality_rejection(request.scope["endpoint"].__name__, best_face))
+
+        with stage(request, "search"):
+            similarity, compared = await blocking_io(handlers.verify_similarity, resident, user, best_face)
+        return answer(handlers.verification(similarity, compared, user))
+    except (PoolBusyError, NotReadyError):
+        raise
+    except Exception as e:
+        return error(f"Error verifying face: {str(e)}", 500)
+
+
+async def recognize_multi(request: Request):
+    img, form = await read_image(request)
+    if img is None:
+        return form
+    room = form.get("room")
+    try:
+        detector, resident = await loaded(face_detector), await loaded(gallery)
+        with stage(request, "inference"):
+            faces = (await infer(detector.detect_faces, img))[:config.MULTI_MAX_FACES]
+        if not faces:
+            return answer(handlers.no_face())
+
+        with stage(request, "search"):
+            candidates, matches = await blocking_io(handlers.match_faces, resident, faces, room)
+        with stage(request, "profile"):
+            profiles = await find_user_profiles([m[0] for m in matches if m])
+        return JSONResponse(handlers.multi_recognition(faces, candidates, matches, profiles))
+    except (PoolBusyError, NotReadyError):
+        raise
+    except Exception as e:
+        return error(f"Error processing faces: {str(e)}", 500)
+
+
+class DuplexStreamingResponse(StreamingResponse):
+    """
+    StreamingResponse whose body is produced while the request body is still being
+    read: receive() is left to the frame reader instead of Starlette's disconnect
+    listener, which would otherwise swallow the uploaded chunks. A client that goes
+    away ends the request stream, and with it the generator.
+    """
+
+    async def __call__(self, scope, receive, send):
+        await self.stream_response(send)
+        if self.background is not None:
+            await self.background()
+
+
+async def recognize_stream(request: Request):
+    """NDJSON stream of per-frame results for a length-prefixed frame upload (see app.main)"""
+    room = request.query_params.get("room") or None
+    # The recognizer searches the gallery from process(), which runs on the inference threads
+    recognizer = handlers.stream_recognizer(await loaded(face_detector), await loaded(gallery), room)
+    frames = aiter_frames(request.stream(), int(config.STREAM_MAX_FRAME_MB * 1024 * 1024))
+
+    async def generate():
+        profiles: Dict[str, Optional[Dict]] = {}
+        try:
+            async for data in frames:
+                img = await blocking_io(decode_image, data)
+                if img is None:
+                    yield json.dumps({"frame": recognizer.frames, "error": "Could not read frame"}) + "\n"
+                    recognizer.frames += 1
+                    continue
+                result = await infer(recognizer.process, img)
+                # One Mongo read per identity per stream
+                for user_id in handlers.stream_users_to_fetch(result, profiles):
+                    doc = await find_user_profile(user_id)
+                    profiles[user_id] = user_to_response(doc) if doc else None
+                yield json.dumps(handlers.attach_stream_profiles(result, profiles)) + "\n"
+        except (ValueError, PoolBusyError) as e:
+            yield json.dumps({"error": str(e)}) + "\n"
+        yield json.dumps({"done": True, **recognizer.stats()}) + "\n"
+
+    return DuplexStreamingResponse(generate(), media_type="application/x-ndjson")
+
+
+async def metrics(request: Request):
+    """Prometheus text format, see app.main metrics()"""
+    return Response(REGISTRY.render(), media_type=METRICS_CONTENT_TYPE)
+
+
+async def inference_busy(request: Request, exc: PoolBusyError):
+    return error(str(exc), 503)
+
+
+async def still_loading(request: Request, exc: NotReadyError):
+    response = error(str(exc), 503)
+    response.headers["Retry-After"] = str(config.READY_RETRY_AFTER_S)
+    return response
+
+
+@asynccontextmanager
+async def lifespan(app):
+    # Model and gallery loading started with the module (runtime.deferred_components)
+    yield
+    gallery_sync.stop()
+    inference_executor.shutdown(wait=False)
+    if isinstance(face_detector.target, (InferencePool, BatchingFaceDetector)):
+        face_detector.target.close()
+
+
+routes = [
+    Route("/", home),
+    Route("/register", register_user, methods=["POST"]),
+    Route("/enroll/bulk", enroll_bulk, methods=["POST"]),
+    Route("/enroll/jobs/{job_id}", enroll_job_status, methods=["GET"]),
+    Route("/enroll/jobs/{job_id}/resume", enroll_job_resume, methods=["POST"]),
+    Route("/users", get_all_users, methods=["GET"]),
+    Route("/users/student/{student_id}", get_user_by_student_id, methods=["GET"]),
+    Route("/users/userid/{user_id}", get_user_by_userid, methods=["GET"]),
+    Route("/users/userid/{user_id}", delete_user_by_userid, methods=["DELETE"]),
+    Route("/ping", ping, methods=["GET"]),
+    Route("/livez", livez, methods=["GET"]),
+    Route("/readyz", readyz, methods=["GET"]),
+    Route("/stats/inference", inference_stats, methods=["GET"]),
+    Route("/stats/cache", cache_stats, methods=["GET"]),
+    Route("/metrics", metrics, methods=["GET"]),
+    Route("/migrate-timestamps", migrate_timestamps_route, methods=["POST"]),
+    Route("/migrate-embeddings", migrate_embeddings_route, methods=["POST"]),
+    Route("/reembed/jobs", reembed_jobs, methods=["GET"]),
+    Route("/detect", detect_faces, methods=["POST"]),
+    Route("/recognize", recognize_face, methods=["POST"]),
+    Route("/recognize/multi", recognize_multi, methods=["POST"]),
+    Route("/verify", verify_face, methods=["POST"]),
+    Route("/recognize/stream", recognize_stream, methods=["POST"]),
+]
+
+app = Starlette(routes=routes, lifespan=lifespan,
+                middleware=[Middleware(CORSMiddleware, allow_origins=["*"], allow_methods=["*"], allow_headers=["*"]),
+                            Middleware(RequestMetrics)],
+                exception_handlers={PoolBusyError: inference_busy, NotReadyError: still_loading})
@@ -0,0 +1,228 @@
+import os
+from typing import Any, Dict, List, Optional, Tuple
+
+try:
+    from dotenv import load_dotenv
+    load_dotenv()
+except ImportError:  # python-dotenv is optional at runtime
+    pass
+
+
+def _get_int(name: str, default: int) -> int:
+    value = os.getenv(name)
+    return int(value) if value not in (None, "") else default
+
+
+def _get_float(name: str, default: float) -> float:
+    value = os.getenv(name)
+    return float(value) if value not in (None, "") else default
+
+
+def _get_optional_int(name: str) -> Optional[int]:
+    value = os.getenv(name)
+    return int(value) if value not in (None, "") else None
+
+
+def _get_bool(name: str, default: Optional[bool]) -> Optional[bool]:
+    value = os.getenv(name)
+    if value in (None, ""):
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
+
+def _get_sizes(name: str) -> List[Tuple[int, int]]:
+    """Comma separated sizes, "320" or "320x240" each, e.g. DET_CASCADE=160,320"""
+    sizes = []
+    for item in (os.getenv(name) or "").split(","):
+        item = item.strip().lower()
+        if item:
+            w, _, h = item.partition("x")
+            sizes.append((int(w), int(h or w)))
+    return sizes
+
+
+# ----------------- MongoDB -----------------
+MONGO_URI = os.getenv("MONGO_URI", "mongodb://localhost:27017/")
+MONGO_DB = os.getenv("MONGO_DB", "face_recognition")
+MONGO_MAX_POOL_SIZE = _get_int("MONGO_MAX_POOL_SIZE", 100)       # connections per process
+MONGO_MIN_POOL_SIZE = _get_int("MONGO_MIN_POOL_SIZE", 0)
+MONGO_CONNECT_TIMEOUT_MS = _get_int("MONGO_CONNECT_TIMEOUT_MS", 5000)
+MONGO_SERVER_SELECTION_TIMEOUT_MS = _get_int("MONGO_SERVER_SELECTION_TIMEOUT_MS", 5000)
+MONGO_SOCKET_TIMEOUT_MS = _get_optional_int("MONGO_SOCKET_TIMEOUT_MS")   # empty = no timeout
+MONGO_ENSURE_INDEXES = _get_bool("MONGO_ENSURE_INDEXES", True)   # create missing indexes at startup
+USERS_PAGE_SIZE = _get_int("USERS_PAGE_SIZE", 100)               # GET /users page size without ?limit=
+USERS_PAGE_MAX = _get_int("USERS_PAGE_MAX", 500)                 # largest ?limit= for GET /users
+
+# ----------------- Recognition -----------------
+# Cosine similarity (dot product of normalized ArcFace embeddings) needed for a match.
+# Real embeddings of different people are typically 0..0.4; 0.7 keeps false positives rare. Tune it.
+RECOGNITION_THRESHOLD = _get_float("RECOGNITION_THRESHOLD", 0.70)
+# /verify compares the probe with one claimed identity only, so there is no 1:N false-match
+# pile-up and the bar can sit lower than RECOGNITION_THRESHOLD. Calibrate per deployment
+VERIFY_THRESHOLD = _get_float("VERIFY_THRESHOLD", 0.50)
+
+# ----------------- Gallery search index -----------------
+# "brute" = exact matmul, "ivf" = k-means coarse quantizer + inverted lists,
+# "pq" / "sq8" = compressed codes (product / 8-bit scalar quantization) + re-rank
+INDEX_BACKEND = os.getenv("INDEX_BACKEND", "brute")
+IVF_NLIST = _get_int("IVF_NLIST", 256)          # number of inverted lists (k-means centroids)
+IVF_NPROBE = _get_int("IVF_NPROBE", 16)         # lists scanned per query: higher = better recall, slower
+IVF_MIN_TRAIN = _get_int("IVF_MIN_TRAIN", 10000)  # below this many faces the IVF index scans exactly
+PQ_M = _get_int("PQ_M", 64)                     # pq: bytes per face (sub-quantizers), must divide 512
+QUANT_RERANK = _get_int("QUANT_RERANK", 64)     # pq/sq8: candidates re-scored on the refine copy
+# pq/sq8: re-rank copy, sq8 | float16 | none; unset = the backend's default (pq: sq8, sq8: none)
+QUANT_REFINE = os.getenv("QUANT_REFINE") or None
+QUANT_MIN_TRAIN = _get_int("QUANT_MIN_TRAIN", 10000)  # pq/sq8: faces kept as float32 until the codecs train
+# Every process holds its own gallery: writes made by other workers / jobs are picked up this often
+GALLERY_SYNC_INTERVAL_S = _get_float("GALLERY_SYNC_INTERVAL_S", 5.0)   # 0 = only this process's writes
+# Two-stage search: per-user confidence-weighted templates first, then the faces of the top-K users
+GALLERY_TEMPLATES = _get_bool("GALLERY_TEMPLATES", False)
+TEMPLATE_RERANK_K = _get_int("TEMPLATE_RERANK_K", 10)   # users whose individual faces are re-ranked
+
+# ----------------- Uploads -----------------
+# Write registration chips (and originals) on a background thread instead of in the request
+PERSIST_UPLOADS_ASYNC = _get_bool("PERSIST_UPLOADS_ASYNC", False)
+# Originals are no longer needed once the aligned chip is stored; true keeps writing them to uploads/
+KEEP_UPLOADS = _get_bool("KEEP_UPLOADS", False)
+
+# ----------------- Face chip storage -----------------
+# Aligned 112x112 crops ArcFace was fed, content-addressed (identical faces stored once).
+# Re-embedding reads them back without running the detector
+FACE_STORE_DIR = os.getenv("FACE_STORE_DIR", "face_store")
+FACE_CHIP_FORMAT = os.getenv("FACE_CHIP_FORMAT", "png")         # png (lossless) | jpg
+FACE_CHIP_JPEG_QUALITY = _get_int("FACE_CHIP_JPEG_QUALITY", 95)
+FACE_THUMBNAIL_SIZE = _get_int("FACE_THUMBNAIL_SIZE", 0)        # px, face-in-context thumbnail (0 = none)
+
+# ----------------- Embedding storage -----------------
+# "float32" / "float16" store embeddings as BSON Binary, "list" as the legacy array of doubles
+EMBEDDING_DTYPE = os.getenv("EMBEDDING_DTYPE", "float32")
+
+# ----------------- Duplicate identities -----------------
+# New faces are checked against the gallery at enrollment: "warn" (listed in the response),
+# "reject" (409 unless allow_duplicate=true) or "off"
+DUPLICATE_CHECK = os.getenv("DUPLICATE_CHECK", "warn")
+DUPLICATE_THRESHOLD = _get_float("DUPLICATE_THRESHOLD", 0.70)  # similarity at which another user counts as the same person
+DUPLICATE_REPORT_BLOCK = _get_int("DUPLICATE_REPORT_BLOCK", 4096)  # offline report: rows per similarity tile
+
+# ----------------- Bulk enrollment -----------------
+ENROLL_WORKERS = _get_int("ENROLL_WORKERS", 4)          # rows decoded/detected/embedded in parallel
+ENROLL_BATCH_SIZE = _get_int("ENROLL_BATCH_SIZE", 200)  # users per bulk write
+IMPORT_FOLDER = os.getenv("IMPORT_FOLDER", "imports")   # uploaded archives/rosters and error reports
+
+# ----------------- Re-embedding (model upgrades) -----------------
+REEMBED_PAGE_SIZE = _get_int("REEMBED_PAGE_SIZE", 200)   # users per page / bulk_write / checkpoint
+REEMBED_BATCH_SIZE = _get_int("REEMBED_BATCH_SIZE", 16)  # images per batched model call
+
+# ----------------- Response caches (size 0 = off) -----------------
+RECOGNIZE_CACHE_SIZE = _get_int("RECOGNIZE_CACHE_SIZE", 1024)     # /recognize results by image hash + room + model
+RECOGNIZE_CACHE_TTL_S = _get_float("RECOGNIZE_CACHE_TTL_S", 30.0)
+PROFILE_CACHE_SIZE = _get_int("PROFILE_CACHE_SIZE", 10000)        # user lookups and the /users list
+PROFILE_CACHE_TTL_S = _get_float("PROFILE_CACHE_TTL_S", 300.0)
+
+# ----------------- Inference -----------------
+# Coalesce concurrent /recognize and /register calls into batched ArcFace runs
+INFERENCE_BATCHING = _get_bool("INFERENCE_BATCHING", False)
+BATCH_MAX_SIZE = _get_int("BATCH_MAX_SIZE", 8)          # images per batch
+BATCH_MAX_WAIT_MS = _get_float("BATCH_MAX_WAIT_MS", 5.0)  # how long the first request waits for company
+
+# Multi-process inference pool (0 = run the model inside the HTTP process)
+INFERENCE_WORKERS = _get_int("INFERENCE_WORKERS", 0)
+INFERENCE_THREADS_PER_WORKER = _get_int("INFERENCE_THREADS_PER_WORKER", 1)  # ORT intra-op threads per worker
+INFERENCE_SLOTS = _get_int("INFERENCE_SLOTS", 0)                # shared-memory slots, 0 = 2 per worker
+INFERENCE_SLOT_MB = _get_float("INFERENCE_SLOT_MB", 24.0)       # largest decoded image accepted (4K BGR ~ 24 MB)
+INFERENCE_ACQUIRE_TIMEOUT_S = _get_float("INFERENCE_ACQUIRE_TIMEOUT_S", 1.0)  # wait for a free slot, then 503
+
+# ASGI mode (app.asgi): threads running model calls, so the event loop keeps serving I/O
+ASGI_INFERENCE_THREADS = _get_int("ASGI_INFERENCE_THREADS", 4)
+
+# ----------------- Startup -----------------
+# "background": serve at once, load the model and the gallery on threads (/readyz turns 200 when done)
+# "lazy": load on first use (or first /readyz); "eager": load before serving
+STARTUP_MODE = os.getenv("STARTUP_MODE", "background")
+# A request arriving while the model or gallery loads waits this long, then gets 503 with Retry-After
+READY_WAIT_S = _get_float("READY_WAIT_S", 2.0)
+READY_RETRY_AFTER_S = _get_int("READY_RETRY_AFTER_S", 5)
+# One inference on this image before the model is reported ready (empty = no warm-up)
+WARMUP_IMAGE = os.getenv("WARMUP_IMAGE", os.path.join(os.path.dirname(__file__), "assets", "warmup.jpg"))
+# Gallery snapshot restored instead of decoding every user document (empty = always read MongoDB)
+GALLERY_SNAPSHOT = os.getenv("GALLERY_SNAPSHOT", os.path.join("cache", "gallery.snapshot"))
+
+# ----------------- Metrics / profiling -----------------
+SLOW_REQUEST_MS = _get_float("SLOW_REQUEST_MS", 1000.0)   # requests slower than this are counted (0 = off)
+# Sample the stacks of in-flight requests and dump a folded-stack profile for each slow one
+PROFILE_SLOW_REQUESTS = _get_bool("PROFILE_SLOW_REQUESTS", False)
+PROFILE_INTERVAL_MS = _get_float("PROFILE_INTERVAL_MS", 5.0)
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+
+# ----------------- Multi-face recognition -----------------
+MULTI_MAX_FACES = _get_int("MULTI_MAX_FACES", 32)   # /recognize/multi: largest faces kept per image
+MULTI_CANDIDATES = _get_int("MULTI_CANDIDATES", 10)  # nearest gallery faces considered per detected face
+
+# ----------------- Streaming recognition -----------------
+STREAM_REVERIFY_S = _get_float("STREAM_REVERIFY_S", 2.0)      # re-embed a tracked face at least this often
+STREAM_QUALITY_GAIN = _get_float("STREAM_QUALITY_GAIN", 0.2)  # ...or when its quality improves by this fraction
+STREAM_IOU_THRESHOLD = _get_float("STREAM_IOU_THRESHOLD", 0.3)  # box overlap to continue a track
+STREAM_MAX_FRAME_MB = _get_float("STREAM_MAX_FRAME_MB", 8.0)  # largest encoded frame accepted
+
+# ----------------- Model / ONNX Runtime -----------------
+MODEL_NAME = os.getenv("MODEL_NAME", "buffalo_l")
+# Tag stored with every embedding; the gallery only serves vectors of this version
+EMBEDDING_VERSION = os.getenv("EMBEDDING_VERSION") or f"insightface-{MODEL_NAME}-v1"
+MODEL_QUANTIZED = _get_bool("MODEL_QUANTIZED", False)   # load the INT8 pack from app.tools.quantize_models
+# "recognition" loads only the detector + ArcFace (all the API needs), "full" every model in the pack
+MODEL_MODE = os.getenv("MODEL_MODE", "recognition")
+ORT_INTRA_OP_THREADS = _get_optional_int("ORT_INTRA_OP_THREADS")
+ORT_INTER_OP_THREADS = _get_optional_int("ORT_INTER_OP_THREADS")
+ORT_GRAPH_OPTIMIZATION = os.getenv("ORT_GRAPH_OPTIMIZATION") or None   # disable | basic | extended | all
+ORT_EXECUTION_MODE = os.getenv("ORT_EXECUTION_MODE") or None           # sequential | parallel
+ORT_MEM_ARENA = _get_bool("ORT_MEM_ARENA", None)
+
+# ----------------- Detector -----------------
+# Smaller detector sizes tried before the full 640x640 scan, e.g. "320" or "160,320" (empty = always 640)
+DET_CASCADE = _get_sizes("DET_CASCADE")
+MIN_FACE_SIZE = _get_int("MIN_FACE_SIZE", 48)   # px; smaller faces found by a cascade step trigger a rescan
+
+# ----------------- Face quality gate -----------------
+# Checked on the detector's box + landmarks before ArcFace; failing faces are answered with a reason code
+# (register / recognize / verify / bulk enrollment) instead of being embedded. 0 disables a single check.
+# Off by default: turning it on changes which requests get an answer, so calibrate the thresholds first
+QUALITY_GATE = _get_bool("QUALITY_GATE", False)
+QUALITY_MIN_FACE_SIZE = _get_float("QUALITY_MIN_FACE_SIZE", 40)      # px, short side of the face box
+QUALITY_MIN_SHARPNESS = _get_float("QUALITY_MIN_SHARPNESS", 50.0)    # variance of the Laplacian of the face
+QUALITY_MIN_BRIGHTNESS = _get_float("QUALITY_MIN_BRIGHTNESS", 40.0)  # mean gray level 0..255
+QUALITY_MAX_BRIGHTNESS = _get_float("QUALITY_MAX_BRIGHTNESS", 220.0)
+QUALITY_MAX_YAW = _get_float("QUALITY_MAX_YAW", 45.0)                # degrees, estimated from the 5 landmarks
+QUALITY_MAX_ROLL = _get_float("QUALITY_MAX_ROLL", 40.0)
+
+
+def quality_thresholds() -> Optional[Dict[str, float]]:
+    """FaceDetection(quality=...) for the settings above, None when the gate is off"""
+    if not QUALITY_GATE:
+        return None
+    return {
+        "min_size": QUALITY_MIN_FACE_SIZE,
+        "min_sharpness": QUALITY_MIN_SHARPNESS,
+        "min_brightness": QUALITY_MIN_BRIGHTNESS,
+        "max_brightness": QUALITY_MAX_BRIGHTNESS,
+        "max_yaw": QUALITY_MAX_YAW,
+        "max_roll": QUALITY_MAX_ROLL,
+    }
+
+
+def detector_kwargs() -> Dict[str, Any]:
+    """FaceDetection arguments for the settings above (shared by the API and offline jobs)"""
+    return {
+        "model_name": MODEL_NAME,
+        "det_size": (640, 640),
+        "conf_threshold": 0.5,
+        "quantized": MODEL_QUANTIZED,
+        "mode": MODEL_MODE,
+        "intra_op_threads": ORT_INTRA_OP_THREADS,
+        "inter_op_threads": ORT_INTER_OP_THREADS,
+        "graph_optimization": ORT_GRAPH_OPTIMIZATION,
+        "execution_mode": ORT_EXECUTION_MODE,
+        "enable_mem_arena": ORT_MEM_ARENA,
+        "det_cascade": DET_CASCADE,
+        "min_face_size": MIN_FACE_SIZE,
+        "quality": quality_thresholds(),
+    }
@@ -1,9 +1,116 @@
-from pymongo import MongoClient
+import threading
+from typing import Dict, List, Optional, Tuple
 
+from bson import ObjectId
+from pymongo import ASCENDING, IndexModel, MongoClient
 
-def get_db():
-    client = MongoClient("mongodb://localhost:27017/")  # or your Atlas URI
-    db = client["face_recognition"]
-    return db
+from app import config
+from app.services.gallery_sync import CHANGED_FIELD, TOMBSTONE_TTL_S, TOMBSTONES
 
+_client: Optional[MongoClient] = None
+_async_client = None
+_client_lock = threading.Lock()
 
+# Every lookup the API and the offline jobs run; without them each is a collection scan
+INDEXES: Dict[str, List[IndexModel]] = {
+    "users": [
+        IndexModel([("user_id", ASCENDING)], name="user_id"),
+        IndexModel([("profile.student_id", ASCENDING)], name="profile_student_id"),
+        IndexModel([("profile.room", ASCENDING)], name="profile_room"),
+        # Changed users read by every process's GallerySync poll; newest change in the snapshot fingerprint
+        IndexModel([(CHANGED_FIELD, ASCENDING)], name=CHANGED_FIELD, sparse=True),
+        # Is a content-addressed chip still used by another face (user deletion)
+        IndexModel([("faces.chip", ASCENDING)], name="faces_chip", sparse=True),
+        # Legacy records: keyed by uuid, profile fields at the top level
+        IndexModel([("uuid", ASCENDING)], name="uuid", sparse=True),
+        IndexModel([("student_id", ASCENDING)], name="student_id", sparse=True),
+    ],
+    # Deleted users, read by GallerySync polls and expired once every process has seen them
+    TOMBSTONES: [IndexModel([("deleted_at", ASCENDING)], name="deleted_at", expireAfterSeconds=TOMBSTONE_TTL_S)],
+    "enrollment_jobs": [IndexModel([("job_id", ASCENDING)], name="job_id", unique=True)],
+    "reembed_jobs": [IndexModel([("job_id", ASCENDING)], name="job_id", unique=True)],
+}
+
+
+def _client_options() -> Dict:
+    return {
+        "maxPoolSize": config.MONGO_MAX_POOL_SIZE,
+        "minPoolSize": config.MONGO_MIN_POOL_SIZE,
+        "connectTimeoutMS": config.MONGO_CONNECT_TIMEOUT_MS,
+        "serverSelectionTimeoutMS": config.MONGO_SERVER_SELECTION_TIMEOUT_MS,
+        "socketTimeoutMS": config.MONGO_SOCKET_TIMEOUT_MS,
+    }
+
+
+def get_client() -> MongoClient:
+    """Process-wide client (pymongo pools connections per client, so share one)"""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = MongoClient(config.MONGO_URI, **_client_options())
+    return _client
+
+
+def get_db(name: Optional[str] = None):
+    return get_client()[name or config.MONGO_DB]
+
+
+def get_async_db(name: Optional[str] = None):
+    """Motor database for the ASGI app (same URI and pool settings as get_db)"""
+    global _async_client
+    if _async_client is None:
+        # Optional dependency, only needed by app.asgi
+        from motor.motor_asyncio import AsyncIOMotorClient
+        with _client_lock:
+            if _async_client is None:
+                _async_client = AsyncIOMotorClient(config.MONGO_URI, **_client_options())
+    return _async_client[name or config.MONGO_DB]
+
+
+def ensure_indexes(db) -> Dict[str, List[str]]:
+    """
+    Create the indexes in INDEXES that are missing (existing ones are left alone).
+    :return: index names per collection
+    """
+    return {name: db[name].create_indexes(models) for name, models in INDEXES.items()}
+
+
+def _page_query(query: Dict, projection: Optional[Dict], after: Optional[str]) -> Tuple[Dict, Optional[Dict]]:
+    if after is not None:
+        if not ObjectId.is_valid(after):
+            raise ValueError("Invalid cursor")
+        query = {"$and": [query, {"_id": {"$gt": ObjectId(after)}}]} if query else {"_id": {"$gt": ObjectId(after)}}
+    if projection is not None and projection.get("_id") == 0:
+        # The cursor needs _id; it is stripped from the returned documents instead
+        projection = {k: v for k, v in projection.items() if k != "_id"} or None
+    return query, projection
+
+
+def _page(docs: List[Dict], limit: int) -> Tuple[List[Dict], Optional[str]]:
+    next_cursor = str(docs[limit - 1]["_id"]) if len(docs) > limit else None
+    for doc in docs:
+        doc.pop("_id", None)
+    return docs[:limit], next_cursor
+
+
+def paginate(col, query: Dict, projection: Optional[Dict] = None, limit: int = 100,
+             after: Optional[str] = None) -> Tuple[List[Dict], Optional[str]]:
+    """
+    Keyset pagination in `_id` order: each page is an index range scan starting after
+    the previous page's last `_id`, so deep pages cost the same as the first one
+    (unlike skip()).
+    :param after: cursor returned with the previous page
+    :return: (documents without `_id`, cursor of the next page or None on the last page)
+    """
+    query, projection = _page_query(query, projection, after)
+    # One extra document tells whether another page exists
+    return _page(list(col.find(query, projection).sort("_id", ASCENDING).limit(limit + 1)), limit)
+
+
+async def paginate_async(col, query: Dict, projection: Optional[Dict] = None, limit: int = 100,
+                         after: Optional[str] = None) -> Tuple[List[Dict], Optional[str]]:
+    """paginate() for a Motor collection"""
+    query, projection = _page_query(query, projection, after)
+    docs = await col.find(query, projection).sort("_id", ASCENDING).limit(limit + 1).to_list(limit + 1)
+    return _page(docs, limit)
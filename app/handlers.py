@@ -0,0 +1,342 @@
+"""
+Request handling shared by the Flask app (app.main) and the ASGI app (app.asgi).
+
+Both apps serve the same JSON contracts, so everything a route does apart from its
+I/O lives here once: form validation, the documents written to MongoDB, the gallery
+searches and the response bodies. The apps only differ in how they wait (blocking
+calls in app.main; awaited Motor calls and thread pools in app.asgi), so their
+routes read as: parse with a helper, do the I/O, answer with a helper.
+
+Helpers named after a response return `(body, status)`; gallery helpers are plain
+blocking calls, which app.asgi runs off the event loop.
+"""
+import os
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from app import config
+from app.models.user import RESPONSE_FIELDS, create_face_entry, create_user_document, user_to_response
+from app.services.batching import BatchingFaceDetector
+from app.services.cache import image_digest
+from app.services.dedup import OFF as DEDUP_OFF, REJECT as DEDUP_REJECT
+from app.services.face_detection import FaceDetection
+from app.services.face_store import FaceStore
+from app.services.gallery import EmbeddingGallery, assign_one_to_one
+from app.services.image_io import ImageWriter, unique_image_name
+from app.services.inference_pool import InferencePool
+from app.services.metrics import QUALITY_REJECTIONS
+from app.services.tracking import StreamRecognizer
+
+UPLOAD_FOLDER = "uploads"
+PROFILE_FORM_FIELDS = ("name", "student_id", "class", "department", "room")
+# Fields a delete reads before removing the document
+DELETE_PROJECTION = {"user_id": 1, "profile.student_id": 1, "faces.image_path": 1, "faces.chip": 1}
+
+Answer = Tuple[Dict, int]
+
+
+def error(message: str, status: int, **extra) -> Answer:
+    return {"error": message, **extra}, status
+
+
+def no_face() -> Answer:
+    return error("No face detected in the image", 400, detected=False)
+
+
+def quality_rejection(route: str, face: Dict) -> Answer:
+    """422 answer for a face the quality gate rejected (counted per route and reason)"""
+    QUALITY_REJECTIONS.inc(route, face["rejected"])
+    return {"error": f"Face rejected by the quality check: {face['rejected']}", "detected": True,
+            "reason": face["rejected"], "quality": face.get("quality")}, 422
+
+
+def probe_embedding(face: Dict) -> np.ndarray:
+    return np.asarray(face["embedding"], dtype=np.float32)
+
+
+# ----------------- Registration -----------------
+def profile_form(get: Callable[[str], Optional[str]]) -> Dict[str, str]:
+    """Profile fields of a registration form, stripped (`get` reads one form field)"""
+    return {field: (get(field) or "").strip() for field in PROFILE_FORM_FIELDS}
+
+
+def invalid_registration(profile: Dict[str, str], has_image: bool) -> Optional[Answer]:
+    if not profile["name"]:
+        return error("Missing required field: name", 400)
+    if not profile["student_id"]:
+        return error("Missing required field: student_id", 400)
+    if not has_image:
+        return error("Missing required field: image file", 400)
+    return None
+
+
+def nothing_to_register(rejected_faces: List[Dict], route: str) -> Answer:
+    """No usable face in any upload: the first quality rejection, else 400"""
+    if rejected_faces:
+        return quality_rejection(route, rejected_faces[0])
+    return error("No face detected in the provided images. Please upload clear face images.", 400)
+
+
+def duplicate_matches(resident: EmbeddingGallery, detected_faces: List[Dict]) -> List[Tuple[str, float]]:
+    """Enrolled users with a face similar to the ones being registered (none with DUPLICATE_CHECK=off)"""
+    if config.DUPLICATE_CHECK == DEDUP_OFF:
+        return []
+    return resident.similar_users(np.stack([item["face"]["embedding"] for item in detected_faces]),
+                                  config.DUPLICATE_THRESHOLD)
+
+
+def duplicate_rejection(duplicates: List[Dict], allow_duplicate: Optional[str]) -> Optional[Answer]:
+    """409 when DUPLICATE_CHECK=reject found the face under another user, unless the form allows it"""
+    allowed = (allow_duplicate or "").strip().lower() in ("1", "true", "yes")
+    if duplicates and config.DUPLICATE_CHECK == DEDUP_REJECT and not allowed:
+        return {"error": "This face is already enrolled under another user", "duplicates": duplicates}, 409
+    return None
+
+
+def persist_face(face_store: FaceStore, image_writer: ImageWriter, item: Dict, student_id: str,
+                 user_id: str) -> None:
+    """
+    Store the aligned chip of a face being enrolled under `user_id` (item["chip"] = key).
+    The original upload is written too with KEEP_UPLOADS, or when the detector returned no chip.
+    """
+    face = item["face"]
+    item["chip"] = face_store.put(face["chip"], user_id, item.pop("image"), face["box"]) \
+        if face.get("chip") is not None else None
+    item["image_path"] = None
+    if config.KEEP_UPLOADS or item["chip"] is None:
+        item["image_path"] = os.path.join(UPLOAD_FOLDER, unique_image_name(student_id))
+        image_writer.save(item["data"], item["image_path"])
+
+
+def new_user_document(profile: Dict[str, str], detected_faces: List[Dict], now_iso: str, user_id: str) -> Dict:
+    """User document with every persisted face (persist_face() ran on each item with the same user_id)"""
+    first = detected_faces[0]
+    data = {**profile, "user_id": user_id, "image_path": first["image_path"], "chip": first["chip"],
+            "registered_at": now_iso, "updated_at": now_iso}
+    user_doc = create_user_document(data, first["face"], embedding_version=config.EMBEDDING_VERSION,
+                                    embedding_dtype=config.EMBEDDING_DTYPE)
+    for item in detected_faces[1:]:
+        user_doc["faces"].append(create_face_entry(item["face"], item["image_path"], now_iso, config.EMBEDDING_DTYPE,
+                                                   item["chip"]))
+    return user_doc
+
+
+def registered(user_doc: Dict, duplicates: List[Dict]) -> Answer:
+    body = {"message": "User registered successfully", "data": user_to_response(user_doc)}
+    if duplicates:
+        body["duplicates"] = duplicates
+    return body, 201
+
+
+# ----------------- Deletion -----------------
+def remove_files(paths: Iterable[str]) -> Tuple[int, List[Dict]]:
+    """:return: (number deleted, [{"path", "error"}])"""
+    deleted, failed = 0, []
+    for path in paths:
+        try:
+            if os.path.exists(path):
+                os.remove(path)
+                deleted += 1
+        except Exception as e:
+            failed.append({"path": path, "error": str(e)})
+    return deleted, failed
+
+
+def remove_user_files(users_col, face_store: FaceStore, user: Dict) -> Dict:
+    """
+    Blocking: delete a removed user's uploads and the chips no other face refers to
+    (chips are per user, only keys stored before that can be shared).
+    :param users_col: synchronous collection, asked which of the chips are still in use
+    :return: the file fields of the delete response
+    """
+    faces = user.get("faces") or []
+    image_paths = [face["image_path"] for face in faces if face.get("image_path")]
+    chips = list({face["chip"] for face in faces if face.get("chip")})
+    deleted_images, failed = remove_files(image_paths)
+    deleted_chips = 0
+    try:
+        if chips:
+            in_use = set(users_col.distinct("faces.chip", {"faces.chip": {"$in": chips}}))
+            deleted_chips = sum(1 for key in chips if key not in in_use and face_store.remove(key))
+    except Exception as e:
+        failed.append({"path": face_store.root, "error": str(e)})
+    body = {"deleted_images": deleted_images, "total_images": len(image_paths), "deleted_chips": deleted_chips}
+    if failed:
+        body["failed_images"] = failed
+    return body
+
+
+def user_deleted(user_id: str, files: Dict) -> Answer:
+    return {"message": "User deleted successfully", "user_id": user_id, **files}, 200
+
+
+# ----------------- Listing -----------------
+def page_request(limit: Optional[str], fields: Optional[str]) -> Tuple[int, List[str]]:
+    """
+    Validated ?limit= and ?fields= of a paged /users request.
+    :return: (limit, wanted response fields); raises ValueError with the message for a 400
+    """
+    try:
+        limit = int(limit) if limit else config.USERS_PAGE_SIZE
+    except ValueError:
+        raise ValueError("limit must be an integer") from None
+    if not 1 <= limit <= config.USERS_PAGE_MAX:
+        raise ValueError(f"limit must be between 1 and {config.USERS_PAGE_MAX}")
+    wanted = [f.strip() for f in fields.split(",") if f.strip()] if fields else list(RESPONSE_FIELDS)
+    if not wanted or any(f not in RESPONSE_FIELDS for f in wanted):
+        raise ValueError(f"fields must be among {', '.join(RESPONSE_FIELDS)}")
+    return limit, wanted
+
+
+def users_page(docs: List[Dict], wanted: Sequence[str], next_cursor: Optional[str]) -> Dict:
+    users = [{k: v for k, v in user_to_response(doc).items() if k in wanted} for doc in docs]
+    return {"users": users, "count": len(users), "next_cursor": next_cursor}
+
+
+# ----------------- Recognition -----------------
+def recognize_cache_key(img: np.ndarray, room: Optional[str]) -> Tuple:
+    """Same pixels, room and model version: same answer"""
+    return image_digest(img), room or None, config.EMBEDDING_VERSION
+
+
+def recognized_user_id(match: Optional[Tuple[str, float]]) -> Optional[str]:
+    """The matched user when the similarity reaches RECOGNITION_THRESHOLD (only then is a profile read)"""
+    if match and match[1] >= config.RECOGNITION_THRESHOLD:
+        return match[0]
+    return None
+
+
+def recognition(match: Optional[Tuple[str, float]], user: Optional[Dict]) -> Answer:
+    best_sim = match[1] if match else 0.0
+    if user:
+        return {"recognized": True, "confidence": round(best_sim, 4), "user": user_to_response(user)}, 200
+    return {
+        "recognized": False,
+        "message": "Face detected but no matching user found (threshold not met).",
+        "confidence": round(best_sim, 4)
+    }, 404
+
+
+def verify_similarity(resident: EmbeddingGallery, user: Dict, face: Dict) -> Tuple[Optional[float], int]:
+    """
+    Best similarity between the probe and the claimed user's faces, read from the
+    gallery by label. :return: (similarity or None without faces, faces compared)
+    """
+    enrolled = resident.user_vectors(user.get("user_id") or user.get("uuid"))
+    probe = probe_embedding(face)
+    similarity = max((FaceDetection.compare_faces_with_distance(probe, vector, config.VERIFY_THRESHOLD)[1]
+                      for vector in enrolled), default=None)
+    return similarity, int(enrolled.shape[0])
+
+
+def verification(similarity: Optional[float], faces_compared: int, user: Dict) -> Answer:
+    if similarity is None:
+        return error(f"User has no face embeddings for model {config.EMBEDDING_VERSION}", 409)
+    return {
+        "verified": similarity >= config.VERIFY_THRESHOLD,
+        "confidence": round(similarity, 4),
+        "threshold": config.VERIFY_THRESHOLD,
+        "faces_compared": faces_compared,
+        "user": user_to_response(user)
+    }, 200
+
+
+def match_faces(resident: EmbeddingGallery, faces: List[Dict],
+                room: Optional[str]) -> Tuple[List[List[Tuple[str, float]]], List[Optional[Tuple[str, float]]]]:
+    """
+    Every face of one image searched with one matrix-matrix product and matched one-to-one.
+    :return: (candidates per face, match per face or None)
+    """
+    probes = np.stack([probe_embedding(face) for face in faces])
+    candidates = resident.search_many(probes, room=room or None, k=config.MULTI_CANDIDATES)
+    return candidates, assign_one_to_one(candidates, config.RECOGNITION_THRESHOLD)
+
+
+def multi_recognition(faces: List[Dict], candidates, matches, profiles: Dict[str, Dict]) -> Dict:
+    results = []
+    for face, cands, match in zip(faces, candidates, matches):
+        user = profiles.get(match[0]) if match else None
+        results.append({
+            "box": [int(v) for v in face["box"]],
+            "conf": round(face["conf"], 4),
+            "landmarks": face["landmarks"],
+            "recognized": user is not None,
+            # Unmatched faces report their best raw similarity, like /recognize
+            "confidence": round(match[1] if match else (cands[0][1] if cands else 0.0), 4),
+            "user": user_to_response(user) if user else None
+        })
+    return {
+        "detected": True,
+        "count": len(results),
+        "recognized": sum(r["recognized"] for r in results),
+        "faces": results
+    }
+
+
+def detection(img: np.ndarray, faces: List[Dict]) -> Dict:
+    return {
+        "detected": bool(faces),
+        "count": len(faces),
+        "image_size": [int(img.shape[1]), int(img.shape[0])],
+        "faces": faces
+    }
+
+
+# ----------------- Streaming -----------------
+def stream_recognizer(detector, resident, room: Optional[str]) -> StreamRecognizer:
+    """
+    Tracker-based recognizer of one stream. Its gallery search runs inside process(),
+    i.e. wherever the caller runs the frame (an inference thread in app.asgi).
+    """
+    return StreamRecognizer(
+        detector,
+        lambda embedding: resident.search(np.asarray(embedding, dtype=np.float32), room=room),
+        threshold=config.RECOGNITION_THRESHOLD,
+        iou_threshold=config.STREAM_IOU_THRESHOLD,
+        reverify_s=config.STREAM_REVERIFY_S,
+        quality_gain=config.STREAM_QUALITY_GAIN,
+    )
+
+
+def stream_users_to_fetch(result: Dict, profiles: Dict[str, Optional[Dict]]) -> List[str]:
+    """Users recognized in a frame whose profile this stream hasn't read yet (one read per identity)"""
+    return list(dict.fromkeys(face["user_id"] for face in result["faces"]
+                              if face["user_id"] and face["user_id"] not in profiles))
+
+
+def attach_stream_profiles(result: Dict, profiles: Dict[str, Optional[Dict]]) -> Dict:
+    """Replace each face's user_id with the user's response (profiles: user_id -> response or None)"""
+    for face in result["faces"]:
+        user_id = face.pop("user_id")
+        face["user"] = profiles.get(user_id) if user_id else None
+        face["recognized"] = face["user"] is not None
+    return result
+
+
+# ----------------- Jobs and stats -----------------
+def enrollment_upload_paths(job_dir: str) -> Tuple[str, str]:
+    """Where an uploaded job's archive and roster are kept: (zip path, CSV path)"""
+    return os.path.join(job_dir, "images.zip"), os.path.join(job_dir, "roster.csv")
+
+
+def enrollment_accepted(job_id: str, job: Dict) -> Answer:
+    return {"job_id": job_id, "status": job["status"], "status_url": f"/enroll/jobs/{job_id}"}, 202
+
+
+def inference_stats(detector) -> Dict:
+    """Batching scheduler / worker pool stats, {"batching": False} for inline inference"""
+    if isinstance(detector, InferencePool):
+        return {"batching": False, "pool": detector.stats()}
+    if not isinstance(detector, BatchingFaceDetector):
+        return {"batching": False}
+    return {"batching": True, **detector.stats()}
+
+
+def timestamps_migrated(updated_count: int) -> Dict:
+    return {"message": f"Migration completed. Updated {updated_count} records.", "updated_count": updated_count}
+
+
+def embeddings_migrated(stats: Dict) -> Dict:
+    return {"message": f"Migration completed. Converted {stats['faces']} faces in {stats['updated']} records.",
+            **stats}
@@ -1,27 +1,55 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, g, request, jsonify, stream_with_context
 from flask_cors import CORS
 import os
 import datetime
-import cv2
+import json
 import numpy as np
 import uuid
 from typing import Optional, Dict, Any
-import base64
 
-from app.db.mongo import get_db
-from app.services.face_detection import FaceDetection
-from app.models.user import create_user_document
+from app import config, handlers, runtime
+from app.db.mongo import get_db, paginate
+from app.handlers import UPLOAD_FOLDER
+from app.services.dedup import describe_matches
+from app.services.enrollment import ImageSource
+from app.services.gallery_sync import TOMBSTONES, insert_stamped, tombstone
+from app.services.inference_pool import PoolBusyError
+from app.services.metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, REGISTRY
+from app.services.lifecycle import NotReadyError, readiness
+from app.services.image_io import ImageWriter, decode_base64_image, decode_image, iter_frames, read_upload
+from app.models.user import PROFILE_PROJECTION, response_projection, user_to_response
+from app.runtime import build_caches
+from app.tools.migrate_embeddings import migrate_embeddings
+from app.tools.migrate_timestamps import migrate_timestamps
 
 app = Flask(__name__)
 CORS(app)
 
-UPLOAD_FOLDER = "uploads"
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 
+# Chips (and originals, with KEEP_UPLOADS) are only written by /register, optionally off the request thread
+image_writer = ImageWriter(asynchronous=config.PERSIST_UPLOADS_ASYNC)
+# Aligned face chips of enrolled faces, content-addressed
+face_store = runtime.build_face_store(image_writer)
+
 db = get_db()
 users_col = db["users"]
+# Deletions, read by the GallerySync of every process
+tombstones_col = db[TOMBSTONES]
+
+# Model and resident embedding gallery load per STARTUP_MODE (in the background by default,
+# /readyz reports when they are done); the gallery is kept in sync by /register and DELETE
+face_detector, gallery = runtime.deferred_components(db)
+
+# Repeated probes and hot profile lookups skip inference / Mongo; invalidated by register, delete and enrollment
+recognize_cache, profile_cache = build_caches()
 
-face_detector = FaceDetection(model_name="buffalo_l", det_size=(640, 640), conf_threshold=0.5)
+# Per-stage timings and gauges for /metrics; stacks of slow requests with PROFILE_SLOW_REQUESTS
+profiler = runtime.build_profiler()
+runtime.register_metrics(face_detector, gallery, recognize_cache, profile_cache)
+
+# Registrations and deletions handled by the other workers (or CLI jobs) reach this process's gallery too
+gallery_sync = runtime.start_gallery_sync(db, gallery, recognize_cache, profile_cache)
 
 # ----------------- Helper functions -----------------
 def normalize_embedding(arr: np.ndarray) -> np.ndarray:
@@ -41,44 +69,110 @@ def cosine_similarity(a: np.ndarray, b: np.ndarray) -> float:
         return 0.0
     return float(np.dot(a, b))
 
-def user_to_response(doc: Dict) -> Dict:
-    """Chuyển user doc thành object trả về cho client (không lộ embedding)"""
-    profile = doc.get("profile", {})
-    # Backwards compatibility: support older schema where fields were top-level
-    if not profile and "name" in doc:
-        profile = {
-            "name": doc.get("name"),
-            "student_id": doc.get("student_id"),
-            "department": doc.get("department"),
-            "class": doc.get("class"),
-            "room": doc.get("room"),
-        }
-
-    # Ensure timestamps exist (for backward compatibility with old records)
-    registered_at = doc.get("registered_at")
-    updated_at = doc.get("updated_at")
-
-    # If timestamps are missing, try to get from face's added_at or use current time
-    if not registered_at:
-        faces = doc.get("faces", [])
-        if faces and faces[0].get("added_at"):
-            registered_at = faces[0]["added_at"]
-        else:
-            registered_at = datetime.datetime.now().isoformat()
 
-    if not updated_at:
-        updated_at = registered_at
+def find_user_profile(user_id: str) -> Optional[Dict]:
+    """User doc without embeddings, by user_id or legacy uuid (cached)"""
+    user = profile_cache.get(("user", user_id))
+    if user is not None:
+        return user
+    user = users_col.find_one({"user_id": user_id}, PROFILE_PROJECTION)
+    if not user:
+        # legacy records keyed by uuid
+        user = users_col.find_one({"uuid": user_id}, PROFILE_PROJECTION)
+    if user:
+        profile_cache.set(("user", user_id), user)
+    return user
+
+
+def find_student_profile(student_id: str) -> Optional[Dict]:
+    """User doc without embeddings, by student_id (cached)"""
+    user = profile_cache.get(("student", student_id))
+    if user is None:
+        user = users_col.find_one({"profile.student_id": student_id}, PROFILE_PROJECTION)
+        if not user:
+            # try legacy
+            user = users_col.find_one({"student_id": student_id}, PROFILE_PROJECTION)
+        if user:
+            profile_cache.set(("student", student_id), user)
+    return user
+
+
+def find_user_profiles(user_ids) -> Dict[str, Dict]:
+    """Several user docs keyed by user_id (or legacy uuid); cache misses are read in one query"""
+    found = {}
+    for user_id in set(user_ids):
+        user = profile_cache.get(("user", user_id))
+        if user is not None:
+            found[user_id] = user
+    missing = [i for i in set(user_ids) if i not in found]
+    if missing:
+        fetched = {doc["user_id"]: doc for doc in users_col.find({"user_id": {"$in": missing}}, PROFILE_PROJECTION)}
+        legacy = [i for i in missing if i not in fetched]
+        if legacy:
+            fetched.update({doc["uuid"]: doc for doc in users_col.find({"uuid": {"$in": legacy}}, PROFILE_PROJECTION)})
+        for user_id, doc in fetched.items():
+            profile_cache.set(("user", user_id), doc)
+        found.update(fetched)
+    return found
+
 
-    return {
-        "user_id": doc.get("user_id") or doc.get("uuid"),
-        "profile": profile,
-        "registered_at": registered_at,
-        "updated_at": updated_at,
-        "embedding_version": doc.get("embedding_version")
-    }
+def invalidate_user_caches(doc: Dict) -> None:
+    runtime.invalidate_user_caches(recognize_cache, profile_cache, doc)
+
+
+def ready(deferred):
+    """The object behind a Deferred; a load still running after READY_WAIT_S raises NotReadyError (503)"""
+    return deferred.get(timeout=config.READY_WAIT_S)
+
+
+def stage(name: str):
+    """Time a stage of the current request (face_api_stage_seconds{route, stage})"""
+    return g.request_timer.stage(name)
+
+
+def answer(result):
+    """(body, status) from app.handlers as a Flask response"""
+    body, status = result
+    return jsonify(body), status
+
+
+# Bulk enrollment jobs: inputs, state and error reports survive restarts (resume with the same job id)
+enrollment_jobs = runtime.build_enrollment_jobs(users_col, db["enrollment_jobs"], face_detector, gallery, face_store,
+                                                image_writer, recognize_cache, profile_cache)
 
 # ----------------- Routes -----------------
 
+@app.before_request
+def start_request_timer():
+    g.request_timer = runtime.request_timer(request.endpoint or "unmatched", profiler)
+
+
+@app.after_request
+def finish_request_timer(response):
+    timer = g.pop("request_timer", None)
+    if timer is not None:
+        timer.finish(response.status_code)
+    return response
+
+
+@app.teardown_request
+def abort_request_timer(exc):
+    # Unhandled exception: after_request didn't run
+    timer = g.pop("request_timer", None)
+    if timer is not None:
+        timer.finish(500)
+
+
+@app.errorhandler(PoolBusyError)
+def inference_busy(e):
+    return jsonify({"error": str(e)}), 503
+
+
+@app.errorhandler(NotReadyError)
+def still_loading(e):
+    return jsonify({"error": str(e)}), 503, {"Retry-After": str(config.READY_RETRY_AFTER_S)}
+
+
 @app.route("/")
 def home():
     return jsonify({"message": "Face Detection API (InsightFace) is running!"})
@@ -91,129 +185,160 @@ def register_user():
     Expects multipart/form-data:
       - name, student_id, class, department, room
       - image (file)
+      - allow_duplicate (optional): enroll even if DUPLICATE_CHECK=reject finds the face under another user
     """
-    name = request.form.get("name", "").strip()
-    student_id = request.form.get("student_id", "").strip()
-    user_class = request.form.get("class", "").strip()
-    department = request.form.get("department", "").strip()
-    room = request.form.get("room", "").strip()
+    profile = handlers.profile_form(request.form.get)
+    student_id = profile["student_id"]
     # Accept either multiple files 'images', single file 'image', or base64
     images_files = request.files.getlist("images")
     image_file = request.files.get("image")
     image_base64 = request.form.get("image_base64")
 
     # Validate required fields - check for None, empty string, or missing file
-    if not name:
-        return jsonify({"error": "Missing required field: name"}), 400
-    if not student_id:
-        return jsonify({"error": "Missing required field: student_id"}), 400
-    if (not images_files and (not image_file or image_file.filename == '')) and not image_base64:
-        return jsonify({"error": "Missing required field: image file"}), 400
-
-    # Save uploaded images (supports multiple files or base64)
-    saved_paths = []
-    timestamp = datetime.datetime.now().strftime("%Y%m%d%H%M%S")
-    if images_files:
-        for idx, f in enumerate(images_files):
-            if not f or f.filename == '':
-                continue
-            filename = f"{student_id}_{timestamp}_{idx+1}.jpg"
-            path = os.path.join(UPLOAD_FOLDER, filename)
-            f.save(path)
-            saved_paths.append(path)
-    elif image_file and image_file.filename != '':
-        filename = f"{student_id}_{timestamp}.jpg"
-        path = os.path.join(UPLOAD_FOLDER, filename)
-        image_file.save(path)
-        saved_paths.append(path)
-    else:
-        try:
-            b64 = image_base64 or ""
-            if "," in b64:
-                b64 = b64.split(",", 1)[1]
-            img_bytes = base64.b64decode(b64)
-            filename = f"{student_id}_{timestamp}.jpg"
-            path = os.path.join(UPLOAD_FOLDER, filename)
-            with open(path, 'wb') as f:
-                f.write(img_bytes)
-            saved_paths.append(path)
-        except Exception as e:
-            return jsonify({"error": f"Invalid image_base64 data: {str(e)}"}), 400
-
-    # Read images and detect faces; keep all valid faces
+    invalid = handlers.invalid_registration(
+        profile, bool(images_files or (image_file and image_file.filename != '') or image_base64))
+    if invalid:
+        return answer(invalid)
+    # 503 before anything is decoded or written while the model or gallery is still loading
+    detector, resident = ready(face_detector), ready(gallery)
+
+    # Read uploads into memory (supports multiple files or base64); nothing touches disk yet
+    uploads = []
+    with stage("read"):
+        if images_files:
+            uploads = [read_upload(f) for f in images_files if f and f.filename != '']
+        elif image_file and image_file.filename != '':
+            uploads = [read_upload(image_file)]
+        else:
+            try:
+                uploads = [decode_base64_image(image_base64)]
+            except Exception as e:
+                return answer(handlers.error(f"Invalid image_base64 data: {str(e)}", 400))
+
+    # Decode and detect faces; keep all valid faces
     detected_faces = []
-    valid_paths = []
-    for path in saved_paths:
-        img = cv2.imread(path)
+    rejected_faces = []
+    for data in uploads:
+        with stage("decode"):
+            img = decode_image(data)
         if img is None:
             continue
-        face = face_detector.get_best_face(img)
-        if face:
-            detected_faces.append({"face": face, "image_path": path})
-            valid_paths.append(path)
+        with stage("inference"):
+            face = detector.get_best_face(img)
+        if face and face.get("rejected"):
+            # Too small, blurred, badly lit or turned away: never stored
+            rejected_faces.append(face)
+        elif face:
+            detected_faces.append({"face": face, "data": data, "image": img})
 
     if not detected_faces:
-        # cleanup saved files
-        for path in saved_paths:
-            try:
-                os.remove(path)
-            except Exception:
-                pass
-        return jsonify({"error": "No face detected in the provided images. Please upload clear face images."}), 400
+        return answer(handlers.nothing_to_register(rejected_faces, g.request_timer.route))
+
+    # Already enrolled under another student_id?
+    with stage("duplicates"):
+        matches = handlers.duplicate_matches(resident, detected_faces)
+        duplicates = describe_matches(matches, find_user_profiles([user_id for user_id, _ in matches]),
+                                      student_id) if matches else []
+    rejection = handlers.duplicate_rejection(duplicates, request.form.get("allow_duplicate"))
+    if rejection:
+        return answer(rejection)
+
+    # Persist only the faces that will be enrolled, their chips keyed by the new user's id
+    user_id = str(uuid.uuid4())
+    with stage("persist"):
+        for item in detected_faces:
+            handlers.persist_face(face_store, image_writer, item, student_id, user_id)
 
     # Build doc and insert
-    now_iso = datetime.datetime.now().isoformat()
-    data = {
-        "name": name,
-        "student_id": student_id,
-        "class": user_class,
-        "department": department,
-        "room": room,
-        "image_path": detected_faces[0]["image_path"],
-        "registered_at": now_iso,
-        "updated_at": now_iso
-    }
-
-    # Start with first detected face
-    user_doc = create_user_document(data, detected_faces[0]["face"], embedding_version="insightface-buffalo_l-v1")
-    # Append additional faces
-    for item in detected_faces[1:]:
-        user_doc["faces"].append({
-            "image_path": item["image_path"],
-            "embedding": item["face"].get("embedding"),
-            "confidence": item["face"].get("conf"),
-            "landmarks": item["face"].get("landmarks"),
-            "added_at": now_iso,
-        })
-    users_col.insert_one(user_doc)
-
-    # Return sanitized response
-    resp = user_to_response(user_doc)
-    return jsonify({"message": "User registered successfully", "data": resp}), 201
+    user_doc = handlers.new_user_document(profile, detected_faces, datetime.datetime.now().isoformat(), user_id)
+    with stage("insert"):
+        # embeddings_updated_at set by the server, for the other processes' GallerySync
+        users_col.update_one(*insert_stamped(user_doc), upsert=True)
+    with stage("gallery"):
+        resident.add_user(user_doc)
+    invalidate_user_caches(user_doc)
+    return answer(handlers.registered(user_doc, duplicates))
+
+
+@app.route("/enroll/bulk", methods=["POST"])
+def enroll_bulk():
+    """
+    Start a bulk enrollment job.
+    multipart/form-data: 'archive' (zip of images) and 'roster' (CSV of profile fields).
+    Returns 202 with the job id; poll GET /enroll/jobs/<job_id>.
+    """
+    archive = request.files.get("archive")
+    roster = request.files.get("roster")
+    if not archive or not roster:
+        return jsonify({"error": "Both 'archive' (zip) and 'roster' (CSV) files are required"}), 400
+
+    job_id = enrollment_jobs.new_job_id()
+    source_path, roster_path = handlers.enrollment_upload_paths(enrollment_jobs.job_dir(job_id))
+    archive.save(source_path)
+    roster.save(roster_path)
+    try:
+        ImageSource(source_path).close()
+    except Exception:
+        return jsonify({"error": "'archive' must be a zip file"}), 400
+
+    return answer(handlers.enrollment_accepted(job_id, enrollment_jobs.submit(job_id, source_path, roster_path)))
+
+
+@app.route("/enroll/jobs/<job_id>", methods=["GET"])
+def enroll_job_status(job_id):
+    """Job status, progress (enrolled/failed/skipped, images/s) and per-row errors"""
+    job = enrollment_jobs.get(job_id)
+    if not job:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify(job), 200
+
+
+@app.route("/enroll/jobs/<job_id>/resume", methods=["POST"])
+def enroll_job_resume(job_id):
+    """Run an interrupted or failed job again; students already enrolled are skipped"""
+    job = enrollment_jobs.resume(job_id)
+    if not job:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify(job), 202
 
 
 @app.route("/users", methods=["GET"])
 def get_all_users():
-    all_users = list(users_col.find({}, {"_id": 0, "faces.embedding": 0}))  # hide embeddings in list endpoint
-    # Transform for backward compat
-    resp = [user_to_response(u) for u in all_users]
+    """
+    Without parameters: every user as a JSON array (legacy response).
+    With ?limit=, ?after= or ?fields=: one page {"users", "count", "next_cursor"} in
+    registration order; pass next_cursor back as ?after= for the next page.
+    ?fields=user_id,profile limits the returned (and fetched) fields.
+    """
+    limit, after, fields = request.args.get("limit"), request.args.get("after"), request.args.get("fields")
+    if limit is not None or after is not None or fields is not None:
+        try:
+            limit, wanted = handlers.page_request(limit, fields)
+            docs, next_cursor = paginate(users_col, {}, response_projection(wanted), limit, after or None)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        return jsonify(handlers.users_page(docs, wanted, next_cursor)), 200
+
+    resp = profile_cache.get(("list",))
+    if resp is None:
+        all_users = list(users_col.find({}, PROFILE_PROJECTION))  # response fields only, no embeddings
+        # Transform for backward compat
+        resp = [user_to_response(u) for u in all_users]
+        profile_cache.set(("list",), resp)
     return jsonify(resp), 200
 
 
 @app.route("/users/student/<student_id>", methods=["GET"])
 def get_user_by_student_id(student_id):
-    user = users_col.find_one({"profile.student_id": student_id}, {"_id": 0, "faces.embedding": 0})
+    user = find_student_profile(student_id)
     if not user:
-        # try legacy
-        user = users_col.find_one({"student_id": student_id}, {"_id": 0, "faces.embedding": 0})
-        if not user:
-            return jsonify({"error": "User not found"}), 404
+        return jsonify({"error": "User not found"}), 404
     return jsonify(user_to_response(user)), 200
 
 
 @app.route("/users/userid/<user_id>", methods=["GET"])
 def get_user_by_userid(user_id):
-    user = users_col.find_one({"user_id": user_id}, {"_id": 0, "faces.embedding": 0})
+    user = find_user_profile(user_id)
     if not user:
         return jsonify({"error": "User not found"}), 404
     return jsonify(user_to_response(user)), 200
@@ -223,51 +348,29 @@ def get_user_by_userid(user_id):
 def delete_user_by_userid(user_id):
     """
     Delete a user by their user_id.
-    Also deletes associated face images from the uploads folder.
+    Also deletes associated face images from the uploads folder, and the face chips
+    no other user shares.
     """
     try:
-        # First, find the user to get their image paths
-        user = users_col.find_one({"user_id": user_id})
+        # First, find the user to get their image paths and chips
+        user = users_col.find_one({"user_id": user_id}, handlers.DELETE_PROJECTION)
 
         if not user:
             return jsonify({"error": "User not found"}), 404
 
-        # Collect all image paths to delete
-        image_paths = []
-        faces = user.get("faces", [])
-        for face in faces:
-            image_path = face.get("image_path")
-            if image_path:
-                image_paths.append(image_path)
-
         # Delete the user document from MongoDB
         result = users_col.delete_one({"user_id": user_id})
 
         if result.deleted_count == 0:
             return jsonify({"error": "Failed to delete user"}), 500
+        tombstones_col.update_one(*tombstone(user_id), upsert=True)
+        if gallery.ready:
+            # Still loading: the load, or GallerySync after it, drops the user
+            gallery.target.remove_user(user_id)
+        invalidate_user_caches(user)
 
-        # Delete associated image files
-        deleted_images = 0
-        failed_images = []
-        for image_path in image_paths:
-            try:
-                if os.path.exists(image_path):
-                    os.remove(image_path)
-                    deleted_images += 1
-            except Exception as e:
-                failed_images.append({"path": image_path, "error": str(e)})
-
-        response = {
-            "message": "User deleted successfully",
-            "user_id": user_id,
-            "deleted_images": deleted_images,
-            "total_images": len(image_paths)
-        }
-
-        if failed_images:
-            response["failed_images"] = failed_images
-
-        return jsonify(response), 200
+        # Delete associated image files and the chips no other face uses
+        return answer(handlers.user_deleted(user_id, handlers.remove_user_files(users_col, face_store, user)))
 
     except Exception as e:
         return jsonify({"error": f"Error deleting user: {str(e)}"}), 500
@@ -279,53 +382,103 @@ def ping():
     return jsonify({"status": "ok", "message": "Server is running"}), 200
 
 
+@app.route("/livez", methods=["GET"])
+def livez():
+    """Liveness probe: the process serves requests (the model may still be loading)"""
+    return jsonify({"status": "ok"}), 200
+
+
+@app.route("/readyz", methods=["GET"])
+def readyz():
+    """Readiness probe: 200 once the model is warm and the gallery loaded, 503 before"""
+    if config.STARTUP_MODE == "lazy":
+        # Nothing loads a lazy component before its first use; a probe counts as one
+        face_detector.start()
+        gallery.start()
+    body = readiness([face_detector, gallery])
+    return jsonify(body), 200 if body["ready"] else 503
+
+
+@app.route("/stats/inference", methods=["GET"])
+def inference_stats():
+    """Batching scheduler / worker pool stats: batch sizes, queue depth and p50/p99 latency"""
+    return jsonify(handlers.inference_stats(ready(face_detector))), 200
+
+
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    """Prometheus text format: request/stage/model histograms, gallery size, caches, queue depth"""
+    return Response(REGISTRY.render(), content_type=METRICS_CONTENT_TYPE)
+
+
+@app.route("/stats/cache", methods=["GET"])
+def cache_stats():
+    """Hit/miss/eviction counters of the recognize and profile caches"""
+    return jsonify({"recognize": recognize_cache.stats(), "profiles": profile_cache.stats()}), 200
+
+
 @app.route("/migrate-timestamps", methods=["POST"])
-def migrate_timestamps():
+def migrate_timestamps_route():
     """
     Migration endpoint to fix existing records with null timestamps.
     This should be run once to update old records.
     """
     try:
-        updated_count = 0
-        users = list(users_col.find({}))
-
-        for user in users:
-            needs_update = False
-            update_fields = {}
-
-            # Check if registered_at or updated_at is missing
-            if not user.get("registered_at"):
-                needs_update = True
-                # Try to get from first face's added_at
-                faces = user.get("faces", [])
-                if faces and faces[0].get("added_at"):
-                    update_fields["registered_at"] = faces[0]["added_at"]
-                else:
-                    # Use current time as fallback
-                    update_fields["registered_at"] = datetime.datetime.now().isoformat()
-
-            if not user.get("updated_at"):
-                needs_update = True
-                # Use registered_at if available, otherwise current time
-                update_fields["updated_at"] = user.get("registered_at") or update_fields.get("registered_at") or datetime.datetime.now().isoformat()
-
-            # Update the record if needed
-            if needs_update:
-                users_col.update_one(
-                    {"_id": user["_id"]},
-                    {"$set": update_fields}
-                )
-                updated_count += 1
-
-        return jsonify({
-            "message": f"Migration completed. Updated {updated_count} records.",
-            "updated_count": updated_count
-        }), 200
+        return jsonify(handlers.timestamps_migrated(migrate_timestamps(users_col))), 200
 
     except Exception as e:
         return jsonify({"error": f"Migration failed: {str(e)}"}), 500
 
 
+@app.route("/migrate-embeddings", methods=["POST"])
+def migrate_embeddings_route():
+    """
+    Convert legacy list embeddings to BSON Binary (EMBEDDING_DTYPE, or ?dtype=float16).
+    Safe to run while serving and to re-run; see app/tools/migrate_embeddings.py.
+    """
+    dtype = request.args.get("dtype") or config.EMBEDDING_DTYPE
+    if dtype not in ("float32", "float16"):
+        return jsonify({"error": "dtype must be float32 or float16"}), 400
+    try:
+        return jsonify(handlers.embeddings_migrated(migrate_embeddings(users_col, dtype=dtype))), 200
+    except Exception as e:
+        return jsonify({"error": f"Migration failed: {str(e)}"}), 500
+
+
+@app.route("/reembed/jobs", methods=["GET"])
+def reembed_jobs():
+    """
+    Progress of re-embedding jobs (python -m app.tools.reembed), one per target version,
+    plus the version this API serves.
+    """
+    jobs = list(db["reembed_jobs"].find({}, {"_id": 0, "last_id": 0}))
+    return jsonify({"active_version": config.EMBEDDING_VERSION, "jobs": jobs}), 200
+
+
+@app.route("/detect", methods=["POST"])
+def detect_faces():
+    """
+    Detection only: boxes and 5-point landmarks, no embeddings, no gallery search.
+    Cheap enough for liveness and framing checks before calling /recognize.
+    Expects multipart/form-data with 'image' file or 'image_base64'.
+    """
+    image_file = request.files.get("image")
+    image_base64 = request.form.get("image_base64")
+    if not image_file and not image_base64:
+        return jsonify({"error": "No image provided"}), 400
+
+    try:
+        data = read_upload(image_file) if image_file else decode_base64_image(image_base64)
+    except Exception as e:
+        return jsonify({"error": f"Invalid image_base64 data: {str(e)}"}), 400
+
+    img = decode_image(data)
+    if img is None:
+        return jsonify({"error": "Could not read uploaded image"}), 400
+
+    return jsonify(handlers.detection(img, ready(face_detector).detect_boxes(img))), 200
+
+
 @app.route("/recognize", methods=["POST"])
 def recognize_face():
     """
@@ -339,100 +492,192 @@ def recognize_face():
     if not image_file and not image_base64:
         return jsonify({"error": "No image provided"}), 400
 
-    # save temp image
-    temp_filename = f"temp_{datetime.datetime.now().strftime('%Y%m%d%H%M%S')}.jpg"
-    temp_path = os.path.join(UPLOAD_FOLDER, temp_filename)
-    if image_file:
-        image_file.save(temp_path)
-    else:
-        try:
-            b64 = image_base64 or ""
-            if "," in b64:
-                b64 = b64.split(",", 1)[1]
-            img_bytes = base64.b64decode(b64)
-            with open(temp_path, 'wb') as f:
-                f.write(img_bytes)
-        except Exception as e:
-            return jsonify({"error": f"Invalid image_base64 data: {str(e)}"}), 400
+    # Decode straight from the request buffer, no temp file
+    try:
+        with stage("read"):
+            data = read_upload(image_file) if image_file else decode_base64_image(image_base64)
+    except Exception as e:
+        return jsonify({"error": f"Invalid image_base64 data: {str(e)}"}), 400
 
     try:
-        img = cv2.imread(temp_path)
+        with stage("decode"):
+            img = decode_image(data)
         if img is None:
             return jsonify({"error": "Could not read uploaded image"}), 400
 
-        best_face = face_detector.get_best_face(img)
+        # A resent frame is answered from the cache: no inference, no Mongo read
+        with stage("cache"):
+            # A registration or delete after this point makes the answer computed below stale
+            generation = recognize_cache.generation
+            cache_key = handlers.recognize_cache_key(img, room)
+            cached = recognize_cache.get(cache_key)
+        if cached is not None:
+            body, status = cached
+            return jsonify(body), status
+
+        def respond(result):
+            recognize_cache.set(cache_key, result, generation=generation)
+            return answer(result)
+
+        detector, resident = ready(face_detector), ready(gallery)
+        with stage("inference"):
+            best_face = detector.get_best_face(img)
         if not best_face:
-            return jsonify({"error": "No face detected in the image", "detected": False}), 400
-
-        probe_emb = np.array(best_face.get("embedding"), dtype=np.float32)
-        probe_emb = normalize_embedding(probe_emb)
-
-        # Query candidate users
-        query = {}
-        if room:
-            query["profile.room"] = room
-
-        # Project only embeddings to compare (and minimal metadata)
-        candidates = list(users_col.find(query, {
-            "_id": 0,
-            "user_id": 1,
-            "profile": 1,
-            "faces.embedding": 1,
-            "faces.confidence": 1,
-            "registered_at": 1,
-            "updated_at": 1,
-            "embedding_version": 1
-        }))
-
-        best_match = None
-        best_sim = -1.0
-
-        for cand in candidates:
-            faces = cand.get("faces", [])
-            for f in faces:
-                emb = f.get("embedding")
-                if emb is None:
-                    continue
-                emb_arr = np.array(emb, dtype=np.float32)
-                sim = cosine_similarity(probe_emb, emb_arr)
-                if sim > best_sim:
-                    best_sim = sim
-                    best_match = {
-                        "user": cand,
-                        "face_meta": f
-                    }
-
-        # Clean up temp file
-        try:
-            os.remove(temp_path)
-        except Exception:
-            pass
-
-        # Decide threshold: similarity ~0.35-0.4 (dot product of normalized vectors) is okay but tune on your data.
-        THRESHOLD = 0.70  # we use 0..1 (higher = more similar); InsightFace normalized dot is in [-1,1], but for real embeddings it's typically 0..1.
-                           # choose a conservative threshold like 0.7 for fewer false positives. Tune it.
-
-        if best_match and best_sim >= THRESHOLD:
-            matched_user = best_match["user"]
-            response = {
-                "recognized": True,
-                "confidence": round(best_sim, 4),
-                "user": user_to_response(matched_user)
-            }
-            return jsonify(response), 200
-        else:
-            return jsonify({
-                "recognized": False,
-                "message": "Face detected but no matching user found (threshold not met).",
-                "confidence": round(best_sim, 4) if best_match else 0.0
-            }), 404
+            return respond(handlers.no_face())
+        if best_face.get("rejected"):
+            return respond(handlers.quality_rejection(g.request_timer.route, best_face))
+
+        # Single matrix-vector product over the resident gallery (room filter is a precomputed row index)
+        with stage("search"):
+            match = resident.search(handlers.probe_embedding(best_face), room=room or None)
+
+        matched_user = None
+        matched_id = handlers.recognized_user_id(match)
+        if matched_id:
+            # Only the winning profile is read from Mongo
+            with stage("profile"):
+                matched_user = find_user_profile(matched_id)
+        return respond(handlers.recognition(match, matched_user))
+
+    except (PoolBusyError, NotReadyError):
+        raise
+    except Exception as e:
+        return jsonify({"error": f"Error processing face: {str(e)}"}), 500
+
+
+@app.route("/verify", methods=["POST"])
+def verify_face():
+    """
+    1:1 verification: is the face in the image the claimed user?
+    Expects multipart/form-data with 'image' file (or image_base64) and 'user_id' or 'student_id'.
+    Only the claimed user's embeddings are scored, so the cost doesn't depend on the gallery size.
+    """
+    image_file = request.files.get("image")
+    image_base64 = request.form.get("image_base64")
+    user_id = request.form.get("user_id", "").strip()
+    student_id = request.form.get("student_id", "").strip()
+
+    if not image_file and not image_base64:
+        return jsonify({"error": "No image provided"}), 400
+    if not user_id and not student_id:
+        return jsonify({"error": "Missing required field: user_id or student_id"}), 400
+
+    try:
+        with stage("read"):
+            data = read_upload(image_file) if image_file else decode_base64_image(image_base64)
+    except Exception as e:
+        return jsonify({"error": f"Invalid image_base64 data: {str(e)}"}), 400
+
+    try:
+        # Indexed lookup of the claimed identity (cached), before any inference
+        with stage("profile"):
+            user = find_user_profile(user_id) if user_id else find_student_profile(student_id)
+        if not user:
+            return jsonify({"error": "User not found"}), 404
+
+        with stage("decode"):
+            img = decode_image(data)
+        if img is None:
+            return jsonify({"error": "Could not read uploaded image"}), 400
+
+        detector, resident = ready(face_detector), ready(gallery)
+        with stage("inference"):
+            best_face = detector.get_best_face(img)
+        if not best_face:
+            return answer(handlers.no_face())
+        if best_face.get("rejected"):
+            return answer(handlers.quality_rejection(g.request_timer.route, best_face))
+
+        # The claimed user's faces straight from the resident gallery, by label
+        with stage("search"):
+            similarity, compared = handlers.verify_similarity(resident, user, best_face)
+        return answer(handlers.verification(similarity, compared, user))
+
+    except (PoolBusyError, NotReadyError):
+        raise
+    except Exception as e:
+        return jsonify({"error": f"Error verifying face: {str(e)}"}), 500
+
+
+@app.route("/recognize/multi", methods=["POST"])
+def recognize_multi():
+    """
+    Recognize every face in one image (group photo, doorway frame).
+    Same inputs as /recognize. All faces are embedded in one batch, searched against the
+    gallery with one matrix-matrix product and matched one-to-one, so two faces in the
+    frame never get the same user.
+    """
+    image_file = request.files.get("image")
+    image_base64 = request.form.get("image_base64")
+    room = request.form.get("room")
+
+    if not image_file and not image_base64:
+        return jsonify({"error": "No image provided"}), 400
+
+    try:
+        with stage("read"):
+            data = read_upload(image_file) if image_file else decode_base64_image(image_base64)
+    except Exception as e:
+        return jsonify({"error": f"Invalid image_base64 data: {str(e)}"}), 400
+
+    try:
+        with stage("decode"):
+            img = decode_image(data)
+        if img is None:
+            return jsonify({"error": "Could not read uploaded image"}), 400
 
+        # Sorted by confidence; keep the most confident faces
+        detector, resident = ready(face_detector), ready(gallery)
+        with stage("inference"):
+            faces = detector.detect_faces(img)[:config.MULTI_MAX_FACES]
+        if not faces:
+            return answer(handlers.no_face())
+
+        with stage("search"):
+            candidates, matches = handlers.match_faces(resident, faces, room)
+        with stage("profile"):
+            profiles = find_user_profiles([m[0] for m in matches if m])
+        return jsonify(handlers.multi_recognition(faces, candidates, matches, profiles)), 200
+
+    except (PoolBusyError, NotReadyError):
+        raise
     except Exception as e:
+        return jsonify({"error": f"Error processing faces: {str(e)}"}), 500
+
+
+@app.route("/recognize/stream", methods=["POST"])
+def recognize_stream():
+    """
+    Streaming recognition for a camera feed.
+    Body: frames as <4-byte big-endian length><JPEG/PNG bytes>, sent with chunked encoding.
+    Response: one JSON line per frame (application/x-ndjson), written as each frame is processed.
+    Faces are tracked across frames; embedding + search only re-run for new tracks,
+    better-quality faces or after STREAM_REVERIFY_S. Optional ?room= limits the search.
+    """
+    room = request.args.get("room") or None
+    recognizer = handlers.stream_recognizer(ready(face_detector), ready(gallery), room)
+    frames = iter_frames(request.stream, int(config.STREAM_MAX_FRAME_MB * 1024 * 1024))
+
+    def generate():
+        profiles: Dict[str, Optional[Dict]] = {}
         try:
-            os.remove(temp_path)
-        except Exception:
-            pass
-        return jsonify({"error": f"Error processing face: {str(e)}"}), 500
+            for data in frames:
+                img = decode_image(data)
+                if img is None:
+                    yield json.dumps({"frame": recognizer.frames, "error": "Could not read frame"}) + "\n"
+                    recognizer.frames += 1
+                    continue
+                result = recognizer.process(img)
+                # One Mongo read per identity per stream
+                for user_id in handlers.stream_users_to_fetch(result, profiles):
+                    doc = find_user_profile(user_id)
+                    profiles[user_id] = user_to_response(doc) if doc else None
+                yield json.dumps(handlers.attach_stream_profiles(result, profiles)) + "\n"
+        except (ValueError, PoolBusyError) as e:
+            yield json.dumps({"error": str(e)}) + "\n"
+        yield json.dumps({"done": True, **recognizer.stats()}) + "\n"
+
+    return Response(stream_with_context(generate()), mimetype="application/x-ndjson")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,74 @@
+from typing import Any, Optional
+
+import numpy as np
+from bson.binary import Binary
+
+# dtypes accepted for stored embeddings; "list" keeps the legacy BSON array of doubles
+EMBEDDING_DTYPES = ("float32", "float16", "list")
+
+
+def encode_embedding(embedding, dtype: str = "float32") -> Any:
+    """
+    Lưu embedding dạng bytes (BSON Binary) kèm metadata, thay vì mảng double.
+    512 x float32 = 2 KB, float16 = 1 KB (mảng BSON double ~6 KB).
+    :param dtype: "float32" | "float16" | "list" (định dạng cũ)
+    :return: {"dtype": "float32", "dim": 512, "data": Binary} hoặc list nếu dtype="list"
+    """
+    if dtype not in EMBEDDING_DTYPES:
+        raise ValueError(f"dtype must be one of {EMBEDDING_DTYPES}")
+    if embedding is None:
+        return None
+    arr = np.asarray(embedding, dtype=np.float32).ravel()
+    if dtype == "list":
+        return arr.tolist()
+    # Little-endian on disk regardless of the host
+    data = arr.astype(np.dtype(dtype).newbyteorder("<"), copy=False).tobytes()
+    return {"dtype": dtype, "dim": int(arr.shape[0]), "data": Binary(data)}
+
+
+def decode_embedding(value: Any) -> Optional[np.ndarray]:
+    """
+    Đọc embedding ở mọi định dạng đã lưu: Binary + metadata (mới) hoặc list (cũ).
+    Với dạng binary, kết quả là view read-only trên bytes của document (np.frombuffer, không copy).
+    :return: vector 1-D (float32/float16) hoặc None
+    """
+    if value is None:
+        return None
+    if isinstance(value, dict):
+        dtype = np.dtype(value.get("dtype", "float32")).newbyteorder("<")
+        arr = np.frombuffer(value["data"], dtype=dtype)
+        dim = value.get("dim")
+        if dim is not None and arr.shape[0] != dim:
+            raise ValueError(f"Embedding has {arr.shape[0]} values, metadata says {dim}")
+        return arr
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return np.frombuffer(value, dtype="<f4")
+    return np.asarray(value, dtype=np.float32).ravel()
+
+
+def is_legacy_embedding(value: Any) -> bool:
+    """True nếu embedding còn lưu dạng mảng BSON (cần migrate)"""
+    return isinstance(value, (list, tuple))
+
+
+
+# Version of documents written before embedding_version existed (buffalo_l ArcFace)
+LEGACY_EMBEDDING_VERSION = "insightface-buffalo_l-v1"
+
+
+def version_key(version: str) -> str:
+    """Tên field MongoDB cho một embedding_version (không chứa "." hay "$")"""
+    return version.replace(".", "_").replace("$", "_")
+
+
+def face_embedding_for(face: dict, doc_version: Optional[str], version: Optional[str]) -> Any:
+    """
+    Embedding đã lưu của một face cho model `version`.
+    `faces.<i>.embedding` thuộc version của document (embedding_version); embedding
+    của model khác (do re-embedding job ghi) nằm trong `faces.<i>.embeddings.<version>`.
+    :param version: None = luôn lấy `embedding` chính
+    :return: giá trị đã lưu (chưa decode) hoặc None nếu chưa có cho version này
+    """
+    if version is None or (doc_version or LEGACY_EMBEDDING_VERSION) == version:
+        return face.get("embedding")
+    return (face.get("embeddings") or {}).get(version_key(version))
@@ -1,13 +1,38 @@
+import datetime
 import uuid
-from typing import Dict, Any
+from typing import Dict, Any, Optional
 
-def create_user_document(data: Dict[str, Any], face: Dict[str, Any], embedding_version: str = "insightface-buffalo_l-v1") -> Dict:
+from app.models.embedding import LEGACY_EMBEDDING_VERSION, encode_embedding
+
+
+def create_face_entry(face: Dict[str, Any], image_path: Optional[str], added_at: Optional[str],
+                      embedding_dtype: str = "float32", chip: Optional[str] = None) -> Dict:
+    """
+    Tạo một phần tử của mảng faces.
+    face: dict returned from FaceDetection.get_best_face()
+    image_path: ảnh gốc (None khi chỉ lưu chip)
+    embedding_dtype: "float32" | "float16" (BSON Binary) hoặc "list" (định dạng cũ)
+    chip: key của ảnh khuôn mặt đã căn chỉnh trong FaceStore
+    """
+    return {
+        "image_path": image_path,
+        "chip": chip,
+        "embedding": encode_embedding(face.get("embedding"), embedding_dtype),
+        "confidence": face.get("conf"),
+        "landmarks": face.get("landmarks"),
+        "added_at": added_at,
+    }
+
+
+def create_user_document(data: Dict[str, Any], face: Dict[str, Any], embedding_version: str = LEGACY_EMBEDDING_VERSION,
+                         embedding_dtype: str = "float32") -> Dict:
     """
     Tạo document consistent để lưu MongoDB.
     face: dict returned from FaceDetection.get_best_face()
+    data["user_id"]: id đã sinh trước (vd. để đặt key cho chip), mặc định uuid4 mới
     """
     return {
-        "user_id": str(uuid.uuid4()),
+        "user_id": data.get("user_id") or str(uuid.uuid4()),
         "profile": {
             "name": data.get("name"),
             "student_id": data.get("student_id"),
@@ -16,15 +41,68 @@ def create_user_document(data: Dict[str, Any], face: Dict[str, Any], embedding_v
             "room": data.get("room"),
         },
         "faces": [
-            {
-                "image_path": data.get("image_path"),
-                "embedding": face.get("embedding"),       # list
-                "confidence": face.get("conf"),
-                "landmarks": face.get("landmarks"),
-                "added_at": data.get("registered_at"),
-            }
+            create_face_entry(face, data.get("image_path"), data.get("registered_at"), embedding_dtype,
+                              data.get("chip"))
         ],
         "embedding_version": embedding_version,
         "registered_at": data.get("registered_at"),
         "updated_at": data.get("updated_at"),
     }
+
+
+def user_to_response(doc: Dict) -> Dict:
+    """Chuyển user doc thành object trả về cho client (không lộ embedding)"""
+    profile = doc.get("profile", {})
+    # Backwards compatibility: support older schema where fields were top-level
+    if not profile and "name" in doc:
+        profile = {
+            "name": doc.get("name"),
+            "student_id": doc.get("student_id"),
+            "department": doc.get("department"),
+            "class": doc.get("class"),
+            "room": doc.get("room"),
+        }
+
+    # Ensure timestamps exist (for backward compatibility with old records)
+    registered_at = doc.get("registered_at")
+    updated_at = doc.get("updated_at")
+
+    # If timestamps are missing, try to get from face's added_at or use current time
+    if not registered_at:
+        faces = doc.get("faces", [])
+        if faces and faces[0].get("added_at"):
+            registered_at = faces[0]["added_at"]
+        else:
+            registered_at = datetime.datetime.now().isoformat()
+
+    if not updated_at:
+        updated_at = registered_at
+
+    return {
+        "user_id": doc.get("user_id") or doc.get("uuid"),
+        "profile": profile,
+        "registered_at": registered_at,
+        "updated_at": updated_at,
+        "embedding_version": doc.get("embedding_version")
+    }
+
+
+# Document fields read by user_to_response() for each response field (legacy top-level fields included)
+RESPONSE_FIELDS = {
+    "user_id": ["user_id", "uuid"],
+    "profile": ["profile", "name", "student_id", "department", "class", "room"],
+    "registered_at": ["registered_at", "faces.added_at"],
+    "updated_at": ["updated_at", "registered_at", "faces.added_at"],
+    "embedding_version": ["embedding_version"],
+}
+
+
+def response_projection(fields) -> Dict[str, int]:
+    """Mongo projection fetching only what the given response fields need"""
+    projection = {"_id": 0}
+    for field in fields:
+        projection.update(dict.fromkeys(RESPONSE_FIELDS[field], 1))
+    return projection
+
+
+PROFILE_PROJECTION = response_projection(RESPONSE_FIELDS)
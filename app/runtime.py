@@ -0,0 +1,228 @@
+"""
+Process-wide objects built from config, shared by the Flask app (app.main) and the
+ASGI app (app.asgi): the face detector, the resident gallery and the response caches.
+"""
+import os
+from typing import Dict, Optional, Tuple
+
+from pymongo import DESCENDING
+
+from app import config, handlers
+from app.db.mongo import ensure_indexes
+from app.services.batching import BatchingFaceDetector
+from app.services.cache import TTLCache
+from app.services.enrollment import BulkEnrollment, EnrollmentJobs, ImageSource, read_roster
+from app.services.face_detection import FaceDetection
+from app.services.face_store import FaceStore
+from app.services.gallery import EmbeddingGallery
+from app.services.gallery_sync import CHANGED_FIELD, TOMBSTONES, GallerySync, change_marks
+from app.services.image_io import ImageWriter, decode_image
+from app.services.inference_pool import InferencePool
+from app.services.lifecycle import Deferred
+from app.services.metrics import REGISTRY, RequestTimer, SamplingProfiler
+from app.services.search_index import create_index
+
+
+def build_detector():
+    """FaceDetection, wrapped in the batching scheduler, or the multi-process pool, per config"""
+    detector_kwargs = config.detector_kwargs()
+    if config.INFERENCE_WORKERS > 0:
+        # Model lives in worker processes only; they start on the first request
+        return InferencePool(workers=config.INFERENCE_WORKERS,
+                             threads_per_worker=config.INFERENCE_THREADS_PER_WORKER,
+                             detector_kwargs=detector_kwargs,
+                             slots=config.INFERENCE_SLOTS or None,
+                             slot_bytes=int(config.INFERENCE_SLOT_MB * 1024 * 1024),
+                             acquire_timeout=config.INFERENCE_ACQUIRE_TIMEOUT_S)
+    face_detector = FaceDetection(**detector_kwargs)
+    if config.INFERENCE_BATCHING:
+        face_detector = BatchingFaceDetector(face_detector, max_batch_size=config.BATCH_MAX_SIZE,
+                                             max_wait_ms=config.BATCH_MAX_WAIT_MS)
+    return face_detector
+
+
+def build_face_store(writer: Optional[ImageWriter] = None) -> FaceStore:
+    """Chip store in FACE_STORE_DIR, writing through `writer` (the API's upload writer)"""
+    return FaceStore(config.FACE_STORE_DIR, chip_format=config.FACE_CHIP_FORMAT,
+                     jpeg_quality=config.FACE_CHIP_JPEG_QUALITY, thumbnail_size=config.FACE_THUMBNAIL_SIZE,
+                     writer=writer)
+
+
+def gallery_index_params() -> Dict:
+    """Constructor parameters of the configured INDEX_BACKEND"""
+    params = {}
+    if config.INDEX_BACKEND == "ivf":
+        params = {"nlist": config.IVF_NLIST, "nprobe": config.IVF_NPROBE, "min_train": config.IVF_MIN_TRAIN}
+    elif config.INDEX_BACKEND in ("pq", "sq8"):
+        params = {"rerank": config.QUANT_RERANK, "min_train": config.QUANT_MIN_TRAIN}
+        if config.QUANT_REFINE:
+            params["refine"] = config.QUANT_REFINE
+        if config.INDEX_BACKEND == "pq":
+            params["m"] = config.PQ_M
+    return params
+
+
+def build_gallery() -> EmbeddingGallery:
+    """Empty gallery with the configured index backend; fill it with load_from_collection()"""
+    index_params = gallery_index_params()
+    template_index = create_index(config.INDEX_BACKEND, dim=512, **index_params) if config.GALLERY_TEMPLATES else None
+    return EmbeddingGallery(dim=512, index=create_index(config.INDEX_BACKEND, dim=512, **index_params),
+                            template_index=template_index, rerank_k=config.TEMPLATE_RERANK_K,
+                            version=config.EMBEDDING_VERSION)
+
+
+def collection_fingerprint(users_col) -> Dict:
+    """
+    Cheap summary of the users collection (three indexed queries) and of the gallery
+    settings: any insert, delete or rewrite of a user's vectors (embeddings_updated_at,
+    set by registration, enrollment and re-embedding), or a change of EMBEDDING_VERSION
+    or index configuration, changes it, so a gallery snapshot taken from another state
+    is rejected.
+    """
+    newest = users_col.find_one({}, {"_id": 1}, sort=[("_id", DESCENDING)])
+    touched = users_col.find_one({CHANGED_FIELD: {"$exists": True}}, {CHANGED_FIELD: 1},
+                                 sort=[(CHANGED_FIELD, DESCENDING)])
+    return {
+        "count": users_col.count_documents({}),
+        "last_id": str(newest["_id"]) if newest else None,
+        CHANGED_FIELD: str(touched[CHANGED_FIELD]) if touched else None,
+        "embedding_version": config.EMBEDDING_VERSION,
+        "index": {"backend": config.INDEX_BACKEND, "params": gallery_index_params()},
+    }
+
+
+def load_gallery(db) -> EmbeddingGallery:
+    """
+    Gallery built from the users collection, restored from GALLERY_SNAPSHOT when the
+    snapshot matches the collection (otherwise loaded from MongoDB and snapshotted).
+    """
+    if config.MONGO_ENSURE_INDEXES:
+        ensure_indexes(db)
+    users_col = db["users"]
+    gallery = build_gallery()
+    # Taken before reading, so a write racing the load makes the next snapshot stale, never wrong,
+    # and GallerySync re-reads it
+    gallery.change_marks = change_marks(users_col, db[TOMBSTONES])
+    fingerprint = collection_fingerprint(users_col)
+    # A compressed index only gives back approximations, which must not replace the embeddings
+    if not config.GALLERY_SNAPSHOT or not gallery.index.lossless:
+        gallery.load_from_collection(users_col)
+        return gallery
+    if gallery.load_snapshot(config.GALLERY_SNAPSHOT, fingerprint) is not None:
+        return gallery
+    gallery.load_from_collection(users_col)
+    try:
+        gallery.save_snapshot(config.GALLERY_SNAPSHOT, fingerprint)
+    except OSError:
+        # Read-only or full disk: serve anyway, the next start reads MongoDB again
+        pass
+    return gallery
+
+
+def start_gallery_sync(db, gallery: Deferred, *caches: TTLCache) -> GallerySync:
+    """
+    Apply writes made by other processes every GALLERY_SYNC_INTERVAL_S (0 = never);
+    `caches` are cleared whenever that changed the gallery.
+    """
+    def on_change() -> None:
+        for cache in caches:
+            cache.clear()
+
+    sync = GallerySync(db["users"], db[TOMBSTONES], gallery, interval_s=config.GALLERY_SYNC_INTERVAL_S,
+                       on_change=on_change)
+    REGISTRY.callback("face_gallery_syncs_total", "Gallery re-syncs after writes by other processes",
+                      lambda: sync.stats["syncs"], "counter")
+    return sync.start()
+
+
+def warm_up(face_detector) -> None:
+    """One detection + embedding so ONNX Runtime allocates before the first request"""
+    if not config.WARMUP_IMAGE or not os.path.exists(config.WARMUP_IMAGE):
+        return
+    with open(config.WARMUP_IMAGE, "rb") as f:
+        face_detector.get_best_face(decode_image(f.read()))
+
+
+def deferred_components(db) -> Tuple[Deferred, Deferred]:
+    """
+    (face detector, gallery) as Deferreds, started per STARTUP_MODE: loading in the
+    background, on first use ("lazy"), or before returning ("eager").
+    """
+    face_detector = Deferred("model", build_detector, warm_up)
+    gallery = Deferred("gallery", lambda: load_gallery(db))
+    if config.STARTUP_MODE != "lazy":
+        face_detector.start()
+        gallery.start()
+    if config.STARTUP_MODE == "eager":
+        face_detector.get()
+        gallery.get()
+    return face_detector, gallery
+
+
+def build_caches() -> Tuple[TTLCache, TTLCache]:
+    """:return: (recognize result cache, profile cache)"""
+    return (TTLCache(config.RECOGNIZE_CACHE_SIZE, config.RECOGNIZE_CACHE_TTL_S),
+            TTLCache(config.PROFILE_CACHE_SIZE, config.PROFILE_CACHE_TTL_S))
+
+
+def invalidate_user_caches(recognize_cache: TTLCache, profile_cache: TTLCache, doc: Dict) -> None:
+    """The gallery changed: drop every cached recognition and this user's cached lookups"""
+    recognize_cache.clear()
+    profile = doc.get("profile") or {}
+    profile_cache.pop(("user", doc.get("user_id") or doc.get("uuid")),
+                      ("student", profile.get("student_id") or doc.get("student_id")),
+                      ("list",))
+
+
+def build_enrollment_jobs(users_col, jobs_col, face_detector, gallery, face_store: FaceStore,
+                          image_writer: ImageWriter, recognize_cache: TTLCache,
+                          profile_cache: TTLCache) -> EnrollmentJobs:
+    """Bulk enrollment jobs writing to a (synchronous) users collection; caches are dropped after every batch"""
+    def build(source: str, roster: str, progress) -> BulkEnrollment:
+        def on_progress(stats: Dict) -> None:
+            # Called after every inserted batch
+            recognize_cache.clear()
+            profile_cache.pop(("list",))
+            progress(stats)
+
+        return BulkEnrollment(users_col, face_detector, ImageSource(source), read_roster(roster),
+                              gallery=gallery, face_store=face_store,
+                              image_writer=image_writer if config.KEEP_UPLOADS else None,
+                              upload_folder=handlers.UPLOAD_FOLDER,
+                              workers=config.ENROLL_WORKERS, batch_size=config.ENROLL_BATCH_SIZE,
+                              embedding_dtype=config.EMBEDDING_DTYPE, embedding_version=config.EMBEDDING_VERSION,
+                              duplicate_check=config.DUPLICATE_CHECK, duplicate_threshold=config.DUPLICATE_THRESHOLD,
+                              progress=on_progress)
+
+    return EnrollmentJobs(jobs_col, build, work_dir=config.IMPORT_FOLDER)
+
+
+def build_profiler() -> Optional[SamplingProfiler]:
+    """Slow-request profiler, None unless PROFILE_SLOW_REQUESTS"""
+    if not config.PROFILE_SLOW_REQUESTS:
+        return None
+    return SamplingProfiler(interval_s=config.PROFILE_INTERVAL_MS / 1000)
+
+
+def request_timer(route: str, profiler: Optional[SamplingProfiler] = None) -> RequestTimer:
+    return RequestTimer(route, slow_ms=config.SLOW_REQUEST_MS, profiler=profiler, profile_dir=config.PROFILE_DIR)
+
+
+def register_metrics(face_detector: Deferred, gallery: Deferred, recognize_cache: TTLCache,
+                     profile_cache: TTLCache) -> None:
+    """Gauges read at scrape time from the objects serving requests (nothing while they load)"""
+    caches = {"recognize": recognize_cache, "profiles": profile_cache}
+
+    def cache_field(field):
+        return lambda: {(name,): cache.stats()[field] for name, cache in caches.items()}
+
+    REGISTRY.callback("face_gallery_faces", "Face embeddings in the resident gallery", lambda: len(gallery.target) if gallery.ready else None)
+    REGISTRY.callback("face_gallery_users", "Users in the resident gallery", lambda: gallery.target.user_count if gallery.ready else None)
+    REGISTRY.callback("face_cache_entries", "Entries per response cache", cache_field("size"), labelnames=("cache",))
+    REGISTRY.callback("face_cache_hits_total", "Cache hits", cache_field("hits"), "counter", ("cache",))
+    REGISTRY.callback("face_cache_misses_total", "Cache misses", cache_field("misses"), "counter", ("cache",))
+    REGISTRY.callback("face_cache_hit_ratio", "Hits / lookups since start", cache_field("hit_ratio"),
+                      labelnames=("cache",))
+    # Batching scheduler / inference pool: requests waiting for the model (0 when inference is inline)
+    REGISTRY.callback("face_inference_queue_depth", "Requests queued for inference",
+                      lambda: getattr(face_detector.target, "queue_depth", 0))
@@ -0,0 +1,140 @@
+import collections
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from app.services.face_detection import FaceDetection
+
+
+class LatencyStats:
+    """Rolling window of request latencies (ms) with percentile summaries."""
+
+    def __init__(self, window: int = 10000):
+        self._samples = collections.deque(maxlen=window)
+        self._lock = threading.Lock()
+        self.count = 0
+
+    def record(self, ms: float) -> None:
+        with self._lock:
+            self._samples.append(ms)
+            self.count += 1
+
+    def summary(self) -> Dict[str, float]:
+        with self._lock:
+            samples = np.fromiter(self._samples, dtype=np.float64)
+            count = self.count
+        if samples.size == 0:
+            return {"count": count, "p50_ms": 0.0, "p90_ms": 0.0, "p99_ms": 0.0, "mean_ms": 0.0}
+        p50, p90, p99 = np.percentile(samples, [50, 90, 99])
+        return {"count": count, "p50_ms": round(float(p50), 3), "p90_ms": round(float(p90), 3),
+                "p99_ms": round(float(p99), 3), "mean_ms": round(float(samples.mean()), 3)}
+
+
+class _Request:
+    __slots__ = ("image", "future", "enqueued_at")
+
+    def __init__(self, image: np.ndarray):
+        self.image = image
+        self.future: Future = Future()
+        self.enqueued_at = time.perf_counter()
+
+
+class BatchingFaceDetector:
+    """
+    Micro-batching front for FaceDetection.
+
+    Requests are queued and coalesced into batches of up to `max_batch_size` images,
+    waiting at most `max_wait_ms` after the first one arrives. Detection runs per image,
+    then ArcFace embeds every aligned crop of the batch in one call; each caller gets
+    its result back through a Future. Drop-in replacement for `get_best_face`.
+    """
+
+    def __init__(self, detector: FaceDetection, max_batch_size: int = 8, max_wait_ms: float = 5.0):
+        self.detector = detector
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max(0.0, max_wait_ms) / 1000.0
+        self.latency = LatencyStats()
+        self.batches = 0
+        self.batched_images = 0
+        self._queue: "queue.Queue[Optional[_Request]]" = queue.Queue()
+        self._worker = threading.Thread(target=self._run, name="face-batcher", daemon=True)
+        self._worker.start()
+
+    @property
+    def queue_depth(self) -> int:
+        return self._queue.qsize()
+
+    def submit(self, image: np.ndarray) -> Future:
+        """Queue an image; the Future resolves to the get_best_face() result."""
+        request = _Request(image)
+        self._queue.put(request)
+        return request.future
+
+    def get_best_face(self, image: np.ndarray, timeout: Optional[float] = None) -> Optional[Dict]:
+        return self.submit(image).result(timeout)
+
+    def detect_boxes(self, image: np.ndarray) -> List[Dict]:
+        """Detection-only calls are cheap and skip the queue."""
+        return self.detector.detect_boxes(image)
+
+    def detect_faces(self, image: np.ndarray) -> List[Dict]:
+        """Every face of one image is already embedded as one batch."""
+        return self.detector.detect_faces(image)
+
+    def embed_faces(self, image: np.ndarray, landmarks: List) -> np.ndarray:
+        """Already batched per frame by the caller, so it skips the queue too."""
+        return self.detector.embed_faces(image, landmarks)
+
+    def close(self) -> None:
+        self._queue.put(None)
+        self._worker.join()
+
+    def _collect(self, first: _Request) -> List[_Request]:
+        batch = [first]
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            try:
+                item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                # put the shutdown marker back for the main loop
+                self._queue.put(None)
+                break
+            batch.append(item)
+        return batch
+
+    def _run(self) -> None:
+        while True:
+            first = self._queue.get()
+            if first is None:
+                return
+            batch = self._collect(first)
+            try:
+                results = self.detector.get_best_faces([r.image for r in batch])
+            except Exception as e:
+                for r in batch:
+                    r.future.set_exception(e)
+                continue
+
+            done = time.perf_counter()
+            for r, result in zip(batch, results):
+                r.future.set_result(result)
+                self.latency.record((done - r.enqueued_at) * 1000)
+            self.batches += 1
+            self.batched_images += len(batch)
+
+    def stats(self) -> Dict:
+        return {
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait * 1000,
+            "queue_depth": self.queue_depth,
+            "batches": self.batches,
+            "avg_batch_size": round(self.batched_images / self.batches, 3) if self.batches else 0.0,
+            "latency": self.latency.summary(),
+        }
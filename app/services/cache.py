@@ -0,0 +1,100 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional
+
+import numpy as np
+
+_MISSING = object()
+
+
+def image_digest(image: np.ndarray) -> str:
+    """Content hash of a decoded image (pixels + shape): a resent frame hashes the same, file or base64"""
+    h = hashlib.blake2b(digest_size=16)
+    h.update(f"{image.shape}{image.dtype}".encode())
+    h.update(np.ascontiguousarray(image).data)
+    return h.hexdigest()
+
+
+class TTLCache:
+    """
+    Thread-safe bounded cache: entries expire `ttl_s` seconds after being stored and,
+    when `max_size` is reached, the least recently used entry is evicted.
+    `max_size=0` disables caching (every get is a miss, set is a no-op).
+
+    `generation` moves on every invalidation (pop / clear). A value computed from state
+    read before an invalidation is stored with `set(..., generation=<read before>)`
+    and dropped, so a slow request can't re-insert a result the invalidation removed.
+    """
+
+    def __init__(self, max_size: int = 1024, ttl_s: float = 30.0, clock: Callable[[], float] = time.monotonic):
+        self.max_size = max(0, max_size)
+        self.ttl_s = ttl_s
+        self.clock = clock
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+        self.generation = 0
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            entry = self._data.get(key, _MISSING)
+            if entry is not _MISSING:
+                expires_at, value = entry
+                if expires_at > self.clock():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+                self.expirations += 1
+            self.misses += 1
+            return default
+
+    def set(self, key: Hashable, value: Any, generation: Optional[int] = None) -> None:
+        """:param generation: `self.generation` read before computing the value; skipped if it has moved"""
+        if self.max_size == 0:
+            return
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                return
+            self._data[key] = (self.clock() + self.ttl_s, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def pop(self, *keys: Hashable) -> None:
+        """Invalidate these keys (missing ones are ignored)"""
+        with self._lock:
+            self.generation += 1
+            for key in keys:
+                if self._data.pop(key, _MISSING) is not _MISSING:
+                    self.invalidations += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self.generation += 1
+            self.invalidations += len(self._data)
+            self._data.clear()
+
+    def stats(self) -> Dict:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "max_size": self.max_size,
+            "ttl_s": self.ttl_s,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "invalidations": self.invalidations,
+        }
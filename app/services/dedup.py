@@ -0,0 +1,80 @@
+"""
+Duplicate identities: the same person enrolled as two users (usually under two
+student_ids).
+
+Enrollment checks the new faces against the resident gallery
+(EmbeddingGallery.similar_users). The offline report compares every enrolled face
+with every other one. The similarity matrix is computed in (block x block) tiles
+of the upper triangle, so memory stays at one tile whatever the gallery size.
+"""
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+OFF, WARN, REJECT = "off", "warn", "reject"
+
+
+def duplicate_face_pairs(vectors: np.ndarray, threshold: float,
+                         block: int = 4096) -> Iterator[Tuple[np.ndarray, np.ndarray, np.ndarray]]:
+    """
+    Every pair of rows i < j with vectors[i] . vectors[j] >= threshold.
+    :param vectors: (n, d) normalized embeddings
+    :param block: rows per tile; a tile costs block^2 * 4 bytes (64 MB for 4096)
+    :return: per tile, (rows i, rows j, similarities)
+    """
+    vectors = np.asarray(vectors, dtype=np.float32)
+    n = vectors.shape[0]
+    for a in range(0, n, block):
+        left = vectors[a:a + block]
+        for b in range(a, n, block):
+            tile = left @ vectors[b:b + block].T
+            if a == b:
+                # Diagonal tile: each pair once, no face against itself
+                tile[np.tril_indices(tile.shape[0], m=tile.shape[1])] = -np.inf
+            i, j = np.nonzero(tile >= threshold)
+            if i.size:
+                yield i + a, j + b, tile[i, j]
+
+
+def duplicate_users(owners: Sequence[str], vectors: np.ndarray, threshold: float,
+                    block: int = 4096) -> List[Dict]:
+    """
+    Pairs of different users with faces at least `threshold` similar.
+    :param owners: user_id of every row of `vectors`
+    :return: [{"user_a", "user_b", "similarity" (best face pair), "face_pairs"}], most similar first
+    """
+    user_ids, rows = np.unique(np.asarray(owners, dtype=object), return_inverse=True)
+    best: Dict[Tuple[int, int], List] = {}
+    for i, j, scores in duplicate_face_pairs(vectors, threshold, block):
+        a, b = rows[i], rows[j]
+        # Faces of one user are expected to match each other
+        other = a != b
+        pairs = np.stack([np.minimum(a, b), np.maximum(a, b)], axis=1)[other]
+        for (x, y), score in zip(pairs.tolist(), scores[other].tolist()):
+            entry = best.get((x, y))
+            if entry is None:
+                best[(x, y)] = [score, 1]
+            else:
+                entry[0] = max(entry[0], score)
+                entry[1] += 1
+    report = [{"user_a": user_ids[x], "user_b": user_ids[y], "similarity": round(score, 4), "face_pairs": count}
+              for (x, y), (score, count) in best.items()]
+    report.sort(key=lambda r: -r["similarity"])
+    return report
+
+
+def describe_matches(matches: List[Tuple[str, float]], profiles: Dict[str, Dict],
+                     student_id: Optional[str] = None) -> List[Dict]:
+    """
+    Enrollment check result for a response: enrolled users similar to the new faces.
+    Matches already enrolled under `student_id` are dropped: re-registering the same
+    student is not a duplicate identity.
+    """
+    duplicates = []
+    for user_id, score in matches:
+        profile = (profiles.get(user_id) or {}).get("profile") or {}
+        if student_id and profile.get("student_id") == student_id:
+            continue
+        duplicates.append({"user_id": user_id, "student_id": profile.get("student_id"),
+                           "name": profile.get("name"), "similarity": round(score, 4)})
+    return duplicates
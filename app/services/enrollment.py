@@ -0,0 +1,425 @@
+import csv
+import datetime
+import os
+import re
+import threading
+import time
+import uuid
+import zipfile
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+from app.models.embedding import LEGACY_EMBEDDING_VERSION
+from app.models.user import create_face_entry, create_user_document
+from app.services.dedup import OFF, REJECT, describe_matches
+from app.services.face_store import FaceStore
+from app.services.gallery import EmbeddingGallery
+from app.services.gallery_sync import insert_stamped
+from app.services.image_io import ImageWriter, decode_image, unique_image_name
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".webp")
+PROFILE_FIELDS = ("name", "student_id", "class", "department", "room")
+
+
+class ImageSource:
+    """Images of a roster import: a directory tree or a zip archive."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._zip = zipfile.ZipFile(path) if zipfile.is_zipfile(path) else None
+        if self._zip is None and not os.path.isdir(path):
+            raise FileNotFoundError(f"{path} is neither a directory nor a zip archive")
+
+    def names(self) -> List[str]:
+        """Relative paths of every image in the source"""
+        if self._zip is not None:
+            names = [n for n in self._zip.namelist() if not n.endswith("/")]
+        else:
+            names = [os.path.relpath(os.path.join(root, f), self.path)
+                     for root, _, files in os.walk(self.path) for f in files]
+        return sorted(n for n in names if n.lower().endswith(IMAGE_EXTENSIONS))
+
+    def read(self, name: str) -> bytes:
+        if self._zip is not None:
+            return self._zip.read(name)
+        path = os.path.normpath(os.path.join(self.path, name))
+        if os.path.commonpath([path, os.path.normpath(self.path)]) != os.path.normpath(self.path):
+            raise KeyError(f"{name} is outside the image directory")
+        with open(path, "rb") as f:
+            return f.read()
+
+    def close(self) -> None:
+        if self._zip is not None:
+            self._zip.close()
+
+
+def read_roster(path: str) -> List[Dict[str, str]]:
+    """
+    Roster CSV with a header row: student_id (required), name, class, department, room,
+    and optionally `images` (file names separated by ";"). Headers are case-insensitive.
+    """
+    with open(path, newline="", encoding="utf-8-sig") as f:
+        return [{(k or "").strip().lower(): (v or "").strip() for k, v in row.items()}
+                for row in csv.DictReader(f)]
+
+
+def _images_by_student(names: Iterable[str], student_ids: Iterable[str] = ()) -> Dict[str, List[str]]:
+    """
+    `<student_id>.jpg`, `<student_id>_2.jpg` (numeric suffix) or `<student_id>/any.jpg` belong
+    to that student. A file named after one of `student_ids` belongs only to that student,
+    so with `A_1` on the roster `A_1.jpg` is not also given to `A`.
+    """
+    known = set(student_ids)
+    index: Dict[str, List[str]] = {}
+    for name in names:
+        parts = name.replace("\\", "/").split("/")
+        stem = os.path.splitext(parts[-1])[0]
+        keys = {stem}
+        numbered = re.fullmatch(r"(.+)_\d+", stem)
+        if numbered and stem not in known:
+            keys.add(numbered.group(1))
+        if len(parts) > 1:
+            keys.add(parts[-2])
+        for key in keys:
+            index.setdefault(key, []).append(name)
+    return index
+
+
+def write_error_report(errors: List[Dict], path: str) -> None:
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.DictWriter(f, fieldnames=["row", "student_id", "image", "code", "message"])
+        writer.writeheader()
+        writer.writerows(errors)
+
+
+class BulkEnrollment:
+    """
+    Enrolls a whole roster: rows stream through a thread pool that reads, decodes,
+    detects and embeds their images (the detector can be a FaceDetection, the batching
+    scheduler or the worker pool), and finished users are written with one unordered
+    `bulk_write` per batch.
+
+    Resumable: students already in the collection are skipped, so re-running the
+    same import after a crash continues where it stopped. Every rejected row or image
+    lands in `errors` with a reason code.
+
+    With `duplicate_check` "warn" or "reject", every student's faces are compared with
+    the gallery (when given) and with the students enrolled earlier in the same run:
+    similar users are reported as `possible_duplicate`, or the row is rejected as
+    `duplicate_identity` before its images are written.
+
+    Accepted faces are stored as aligned chips in `face_store`; the original images
+    are copied to `upload_folder` only when an `image_writer` is given.
+    """
+
+    def __init__(self, users_col, detector, source: ImageSource, rows: List[Dict[str, str]],
+                 gallery=None, face_store: Optional[FaceStore] = None,
+                 image_writer: Optional[ImageWriter] = None, upload_folder: str = "uploads",
+                 workers: int = 4, batch_size: int = 200, embedding_dtype: str = "float32",
+                 embedding_version: str = LEGACY_EMBEDDING_VERSION, resume: bool = True,
+                 duplicate_check: str = OFF, duplicate_threshold: float = 0.70,
+                 progress: Optional[Callable[[Dict], None]] = None):
+        self.users_col = users_col
+        self.detector = detector
+        self.source = source
+        self.rows = rows
+        self.gallery = gallery
+        self.face_store = face_store
+        self.image_writer = image_writer
+        self.upload_folder = upload_folder
+        self.workers = max(1, workers)
+        self.batch_size = max(1, batch_size)
+        self.embedding_dtype = embedding_dtype
+        self.embedding_version = embedding_version
+        self.resume = resume
+        self.duplicate_check = duplicate_check
+        self.duplicate_threshold = duplicate_threshold
+        # Users accepted by this run, so two rows with one face are caught before either is flushed
+        self._run_gallery: Optional[EmbeddingGallery] = None
+        self._run_docs: Dict[str, Dict] = {}
+        self._dedup_lock = threading.Lock()
+        self.progress = progress
+        self.errors: List[Dict] = []
+        self.stats = {"rows": len(rows), "enrolled": 0, "skipped": 0, "failed": 0,
+                      "images": 0, "faces": 0, "elapsed_s": 0.0, "images_per_s": 0.0}
+        self._lock = threading.Lock()
+
+    def _error(self, row: int, student_id: Optional[str], code: str, message: str, image: str = "") -> None:
+        with self._lock:
+            self.errors.append({"row": row, "student_id": student_id, "image": image,
+                                "code": code, "message": message})
+
+    def _enrolled_ids(self, student_ids: List[str]) -> set:
+        found = set()
+        for start in range(0, len(student_ids), 1000):
+            chunk = student_ids[start:start + 1000]
+            for doc in self.users_col.find({"profile.student_id": {"$in": chunk}}, {"_id": 0, "profile.student_id": 1}):
+                found.add(doc["profile"]["student_id"])
+        return found
+
+    def _plan(self) -> List[Tuple[int, Dict[str, str], List[str]]]:
+        """Validate rows and resolve their images; returns the rows left to process."""
+        ids = [r.get("student_id", "") for r in self.rows]
+        by_student = _images_by_student(self.source.names(), ids)
+        done = self._enrolled_ids([i for i in ids if i]) if self.resume else set()
+        seen = set()
+        todo = []
+        for i, row in enumerate(self.rows):
+            line = i + 2  # CSV line, after the header
+            student_id = row.get("student_id")
+            if not student_id:
+                self._error(line, None, "missing_student_id", "Row has no student_id")
+                self.stats["failed"] += 1
+                continue
+            if student_id in seen:
+                self._error(line, student_id, "duplicate_row", "student_id appears more than once in the roster")
+                self.stats["failed"] += 1
+                continue
+            seen.add(student_id)
+            if student_id in done:
+                self.stats["skipped"] += 1
+                continue
+            if row.get("images"):
+                images = [n.strip() for n in row["images"].split(";") if n.strip()]
+            else:
+                images = by_student.get(student_id, [])
+            if not images:
+                self._error(line, student_id, "no_images", "No image found for this student")
+                self.stats["failed"] += 1
+                continue
+            todo.append((line, row, images))
+        return todo
+
+    def _process(self, line: int, row: Dict[str, str], images: List[str]) -> Optional[Dict]:
+        """Runs on a pool thread: read -> decode -> detect + embed every image of one student."""
+        student_id = row["student_id"]
+        now_iso = datetime.datetime.now().isoformat()
+        # Chips are keyed by their owner's id
+        user_id = str(uuid.uuid4())
+        faces = []
+        for name in images:
+            try:
+                data = self.source.read(name)
+            except (KeyError, OSError) as e:
+                self._error(line, student_id, "missing_image", str(e), name)
+                continue
+            img = decode_image(data)
+            if img is None:
+                self._error(line, student_id, "unreadable_image", "Could not decode image", name)
+                continue
+            with self._lock:
+                self.stats["images"] += 1
+            face = self.detector.get_best_face(img)
+            if face is None:
+                self._error(line, student_id, "no_face", "No face detected", name)
+                continue
+            if face.get("rejected"):
+                # Quality gate reason code (face_too_small, blurry, ...), with the measurements
+                self._error(line, student_id, face["rejected"],
+                            f"Face rejected by the quality check: {face.get('quality')}", name)
+                continue
+            path = os.path.join(self.upload_folder, unique_image_name(student_id)) \
+                if self.image_writer is not None else None
+            # Chip key known before anything is written: rows rejected as duplicates leave no file
+            chip = FaceStore.key(face["chip"], user_id) \
+                if self.face_store is not None and face.get("chip") is not None else None
+            # The decoded image is only kept when a thumbnail will be cut from it
+            thumb_source = img if chip is not None and self.face_store.thumbnail_size else None
+            faces.append((face, data, thumb_source, path, chip))
+        if not faces:
+            return None
+
+        data = {field: row.get(field) or None for field in PROFILE_FIELDS}
+        data.update({"user_id": user_id, "image_path": faces[0][3], "chip": faces[0][4],
+                     "registered_at": now_iso, "updated_at": now_iso})
+        doc = create_user_document(data, faces[0][0], embedding_version=self.embedding_version,
+                                   embedding_dtype=self.embedding_dtype)
+        for face, _, _, path, chip in faces[1:]:
+            doc["faces"].append(create_face_entry(face, path, now_iso, self.embedding_dtype, chip))
+        if self.duplicate_check != OFF and self._is_duplicate(line, doc, [face[0] for face in faces]):
+            return None
+        for face, data, img, path, chip in faces:
+            if chip is not None:
+                self.face_store.put(face["chip"], user_id, img, face["box"])
+            if path is not None:
+                self.image_writer.save(data, path)
+        return doc
+
+    def _is_duplicate(self, line: int, doc: Dict, faces: List[Dict]) -> bool:
+        """
+        Report users similar to these faces, in the gallery or enrolled earlier in this
+        run (not flushed yet); True when the row must be rejected.
+        """
+        student_id = doc["profile"]["student_id"]
+        embeddings = np.stack([face["embedding"] for face in faces])
+        with self._dedup_lock:
+            if self._run_gallery is None:
+                self._run_gallery = EmbeddingGallery(dim=embeddings.shape[1], version=self.embedding_version)
+            matches = dict(self._run_gallery.similar_users(embeddings, self.duplicate_threshold))
+            if self.gallery is not None:
+                for user_id, score in self.gallery.similar_users(embeddings, self.duplicate_threshold):
+                    matches[user_id] = max(score, matches.get(user_id, score))
+            profiles = {user_id: self._run_docs[user_id] for user_id in matches if user_id in self._run_docs}
+            missing = [user_id for user_id in matches if user_id not in profiles]
+            if missing:
+                profiles.update({d["user_id"]: d for d in self.users_col.find(
+                    {"user_id": {"$in": missing}}, {"_id": 0, "user_id": 1, "profile.student_id": 1, "profile.name": 1})})
+            duplicates = describe_matches(sorted(matches.items(), key=lambda item: -item[1]), profiles, student_id)
+            reject = bool(duplicates) and self.duplicate_check == REJECT
+            if not reject:
+                self._run_gallery.add_user(doc)
+                self._run_docs[doc["user_id"]] = {"profile": doc["profile"]}
+        if duplicates:
+            best = duplicates[0]
+            message = (f"Same face as student_id {best['student_id']} (user {best['user_id']}, "
+                       f"similarity {best['similarity']})")
+            self._error(line, student_id, "duplicate_identity" if reject else "possible_duplicate", message)
+        return reject
+
+    def _flush(self, buffer: List[Tuple[int, Dict]]) -> None:
+        if not buffer:
+            return
+        docs = [doc for _, doc in buffer]
+        try:
+            # Upserts of the new documents, so the server stamps embeddings_updated_at (GallerySync)
+            self.users_col.bulk_write([UpdateOne(*insert_stamped(doc), upsert=True) for doc in docs], ordered=False)
+            inserted = docs
+        except BulkWriteError as e:
+            failed = {err["index"]: err.get("errmsg", "") for err in e.details.get("writeErrors", [])}
+            inserted = [d for i, d in enumerate(docs) if i not in failed]
+            for i, message in failed.items():
+                line, doc = buffer[i]
+                self._error(line, doc["profile"]["student_id"], "write_failed", message)
+            self.stats["failed"] += len(failed)
+        if self.gallery is not None:
+            for doc in inserted:
+                self.gallery.add_user(doc)
+        self.stats["enrolled"] += len(inserted)
+        self.stats["faces"] += sum(len(d["faces"]) for d in inserted)
+        buffer.clear()
+
+    def _report(self, start: float) -> None:
+        elapsed = time.perf_counter() - start
+        self.stats["elapsed_s"] = round(elapsed, 3)
+        self.stats["images_per_s"] = round(self.stats["images"] / elapsed, 2) if elapsed > 0 else 0.0
+        if self.progress is not None:
+            self.progress(dict(self.stats))
+
+    def run(self) -> Dict:
+        """:return: stats (rows, enrolled, skipped, failed, images, faces, images_per_s) plus `errors`"""
+        start = time.perf_counter()
+        todo = iter(self._plan())
+        buffer: List[Tuple[int, Dict]] = []
+        pending: Dict[Future, Tuple[int, str]] = {}
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="enroll") as executor:
+            while True:
+                # Bounded in-flight work: rows are streamed, not all decoded up front
+                for line, row, images in todo:
+                    pending[executor.submit(self._process, line, row, images)] = (line, row["student_id"])
+                    if len(pending) >= self.workers * 2:
+                        break
+                if not pending:
+                    break
+                finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    line, student_id = pending.pop(future)
+                    try:
+                        doc = future.result()
+                    except Exception as e:
+                        self._error(line, student_id, "error", f"{type(e).__name__}: {e}")
+                        doc = None
+                    if doc is None:
+                        self.stats["failed"] += 1
+                        continue
+                    buffer.append((line, doc))
+                    if len(buffer) >= self.batch_size:
+                        self._flush(buffer)
+                        self._report(start)
+        self._flush(buffer)
+        self._report(start)
+        return {**self.stats, "errors": self.errors}
+
+
+class EnrollmentJobs:
+    """
+    Background bulk enrollments behind the HTTP API. Jobs run one at a time on a
+    worker thread; their state, progress and error report live in `jobs_col`, so a
+    job interrupted by a restart can be resumed with the same inputs.
+
+    :param build: (source path, roster path, progress callback) -> BulkEnrollment
+    """
+
+    ERROR_LIMIT = 1000  # errors kept in the job document; the full report is a CSV next to the inputs
+
+    def __init__(self, jobs_col, build: Callable[[str, str, Callable[[Dict], None]], BulkEnrollment],
+                 work_dir: str = "imports"):
+        self.jobs_col = jobs_col
+        self.build = build
+        self.work_dir = work_dir
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="enroll-job")
+        self._active = set()
+
+    def job_dir(self, job_id: str) -> str:
+        path = os.path.join(self.work_dir, job_id)
+        os.makedirs(path, exist_ok=True)
+        return path
+
+    def new_job_id(self) -> str:
+        return uuid.uuid4().hex
+
+    def submit(self, job_id: str, source: str, roster: str) -> Dict:
+        job = {"job_id": job_id, "status": "queued", "source": source, "roster": roster,
+               "created_at": datetime.datetime.now().isoformat()}
+        self.jobs_col.insert_one(dict(job))
+        self._start(job_id, source, roster)
+        return job
+
+    def resume(self, job_id: str) -> Optional[Dict]:
+        """Re-queue a job that is not running in this process; enrolled students are skipped."""
+        job = self.get(job_id)
+        if job is None or job_id in self._active:
+            return job
+        self.jobs_col.update_one({"job_id": job_id}, {"$set": {"status": "queued"}})
+        self._start(job_id, job["source"], job["roster"])
+        return self.get(job_id)
+
+    def get(self, job_id: str) -> Optional[Dict]:
+        return self.jobs_col.find_one({"job_id": job_id}, {"_id": 0})
+
+    def _start(self, job_id: str, source: str, roster: str) -> None:
+        self._active.add(job_id)
+        self._executor.submit(self._run, job_id, source, roster)
+
+    def _run(self, job_id: str, source: str, roster: str) -> None:
+        def progress(stats: Dict) -> None:
+            self.jobs_col.update_one({"job_id": job_id}, {"$set": {"progress": stats}})
+
+        self.jobs_col.update_one({"job_id": job_id}, {"$set": {
+            "status": "running", "started_at": datetime.datetime.now().isoformat()}})
+        try:
+            enrollment = self.build(source, roster, progress)
+            try:
+                report = enrollment.run()
+            finally:
+                enrollment.source.close()
+            errors = report.pop("errors")
+            report_path = os.path.join(self.job_dir(job_id), "errors.csv")
+            write_error_report(errors, report_path)
+            self.jobs_col.update_one({"job_id": job_id}, {"$set": {
+                "status": "completed",
+                "finished_at": datetime.datetime.now().isoformat(),
+                "progress": report,
+                "errors": errors[:self.ERROR_LIMIT],
+                "error_count": len(errors),
+                "error_report": report_path,
+            }})
+        except Exception as e:
+            self.jobs_col.update_one({"job_id": job_id}, {"$set": {
+                "status": "failed", "finished_at": datetime.datetime.now().isoformat(),
+                "error": f"{type(e).__name__}: {e}"}})
+        finally:
+            self._active.discard(job_id)
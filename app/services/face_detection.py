@@ -1,8 +1,71 @@
+import os
+
 import cv2
 import numpy as np
+import onnxruntime
 from insightface.app import FaceAnalysis
+from insightface.utils import face_align
 from typing import List, Tuple, Dict, Optional
 
+from app.services.face_quality import QualityGate
+from app.services.metrics import model_stage, record_model_metric
+
+
+GRAPH_OPTIMIZATION_LEVELS = {
+    "disable": onnxruntime.GraphOptimizationLevel.ORT_DISABLE_ALL,
+    "basic": onnxruntime.GraphOptimizationLevel.ORT_ENABLE_BASIC,
+    "extended": onnxruntime.GraphOptimizationLevel.ORT_ENABLE_EXTENDED,
+    "all": onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL,
+}
+
+EXECUTION_MODES = {
+    "sequential": onnxruntime.ExecutionMode.ORT_SEQUENTIAL,
+    "parallel": onnxruntime.ExecutionMode.ORT_PARALLEL,
+}
+
+# Suffix of the model pack written by `python -m app.tools.quantize_models`
+QUANTIZED_SUFFIX = "_int8"
+MODEL_ROOT = os.path.expanduser("~/.insightface/models")
+
+# Các model được load theo từng chế độ (None = tất cả model trong pack)
+MODEL_MODES = {
+    "full": None,
+    "recognition": ["detection", "recognition"],
+    "detection": ["detection"],
+}
+
+
+def build_session_options(
+    intra_op_threads: Optional[int] = None,
+    inter_op_threads: Optional[int] = None,
+    graph_optimization: Optional[str] = None,
+    execution_mode: Optional[str] = None,
+    enable_mem_arena: Optional[bool] = None,
+) -> Optional[onnxruntime.SessionOptions]:
+    """
+    Tạo onnxruntime.SessionOptions từ các tham số; trả về None nếu tất cả đều mặc định.
+    :param graph_optimization: "disable" | "basic" | "extended" | "all"
+    :param execution_mode: "sequential" | "parallel"
+    """
+    if all(v is None for v in (intra_op_threads, inter_op_threads, graph_optimization, execution_mode, enable_mem_arena)):
+        return None
+    sess_options = onnxruntime.SessionOptions()
+    if intra_op_threads:
+        sess_options.intra_op_num_threads = intra_op_threads
+    if inter_op_threads:
+        sess_options.inter_op_num_threads = inter_op_threads
+    if graph_optimization:
+        if graph_optimization not in GRAPH_OPTIMIZATION_LEVELS:
+            raise ValueError(f"graph_optimization must be one of {sorted(GRAPH_OPTIMIZATION_LEVELS)}")
+        sess_options.graph_optimization_level = GRAPH_OPTIMIZATION_LEVELS[graph_optimization]
+    if execution_mode:
+        if execution_mode not in EXECUTION_MODES:
+            raise ValueError(f"execution_mode must be one of {sorted(EXECUTION_MODES)}")
+        sess_options.execution_mode = EXECUTION_MODES[execution_mode]
+    if enable_mem_arena is not None:
+        sess_options.enable_cpu_mem_arena = enable_mem_arena
+    return sess_options
+
 
 class FaceDetection:
     """
@@ -16,6 +79,17 @@ class FaceDetection:
         det_size: Tuple[int, int] = (640, 640),
         conf_threshold: float = 0.5,
         det_name: Optional[str] = None,
+        intra_op_threads: Optional[int] = None,
+        inter_op_threads: Optional[int] = None,
+        graph_optimization: Optional[str] = None,
+        execution_mode: Optional[str] = None,
+        enable_mem_arena: Optional[bool] = None,
+        quantized: bool = False,
+        mode: str = "full",
+        allowed_modules: Optional[List[str]] = None,
+        det_cascade: Optional[List[Tuple[int, int]]] = None,
+        min_face_size: int = 0,
+        quality: Optional[Dict[str, float]] = None,
     ):
         """
         Khởi tạo model InsightFace.
@@ -23,32 +97,144 @@ class FaceDetection:
         :param det_size: kích thước khung hình cho detector
         :param conf_threshold: ngưỡng độ tin cậy khi detect khuôn mặt
         :param det_name: tham số cũ để tương thích ngược (nếu truyền sẽ override model_name)
+        :param intra_op_threads: số thread ONNX Runtime cho mỗi model (None = mặc định của ORT)
+        :param inter_op_threads: số thread giữa các node (chỉ có tác dụng với execution_mode="parallel")
+        :param graph_optimization: mức tối ưu graph: "disable" | "basic" | "extended" | "all"
+        :param execution_mode: "sequential" | "parallel"
+        :param enable_mem_arena: bật/tắt memory arena của CPU allocator
+        :param quantized: dùng bản INT8 (pack "<model_name>_int8" tạo bởi app.tools.quantize_models)
+        :param mode: "full" (mọi model trong pack), "recognition" (detector + ArcFace) hoặc "detection" (chỉ detector)
+        :param allowed_modules: danh sách task cụ thể cần load, override mode (vd: ["detection", "recognition"])
+        :param det_cascade: các kích thước detector nhỏ chạy trước det_size (vd: [(160, 160), (320, 320)]);
+            chỉ quét lại ở det_size khi không tìm được khuôn mặt đủ tin cậy và đủ lớn. None = luôn dùng det_size
+        :param min_face_size: cạnh ngắn tối thiểu (pixel, ảnh gốc) để chấp nhận kết quả của một bước cascade
+        :param quality: ngưỡng của quality gate (tham số của face_quality.QualityGate, vd: {"min_sharpness": 50});
+            khuôn mặt không đạt bị loại trước khi align/embed. None = không kiểm tra
         """
+        if mode not in MODEL_MODES:
+            raise ValueError(f"mode must be one of {sorted(MODEL_MODES)}")
+        if allowed_modules is None:
+            allowed_modules = MODEL_MODES[mode]
         effective_model = det_name if det_name else model_name
-        self.app = FaceAnalysis(name=effective_model, providers=['CPUExecutionProvider'])
+        if quantized:
+            effective_model = f"{effective_model}{QUANTIZED_SUFFIX}"
+            if not os.path.isdir(os.path.join(MODEL_ROOT, effective_model)):
+                raise FileNotFoundError(
+                    f"Quantized model pack '{effective_model}' not found in {MODEL_ROOT}. "
+                    f"Create it with: python -m app.tools.quantize_models --model {model_name}"
+                )
+        self.model_name = effective_model
+        kwargs = {}
+        sess_options = build_session_options(intra_op_threads, inter_op_threads, graph_optimization,
+                                             execution_mode, enable_mem_arena)
+        if sess_options is not None:
+            kwargs["sess_options"] = sess_options
+        self.app = FaceAnalysis(name=effective_model, allowed_modules=allowed_modules,
+                                providers=['CPUExecutionProvider'], **kwargs)
         self.app.prepare(ctx_id=-1, det_size=det_size)
         self.conf_threshold = conf_threshold
+        self.det_size = tuple(det_size)
+        self.det_cascade = [tuple(size) for size in det_cascade or [] if tuple(size) != tuple(det_size)]
+        self.min_face_size = min_face_size
+        self.quality = QualityGate(**quality) if quality is not None else None
+
+    @property
+    def can_embed(self) -> bool:
+        """False khi chạy ở chế độ detection-only (không có ArcFace)"""
+        return "recognition" in self.app.models
+
+    @property
+    def chip_size(self) -> int:
+        """Cạnh (px) của ảnh khuôn mặt đã căn chỉnh mà ArcFace nhận (112 với các model pack InsightFace)"""
+        self._require_recognition()
+        return self.app.models["recognition"].input_size[0]
+
+    def _require_recognition(self) -> None:
+        if not self.can_embed:
+            raise RuntimeError("FaceDetection was loaded without the recognition model (detection-only mode)")
+
+    def _accepts(self, bboxes: np.ndarray) -> bool:
+        """Có ít nhất một khuôn mặt đạt conf_threshold và đủ lớn (min_face_size) để embed"""
+        if bboxes.shape[0] == 0:
+            return False
+        keep = bboxes[bboxes[:, 4] >= self.conf_threshold]
+        sides = np.minimum(keep[:, 2] - keep[:, 0], keep[:, 3] - keep[:, 1])
+        return bool(np.any(sides >= self.min_face_size))
+
+    def check_quality(self, image: np.ndarray, bbox: np.ndarray,
+                      kps: Optional[np.ndarray]) -> Tuple[Optional[str], Dict[str, float]]:
+        """
+        Quality gate trên box + keypoints (kích thước, pose, độ sáng, độ nét), không cần chạy ArcFace.
+        :return: (mã lý do bị loại hoặc None nếu đạt, các số đo); luôn đạt khi không cấu hình quality
+        """
+        if self.quality is None:
+            return None, {}
+        with model_stage("quality"):
+            reason, measures = self.quality.assess(image, bbox, kps)
+        record_model_metric("quality", reason or "ok")
+        return reason, measures
+
+    def _detect(self, image: np.ndarray) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+        """
+        Chạy detector theo cascade: thử lần lượt các kích thước trong det_cascade, dừng ở bước đầu tiên
+        có khuôn mặt hợp lệ, nếu không thì quét lại ở det_size.
+        Box và keypoints luôn theo toạ độ ảnh gốc, nên bước embed vẫn căn chỉnh trên ảnh độ phân giải gốc.
+        :return: (bboxes (N, 5), kpss (N, 5, 2))
+        """
+        det_model = self.app.det_model
+        with model_stage("detect"):
+            for size in self.det_cascade:
+                bboxes, kpss = det_model.detect(image, input_size=size, max_num=0, metric="default")
+                if self._accepts(bboxes):
+                    return bboxes, kpss
+            return det_model.detect(image, max_num=0, metric="default")
 
     def detect_faces(self, image: np.ndarray) -> List[Dict]:
         """
-        Phát hiện khuôn mặt trong ảnh.
+        Phát hiện khuôn mặt trong ảnh, sắp xếp theo conf giảm dần.
         :param image: ảnh đầu vào dạng numpy (BGR - từ OpenCV)
         :return: danh sách các khuôn mặt [{'box': (x1, y1, x2, y2), 'conf': 0.95, 'embedding': [...], 'landmarks': [...]}]
         """
-        faces = self.app.get(image)
+        self._require_recognition()
+        bboxes, kpss = self._detect(image)
+        keep = [i for i in np.argsort(-bboxes[:, 4]) if bboxes[i, 4] >= self.conf_threshold] if bboxes.shape[0] else []
+        if not keep or kpss is None:
+            return []
+        # Khuôn mặt không qua quality gate bị bỏ, không tốn ArcFace
+        keep = [i for i in keep if self.check_quality(image, bboxes[i], kpss[i])[0] is None]
+        if not keep:
+            return []
+        # Mọi khuôn mặt trong ảnh được embed trong một lần gọi ArcFace
+        embeddings = self.embed_faces(image, [kpss[i] for i in keep])
+
         detections = []
+        for i, embedding in zip(keep, embeddings):
+            x1, y1, x2, y2 = bboxes[i, :4].astype(int).tolist()
+            detections.append({
+                "box": (x1, y1, x2, y2),
+                "conf": float(bboxes[i, 4]),
+                "embedding": embedding,
+                "landmarks": kpss[i].astype(int).tolist()
+            })
 
-        for face in faces:
-            if face.det_score >= self.conf_threshold:
-                bbox = face.bbox.astype(int)
-                x1, y1, x2, y2 = bbox
-                detections.append({
-                    "box": (x1, y1, x2, y2),
-                    "conf": float(face.det_score),
-                    "embedding": face.embedding,
-                    "landmarks": face.kps.astype(int).tolist() if hasattr(face, 'kps') else None
-                })
+        return detections
 
+    def detect_boxes(self, image: np.ndarray) -> List[Dict]:
+        """
+        Chỉ chạy detector: trả về box + 5 keypoints, không tính embedding.
+        Dùng cho kiểm tra liveness / căn khung hình, rẻ hơn nhiều so với detect_faces().
+        :return: [{'box': [x1, y1, x2, y2], 'conf': 0.95, 'landmarks': [[x, y], ...]}], sắp xếp theo conf giảm dần
+        """
+        bboxes, kpss = self._detect(image)
+        detections = []
+        for i in np.argsort(-bboxes[:, 4]) if bboxes.shape[0] else []:
+            if bboxes[i, 4] < self.conf_threshold:
+                continue
+            detections.append({
+                "box": bboxes[i, :4].astype(int).tolist(),
+                "conf": float(bboxes[i, 4]),
+                "landmarks": kpss[i].astype(int).tolist() if kpss is not None else None
+            })
         return detections
 
     def draw_boxes(self, image: np.ndarray, detections: List[Dict]) -> np.ndarray:
@@ -109,11 +295,15 @@ class FaceDetection:
         similarity = np.dot(encoding1, encoding2) / (np.linalg.norm(encoding1) * np.linalg.norm(encoding2))
         return similarity >= tolerance
 
-    def compare_faces_with_distance(self, encoding1: np.ndarray, encoding2: np.ndarray) -> Tuple[bool, float]:
+    @staticmethod
+    def compare_faces_with_distance(encoding1: np.ndarray, encoding2: np.ndarray,
+                                    threshold: float = 0.4) -> Tuple[bool, float]:
         """
         So sánh hai face encodings và trả về cả độ tương đồng (similarity).
+        Static: không cần model, dùng được cả khi inference chạy trong worker pool (/verify).
         :param encoding1: face encoding thứ nhất
         :param encoding2: face encoding thứ hai
+        :param threshold: similarity tối thiểu để coi là cùng một người
         :return: (is_match, similarity) - similarity càng cao càng giống (0-1)
         """
         if encoding1 is None or encoding2 is None:
@@ -121,24 +311,94 @@ class FaceDetection:
 
         # Tính cosine similarity
         similarity = np.dot(encoding1, encoding2) / (np.linalg.norm(encoding1) * np.linalg.norm(encoding2))
-        is_match = similarity >= 0.4
-        return is_match, float(similarity)
+        is_match = similarity >= threshold
+        return bool(is_match), float(similarity)
     
     def get_best_face(self, image: np.ndarray) -> Optional[Dict]:
         """
         Lấy khuôn mặt có độ tin cậy cao nhất, bao gồm embedding (list) sẵn sàng lưu DB.
+        Nếu khuôn mặt không qua quality gate: embedding là None, "rejected" chứa mã lý do.
         """
-        faces = self.app.get(image)
-        if not faces:
+        self._require_recognition()
+        # detect -> align -> embed từng bước (đo được thời gian từng stage), chỉ embed khuôn mặt tốt nhất
+        return self.get_best_faces([image])[0]
+
+    def detect_best(self, image: np.ndarray) -> Optional[Tuple[np.ndarray, float, np.ndarray]]:
+        """
+        Chỉ chạy detector (không chạy recognition) và lấy khuôn mặt có độ tin cậy cao nhất.
+        :return: (bbox, det_score, kps) hoặc None nếu không có khuôn mặt
+        """
+        bboxes, kpss = self._detect(image)
+        if bboxes.shape[0] == 0 or kpss is None:
             return None
+        i = int(np.argmax(bboxes[:, 4]))
+        return bboxes[i, :4], float(bboxes[i, 4]), kpss[i]
 
-        best = max(faces, key=lambda f: f.det_score)
+    def align_face(self, image: np.ndarray, kps: np.ndarray) -> np.ndarray:
+        """
+        Căn chỉnh khuôn mặt theo 5 landmark về ảnh 112x112 cho ArcFace.
+        """
+        self._require_recognition()
+        rec_model = self.app.models["recognition"]
+        with model_stage("align"):
+            return face_align.norm_crop(image, landmark=kps, image_size=rec_model.input_size[0])
+
+    def embed_aligned(self, crops: List[np.ndarray]) -> np.ndarray:
+        """
+        Chạy ArcFace một lần cho cả batch ảnh khuôn mặt đã căn chỉnh.
+        :param crops: danh sách ảnh 112x112 BGR
+        :return: ma trận embedding (N, 512)
+        """
+        self._require_recognition()
+        if not crops:
+            return np.zeros((0, 512), dtype=np.float32)
+        with model_stage("embed"):
+            return self.app.models["recognition"].get_feat(list(crops))
 
-        return {
-            "box": best.bbox.astype(int).tolist(),
-            "conf": float(best.det_score),
-            "embedding": best.embedding.tolist(),
-            "landmarks": best.kps.astype(int).tolist()
-        }
+    def embed_faces(self, image: np.ndarray, landmarks: List) -> np.ndarray:
+        """
+        Căn chỉnh và embed nhiều khuôn mặt của cùng một ảnh trong một lần gọi ArcFace.
+        :param landmarks: danh sách 5 keypoints của từng khuôn mặt (vd: từ detect_boxes())
+        :return: ma trận embedding (N, 512)
+        """
+        crops = [self.align_face(image, np.asarray(kps, dtype=np.float32)) for kps in landmarks]
+        return self.embed_aligned(crops)
 
+    def get_best_faces(self, images: List[np.ndarray], check_quality: bool = True) -> List[Optional[Dict]]:
+        """
+        Phiên bản batch của get_best_face(): detect từng ảnh, sau đó embed tất cả
+        khuôn mặt đã căn chỉnh trong một lần gọi recognizer.
+        :param check_quality: False = bỏ qua quality gate (vd: re-embed ảnh đã có trong gallery)
+        :return: danh sách kết quả cùng định dạng get_best_face(), None nếu ảnh không có khuôn mặt.
+            "chip" là ảnh 112x112 đã căn chỉnh được đưa vào ArcFace (để lưu vào FaceStore).
+            Khuôn mặt bị quality gate loại không được align/embed: {"embedding": None, "rejected": mã lý do,
+            "quality": số đo, ...}
+        """
+        detections = [self.detect_best(image) for image in images]
+        verdicts = [self.check_quality(image, det[0], det[2]) if det is not None and check_quality else (None, {})
+                    for image, det in zip(images, detections)]
+        crops = [self.align_face(image, det[2]) for image, det, (reason, _) in zip(images, detections, verdicts)
+                 if det is not None and reason is None]
+        embeddings = iter(self.embed_aligned(crops))
+        chips = iter(crops)
 
+        results: List[Optional[Dict]] = []
+        for det, (reason, measures) in zip(detections, verdicts):
+            if det is None:
+                results.append(None)
+                continue
+            bbox, score, kps = det
+            face = {
+                "box": bbox.astype(int).tolist(),
+                "conf": score,
+                "embedding": next(embeddings).flatten().tolist() if reason is None else None,
+                "landmarks": kps.astype(int).tolist()
+            }
+            if measures:
+                face["quality"] = measures
+            if reason is not None:
+                face["rejected"] = reason
+            else:
+                face["chip"] = next(chips)
+            results.append(face)
+        return results
@@ -0,0 +1,109 @@
+"""
+Cheap face-quality gate, run on the detector's box and 5 keypoints before alignment
+and ArcFace: faces too small, blurred, badly exposed or turned away are rejected
+with a reason code instead of being embedded, stored or matched.
+
+Checks run cheapest first and stop at the first failure:
+  face_too_small   short side of the box below min_size px
+  head_turned      yaw, estimated from the nose offset between the eyes, above max_yaw
+  head_tilted      roll, the angle of the eye line, above max_roll
+  too_dark         mean gray level of the face below min_brightness
+  too_bright       mean gray level of the face above max_brightness
+  blurry           variance of the Laplacian of the face (downscaled to 112 px) below min_sharpness
+"""
+import math
+from typing import Dict, Optional, Tuple
+
+import cv2
+import numpy as np
+
+FACE_TOO_SMALL = "face_too_small"
+HEAD_TURNED = "head_turned"
+HEAD_TILTED = "head_tilted"
+TOO_DARK = "too_dark"
+TOO_BRIGHT = "too_bright"
+BLURRY = "blurry"
+REASONS = (FACE_TOO_SMALL, HEAD_TURNED, HEAD_TILTED, TOO_DARK, TOO_BRIGHT, BLURRY)
+
+# Larger faces are downscaled to this size before measuring, so one sharpness threshold fits all sizes
+SHARPNESS_SIZE = 112
+
+
+def estimate_pose(kps: np.ndarray) -> Tuple[float, float]:
+    """
+    Yaw and roll in degrees from the 5 landmarks (left eye, right eye, nose, left and
+    right mouth corner). Roll is the angle of the eye line. Yaw comes from how far the
+    nose sits from the midline of eyes and mouth, relative to half the eye distance,
+    assuming the nose tip stands about that far in front of the eyes (atan of the ratio).
+    """
+    kps = np.asarray(kps, dtype=np.float32).reshape(5, 2)
+    left_eye, right_eye, nose = kps[0], kps[1], kps[2]
+    dx, dy = right_eye - left_eye
+    roll = math.degrees(math.atan2(dy, dx))
+    half_eye_distance = math.hypot(dx, dy) / 2
+    if half_eye_distance < 1e-6:
+        return 90.0, roll
+    # Nose offset along the (roll-corrected) eye axis, from the eye/mouth midline
+    axis = np.array([dx, dy]) / (2 * half_eye_distance)
+    midline = (left_eye + right_eye + kps[3] + kps[4]) / 4
+    offset = float(np.dot(nose - midline, axis))
+    yaw = math.degrees(math.atan(offset / half_eye_distance))
+    return yaw, roll
+
+
+class QualityGate:
+    """Thresholds of the quality gate; a threshold of 0 disables that check"""
+
+    def __init__(self, min_size: float = 40, min_sharpness: float = 50.0, min_brightness: float = 40.0,
+                 max_brightness: float = 220.0, max_yaw: float = 45.0, max_roll: float = 40.0):
+        self.min_size = min_size
+        self.min_sharpness = min_sharpness
+        self.min_brightness = min_brightness
+        self.max_brightness = max_brightness
+        self.max_yaw = max_yaw
+        self.max_roll = max_roll
+
+    def assess(self, image: np.ndarray, bbox: np.ndarray,
+               kps: Optional[np.ndarray]) -> Tuple[Optional[str], Dict[str, float]]:
+        """
+        :param image: BGR image the box and keypoints refer to
+        :param bbox: (x1, y1, x2, y2) in image coordinates
+        :return: (reason code or None when the face passes, measurements taken so far)
+        """
+        x1, y1, x2, y2 = (float(v) for v in bbox[:4])
+        measures = {"size": round(min(x2 - x1, y2 - y1), 1)}
+        if self.min_size and measures["size"] < self.min_size:
+            return FACE_TOO_SMALL, measures
+
+        if kps is not None:
+            yaw, roll = estimate_pose(kps)
+            measures.update(yaw=round(yaw, 1), roll=round(roll, 1))
+            if self.max_yaw and abs(yaw) > self.max_yaw:
+                return HEAD_TURNED, measures
+            if self.max_roll and abs(roll) > self.max_roll:
+                return HEAD_TILTED, measures
+
+        h, w = image.shape[:2]
+        crop = image[max(int(y1), 0):min(int(math.ceil(y2)), h), max(int(x1), 0):min(int(math.ceil(x2)), w)]
+        if crop.size == 0:
+            return FACE_TOO_SMALL, measures
+        # Measured at most SHARPNESS_SIZE px wide; only downscaled, upscaling a small face would blur it.
+        # An integer factor keeps INTER_AREA on its block-averaging fast path (~4x faster than a fractional one)
+        step = -(-max(crop.shape[:2]) // SHARPNESS_SIZE)
+        if step > 1:
+            crop = cv2.resize(crop, (max(1, crop.shape[1] // step), max(1, crop.shape[0] // step)),
+                              interpolation=cv2.INTER_AREA)
+        gray = cv2.cvtColor(crop, cv2.COLOR_BGR2GRAY) if crop.ndim == 3 else crop
+        brightness = float(gray.mean())
+        measures["brightness"] = round(brightness, 1)
+        if self.min_brightness and brightness < self.min_brightness:
+            return TOO_DARK, measures
+        if self.max_brightness and brightness > self.max_brightness:
+            return TOO_BRIGHT, measures
+
+        if self.min_sharpness:
+            sharpness = float(cv2.Laplacian(gray, cv2.CV_32F).var())
+            measures["sharpness"] = round(sharpness, 1)
+            if sharpness < self.min_sharpness:
+                return BLURRY, measures
+        return None, measures
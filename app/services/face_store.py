@@ -0,0 +1,250 @@
+"""
+Content-addressed storage of aligned face chips.
+
+Registration keeps the crop ArcFace was actually fed (the face warped onto the
+5-landmark template by face_align.norm_crop, 112x112) instead of the original
+upload: about 25 KB as lossless PNG against megabytes for a phone photo, and a
+re-embedding job can feed it to the next model without decoding a large image or
+running the detector again.
+
+Layout under `root`:
+  chips/<ab>/<key>.png     the aligned chip (FACE_CHIP_FORMAT png or jpg)
+  thumbs/<ab>/<key>.jpg    optional, the face with some context from its photo
+  chips.pack               optional, every chip raw in one file (build_pack())
+
+The key is a digest of the owner's user_id and the chip pixels (cache.image_digest),
+so the same face uploaded twice by one user is stored once, while two users never
+share a file: deleting one user can't take away a chip another user, possibly
+still being enrolled, refers to. Face documents refer to it as `faces.<i>.chip`;
+a chip is deleted only once no face refers to it any more (keys stored before
+chips had an owner are plain pixel digests, possibly shared).
+
+The pack is for bulk jobs: a JSON header with the keys, then the chips as one
+(n, size, size, 3) uint8 array, 64-byte aligned and memory-mapped on load, so
+reading a chip is a page-cache copy instead of a file open + PNG decode. Chips
+stored after the pack was built are read from their files.
+"""
+import hashlib
+import json
+import os
+import struct
+import threading
+from typing import Dict, Iterator, Optional
+
+import cv2
+import numpy as np
+
+from app.services.cache import image_digest
+from app.services.image_io import ImageWriter
+
+CHIP_FORMATS = ("png", "jpg")
+THUMBNAIL_MARGIN = 0.25  # fraction of the face box added on every side of the thumbnail
+
+PACK_MAGIC = b"FACECHP1"
+PACK_FORMAT = 1
+
+
+def _pack_data_offset(header_size: int) -> int:
+    # Chips start 64-byte aligned after magic + length + header
+    end = len(PACK_MAGIC) + 8 + header_size
+    return (end + 63) // 64 * 64
+
+
+class ChipPack:
+    """Read side of a chip pack: one read-only memory map, chips looked up by key"""
+
+    def __init__(self, path: str):
+        with open(path, "rb") as f:
+            if f.read(len(PACK_MAGIC)) != PACK_MAGIC:
+                raise ValueError(f"{path} is not a chip pack")
+            (size,) = struct.unpack("<Q", f.read(8))
+            header = json.loads(f.read(size))
+        if header.get("format") != PACK_FORMAT:
+            raise ValueError(f"{path}: unsupported pack format {header.get('format')}")
+        self.path = path
+        self.size = header["size"]
+        self._rows = {key: i for i, key in enumerate(header["keys"])}
+        n = len(self._rows)
+        self.chips = np.memmap(path, dtype=np.uint8, mode="r", offset=_pack_data_offset(size),
+                               shape=(n, self.size, self.size, 3)) if n else np.zeros((0, self.size, self.size, 3),
+                                                                                        dtype=np.uint8)
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._rows
+
+    def get(self, key: str) -> Optional[np.ndarray]:
+        """Writable copy of the chip, None if it is not in the pack"""
+        row = self._rows.get(key)
+        return None if row is None else np.array(self.chips[row])
+
+
+class FaceStore:
+    """
+    :param chip_format: "png" (lossless: re-embedding gives the vector of the original
+        upload) or "jpg" (about 3x smaller, small embedding drift)
+    :param thumbnail_size: longest side of the thumbnail in px, 0 = no thumbnails
+    :param writer: ImageWriter used for the file writes (asynchronous or not)
+    """
+
+    def __init__(self, root: str, chip_format: str = "png", jpeg_quality: int = 95, thumbnail_size: int = 0,
+                 writer: Optional[ImageWriter] = None):
+        if chip_format not in CHIP_FORMATS:
+            raise ValueError(f"chip_format must be one of {CHIP_FORMATS}, got {chip_format!r}")
+        self.root = root
+        self.chip_format = chip_format
+        self.jpeg_quality = jpeg_quality
+        self.thumbnail_size = max(0, thumbnail_size)
+        self.writer = writer or ImageWriter()
+        self.pack: Optional[ChipPack] = None
+        self._dirs = set()
+        self._dirs_lock = threading.Lock()
+
+    @staticmethod
+    def key(chip: np.ndarray, owner: Optional[str] = None) -> str:
+        """Key of `owner`'s chip; without an owner, the pixel digest (the key of chips stored before owners)"""
+        digest = image_digest(chip)
+        if owner is None:
+            return digest
+        return hashlib.blake2b(f"{owner}:{digest}".encode(), digest_size=16).hexdigest()
+
+    def _path(self, kind: str, key: str, ext: str) -> str:
+        return os.path.join(self.root, kind, key[:2], f"{key}.{ext}")
+
+    def chip_path(self, key: str) -> Optional[str]:
+        """File of a stored chip (either format), None if there is none"""
+        for ext in (self.chip_format,) + tuple(e for e in CHIP_FORMATS if e != self.chip_format):
+            path = self._path("chips", key, ext)
+            if os.path.exists(path):
+                return path
+        return None
+
+    def thumbnail_path(self, key: str) -> str:
+        return self._path("thumbs", key, "jpg")
+
+    @property
+    def pack_path(self) -> str:
+        return os.path.join(self.root, "chips.pack")
+
+    def _write(self, path: str, data: bytes) -> None:
+        directory = os.path.dirname(path)
+        if directory not in self._dirs:
+            os.makedirs(directory, exist_ok=True)
+            with self._dirs_lock:
+                self._dirs.add(directory)
+        self.writer.save(data, path)
+
+    def _encode(self, image: np.ndarray, ext: str) -> bytes:
+        params = [cv2.IMWRITE_JPEG_QUALITY, self.jpeg_quality] if ext == "jpg" else []
+        ok, buf = cv2.imencode(f".{ext}", image, params)
+        if not ok:
+            raise ValueError(f"Could not encode the chip as {ext}")
+        return buf.tobytes()
+
+    def thumbnail(self, image: np.ndarray, box) -> np.ndarray:
+        """The face box plus THUMBNAIL_MARGIN on every side, scaled to thumbnail_size"""
+        h, w = image.shape[:2]
+        x1, y1, x2, y2 = (float(v) for v in box[:4])
+        mx, my = (x2 - x1) * THUMBNAIL_MARGIN, (y2 - y1) * THUMBNAIL_MARGIN
+        crop = image[max(int(y1 - my), 0):min(int(y2 + my), h), max(int(x1 - mx), 0):min(int(x2 + mx), w)]
+        scale = self.thumbnail_size / max(crop.shape[:2])
+        if scale < 1:
+            crop = cv2.resize(crop, (max(1, round(crop.shape[1] * scale)), max(1, round(crop.shape[0] * scale))),
+                              interpolation=cv2.INTER_AREA)
+        return crop
+
+    def put(self, chip: np.ndarray, owner: str, image: Optional[np.ndarray] = None, box=None) -> str:
+        """
+        Store `owner`'s aligned chip (and, with thumbnail_size and the source image + box,
+        its thumbnail) unless the owner has a chip with the same pixels stored already.
+        :param owner: user_id of the user the face is enrolled under
+        :return: the chip key
+        """
+        key = self.key(chip, owner)
+        if self.chip_path(key) is None:
+            self._write(self._path("chips", key, self.chip_format), self._encode(chip, self.chip_format))
+        if self.thumbnail_size and image is not None and box is not None:
+            path = self.thumbnail_path(key)
+            if not os.path.exists(path):
+                self._write(path, self._encode(self.thumbnail(image, box), "jpg"))
+        return key
+
+    def get(self, key: str) -> Optional[np.ndarray]:
+        """The chip as BGR uint8 (from the pack when loaded), None if it is not stored"""
+        if self.pack is not None:
+            chip = self.pack.get(key)
+            if chip is not None:
+                return chip
+        path = self.chip_path(key)
+        if path is None:
+            return None
+        with open(path, "rb") as f:
+            return cv2.imdecode(np.frombuffer(f.read(), dtype=np.uint8), cv2.IMREAD_COLOR)
+
+    def remove(self, key: str) -> int:
+        """Delete a chip and its thumbnail; call only once no face refers to the key. :return: files removed"""
+        removed = 0
+        for path in (self.chip_path(key), self.thumbnail_path(key)):
+            if path and os.path.exists(path):
+                os.remove(path)
+                removed += 1
+        return removed
+
+    def keys(self) -> Iterator[str]:
+        """Keys of every chip file"""
+        chips_dir = os.path.join(self.root, "chips")
+        if not os.path.isdir(chips_dir):
+            return
+        for prefix in sorted(os.listdir(chips_dir)):
+            directory = os.path.join(chips_dir, prefix)
+            if not os.path.isdir(directory):
+                continue
+            for name in sorted(os.listdir(directory)):
+                key, ext = os.path.splitext(name)
+                if ext[1:] in CHIP_FORMATS:
+                    yield key
+
+    def load_pack(self, path: Optional[str] = None) -> Optional[int]:
+        """Memory-map a pack written by build_pack(). :return: chips in it, None if there is no pack"""
+        path = path or self.pack_path
+        if not os.path.exists(path):
+            return None
+        self.pack = ChipPack(path)
+        return len(self.pack)
+
+    def build_pack(self, path: Optional[str] = None, size: int = 112) -> Dict[str, int]:
+        """
+        Write every stored chip of `size` px into one pack (temporary file + rename, so
+        a loaded pack stays valid meanwhile). Chips are decoded one at a time and
+        streamed to the file, so memory stays at one chip.
+        :return: {"chips": packed, "skipped": unreadable or of another size}
+        """
+        path = path or self.pack_path
+        keys, skipped = [], 0
+        tmp = f"{path}.{os.getpid()}.tmp"
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(tmp + ".data", "wb") as data:
+            for key in self.keys():
+                chip_file = self.chip_path(key)
+                chip = cv2.imread(chip_file, cv2.IMREAD_COLOR) if chip_file else None
+                if chip is None or chip.shape != (size, size, 3):
+                    skipped += 1
+                    continue
+                data.write(np.ascontiguousarray(chip).tobytes())
+                keys.append(key)
+        header = json.dumps({"format": PACK_FORMAT, "size": size, "keys": keys}).encode()
+        with open(tmp, "wb") as f, open(tmp + ".data", "rb") as data:
+            f.write(PACK_MAGIC)
+            f.write(struct.pack("<Q", len(header)))
+            f.write(header)
+            f.write(b"\0" * (_pack_data_offset(len(header)) - f.tell()))
+            while True:
+                block = data.read(1 << 20)
+                if not block:
+                    break
+                f.write(block)
+        os.remove(tmp + ".data")
+        os.replace(tmp, path)
+        return {"chips": len(keys), "skipped": skipped}
@@ -0,0 +1,514 @@
+import json
+import os
+import struct
+import threading
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from app.models.embedding import decode_embedding, face_embedding_for, version_key
+from app.services.search_index import BruteForceIndex, SearchIndex, normalize_rows
+
+
+def weighted_template_sum(vectors: np.ndarray, weights: np.ndarray) -> np.ndarray:
+    """Confidence-weighted sum of L2-normalized face embeddings (normalize it to get the template)"""
+    return (normalize_rows(vectors) * np.asarray(weights, dtype=np.float32)[:, None]).sum(axis=0)
+
+
+def _append_labels(mapping: Dict[str, np.ndarray], key: str, labels: List[int]) -> None:
+    current = mapping.get(key)
+    merged = labels if current is None else current.tolist() + labels
+    mapping[key] = np.asarray(merged, dtype=np.int64)
+
+
+SNAPSHOT_MAGIC = b"FACEGAL1"
+SNAPSHOT_FORMAT = 1
+
+
+def read_snapshot_header(path: str) -> Optional[Tuple[Dict, int]]:
+    """:return: (header, byte offset of the vectors) of a gallery snapshot, None if missing or not one"""
+    try:
+        with open(path, "rb") as f:
+            if f.read(len(SNAPSHOT_MAGIC)) != SNAPSHOT_MAGIC:
+                return None
+            (size,) = struct.unpack("<Q", f.read(8))
+            header = json.loads(f.read(size))
+    except (OSError, ValueError, struct.error):
+        return None
+    return header, _snapshot_data_offset(size)
+
+
+def _snapshot_data_offset(header_size: int) -> int:
+    # Vectors start 64-byte aligned after magic + length + header
+    end = len(SNAPSHOT_MAGIC) + 8 + header_size
+    return (end + 63) // 64 * 64
+
+
+def _drop_labels(mapping: Dict[str, np.ndarray], key: str, labels: np.ndarray) -> None:
+    if key not in mapping:
+        return
+    remaining = mapping[key][~np.isin(mapping[key], labels)]
+    if remaining.size:
+        mapping[key] = remaining
+    else:
+        del mapping[key]
+
+
+def assign_one_to_one(candidates: List[List[Tuple[str, float]]],
+                      threshold: float) -> List[Optional[Tuple[str, float]]]:
+    """
+    Greedy one-to-one matching of probes to users: the highest-scoring (probe, user)
+    pair above `threshold` is fixed first, so two faces in one frame never share a user.
+    :param candidates: per probe, (user_id, score) candidates
+    :return: per probe, the assigned (user_id, score) or None
+    """
+    # Ties go to the earlier (more confident) probe
+    pairs = sorted((-score, i, user_id) for i, cands in enumerate(candidates)
+                   for user_id, score in cands if score >= threshold)
+    assigned: List[Optional[Tuple[str, float]]] = [None] * len(candidates)
+    taken = set()
+    for neg_score, i, user_id in pairs:
+        if assigned[i] is None and user_id not in taken:
+            assigned[i] = (user_id, -neg_score)
+            taken.add(user_id)
+    return assigned
+
+
+class EmbeddingGallery:
+    """
+    Resident gallery of all enrolled face embeddings.
+
+    Every face gets an integer label; vectors live in a pluggable `SearchIndex`
+    (exact brute force or IVF) and the gallery keeps the label -> user_id and
+    room -> labels maps, so a recognition is one index search instead of a Mongo scan.
+
+    With a `template_index`, every user also gets one aggregated template: the
+    detection-confidence weighted mean of their normalized face embeddings. Searches
+    then run in two stages: the `rerank_k` best users by template, then only those
+    users' individual faces, instead of every enrolled face.
+
+    With a `version`, only embeddings produced by that model (embedding_version) are
+    loaded, so documents re-embedded for a new model pack can hold both versions
+    while the API keeps serving the one it runs.
+    """
+
+    def __init__(self, dim: int = 512, index: Optional[SearchIndex] = None,
+                 template_index: Optional[SearchIndex] = None, rerank_k: int = 10,
+                 version: Optional[str] = None):
+        self.dim = dim
+        self.version = version
+        self.index = index if index is not None else BruteForceIndex(dim)
+        self.template_index = template_index
+        self.rerank_k = max(1, rerank_k)
+        self._lock = threading.Lock()
+        self._next_label = 0
+        self._label_users: Dict[int, str] = {}
+        self._user_labels: Dict[str, np.ndarray] = {}
+        self._user_rooms: Dict[str, Optional[str]] = {}
+        self._room_labels: Dict[str, np.ndarray] = {}
+        # Per-user templates (only with a template_index), labelled by "slot"
+        self._next_slot = 0
+        self._slot_users: Dict[int, str] = {}
+        self._user_slots: Dict[str, int] = {}
+        self._user_sums: Dict[str, np.ndarray] = {}
+        self._room_slots: Dict[str, np.ndarray] = {}
+        # Newest change and deletion times, taken before the gallery was loaded, for GallerySync
+        self.change_marks: Optional[Dict] = None
+
+    def __len__(self) -> int:
+        return len(self._label_users)
+
+    @property
+    def user_count(self) -> int:
+        return len(self._user_labels)
+
+    def user_ids(self) -> List[str]:
+        """Users with at least one face in the gallery"""
+        with self._lock:
+            return list(self._user_labels)
+
+    @staticmethod
+    def _user_key(doc: Dict) -> Optional[str]:
+        return doc.get("user_id") or doc.get("uuid")
+
+    @staticmethod
+    def _user_room(doc: Dict) -> Optional[str]:
+        return (doc.get("profile") or {}).get("room") or None
+
+    def _face_vectors(self, doc: Dict) -> Tuple[List[np.ndarray], List[float]]:
+        """:return: (embeddings, detection confidences used as template weights)"""
+        vectors, weights = [], []
+        doc_version = doc.get("embedding_version")
+        for face in doc.get("faces", []) or []:
+            # Binary (float32/float16) or legacy list, so the gallery loads mid-migration
+            arr = decode_embedding(face_embedding_for(face, doc_version, self.version))
+            if arr is None:
+                continue
+            # Skip legacy embeddings from other models (e.g. 128-D face_recognition)
+            if arr.shape[0] != self.dim:
+                continue
+            vectors.append(arr)
+            weights.append(float(face.get("confidence") or 1.0))
+        return vectors, weights
+
+    def projection(self) -> Dict[str, int]:
+        """Fields of a user document the gallery reads"""
+        projection = {
+            "_id": 0,
+            "user_id": 1,
+            "uuid": 1,
+            "profile.room": 1,
+            "embedding_version": 1,
+            "faces.embedding": 1,
+            "faces.confidence": 1,
+        }
+        if self.version is not None:
+            # Only the active version's re-embedded vectors, not every stored model's
+            projection[f"faces.embeddings.{version_key(self.version)}"] = 1
+        return projection
+
+    def load_from_collection(self, users_col) -> int:
+        """
+        Rebuild the gallery from the users collection.
+        :param users_col: pymongo collection holding user documents
+        :return: number of face embeddings loaded
+        """
+        return self.load_documents(users_col.find({}, self.projection()))
+
+    def load_documents(self, docs: Iterable[Dict]) -> int:
+        """Replace the gallery content with the faces of the given user documents."""
+        with self._lock:
+            self._clear()
+            labels: List[int] = []
+            vectors: List[np.ndarray] = []
+            rooms: Dict[str, List[int]] = {}
+            for doc in docs:
+                user_id = self._user_key(doc)
+                faces, weights = self._face_vectors(doc)
+                if not user_id or not faces:
+                    continue
+                user_labels = list(range(self._next_label, self._next_label + len(faces)))
+                self._next_label += len(faces)
+                self._register_labels(user_id, self._user_room(doc), user_labels, rooms)
+                self._accumulate(user_id, faces, weights)
+                labels.extend(user_labels)
+                vectors.extend(faces)
+
+            self._room_labels = {room: np.asarray(ls, dtype=np.int64) for room, ls in rooms.items()}
+            if labels:
+                self.index.add(labels, np.stack(vectors))
+            self._publish_templates(list(self._user_sums))
+        return len(labels)
+
+    def _clear(self) -> None:
+        if self._label_users:
+            self.index.remove(np.fromiter(self._label_users, dtype=np.int64))
+        if self.template_index is not None and self._slot_users:
+            self.template_index.remove(np.fromiter(self._slot_users, dtype=np.int64))
+        for mapping in (self._label_users, self._user_labels, self._user_rooms, self._room_labels,
+                        self._slot_users, self._user_slots, self._user_sums, self._room_slots):
+            mapping.clear()
+
+    def save_snapshot(self, path: str, fingerprint: Optional[Dict] = None) -> int:
+        """
+        Write the gallery to one file: a JSON header (version, `fingerprint` of the
+        source collection, user ids, rooms, owner of every face) followed by the raw
+        float32 face vectors and, with templates, the per-user template sums.
+        Written to a temporary file and renamed, so readers never see a partial file.
+        :return: number of faces written
+        """
+        with self._lock:
+            # Blocks are immutable once published, so the arrays can be written after unlocking
+            labels, vectors = self.index.stored()
+            users = list(self._user_labels)
+            positions = {user_id: i for i, user_id in enumerate(users)}
+            owners = [positions[self._label_users[label]] for label in labels.tolist()]
+            rooms = [self._user_rooms.get(user_id) for user_id in users]
+            sums = None
+            if self.template_index is not None and users:
+                sums = np.stack([self._user_sums[user_id] for user_id in users])
+
+        header = json.dumps({
+            "format": SNAPSHOT_FORMAT, "version": self.version, "dim": self.dim, "faces": len(owners),
+            "templates": self.template_index is not None, "fingerprint": fingerprint,
+            "users": users, "rooms": rooms, "owners": owners,
+        }).encode()
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(SNAPSHOT_MAGIC)
+            f.write(struct.pack("<Q", len(header)))
+            f.write(header)
+            f.write(b"\0" * (_snapshot_data_offset(len(header)) - f.tell()))
+            np.ascontiguousarray(vectors, dtype=np.float32).tofile(f)
+            if sums is not None:
+                np.ascontiguousarray(sums, dtype=np.float32).tofile(f)
+        os.replace(tmp, path)
+        return len(owners)
+
+    def load_snapshot(self, path: str, fingerprint: Optional[Dict] = None) -> Optional[int]:
+        """
+        Replace the gallery content with a snapshot written by save_snapshot(). The
+        vectors are memory-mapped and copied once into the index; no document is decoded.
+        :param fingerprint: expected fingerprint of the source collection; a snapshot
+            taken from a different state is rejected
+        :return: number of faces restored, or None if the snapshot is missing, stale,
+            or from another model version / configuration (the gallery is left untouched)
+        """
+        found = read_snapshot_header(path)
+        if found is None:
+            return None
+        header, offset = found
+        if (header.get("format") != SNAPSHOT_FORMAT or header.get("version") != self.version
+                or header.get("dim") != self.dim or header.get("templates") != (self.template_index is not None)):
+            return None
+        if fingerprint is not None and header.get("fingerprint") != fingerprint:
+            return None
+
+        n, users, rooms = header["faces"], header["users"], header["rooms"]
+        vectors = np.zeros((0, self.dim), dtype=np.float32)
+        if n:
+            vectors = np.memmap(path, dtype=np.float32, mode="r", offset=offset, shape=(n, self.dim))
+        sums = None
+        if self.template_index is not None and users:
+            sums = np.memmap(path, dtype=np.float32, mode="r", offset=offset + n * self.dim * 4,
+                             shape=(len(users), self.dim))
+        owners = np.asarray(header["owners"], dtype=np.int64)
+
+        with self._lock:
+            self._clear()
+            labels = np.arange(self._next_label, self._next_label + n, dtype=np.int64)
+            self._next_label += n
+            # Faces grouped by owner, in label order
+            order = np.argsort(owners, kind="stable")
+            per_user = np.split(labels[order], np.cumsum(np.bincount(owners, minlength=len(users)))[:-1])
+            room_labels: Dict[str, List[int]] = {}
+            for user_id, room, user_labels in zip(users, rooms, per_user):
+                if user_labels.size:
+                    self._register_labels(user_id, room, user_labels.tolist(), room_labels)
+            self._room_labels = {room: np.asarray(ls, dtype=np.int64) for room, ls in room_labels.items()}
+            if n:
+                self.index.add(labels, vectors)
+            if sums is not None:
+                self._user_sums = {user_id: np.array(sums[i]) for i, user_id in enumerate(users)}
+                self._publish_templates(users)
+        return n
+
+    def _register_labels(self, user_id: str, room: Optional[str], labels: List[int],
+                         rooms: Optional[Dict[str, List[int]]] = None) -> None:
+        """:param rooms: collect room labels here (bulk load) instead of updating the room index"""
+        _append_labels(self._user_labels, user_id, labels)
+        self._user_rooms[user_id] = room
+        self._label_users.update(dict.fromkeys(labels, user_id))
+        if room and rooms is not None:
+            rooms.setdefault(room, []).extend(labels)
+        elif room:
+            _append_labels(self._room_labels, room, labels)
+
+    def _accumulate(self, user_id: str, faces: List[np.ndarray], weights: List[float]) -> None:
+        if self.template_index is None:
+            return
+        total = weighted_template_sum(np.stack(faces), np.asarray(weights))
+        previous = self._user_sums.get(user_id)
+        self._user_sums[user_id] = total if previous is None else previous + total
+
+    def _publish_templates(self, user_ids: List[str]) -> None:
+        """(Re)index the templates of these users under fresh slots, then retire the old slots."""
+        if self.template_index is None or not user_ids:
+            return
+        slots = list(range(self._next_slot, self._next_slot + len(user_ids)))
+        self._next_slot += len(user_ids)
+        self.template_index.add(slots, np.stack([self._user_sums[u] for u in user_ids]))
+
+        new_by_room: Dict[str, List[int]] = {}
+        old_by_room: Dict[str, List[int]] = {}
+        old_slots = []
+        for user_id, slot in zip(user_ids, slots):
+            old = self._user_slots.get(user_id)
+            room = self._user_rooms.get(user_id)
+            self._user_slots[user_id] = slot
+            self._slot_users[slot] = user_id
+            if room:
+                new_by_room.setdefault(room, []).append(slot)
+            if old is not None:
+                old_slots.append(old)
+                self._slot_users.pop(old, None)
+                if room:
+                    old_by_room.setdefault(room, []).append(old)
+        for room, room_slots in new_by_room.items():
+            _append_labels(self._room_slots, room, room_slots)
+        for room, room_slots in old_by_room.items():
+            _drop_labels(self._room_slots, room, np.asarray(room_slots, dtype=np.int64))
+        if old_slots:
+            self.template_index.remove(old_slots)
+
+    def add_user(self, doc: Dict) -> int:
+        """
+        Add all face embeddings of a (newly inserted) user document.
+        Faces of an already known user are appended and their template recomputed.
+        :return: number of faces added
+        """
+        user_id = self._user_key(doc)
+        faces, weights = self._face_vectors(doc)
+        if not user_id or not faces:
+            return 0
+        room = self._user_room(doc)
+        with self._lock:
+            labels = list(range(self._next_label, self._next_label + len(faces)))
+            self._next_label += len(faces)
+            # Vectors go in before the labels become resolvable
+            self.index.add(labels, np.stack(faces))
+            self._register_labels(user_id, room, labels)
+            self._accumulate(user_id, faces, weights)
+            self._publish_templates([user_id])
+        return len(faces)
+
+    def update_user(self, doc: Dict) -> int:
+        """
+        Replace a user's faces (and template) with the ones in `doc`.
+        :return: number of faces now indexed for the user
+        """
+        self.remove_user(self._user_key(doc))
+        return self.add_user(doc)
+
+    def remove_user(self, user_id: str) -> int:
+        """
+        Drop every face belonging to a user.
+        :return: number of faces removed
+        """
+        with self._lock:
+            labels = self._user_labels.pop(user_id, None)
+            room = self._user_rooms.pop(user_id, None)
+            if labels is None:
+                return 0
+            for label in labels.tolist():
+                self._label_users.pop(label, None)
+            if room:
+                _drop_labels(self._room_labels, room, labels)
+            self.index.remove(labels)
+
+            slot = self._user_slots.pop(user_id, None)
+            self._user_sums.pop(user_id, None)
+            if slot is not None:
+                self._slot_users.pop(slot, None)
+                if room:
+                    _drop_labels(self._room_slots, room, np.asarray([slot]))
+                self.template_index.remove([slot])
+        return int(labels.shape[0])
+
+    def _candidate_labels(self, probe: np.ndarray, room: Optional[str]) -> Optional[np.ndarray]:
+        """First stage: face labels of the `rerank_k` users whose template is closest to the probe."""
+        allowed = None
+        if room:
+            allowed = self._room_slots.get(room)
+            if allowed is None:
+                return None
+        _, slots = self.template_index.search(probe, k=self.rerank_k, allowed=allowed)
+        candidates = []
+        for slot in slots[0].tolist():
+            user_id = self._slot_users.get(slot)
+            labels = self._user_labels.get(user_id) if user_id is not None else None
+            if labels is not None:
+                candidates.append(labels)
+        return np.concatenate(candidates) if candidates else None
+
+    def search_many(self, probes: np.ndarray, room: Optional[str] = None,
+                    k: int = 10) -> List[List[Tuple[str, float]]]:
+        """
+        Search several probes (e.g. every face of one frame) with one matrix-matrix product.
+        :param probes: (m, d) probe embeddings (any norm)
+        :param k: nearest faces looked at per probe
+        :return: per probe, candidate (user_id, best face similarity), best first, one entry per user
+        """
+        probes = np.asarray(probes, dtype=np.float32).reshape(-1, self.dim)
+        if probes.shape[0] == 0:
+            return []
+        allowed = None
+        if self.template_index is not None:
+            # Union of every probe's first-stage candidates, re-ranked in one product
+            slots_allowed = self._room_slots.get(room) if room else None
+            if room and slots_allowed is None:
+                return [[] for _ in range(probes.shape[0])]
+            _, slots = self.template_index.search(probes, k=self.rerank_k, allowed=slots_allowed)
+            users = {self._slot_users.get(slot) for slot in np.unique(slots[slots >= 0]).tolist()}
+            labels = [self._user_labels.get(u) for u in users if u is not None]
+            labels = [ls for ls in labels if ls is not None]
+            allowed = np.concatenate(labels) if labels else np.zeros(0, dtype=np.int64)
+        elif room:
+            allowed = self._room_labels.get(room)
+            if allowed is None:
+                return [[] for _ in range(probes.shape[0])]
+
+        scores, labels = self.index.search(probes, k=k, allowed=allowed)
+        results = []
+        for row_scores, row_labels in zip(scores.tolist(), labels.tolist()):
+            best: Dict[str, float] = {}
+            for score, label in zip(row_scores, row_labels):
+                user_id = self._label_users.get(label)
+                if user_id is not None and user_id not in best:
+                    best[user_id] = score
+            results.append(list(best.items()))
+        return results
+
+    def similar_users(self, probes: np.ndarray, threshold: float, k: int = 10) -> List[Tuple[str, float]]:
+        """
+        Enrolled users with a face at least `threshold` similar to any of the probes
+        (the duplicate check of enrollment). Every face is searched, whatever its room
+        and without the template stage, in one matrix product.
+        :param probes: (m, d) embeddings of the faces being enrolled (any norm)
+        :param k: nearest faces looked at per probe
+        :return: (user_id, best similarity), best first
+        """
+        probes = np.asarray(probes, dtype=np.float32).reshape(-1, self.dim)
+        if probes.shape[0] == 0 or len(self) == 0:
+            return []
+        scores, labels = self.index.search(probes, k=k)
+        best: Dict[str, float] = {}
+        for score, label in zip(scores.ravel().tolist(), labels.ravel().tolist()):
+            if score < threshold:
+                continue
+            user_id = self._label_users.get(label)
+            if user_id is not None and score > best.get(user_id, -1.0):
+                best[user_id] = score
+        return sorted(best.items(), key=lambda item: -item[1])
+
+    def faces(self) -> Tuple[List[str], np.ndarray]:
+        """:return: (owner user_id per face, (n, dim) normalized embeddings) of the whole gallery"""
+        labels, vectors = self.index.stored()
+        owners = [self._label_users.get(label) for label in labels.tolist()]
+        keep = np.array([owner is not None for owner in owners], dtype=bool)
+        return [owner for owner in owners if owner is not None], np.asarray(vectors[keep], dtype=np.float32)
+
+    def user_vectors(self, user_id: str) -> np.ndarray:
+        """
+        Normalized face embeddings of one user, read by label: no search, so the cost
+        doesn't grow with the gallery.
+        :return: (n, dim) array, empty if the user has no face in the gallery
+        """
+        labels = self._user_labels.get(user_id)
+        if labels is None:
+            return np.zeros((0, self.dim), dtype=np.float32)
+        return self.index.reconstruct(labels)[1]
+
+    def search(self, probe: np.ndarray, room: Optional[str] = None) -> Optional[Tuple[str, float]]:
+        """
+        Find the closest enrolled face to a probe embedding.
+        :param probe: probe embedding (any norm)
+        :param room: optional room to restrict the search to
+        :return: (user_id, cosine similarity) of the best face, or None if nothing to search
+        """
+        if self.template_index is not None:
+            # Second stage re-ranks the candidates' individual faces
+            allowed = self._candidate_labels(probe, room)
+        elif room:
+            allowed = self._room_labels.get(room)
+        else:
+            allowed = None
+        if allowed is None and (room or self.template_index is not None):
+            return None
+        scores, labels = self.index.search(probe, k=1, allowed=allowed)
+        user_id = self._label_users.get(int(labels[0, 0]))
+        if user_id is None:
+            return None
+        return user_id, float(scores[0, 0])
@@ -0,0 +1,201 @@
+"""
+Keeps a process's resident gallery in step with writes made by other processes.
+
+Every HTTP worker (gunicorn -w N, uvicorn --workers N), the bulk-enrollment CLI
+and the admin jobs write to MongoDB, but each process holds its own in-memory
+gallery and only applies the writes it handled itself. The writes a gallery
+depends on are timed by the MongoDB server ($currentDate, UTC), never by the clock
+of the host that made them:
+  - a user document gets `embeddings_updated_at` when it is inserted
+    (insert_stamped) or its vectors are rewritten (STAMP),
+  - a deletion upserts a tombstone {key, deleted_at} into `user_tombstones`
+    (tombstone()), expired by a TTL index after TOMBSTONE_TTL_S.
+GallerySync runs one indexed range query on each every `interval_s` seconds, from
+`overlap_s` before the newest time it has seen: a write committed just after a
+later-stamped one is still read, and what was applied already is skipped. A write
+therefore reaches every process within one interval, and a poll reads only the
+users that changed, never the whole collection.
+"""
+import datetime
+import os
+import threading
+import time
+import weakref
+from typing import Callable, Dict, Iterator, Optional, Tuple
+
+CHANGED_FIELD = "embeddings_updated_at"
+TOMBSTONES = "user_tombstones"
+TOMBSTONE_TTL_S = 7 * 24 * 3600
+
+# Update operator marking a user's vectors as rewritten, e.g. {"$set": ..., **STAMP}
+STAMP = {"$currentDate": {CHANGED_FIELD: True}}
+
+# Every started GallerySync, restarted in forked children (gunicorn --preload)
+_instances: "weakref.WeakSet[GallerySync]" = weakref.WeakSet()
+
+
+def insert_stamped(doc: Dict) -> Tuple[Dict, Dict]:
+    """
+    (filter, update) of an upsert inserting a new user document with its
+    embeddings_updated_at set by the server: insert_one can't take $currentDate.
+        users_col.update_one(*insert_stamped(doc), upsert=True)
+    """
+    fields = {key: value for key, value in doc.items() if key not in ("_id", "user_id")}
+    return {"user_id": doc["user_id"]}, {"$setOnInsert": fields, **STAMP}
+
+
+def tombstone(user_id: str) -> Tuple[Dict, Dict]:
+    """
+    (filter, update) of the upsert recording a deleted user:
+        db[TOMBSTONES].update_one(*tombstone(user_id), upsert=True)
+    """
+    return {"key": user_id}, {"$currentDate": {"deleted_at": True}}
+
+
+def _newest(col, field: str) -> Optional[datetime.datetime]:
+    doc = col.find_one({field: {"$exists": True}}, {field: 1}, sort=[(field, -1)])
+    return doc[field] if doc else None
+
+
+def change_marks(users_col, tombstones_col) -> Dict[str, Optional[datetime.datetime]]:
+    """
+    Newest change and deletion times (two indexed queries). Taken before a gallery
+    reads the collection, they tell GallerySync where to start.
+    """
+    return {"users": _newest(users_col, CHANGED_FIELD), "deleted": _newest(tombstones_col, "deleted_at")}
+
+
+class GallerySync:
+    """
+    :param gallery: the EmbeddingGallery or a Deferred building it (polling starts once it is ready)
+    :param overlap_s: how far back each poll re-reads, for writes committed after a later-stamped one
+    :param on_change: called after changes were applied, e.g. to drop response caches
+    """
+
+    def __init__(self, users_col, tombstones_col, gallery, interval_s: float = 5.0, overlap_s: float = 30.0,
+                 tombstone_ttl_s: float = TOMBSTONE_TTL_S, on_change: Optional[Callable[[], None]] = None):
+        self.users_col = users_col
+        self.tombstones_col = tombstones_col
+        self.gallery = gallery
+        self.interval_s = interval_s
+        self.overlap = datetime.timedelta(seconds=overlap_s)
+        self.tombstone_ttl_s = tombstone_ttl_s
+        self.on_change = on_change
+        self.since: Optional[Dict[str, Optional[datetime.datetime]]] = None
+        # (stream, key) -> newest time applied, for the writes still inside the overlap
+        self._applied: Dict[Tuple[str, str], datetime.datetime] = {}
+        self._synced_at: Optional[float] = None
+        self.stats = {"polls": 0, "syncs": 0, "updated": 0, "removed": 0, "reconciles": 0, "errors": 0}
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def _target(self):
+        if hasattr(self.gallery, "ready"):
+            # Deferred: nothing to sync until it has loaded
+            return self.gallery.target if self.gallery.ready else None
+        return self.gallery
+
+    def _changes(self, stream: str, col, field: str, key_of: Callable[[Dict], str],
+                 projection: Dict) -> Iterator[Dict]:
+        """Documents of `col` stamped since the last poll (minus the overlap) and not applied yet"""
+        since = self.since[stream]
+        query = {field: {"$gte": since - self.overlap}} if since else {field: {"$exists": True}}
+        newest = since
+        for doc in col.find(query, projection):
+            stamp, key = doc[field], key_of(doc)
+            applied = self._applied.get((stream, key))
+            if applied is not None and applied >= stamp:
+                continue
+            self._applied[(stream, key)] = stamp
+            newest = stamp if newest is None else max(newest, stamp)
+            yield doc
+        self.since[stream] = newest
+        if newest is not None:
+            self._applied = {k: t for k, t in self._applied.items()
+                             if k[0] != stream or t >= newest - self.overlap}
+
+    def _reconcile(self, gallery) -> int:
+        """Drop users no longer in the collection, by id: only after tombstones may have expired unseen"""
+        known = gallery.user_ids()
+        present = {doc.get("user_id") or doc.get("uuid")
+                   for doc in self.users_col.find({}, {"_id": 0, "user_id": 1, "uuid": 1})}
+        removed = [user_id for user_id in known if user_id not in present]
+        for user_id in removed:
+            gallery.remove_user(user_id)
+        self.stats["reconciles"] += 1
+        return len(removed)
+
+    def poll(self) -> bool:
+        """
+        One check; applies the changes made since the last one.
+        :return: True when the gallery was re-synced
+        """
+        gallery = self._target()
+        if gallery is None:
+            return False
+        self.stats["polls"] += 1
+        if self.since is None:
+            # Times taken before the gallery read the collection (runtime.load_gallery)
+            self.since = dict(getattr(gallery, "change_marks", None) or change_marks(self.users_col,
+                                                                                     self.tombstones_col))
+        now = time.monotonic()
+        # Deletions first: a user read below was still in the collection after them
+        removed = 0
+        for doc in self._changes("deleted", self.tombstones_col, "deleted_at", lambda d: d["key"],
+                                 {"_id": 0, "key": 1, "deleted_at": 1}):
+            if gallery.remove_user(doc["key"]):
+                removed += 1
+        if self._synced_at is not None and now - self._synced_at > self.tombstone_ttl_s:
+            # Out of touch for longer than tombstones are kept: some deletions can't be seen any more
+            removed += self._reconcile(gallery)
+        updated = 0
+        projection = {**gallery.projection(), CHANGED_FIELD: 1}
+        for doc in self._changes("users", self.users_col, CHANGED_FIELD, lambda d: d.get("user_id") or d.get("uuid"),
+                                 projection):
+            gallery.update_user(doc)
+            updated += 1
+        self._synced_at = now
+        if not updated and not removed:
+            return False
+
+        self.stats["syncs"] += 1
+        self.stats["updated"] += updated
+        self.stats["removed"] += removed
+        if self.on_change is not None:
+            self.on_change()
+        return True
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval_s):
+            try:
+                self.poll()
+            except Exception:
+                # Mongo unreachable for a moment: keep serving, retry next interval
+                self.stats["errors"] += 1
+
+    def start(self) -> "GallerySync":
+        if self.interval_s <= 0 or (self._thread is not None and self._thread.is_alive()):
+            return self
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="gallery-sync", daemon=True)
+        self._thread.start()
+        _instances.add(self)
+        return self
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def _after_fork(self) -> None:
+        # The polling thread didn't survive the fork
+        self._stop = threading.Event()
+        self._thread = None
+        self.start()
+
+
+def _restart_in_child() -> None:
+    for sync in list(_instances):
+        sync._after_fork()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_restart_in_child)
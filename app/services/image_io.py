@@ -0,0 +1,136 @@
+import base64
+import datetime
+import os
+import struct
+import threading
+import uuid
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import AsyncIterator, BinaryIO, Iterator, Optional, Union
+
+import cv2
+import numpy as np
+
+
+BytesLike = Union[bytes, bytearray, memoryview]
+
+
+def read_upload(file_storage) -> bytes:
+    """Read a werkzeug FileStorage fully into memory (never touches disk)."""
+    return file_storage.stream.read()
+
+
+def decode_base64_image(data: str) -> bytes:
+    """
+    Decode a base64 image field, with or without a `data:image/...;base64,` prefix.
+    Raises ValueError (binascii.Error) on malformed input.
+    """
+    b64 = data or ""
+    if "," in b64:
+        b64 = b64.split(",", 1)[1]
+    return base64.b64decode(b64)
+
+
+def decode_image(data: BytesLike) -> Optional[np.ndarray]:
+    """
+    Decode encoded image bytes (JPEG/PNG/...) straight from memory.
+    :return: BGR image as returned by cv2.imread, or None if the bytes are not an image
+    """
+    if not data:
+        return None
+    # frombuffer over a memoryview shares the upload buffer instead of copying it
+    buf = np.frombuffer(memoryview(data), dtype=np.uint8)
+    return cv2.imdecode(buf, cv2.IMREAD_COLOR)
+
+
+def _read_exact(stream: BinaryIO, size: int) -> bytes:
+    chunks, remaining = [], size
+    while remaining:
+        chunk = stream.read(remaining)
+        if not chunk:
+            break
+        chunks.append(chunk)
+        remaining -= len(chunk)
+    return b"".join(chunks)
+
+
+def iter_frames(stream: BinaryIO, max_frame_bytes: int) -> Iterator[bytes]:
+    """
+    Split a stream of length-prefixed frames: <4-byte big-endian length><encoded image>...
+    Stops cleanly at end of stream; raises ValueError on an oversized or truncated frame.
+    """
+    while True:
+        header = _read_exact(stream, 4)
+        if not header:
+            return
+        if len(header) < 4:
+            raise ValueError("Truncated frame header")
+        (size,) = struct.unpack(">I", header)
+        if size > max_frame_bytes:
+            raise ValueError(f"Frame too large ({size} > {max_frame_bytes} bytes)")
+        data = _read_exact(stream, size)
+        if len(data) < size:
+            raise ValueError("Truncated frame")
+        yield data
+
+
+async def aiter_frames(chunks: AsyncIterator[bytes], max_frame_bytes: int) -> AsyncIterator[bytes]:
+    """iter_frames() over an async stream of arbitrary body chunks (e.g. Starlette request.stream())"""
+    buffer = bytearray()
+    size = None
+    async for chunk in chunks:
+        buffer += chunk
+        while True:
+            if size is None:
+                if len(buffer) < 4:
+                    break
+                (size,) = struct.unpack(">I", buffer[:4])
+                del buffer[:4]
+                if size > max_frame_bytes:
+                    raise ValueError(f"Frame too large ({size} > {max_frame_bytes} bytes)")
+            if len(buffer) < size:
+                break
+            frame = bytes(buffer[:size])
+            del buffer[:size]
+            size = None
+            yield frame
+    if size is not None or buffer:
+        raise ValueError("Truncated frame" if size is not None else "Truncated frame header")
+
+
+def unique_image_name(prefix: str, ext: str = "jpg") -> str:
+    """`<prefix>_<timestamp>_<random>.<ext>`; the random suffix avoids same-second collisions."""
+    timestamp = datetime.datetime.now().strftime("%Y%m%d%H%M%S")
+    return f"{prefix}_{timestamp}_{uuid.uuid4().hex[:8]}.{ext}"
+
+
+def _write_file(path: str, data: BytesLike) -> str:
+    # Per-thread temp name: two writers of the same content-addressed file must not share it
+    tmp_path = f"{path}.{threading.get_ident()}.part"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+    return path
+
+
+class ImageWriter:
+    """
+    Persists original uploads. Only the registration flow uses it; with
+    `asynchronous=True` writes happen on a background thread so the request
+    doesn't wait on disk.
+    """
+
+    def __init__(self, asynchronous: bool = False, max_workers: int = 2):
+        self.asynchronous = asynchronous
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="image-writer") \
+            if asynchronous else None
+
+    def save(self, data: BytesLike, path: str) -> Future:
+        """
+        Write bytes to `path` (atomically, via a temp file + rename).
+        :return: a Future resolving to the path once it is on disk
+        """
+        if self._executor is not None:
+            return self._executor.submit(_write_file, path, bytes(data))
+        future: Future = Future()
+        future.set_result(_write_file(path, data))
+        return future
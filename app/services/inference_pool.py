@@ -0,0 +1,229 @@
+import itertools
+import multiprocessing
+import queue
+import threading
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+from multiprocessing.shared_memory import SharedMemory
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from app.services.metrics import capture_model_metrics, replay_model_metrics
+
+
+class PoolBusyError(RuntimeError):
+    """Raised when every shared-memory slot stays busy past the acquire timeout."""
+
+
+# FaceDetection methods a worker may run on an image
+WORKER_METHODS = ("get_best_face", "detect_boxes", "detect_faces", "embed_faces")
+
+
+def _worker_main(shm_names: List[str], tasks, results, detector_kwargs: Dict[str, Any]) -> None:
+    """
+    Worker process: owns one FaceDetection and reads images out of shared-memory slots.
+    Each answer carries the model metrics (stage timings, quality checks) of its call,
+    recorded by the parent.
+    """
+    from app.services.face_detection import FaceDetection
+
+    detector = FaceDetection(**detector_kwargs)
+    slots = [SharedMemory(name=name, track=False) for name in shm_names]
+    results.put(("ready", None, None, ()))
+    try:
+        while True:
+            task = tasks.get()
+            if task is None:
+                return
+            request_id, method, slot, shape, dtype, args = task
+            # Zero-copy view over the slot; the parent won't reuse it until we answer
+            image = np.ndarray(shape, dtype=dtype, buffer=slots[slot].buf)
+            with capture_model_metrics() as events:
+                try:
+                    ok, payload = True, getattr(detector, method)(image, *args)
+                except Exception as e:
+                    ok, payload = False, f"{type(e).__name__}: {e}"
+                finally:
+                    del image
+            results.put((request_id, ok, payload, events))
+    finally:
+        for shm in slots:
+            shm.close()
+
+
+class InferencePool:
+    """
+    Pool of inference worker processes, each loading the model once with its own
+    ONNX Runtime intra-op thread budget.
+
+    Decoded images are copied into pre-allocated shared-memory slots and only the
+    slot id/shape/dtype crosses the process boundary, so arrays are never pickled.
+    The number of slots bounds the work in flight: when all are busy, callers wait
+    up to `acquire_timeout` and then get PoolBusyError (backpressure).
+    Drop-in replacement for `FaceDetection.get_best_face`.
+
+    Workers are started lazily on first use, so importing a module that builds a
+    pool (e.g. from a spawned child) doesn't start processes.
+    """
+
+    def __init__(self, workers: int = 2, threads_per_worker: int = 1,
+                 detector_kwargs: Optional[Dict[str, Any]] = None, slots: Optional[int] = None,
+                 slot_bytes: int = 3840 * 2160 * 3, acquire_timeout: float = 1.0,
+                 request_timeout: float = 30.0):
+        """
+        :param workers: number of worker processes
+        :param threads_per_worker: ONNX Runtime intra-op threads per worker
+        :param detector_kwargs: FaceDetection constructor arguments
+        :param slots: shared-memory slots (max requests in flight), default 2 per worker
+        :param slot_bytes: size of one slot, i.e. the largest decoded image accepted
+        :param acquire_timeout: seconds to wait for a free slot before PoolBusyError
+        :param request_timeout: seconds to wait for a worker's answer
+        """
+        self.workers = max(1, workers)
+        self.threads_per_worker = threads_per_worker
+        self.detector_kwargs = dict(detector_kwargs or {})
+        self.detector_kwargs["intra_op_threads"] = threads_per_worker
+        self.num_slots = slots or self.workers * 2
+        self.slot_bytes = slot_bytes
+        self.acquire_timeout = acquire_timeout
+        self.request_timeout = request_timeout
+
+        self._start_lock = threading.Lock()
+        self._started = False
+        self._ids = itertools.count()
+        self._pending: Dict[int, Tuple[Future, int]] = {}
+        self._pending_lock = threading.Lock()
+        self._free_slots: "queue.Queue[int]" = queue.Queue()
+        self._shm: List[SharedMemory] = []
+        self._processes: List[multiprocessing.Process] = []
+
+    def start(self) -> None:
+        with self._start_lock:
+            if self._started:
+                return
+            ctx = multiprocessing.get_context("spawn")
+            self._shm = [SharedMemory(create=True, size=self.slot_bytes) for _ in range(self.num_slots)]
+            for slot in range(self.num_slots):
+                self._free_slots.put(slot)
+            self._tasks = ctx.Queue()
+            self._results = ctx.Queue()
+            names = [shm.name for shm in self._shm]
+            self._processes = [
+                ctx.Process(target=_worker_main, args=(names, self._tasks, self._results, self.detector_kwargs),
+                            name=f"inference-worker-{i}", daemon=True)
+                for i in range(self.workers)
+            ]
+            for p in self._processes:
+                p.start()
+            self._listener = threading.Thread(target=self._collect_results, name="inference-results", daemon=True)
+            self._listener.start()
+            self._started = True
+
+    @property
+    def queue_depth(self) -> int:
+        """Requests handed to the pool and not answered yet"""
+        return len(self._pending)
+
+    def _release(self, request_id: int) -> Optional[Future]:
+        with self._pending_lock:
+            entry = self._pending.pop(request_id, None)
+        if entry is None:
+            return None
+        future, slot = entry
+        self._free_slots.put(slot)
+        return future
+
+    def _collect_results(self) -> None:
+        while True:
+            try:
+                request_id, ok, payload, metrics = self._results.get()
+            except (EOFError, OSError):
+                return
+            if request_id == "ready":
+                continue
+            if request_id is None:
+                return
+            replay_model_metrics(metrics)
+            future = self._release(request_id)
+            if future is None or not future.set_running_or_notify_cancel():
+                continue  # caller gave up on it: the slot is free again only now
+            if ok:
+                future.set_result(payload)
+            else:
+                future.set_exception(RuntimeError(payload))
+
+    def submit(self, image: np.ndarray, method: str = "get_best_face", args: Tuple = ()) -> Tuple[int, Future]:
+        """
+        Copy the image into a free slot and queue it.
+        :param method: FaceDetection method to run, one of WORKER_METHODS
+        :param args: extra (small, picklable) arguments passed after the image
+        :return: (request id, Future resolving to the method's result)
+        """
+        if method not in WORKER_METHODS:
+            raise ValueError(f"method must be one of {WORKER_METHODS}")
+        self.start()
+        image = np.ascontiguousarray(image)
+        if image.nbytes > self.slot_bytes:
+            raise ValueError(f"Image too large for inference pool ({image.nbytes} > {self.slot_bytes} bytes)")
+        try:
+            slot = self._free_slots.get(timeout=self.acquire_timeout)
+        except queue.Empty:
+            raise PoolBusyError("Inference pool is busy, try again later")
+
+        view = np.ndarray(image.shape, dtype=image.dtype, buffer=self._shm[slot].buf)
+        view[...] = image
+        del view
+
+        request_id = next(self._ids)
+        future: Future = Future()
+        with self._pending_lock:
+            self._pending[request_id] = (future, slot)
+        self._tasks.put((request_id, method, slot, image.shape, image.dtype.str, tuple(args)))
+        return request_id, future
+
+    def _call(self, image: np.ndarray, method: str, timeout: Optional[float], args: Tuple = ()):
+        request_id, future = self.submit(image, method, args)
+        try:
+            return future.result(timeout or self.request_timeout)
+        except FutureTimeout:
+            if not future.cancel():
+                # The answer came in meanwhile
+                return future.result()
+            # The worker may still be reading the image: the slot stays reserved until
+            # its late answer, which the listener drops
+            raise
+
+    def get_best_face(self, image: np.ndarray, timeout: Optional[float] = None) -> Optional[Dict]:
+        return self._call(image, "get_best_face", timeout)
+
+    def detect_boxes(self, image: np.ndarray, timeout: Optional[float] = None) -> List[Dict]:
+        return self._call(image, "detect_boxes", timeout)
+
+    def detect_faces(self, image: np.ndarray, timeout: Optional[float] = None) -> List[Dict]:
+        return self._call(image, "detect_faces", timeout)
+
+    def embed_faces(self, image: np.ndarray, landmarks: List, timeout: Optional[float] = None) -> np.ndarray:
+        return self._call(image, "embed_faces", timeout, (landmarks,))
+
+    def close(self) -> None:
+        if not self._started:
+            return
+        for _ in self._processes:
+            self._tasks.put(None)
+        for p in self._processes:
+            p.join(timeout=5)
+        self._results.put((None, None, None, ()))
+        for shm in self._shm:
+            shm.close()
+            shm.unlink()
+        self._started = False
+
+    def stats(self) -> Dict:
+        return {
+            "workers": self.workers,
+            "threads_per_worker": self.threads_per_worker,
+            "slots": self.num_slots,
+            "free_slots": self._free_slots.qsize(),
+            "queue_depth": self.queue_depth,
+            "alive_workers": sum(p.is_alive() for p in self._processes),
+        }
@@ -0,0 +1,154 @@
+"""
+Deferred construction of the expensive process-wide objects (model sessions, the
+resident gallery), so the HTTP server binds and answers liveness probes at once
+while they load.
+
+A Deferred wraps a builder. start() builds it on a background thread, get() returns
+it (building inline on first use when nothing started it, waiting when a build is
+running), and attribute access is forwarded, so a Deferred stands in for the object
+it builds. status() feeds the readiness probe.
+"""
+import os
+import threading
+import time
+import weakref
+from typing import Any, Callable, Dict, Iterable, Optional
+
+IDLE, LOADING, READY, FAILED = "idle", "loading", "ready", "failed"
+
+# Every Deferred, for the fork handler below
+_instances: "weakref.WeakSet[Deferred]" = weakref.WeakSet()
+
+
+class NotReadyError(RuntimeError):
+    """Raised by get(timeout=...) when the object is still loading"""
+
+
+class Deferred:
+    def __init__(self, name: str, build: Callable[[], Any], warmup: Optional[Callable[[Any], None]] = None):
+        """
+        :param build: returns the object; may take seconds (model files, a full collection scan)
+        :param warmup: called with the built object before it is published, e.g. one
+            inference so the first request doesn't pay for lazy ONNX initialisation
+        """
+        self.name = name
+        self._build = build
+        self._warmup = warmup
+        self._state = IDLE
+        self._target = None
+        self._error: Optional[BaseException] = None
+        self._seconds: Optional[float] = None
+        self._background = False
+        self._cond = threading.Condition()
+        _instances.add(self)
+
+    @property
+    def state(self) -> str:
+        return self._state
+
+    @property
+    def ready(self) -> bool:
+        return self._state == READY
+
+    @property
+    def target(self):
+        """The built object, None until ready (never blocks)"""
+        return self._target
+
+    def start(self) -> "Deferred":
+        """Build on a background thread unless already built or building"""
+        with self._cond:
+            self._background = True
+            if self._state not in (IDLE, FAILED):
+                return self
+            self._state = LOADING
+        threading.Thread(target=self._load, name=f"load-{self.name}", daemon=True).start()
+        return self
+
+    def get(self, timeout: Optional[float] = None):
+        """
+        :param timeout: seconds to wait for a running build, None = as long as it takes
+        :return: the built object, building it here if nothing has started it yet (on
+            a background thread when a timeout is given, so the caller waits no longer)
+        :raise NotReadyError: still loading after `timeout`
+        :raise: the builder's exception when the build failed (the next get() retries)
+        """
+        if self._state == READY:
+            return self._target
+        with self._cond:
+            if self._state in (IDLE, FAILED):
+                self._state = LOADING
+                build_here = True
+            else:
+                build_here = False
+        if build_here:
+            if timeout is None:
+                self._load()
+            else:
+                threading.Thread(target=self._load, name=f"load-{self.name}", daemon=True).start()
+        with self._cond:
+            if not self._cond.wait_for(lambda: self._state != LOADING, timeout):
+                raise NotReadyError(f"{self.name} is still loading")
+            if self._state == FAILED:
+                raise self._error
+            return self._target
+
+    def _load(self) -> None:
+        start = time.perf_counter()
+        try:
+            target = self._build()
+            if self._warmup is not None:
+                self._warmup(target)
+        except BaseException as e:
+            with self._cond:
+                self._state, self._error = FAILED, e
+                self._seconds = time.perf_counter() - start
+                self._cond.notify_all()
+            return
+        with self._cond:
+            self._target, self._state, self._error = target, READY, None
+            self._seconds = time.perf_counter() - start
+            self._cond.notify_all()
+
+    def status(self) -> Dict[str, Any]:
+        status = {"state": self._state}
+        if self._seconds is not None:
+            status["seconds"] = round(self._seconds, 3)
+        if self._error is not None:
+            status["error"] = str(self._error)
+        return status
+
+    def _after_fork(self) -> None:
+        # The thread building us didn't survive the fork; start over in the child
+        self._cond = threading.Condition()
+        if self._state == LOADING:
+            self._state = IDLE
+            if self._background:
+                self.start()
+
+    def __getattr__(self, name):
+        # Only reached for attributes Deferred itself doesn't define
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return getattr(self.get(), name)
+
+    def __len__(self) -> int:
+        return len(self.get())
+
+
+def readiness(components: Iterable[Deferred]) -> Dict[str, Any]:
+    """Body of a readiness probe: ready once every component is"""
+    components = list(components)
+    return {
+        "ready": all(c.ready for c in components),
+        "components": {c.name: c.status() for c in components},
+    }
+
+
+def _reset_after_fork() -> None:
+    for deferred in list(_instances):
+        deferred._after_fork()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
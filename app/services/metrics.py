@@ -0,0 +1,333 @@
+"""
+In-process metrics in the Prometheus text format (no client library needed):
+histograms and counters updated on the hot path, plus callback gauges read at
+scrape time (gallery size, cache counters, queue depth).
+
+Requests record per-stage timings through a RequestTimer; FaceDetection records its
+own detect / align / embed stages (inference pool workers capture them and the parent
+process, which serves /metrics, records them). With a SamplingProfiler attached, requests slower
+than the threshold also dump a folded-stack profile (flamegraph.pl / speedscope input).
+"""
+import bisect
+import collections
+import datetime
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+# Seconds; spans cache hits (sub-ms) to a cold CPU recognition on a large image
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: Sequence[str], values: Sequence, extra: str = "") -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Histogram:
+    """Cumulative-bucket histogram per label set"""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series: Dict[Tuple, List] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labels) -> None:
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                # [bucket counts..., +Inf count, sum]
+                series = self._series[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            # First bucket with value <= bound; past the end is +Inf
+            series[bisect.bisect_left(self.buckets, value)] += 1
+            series[-1] += value
+
+    def collect(self) -> Iterator[str]:
+        with self._lock:
+            series = {labels: list(s) for labels, s in self._series.items()}
+        for labels, s in sorted(series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), s[:-1]):
+                cumulative += count
+                le = 'le="%s"' % _number(bound)
+                yield f"{self.name}_bucket{_labels(self.labelnames, labels, le)} {cumulative}"
+            yield f"{self.name}_sum{_labels(self.labelnames, labels)} {_number(s[-1])}"
+            yield f"{self.name}_count{_labels(self.labelnames, labels)} {cumulative}"
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple, float] = collections.defaultdict(int)
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount: float = 1) -> None:
+        with self._lock:
+            self._values[labels] += amount
+
+    def collect(self) -> Iterator[str]:
+        with self._lock:
+            values = dict(self._values)
+        for labels, value in sorted(values.items()):
+            yield f"{self.name}{_labels(self.labelnames, labels)} {_number(value)}"
+
+
+class Callback:
+    """Value read at scrape time: `fn()` returns a number or {label values tuple: number}"""
+
+    def __init__(self, name: str, help: str, fn: Callable, kind: str = "gauge", labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.fn = fn
+        self.kind = kind
+        self.labelnames = tuple(labelnames)
+
+    def collect(self) -> Iterator[str]:
+        try:
+            value = self.fn()
+        except Exception:
+            # A broken source (e.g. a dead pool) must not fail the whole scrape
+            return
+        if isinstance(value, dict):
+            for labels, v in sorted(value.items()):
+                yield f"{self.name}{_labels(self.labelnames, labels)} {_number(v)}"
+        elif value is not None:
+            yield f"{self.name} {_number(value)}"
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics: Dict[str, object] = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric):
+        with self._lock:
+            # Re-registering a name (module reload, second app in one process) replaces it
+            self._metrics[metric.name] = metric
+        return metric
+
+    def histogram(self, name: str, help: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        with self._lock:
+            existing = self._metrics.get(name)
+        if isinstance(existing, Histogram):
+            return existing
+        return self._register(Histogram(name, help, labelnames, buckets))
+
+    def counter(self, name: str, help: str, labelnames: Sequence[str] = ()) -> Counter:
+        with self._lock:
+            existing = self._metrics.get(name)
+        if isinstance(existing, Counter):
+            return existing
+        return self._register(Counter(name, help, labelnames))
+
+    def callback(self, name: str, help: str, fn: Callable, kind: str = "gauge",
+                 labelnames: Sequence[str] = ()) -> Callback:
+        return self._register(Callback(name, help, fn, kind, labelnames))
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.collect())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+REQUEST_SECONDS = REGISTRY.histogram("face_api_request_seconds", "Request latency by route and status",
+                                     ("route", "status"))
+STAGE_SECONDS = REGISTRY.histogram("face_api_stage_seconds", "Time spent in each stage of a request",
+                                   ("route", "stage"))
+MODEL_STAGE_SECONDS = REGISTRY.histogram("face_model_stage_seconds",
+                                         "FaceDetection time per stage (detect, align, embed)", ("stage",))
+QUALITY_CHECKS = REGISTRY.counter("face_quality_checks_total",
+                                  "Faces seen by the quality gate, by result (ok or the rejection reason)", ("result",))
+QUALITY_REJECTIONS = REGISTRY.counter("face_api_quality_rejections_total",
+                                      "Requests answered early because the face failed the quality gate",
+                                      ("route", "reason"))
+SLOW_REQUESTS = REGISTRY.counter("face_api_slow_requests_total", "Requests slower than SLOW_REQUEST_MS", ("route",))
+
+
+# FaceDetection metrics by kind: (label, value) -> record it
+_MODEL_METRICS = {
+    "stage": lambda name, seconds: MODEL_STAGE_SECONDS.observe(seconds, name),
+    "quality": lambda result, count: QUALITY_CHECKS.inc(result, amount=count),
+}
+_captured = threading.local()
+
+
+def record_model_metric(kind: str, label: str, value: float = 1) -> None:
+    """
+    Record a FaceDetection metric ("stage": seconds, "quality": count), or keep it
+    while capture_model_metrics() is open on this thread.
+    """
+    events = getattr(_captured, "events", None)
+    if events is not None:
+        events.append((kind, label, value))
+    else:
+        _MODEL_METRICS[kind](label, value)
+
+
+@contextmanager
+def capture_model_metrics():
+    """
+    Collect this thread's FaceDetection metrics instead of recording them; yields the
+    list of (kind, label, value). Inference pool workers send it back with each result,
+    since their registry is never scraped.
+    """
+    events: List[Tuple[str, str, float]] = []
+    _captured.events = events
+    try:
+        yield events
+    finally:
+        _captured.events = None
+
+
+def replay_model_metrics(events: Sequence[Tuple[str, str, float]]) -> None:
+    """Record metrics captured in another process"""
+    for kind, label, value in events:
+        _MODEL_METRICS[kind](label, value)
+
+
+@contextmanager
+def model_stage(name: str):
+    """Time a FaceDetection stage"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_model_metric("stage", name, time.perf_counter() - start)
+
+
+class SamplingProfiler:
+    """
+    Samples the stacks of the threads serving tracked requests every `interval_s`
+    from one background thread (sys._current_frames), so untracked requests cost
+    nothing and tracked ones only a dict update. Stacks are kept in the folded
+    format: "module:function;module:function count".
+    """
+
+    def __init__(self, interval_s: float = 0.005, max_depth: int = 64):
+        self.interval_s = interval_s
+        self.max_depth = max_depth
+        self._tracked: Dict[int, collections.Counter] = {}
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+    def _ensure_running(self) -> None:
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+            self._thread.start()
+
+    def start(self, thread_id: int) -> None:
+        with self._lock:
+            self._tracked[thread_id] = collections.Counter()
+            self._ensure_running()
+
+    def stop(self, thread_id: int) -> collections.Counter:
+        with self._lock:
+            return self._tracked.pop(thread_id, collections.Counter())
+
+    def _fold(self, frame) -> str:
+        names = []
+        while frame is not None and len(names) < self.max_depth:
+            code = frame.f_code
+            names.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+            frame = frame.f_back
+        return ";".join(reversed(names))
+
+    def _run(self) -> None:
+        while True:
+            time.sleep(self.interval_s)
+            with self._lock:
+                if not self._tracked:
+                    continue
+                frames = sys._current_frames()
+                for thread_id, samples in self._tracked.items():
+                    frame = frames.get(thread_id)
+                    if frame is not None:
+                        samples[self._fold(frame)] += 1
+
+
+def write_profile(directory: str, route: str, duration_ms: float, samples: collections.Counter) -> Optional[str]:
+    """:return: path of the folded-stack file, None without samples"""
+    if not samples:
+        return None
+    os.makedirs(directory, exist_ok=True)
+    stamp = datetime.datetime.now().strftime("%Y%m%d%H%M%S%f")
+    path = os.path.join(directory, f"{stamp}_{route}_{int(duration_ms)}ms.folded")
+    with open(path, "w") as f:
+        for stack, count in samples.most_common():
+            f.write(f"{stack} {count}\n")
+    return path
+
+
+class RequestTimer:
+    """
+    Stage timings of one request: `with timer.stage("decode"): ...` observes
+    face_api_stage_seconds{route, stage}; finish() observes the total and handles
+    slow requests (counter, and a profile dump when a profiler is attached).
+    """
+
+    def __init__(self, route: str, slow_ms: float = 0.0, profiler: Optional[SamplingProfiler] = None,
+                 profile_dir: str = "profiles"):
+        self.route = route
+        self.slow_ms = slow_ms
+        self.profiler = profiler
+        self.profile_dir = profile_dir
+        self.stages: Dict[str, float] = {}
+        self._thread_id = threading.get_ident()
+        self._start = time.perf_counter()
+        if profiler is not None:
+            profiler.start(self._thread_id)
+
+    @contextmanager
+    def stage(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self.stages[name] = self.stages.get(name, 0.0) + elapsed
+            STAGE_SECONDS.observe(elapsed, self.route, name)
+
+    def finish(self, status: int) -> float:
+        """:return: request duration in ms"""
+        elapsed = time.perf_counter() - self._start
+        REQUEST_SECONDS.observe(elapsed, self.route, str(status))
+        duration_ms = elapsed * 1000
+        samples = self.profiler.stop(self._thread_id) if self.profiler is not None else None
+        if self.slow_ms and duration_ms >= self.slow_ms:
+            SLOW_REQUESTS.inc(self.route)
+            if samples:
+                write_profile(self.profile_dir, self.route, duration_ms, samples)
+        return duration_ms
@@ -0,0 +1,199 @@
+"""
+Vector codecs of the compressed search indexes (search_index.PQIndex / SQ8Index).
+
+Every codec turns float32 rows into uint8 codes. Search codecs also score float
+queries against codes directly (asymmetric distance computation, ADC): the query
+is projected onto the codec's tables once, and the codes are only used as table
+indexes / integer weights, never dequantized back to vectors.
+"""
+from typing import Dict
+
+import numpy as np
+
+
+def kmeans_l2(vectors: np.ndarray, k: int, iters: int = 10, seed: int = 0) -> np.ndarray:
+    """Plain (Euclidean) k-means, used for the PQ sub-quantizers. :return: (k, d) centroids"""
+    rng = np.random.default_rng(seed)
+    n = vectors.shape[0]
+    centroids = vectors[rng.choice(n, min(k, n), replace=False)].copy()
+    if centroids.shape[0] < k:
+        # Fewer training points than centroids: pad with jittered copies
+        extra = centroids[rng.integers(0, centroids.shape[0], k - centroids.shape[0])]
+        centroids = np.concatenate([centroids, extra + 1e-4 * rng.standard_normal(extra.shape, dtype=np.float32)])
+    for _ in range(iters):
+        assign = _nearest_l2(vectors, centroids)
+        order = np.argsort(assign, kind="stable")
+        counts = np.bincount(assign, minlength=k)
+        starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+        nonempty = counts > 0
+        sums = np.zeros_like(centroids)
+        sums[nonempty] = np.add.reduceat(vectors[order], starts[nonempty], axis=0)
+        centroids[nonempty] = sums[nonempty] / counts[nonempty, None]
+        # Re-seed empty clusters from random points
+        empty = np.flatnonzero(~nonempty)
+        if empty.size:
+            centroids[empty] = vectors[rng.choice(n, empty.size)]
+    return centroids
+
+
+def _nearest_l2(vectors: np.ndarray, centroids: np.ndarray, chunk: int = 65536) -> np.ndarray:
+    # argmin |x - c|^2 = argmin |c|^2 - 2 x.c, accumulated in place
+    norms = (centroids * centroids).sum(axis=1)
+    scaled = -2 * centroids.T
+    out = np.empty(vectors.shape[0], dtype=np.int64)
+    for start in range(0, vectors.shape[0], chunk):
+        distances = vectors[start:start + chunk] @ scaled
+        distances += norms
+        out[start:start + chunk] = distances.argmin(axis=1)
+    return out
+
+
+class ScalarQuantizer:
+    """
+    8 bits per dimension (SQ8): x[i] ~ vmin[i] + code[i] * scale[i], with the range of
+    every dimension learned from the training vectors. 4x smaller than float32.
+    """
+
+    kind = "sq8"
+
+    def __init__(self, dim: int):
+        self.dim = dim
+        self.code_size = dim
+        self.vmin = None
+        self.scale = None
+
+    @property
+    def is_trained(self) -> bool:
+        return self.vmin is not None
+
+    def train(self, vectors: np.ndarray) -> None:
+        vmin, vmax = vectors.min(axis=0), vectors.max(axis=0)
+        span = vmax - vmin
+        self.vmin = vmin.astype(np.float32)
+        self.scale = np.where(span > 0, span / 255.0, 1.0).astype(np.float32)
+
+    def encode(self, vectors: np.ndarray) -> np.ndarray:
+        # Values outside the trained range saturate
+        return np.clip(np.rint((vectors - self.vmin) / self.scale), 0, 255).astype(np.uint8)
+
+    def decode(self, codes: np.ndarray) -> np.ndarray:
+        return codes.astype(np.float32) * self.scale + self.vmin
+
+    def adc(self, queries: np.ndarray, codes: np.ndarray, chunk: int = 256) -> np.ndarray:
+        """
+        Inner products of float queries with coded vectors:
+        q.x = q.vmin + (q * scale).code, so the codes are only integer weights.
+        :return: (m, n) scores
+        """
+        weights = np.ascontiguousarray((queries * self.scale).T, dtype=np.float32)
+        out = np.empty((codes.shape[0], queries.shape[0]), dtype=np.float32)
+        # uint8 @ float32 has no BLAS path; widen a few cache-sized rows at a time into one buffer
+        buffer = np.empty((min(chunk, codes.shape[0]), self.dim), dtype=np.float32)
+        for start in range(0, codes.shape[0], chunk):
+            block = codes[start:start + chunk]
+            rows = buffer[:block.shape[0]]
+            np.copyto(rows, block, casting="unsafe")
+            np.matmul(rows, weights, out=out[start:start + chunk])
+        out += queries @ self.vmin
+        return out.T
+
+    def state(self) -> Dict[str, np.ndarray]:
+        return {"vmin": self.vmin, "scale": self.scale}
+
+    def load_state(self, state: Dict[str, np.ndarray]) -> None:
+        self.vmin, self.scale = state["vmin"], state["scale"]
+
+
+class ProductQuantizer:
+    """
+    Product quantization: the vector is cut into `m` sub-vectors, each replaced by the
+    id of its nearest of 256 centroids (one byte), so a 512-d face takes `m` bytes.
+    Scores use one (m, 256) lookup table of query . centroid per query.
+    """
+
+    kind = "pq"
+    ksub = 256
+
+    def __init__(self, dim: int, m: int = 64, iters: int = 10, seed: int = 0):
+        if dim % m:
+            raise ValueError(f"dim {dim} is not divisible by m={m}")
+        self.dim = dim
+        self.m = m
+        self.dsub = dim // m
+        self.code_size = m
+        self.iters = iters
+        self.seed = seed
+        self.centroids = None  # (m, 256, dsub)
+
+    @property
+    def is_trained(self) -> bool:
+        return self.centroids is not None
+
+    def _sub(self, vectors: np.ndarray, j: int) -> np.ndarray:
+        return np.ascontiguousarray(vectors[:, j * self.dsub:(j + 1) * self.dsub])
+
+    def train(self, vectors: np.ndarray) -> None:
+        self.centroids = np.stack([kmeans_l2(self._sub(vectors, j), self.ksub, self.iters, self.seed + j)
+                                   for j in range(self.m)])
+
+    def encode(self, vectors: np.ndarray) -> np.ndarray:
+        codes = np.empty((vectors.shape[0], self.m), dtype=np.uint8)
+        for j in range(self.m):
+            codes[:, j] = _nearest_l2(self._sub(vectors, j), self.centroids[j])
+        return codes
+
+    def decode(self, codes: np.ndarray) -> np.ndarray:
+        return np.concatenate([self.centroids[j][codes[:, j]] for j in range(self.m)], axis=1)
+
+    def adc(self, queries: np.ndarray, codes: np.ndarray, chunk: int = 8192) -> np.ndarray:
+        """:return: (m, n) scores, the sum over sub-spaces of table[j, code[j]]"""
+        tables = np.einsum("qjd,jcd->qjc", queries.reshape(-1, self.m, self.dsub), self.centroids)
+        out = np.empty((queries.shape[0], codes.shape[0]), dtype=np.float32)
+        # A chunk of codes at a time, so its columns stay in cache across the m table lookups
+        for start in range(0, codes.shape[0], chunk):
+            block = codes[start:start + chunk]
+            for q, table in enumerate(tables):
+                acc = np.zeros(block.shape[0], dtype=np.float32)
+                for j in range(self.m):
+                    acc += table[j].take(block[:, j])
+                out[q, start:start + chunk] = acc
+        return out
+
+    def state(self) -> Dict[str, np.ndarray]:
+        return {"centroids": self.centroids}
+
+    def load_state(self, state: Dict[str, np.ndarray]) -> None:
+        self.centroids = state["centroids"]
+
+
+class Float16Codec:
+    """Half-precision copy (2 bytes per dimension), the re-rank store of the compressed indexes"""
+
+    kind = "float16"
+
+    def __init__(self, dim: int):
+        self.dim = dim
+        self.code_size = 2 * dim
+        self.is_trained = True
+
+    def train(self, vectors: np.ndarray) -> None:
+        pass
+
+    def encode(self, vectors: np.ndarray) -> np.ndarray:
+        return np.ascontiguousarray(vectors, dtype=np.float16).view(np.uint8)
+
+    def decode(self, codes: np.ndarray) -> np.ndarray:
+        return np.ascontiguousarray(codes).view(np.float16).astype(np.float32)
+
+    def state(self) -> Dict[str, np.ndarray]:
+        return {}
+
+    def load_state(self, state: Dict[str, np.ndarray]) -> None:
+        pass
+
+
+# Finer copies the compressed indexes can re-rank their candidates on
+REFINE_CODECS = {
+    Float16Codec.kind: Float16Codec,
+    ScalarQuantizer.kind: ScalarQuantizer,
+}
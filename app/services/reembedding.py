@@ -0,0 +1,211 @@
+import datetime
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+from pymongo import UpdateOne
+
+from app.models.embedding import encode_embedding, version_key
+from app.services.gallery_sync import STAMP
+from app.services.image_io import decode_image
+
+
+def _read_image(path: str):
+    with open(path, "rb") as f:
+        return decode_image(f.read())
+
+
+class Reembedding:
+    """
+    Re-embed every stored face image with another model pack, next to the current vectors.
+
+    Users are walked in `_id` order one page at a time (`_id > last`, `page_size`
+    documents), so memory is bounded by a page and no cursor stays open while the
+    model runs. For every face that has no embedding of `version` yet, its aligned
+    chip is read from `face_store` (the memory-mapped pack when loaded) and fed to
+    ArcFace directly, in batches of `batch_size`: no detection, no alignment. Faces
+    without a chip (enrolled before chips were stored) fall back to the original
+    upload at `image_path`, which is run through the detector. The results are
+    written with one unordered bulk_write per page as `faces.<i>.embeddings.<version>`.
+    The serving gallery only reads the version it runs, so the API keeps answering
+    from the old vectors meanwhile.
+
+    After every page the last `_id` and the counters are checkpointed in `jobs_col`;
+    an interrupted run continues after the last written page. Faces that already
+    carry the version are skipped, so a completed job can be re-run cheaply to pick
+    up users registered during the transition.
+
+    :param detector: FaceDetection of the new model (get_best_faces() batches the
+        embedding, embed_aligned() embeds chips), or anything with get_best_face()
+    """
+
+    ERROR_LIMIT = 1000  # errors kept in the job document
+
+    def __init__(self, users_col, jobs_col, detector, version: str, embedding_dtype: str = "float32",
+                 page_size: int = 200, batch_size: int = 16, workers: int = 4, face_store=None,
+                 progress: Optional[Callable[[Dict], None]] = None):
+        self.users_col = users_col
+        self.jobs_col = jobs_col
+        self.detector = detector
+        self.face_store = face_store
+        # Chips only fit a recognizer with the same input size; other detectors re-detect the uploads
+        self.chip_size = getattr(detector, "chip_size", None) \
+            if face_store is not None and hasattr(detector, "embed_aligned") else None
+        self.version = version
+        self.key = version_key(version)
+        self.embedding_dtype = embedding_dtype
+        self.page_size = max(1, page_size)
+        self.batch_size = max(1, batch_size)
+        self.workers = max(1, workers)
+        self.progress = progress
+        self.errors: List[Dict] = []
+        self.stats = {"users": 0, "faces": 0, "chips": 0, "skipped": 0, "failed": 0, "pages": 0,
+                      "elapsed_s": 0.0, "faces_per_s": 0.0}
+
+    @property
+    def job_id(self) -> str:
+        return self.key
+
+    def status(self) -> Optional[Dict]:
+        return self.jobs_col.find_one({"job_id": self.job_id}, {"_id": 0})
+
+    def _error(self, doc: Dict, face: int, path: Optional[str], reason: str, message: str) -> None:
+        self.stats["failed"] += 1
+        self.errors.append({"user_id": doc.get("user_id") or doc.get("uuid"), "face": face,
+                            "image_path": path, "reason": reason, "message": message})
+
+    def _pending(self, page: List[Dict]) -> List[Tuple[Dict, int, Dict]]:
+        """(doc, face index, face) of every face still missing the target version"""
+        pending = []
+        for doc in page:
+            self.stats["users"] += 1
+            faces = doc.get("faces") or []
+            if doc.get("embedding_version") == self.version:
+                # Registered under the new model already
+                self.stats["skipped"] += len(faces)
+                continue
+            for i, face in enumerate(faces):
+                if self.key in (face.get("embeddings") or {}):
+                    self.stats["skipped"] += 1
+                else:
+                    pending.append((doc, i, face))
+        return pending
+
+    def _load(self, face: Dict) -> Tuple[str, Optional[np.ndarray]]:
+        """
+        Runs on a read thread: ("chip", aligned chip) when the store has a usable one,
+        else ("image", decoded upload). Raises OSError when there is neither.
+        """
+        key = face.get("chip")
+        if key and self.chip_size is not None:
+            chip = self.face_store.get(key)
+            if chip is not None and chip.shape[:2] == (self.chip_size, self.chip_size):
+                return "chip", chip
+        path = face.get("image_path")
+        if not path:
+            raise FileNotFoundError(f"Face has no usable chip ({key}) and no image_path")
+        return "image", _read_image(path)
+
+    def _embed(self, images: List) -> List[Optional[Dict]]:
+        if hasattr(self.detector, "get_best_faces"):
+            # Already enrolled faces: the quality gate must not drop them from the new model's gallery
+            return self.detector.get_best_faces(images, check_quality=False)
+        return [self.detector.get_best_face(image) for image in images]
+
+    def _process_page(self, page: List[Dict], executor: ThreadPoolExecutor) -> int:
+        """:return: number of documents updated"""
+        updates: Dict = {}
+        pending = self._pending(page)
+        for start in range(0, len(pending), self.batch_size):
+            chunk = pending[start:start + self.batch_size]
+            # Read + decode the chunk in parallel, then one batched model call per kind
+            reads = [executor.submit(self._load, face) for _, _, face in chunk]
+            chips, images = [], []
+            for (doc, i, face), future in zip(chunk, reads):
+                path = face.get("image_path")
+                try:
+                    kind, image = future.result()
+                except OSError as e:
+                    self._error(doc, i, path, "missing_image", str(e))
+                    continue
+                if image is None:
+                    self._error(doc, i, path, "unreadable_image", "Could not decode image")
+                    continue
+                (chips if kind == "chip" else images).append(((doc, i, path), image))
+            embedded = []
+            if chips:
+                # Already aligned: straight into the recognizer
+                embedded += zip([ref for ref, _ in chips], self.detector.embed_aligned([chip for _, chip in chips]))
+                self.stats["chips"] += len(chips)
+            if images:
+                for ((doc, i, path), _), face in zip(images, self._embed([image for _, image in images])):
+                    if face is None:
+                        self._error(doc, i, path, "no_face", "No face detected")
+                        continue
+                    embedded.append(((doc, i, path), face["embedding"]))
+            for (doc, i, _), embedding in embedded:
+                updates.setdefault(doc["_id"], {})[f"faces.{i}.embeddings.{self.key}"] = \
+                    encode_embedding(embedding, self.embedding_dtype)
+                self.stats["faces"] += 1
+        if not updates:
+            return 0
+        # The server-set embeddings_updated_at moves the collection fingerprint (snapshots of the old
+        # vectors go stale) and GallerySync re-reads these users in processes already serving this
+        # version; the profile's updated_at is left alone
+        ops = [UpdateOne({"_id": _id}, {"$set": fields, **STAMP}) for _id, fields in updates.items()]
+        return self.users_col.bulk_write(ops, ordered=False).modified_count
+
+    def _checkpoint(self, fields: Dict) -> None:
+        self.jobs_col.update_one({"job_id": self.job_id}, {"$set": {
+            **fields,
+            "progress": dict(self.stats),
+            "errors": self.errors[:self.ERROR_LIMIT],
+            "error_count": len(self.errors),
+            "updated_at": datetime.datetime.now().isoformat(),
+        }}, upsert=True)
+
+    def run(self, resume: bool = True) -> Dict:
+        """
+        :param resume: continue an interrupted run from its checkpoint (a completed
+            job always starts over and only embeds what is still missing)
+        :return: stats and the list of errors
+        """
+        job = self.status()
+        last_id = None
+        if resume and job and job.get("status") != "completed" and job.get("last_id") is not None:
+            last_id = job["last_id"]
+            self.stats.update({k: v for k, v in (job.get("progress") or {}).items() if k in self.stats})
+            self.errors = list(job.get("errors") or [])
+        self._checkpoint({"version": self.version, "status": "running", "last_id": last_id,
+                          "started_at": datetime.datetime.now().isoformat()})
+
+        projection = {"user_id": 1, "uuid": 1, "embedding_version": 1,
+                      "faces.image_path": 1, "faces.chip": 1, f"faces.embeddings.{self.key}": 1}
+        elapsed_before = self.stats["elapsed_s"]
+        committed = (dict(self.stats), len(self.errors))
+        start = time.perf_counter()
+        try:
+            with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="reembed-read") as executor:
+                while True:
+                    query = {"_id": {"$gt": last_id}} if last_id is not None else {}
+                    page = list(self.users_col.find(query, projection).sort("_id", 1).limit(self.page_size))
+                    if not page:
+                        break
+                    self._process_page(page, executor)
+                    last_id = page[-1]["_id"]
+                    self.stats["pages"] += 1
+                    self.stats["elapsed_s"] = round(elapsed_before + time.perf_counter() - start, 3)
+                    self.stats["faces_per_s"] = round(self.stats["faces"] / max(self.stats["elapsed_s"], 1e-9), 2)
+                    self._checkpoint({"last_id": last_id})
+                    committed = (dict(self.stats), len(self.errors))
+                    if self.progress is not None:
+                        self.progress(dict(self.stats))
+        except Exception as e:
+            # Counters of the unfinished page are redone on resume
+            self.stats, self.errors = committed[0], self.errors[:committed[1]]
+            self._checkpoint({"status": "failed", "error": f"{type(e).__name__}: {e}"})
+            raise
+        self._checkpoint({"status": "completed", "last_id": last_id,
+                          "finished_at": datetime.datetime.now().isoformat()})
+        return {**self.stats, "errors": self.errors}
@@ -0,0 +1,756 @@
+import threading
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from app.services.quantization import REFINE_CODECS, ProductQuantizer, ScalarQuantizer
+
+
+def normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    """L2 normalize every row of a 2-D float32 array"""
+    matrix = np.asarray(matrix, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def _as_queries(queries: np.ndarray) -> np.ndarray:
+    queries = np.asarray(queries, dtype=np.float32)
+    if queries.ndim == 1:
+        queries = queries[None, :]
+    return normalize_rows(queries)
+
+
+def _top_k(scores: np.ndarray, labels: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Pick the k best (score, label) pairs of a 1-D score vector, padded with (-inf, -1)"""
+    out_scores = np.full(k, -np.inf, dtype=np.float32)
+    out_labels = np.full(k, -1, dtype=np.int64)
+    n = scores.shape[0]
+    if n == 0:
+        return out_scores, out_labels
+    take = min(k, n)
+    if take < n:
+        idx = np.argpartition(-scores, take - 1)[:take]
+    else:
+        idx = np.arange(n)
+    idx = idx[np.argsort(-scores[idx], kind="stable")]
+    out_scores[:take] = scores[idx]
+    out_labels[:take] = labels[idx]
+    return out_scores, out_labels
+
+
+def _top_k_rows(scores: np.ndarray, labels: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """_top_k for every row of an (m, n) score matrix over the same n labels"""
+    out_scores = np.empty((scores.shape[0], k), dtype=np.float32)
+    out_labels = np.empty((scores.shape[0], k), dtype=np.int64)
+    for i in range(scores.shape[0]):
+        out_scores[i], out_labels[i] = _top_k(scores[i], labels, k)
+    return out_scores, out_labels
+
+
+class _Block:
+    """Immutable view of a growable (vectors, labels) buffer; rows past `size` are unused"""
+
+    __slots__ = ("vectors", "labels", "size", "_sorted")
+
+    def __init__(self, vectors: np.ndarray, labels: np.ndarray, size: int):
+        self.vectors = vectors
+        self.labels = labels
+        self.size = size
+        self._sorted: Optional[Tuple[np.ndarray, np.ndarray]] = None
+
+    def row_of(self, label: int) -> int:
+        """Row holding this label, -1 if absent (the labels are sorted once per block)"""
+        if self._sorted is None:
+            order = np.argsort(self.labels[:self.size], kind="stable")
+            self._sorted = (order, self.labels[:self.size][order])
+        order, sorted_labels = self._sorted
+        pos = int(sorted_labels.searchsorted(label))
+        if pos < self.size and sorted_labels[pos] == label:
+            return int(order[pos])
+        return -1
+
+    @classmethod
+    def empty(cls, dim: int, capacity: int = 0, dtype=np.float32) -> "_Block":
+        return cls(np.zeros((capacity, dim), dtype=dtype), np.zeros(capacity, dtype=np.int64), 0)
+
+    def appended(self, labels: np.ndarray, vectors: np.ndarray) -> "_Block":
+        size = self.size
+        new_size = size + labels.shape[0]
+        buf_vectors, buf_labels = self.vectors, self.labels
+        if new_size > buf_vectors.shape[0]:
+            capacity = max(new_size, buf_vectors.shape[0] * 2, 64)
+            buf_vectors = np.zeros((capacity, vectors.shape[1]), dtype=self.vectors.dtype)
+            buf_labels = np.zeros(capacity, dtype=np.int64)
+            buf_vectors[:size] = self.vectors[:size]
+            buf_labels[:size] = self.labels[:size]
+        # Rows past `size` are invisible to readers of the old block, so writing in place is safe
+        buf_vectors[size:new_size] = vectors
+        buf_labels[size:new_size] = labels
+        return _Block(buf_vectors, buf_labels, new_size)
+
+    def without(self, labels: np.ndarray) -> Tuple["_Block", int]:
+        keep = ~np.isin(self.labels[:self.size], labels)
+        removed = int(self.size - keep.sum())
+        if removed == 0:
+            return self, 0
+        # Fresh arrays: in-place compaction would corrupt concurrent readers
+        vectors = np.ascontiguousarray(self.vectors[:self.size][keep])
+        return _Block(vectors, self.labels[:self.size][keep].copy(), vectors.shape[0]), removed
+
+
+class SearchIndex:
+    """
+    Cosine-similarity index over L2-normalized vectors addressed by int64 labels.
+    Writers serialize on a lock; searches read immutable blocks and never block.
+    """
+
+    kind = "base"
+    # stored() / reconstruct() return the vectors that were added (compressed indexes: approximations)
+    lossless = True
+
+    def __init__(self, dim: int = 512):
+        self.dim = dim
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        raise NotImplementedError
+
+    def add(self, labels: Sequence[int], vectors: np.ndarray) -> None:
+        """Insert vectors (normalized here) under the given labels."""
+        raise NotImplementedError
+
+    def remove(self, labels: Sequence[int]) -> int:
+        """Delete vectors by label, return how many were removed."""
+        raise NotImplementedError
+
+    def search(self, queries: np.ndarray, k: int = 1,
+               allowed: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        k-nearest-neighbour search.
+        :param queries: (d,) or (m, d) query embeddings
+        :param k: number of neighbours per query
+        :param allowed: optional array of labels the results are restricted to
+        :return: (scores, labels), both (m, k); missing slots are (-inf, -1)
+        """
+        raise NotImplementedError
+
+    def stored(self) -> Tuple[np.ndarray, np.ndarray]:
+        """All (labels, normalized vectors) currently held."""
+        raise NotImplementedError
+
+    def reconstruct(self, labels: Sequence[int]) -> Tuple[np.ndarray, np.ndarray]:
+        """(labels, normalized vectors) of the given labels that are held, without a search."""
+        raise NotImplementedError
+
+    def save(self, path: str) -> None:
+        raise NotImplementedError
+
+    @classmethod
+    def load(cls, path: str) -> "SearchIndex":
+        raise NotImplementedError
+
+    def _check(self, labels: Sequence[int], vectors: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        labels = np.asarray(labels, dtype=np.int64).ravel()
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(-1, self.dim)
+        if labels.shape[0] != vectors.shape[0]:
+            raise ValueError("labels and vectors must have the same length")
+        return labels, normalize_rows(vectors)
+
+
+class BruteForceIndex(SearchIndex):
+    """Exact search: one contiguous matrix, one matrix product per query batch."""
+
+    kind = "brute"
+
+    def __init__(self, dim: int = 512):
+        super().__init__(dim)
+        # (block, argsort of its labels, labels in that order) published together so
+        # label -> row lookups stay consistent and cost O(log n) per label
+        empty = np.zeros(0, dtype=np.int64)
+        self._state: Tuple[_Block, np.ndarray, np.ndarray] = (_Block.empty(dim, 1024), empty, empty)
+
+    @property
+    def _block(self) -> _Block:
+        return self._state[0]
+
+    def __len__(self) -> int:
+        return self._block.size
+
+    def _publish(self, block: _Block) -> None:
+        order = np.argsort(block.labels[:block.size], kind="stable")
+        self._state = (block, order, block.labels[:block.size][order])
+
+    def add(self, labels, vectors) -> None:
+        labels, vectors = self._check(labels, vectors)
+        if labels.shape[0] == 0:
+            return
+        with self._lock:
+            self._publish(self._block.appended(labels, vectors))
+
+    def remove(self, labels) -> int:
+        labels = np.asarray(labels, dtype=np.int64).ravel()
+        with self._lock:
+            block, removed = self._block.without(labels)
+            if removed:
+                self._publish(block)
+        return removed
+
+    @staticmethod
+    def _rows_for(block: _Block, order: np.ndarray, sorted_labels: np.ndarray, allowed: np.ndarray) -> np.ndarray:
+        pos = np.searchsorted(sorted_labels, allowed)
+        found = pos < block.size
+        pos, allowed = pos[found], allowed[found]
+        return order[pos[sorted_labels[pos] == allowed]]
+
+    def search(self, queries, k=1, allowed=None):
+        queries = _as_queries(queries)
+        block, order, sorted_labels = self._state
+        if allowed is not None:
+            rows = self._rows_for(block, order, sorted_labels, np.asarray(allowed, dtype=np.int64).ravel())
+            vectors, labels = block.vectors[rows], block.labels[rows]
+        else:
+            vectors, labels = block.vectors[:block.size], block.labels[:block.size]
+
+        return _top_k_rows(queries @ vectors.T, labels, k)
+
+    def stored(self) -> Tuple[np.ndarray, np.ndarray]:
+        block = self._block
+        return block.labels[:block.size], block.vectors[:block.size]
+
+    def reconstruct(self, labels) -> Tuple[np.ndarray, np.ndarray]:
+        block, order, sorted_labels = self._state
+        rows = self._rows_for(block, order, sorted_labels, np.asarray(labels, dtype=np.int64).ravel())
+        return block.labels[rows], block.vectors[rows]
+
+    def save(self, path: str) -> None:
+        block = self._block
+        np.savez(path, kind=self.kind, dim=self.dim,
+                 vectors=block.vectors[:block.size], labels=block.labels[:block.size])
+
+    @classmethod
+    def load(cls, path: str) -> "BruteForceIndex":
+        with np.load(path) as data:
+            index = cls(int(data["dim"]))
+            index.add(data["labels"], data["vectors"])
+        return index
+
+
+def _assign(vectors: np.ndarray, centroids: np.ndarray, chunk: int = 65536) -> np.ndarray:
+    """Nearest centroid (max inner product) per row, computed in chunks to bound memory"""
+    out = np.empty(vectors.shape[0], dtype=np.int64)
+    for start in range(0, vectors.shape[0], chunk):
+        out[start:start + chunk] = np.argmax(vectors[start:start + chunk] @ centroids.T, axis=1)
+    return out
+
+
+def spherical_kmeans(vectors: np.ndarray, k: int, iters: int = 20, seed: int = 0) -> np.ndarray:
+    """
+    k-means on the unit sphere (cosine similarity), used as the IVF coarse quantizer.
+    :return: (k, d) L2-normalized centroids
+    """
+    rng = np.random.default_rng(seed)
+    n = vectors.shape[0]
+    k = min(k, n)
+    centroids = vectors[rng.choice(n, k, replace=False)].copy()
+    for _ in range(iters):
+        assign = _assign(vectors, centroids)
+        order = np.argsort(assign, kind="stable")
+        counts = np.bincount(assign, minlength=k)
+        starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+        nonempty = counts > 0
+        sums = np.zeros_like(centroids)
+        sums[nonempty] = np.add.reduceat(vectors[order], starts[nonempty], axis=0)
+        # Re-seed empty clusters from random points
+        empty = np.flatnonzero(~nonempty)
+        if empty.size:
+            sums[empty] = vectors[rng.choice(n, empty.size, replace=False)]
+        centroids = normalize_rows(sums)
+    return centroids
+
+
+class IVFIndex(SearchIndex):
+    """
+    Inverted-file index: a spherical k-means coarse quantizer with one inverted list per centroid.
+    A query only scores the `nprobe` lists whose centroids are closest. A search restricted to
+    a small set of labels (well under what those lists hold) scores exactly the allowed rows instead.
+
+    Until `min_train` vectors have been added the index stays untrained and scans exactly;
+    it trains itself on the first batch that crosses the threshold.
+    """
+
+    kind = "ivf"
+    # Looking up one allowed row costs about as much as scoring this many vectors of a probed list
+    EXACT_ALLOWED_COST = 8
+
+    def __init__(self, dim: int = 512, nlist: int = 256, nprobe: int = 16,
+                 min_train: int = 10000, kmeans_iters: int = 20, max_train_points: int = 256,
+                 seed: int = 0):
+        """
+        :param nlist: number of inverted lists
+        :param nprobe: lists scanned per query (recall/latency knob, can be overridden per search)
+        :param min_train: vectors needed before the quantizer is trained
+        :param max_train_points: k-means sample size per list
+        """
+        super().__init__(dim)
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.min_train = max(min_train, nlist)
+        self.kmeans_iters = kmeans_iters
+        self.max_train_points = max_train_points
+        self.seed = seed
+        self.centroids: Optional[np.ndarray] = None
+        self._lists: List[_Block] = []
+        self._where: Dict[int, int] = {}  # label -> list id
+        self._flat = BruteForceIndex(dim)  # holds vectors while untrained
+        self._train_lock = threading.RLock()
+
+    @property
+    def is_trained(self) -> bool:
+        return self.centroids is not None
+
+    def __len__(self) -> int:
+        if not self.is_trained:
+            return len(self._flat)
+        return len(self._where)
+
+    def stored(self) -> Tuple[np.ndarray, np.ndarray]:
+        """All (labels, vectors) currently held, staged or in lists"""
+        blocks = [self._flat._block] + list(self._lists)
+        labels = np.concatenate([b.labels[:b.size] for b in blocks])
+        vectors = np.concatenate([b.vectors[:b.size] for b in blocks]).reshape(-1, self.dim)
+        return labels, vectors
+
+    def reconstruct(self, labels) -> Tuple[np.ndarray, np.ndarray]:
+        if not self.is_trained:
+            return self._flat.reconstruct(labels)
+        return self._gather(np.asarray(labels, dtype=np.int64).ravel())
+
+    def _gather(self, labels: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """(labels, vectors) of these labels, each looked up by row in the list holding it"""
+        lists, where = self._lists, self._where
+        found_labels, found_vectors = [], []
+        for label in labels.tolist():
+            list_id = where.get(label)
+            if list_id is None:
+                continue
+            block = lists[list_id]
+            row = block.row_of(label)
+            if row >= 0:
+                found_labels.append(label)
+                found_vectors.append(block.vectors[row])
+        if not found_labels:
+            return np.zeros(0, dtype=np.int64), np.zeros((0, self.dim), dtype=np.float32)
+        return np.asarray(found_labels, dtype=np.int64), np.stack(found_vectors)
+
+    def train(self, vectors: Optional[np.ndarray] = None) -> None:
+        """
+        Fit the coarse quantizer and (re)distribute every stored vector into the inverted lists.
+        :param vectors: training sample; defaults to the vectors already in the index
+        """
+        with self._train_lock:
+            if vectors is None:
+                vectors = self.stored()[1]
+            vectors = normalize_rows(np.asarray(vectors, dtype=np.float32).reshape(-1, self.dim))
+            sample_size = min(vectors.shape[0], self.nlist * self.max_train_points)
+            if sample_size < vectors.shape[0]:
+                rng = np.random.default_rng(self.seed)
+                vectors = vectors[rng.choice(vectors.shape[0], sample_size, replace=False)]
+            centroids = spherical_kmeans(vectors, self.nlist, self.kmeans_iters, self.seed)
+
+            with self._lock:
+                labels, stored = self.stored()
+                lists = [_Block.empty(self.dim) for _ in range(centroids.shape[0])]
+                where: Dict[int, int] = {}
+                self._assign_into(lists, where, centroids, labels, stored)
+                # Publish lists before centroids: readers switch paths on `is_trained`
+                self._lists, self._where = lists, where
+                self.centroids = centroids
+                self._flat = BruteForceIndex(self.dim)
+
+    @staticmethod
+    def _assign_into(lists: List[_Block], where: Dict[int, int], centroids: np.ndarray,
+                     labels: np.ndarray, vectors: np.ndarray) -> None:
+        if labels.shape[0] == 0:
+            return
+        assign = _assign(vectors, centroids)
+        for list_id in np.unique(assign):
+            members = assign == list_id
+            lists[list_id] = lists[list_id].appended(labels[members], vectors[members])
+        where.update(zip(labels.tolist(), assign.tolist()))
+
+    def add(self, labels, vectors) -> None:
+        labels, vectors = self._check(labels, vectors)
+        if labels.shape[0] == 0:
+            return
+        with self._lock:
+            if self.is_trained:
+                self._assign_into(self._lists, self._where, self.centroids, labels, vectors)
+                return
+            self._flat.add(labels, vectors)
+            needs_training = len(self._flat) >= self.min_train
+        if needs_training:
+            with self._train_lock:
+                # another writer may have crossed the threshold first
+                if not self.is_trained:
+                    self.train()
+
+    def remove(self, labels) -> int:
+        labels = np.asarray(labels, dtype=np.int64).ravel()
+        removed = 0
+        with self._lock:
+            if not self.is_trained:
+                return self._flat.remove(labels)
+            by_list: Dict[int, List[int]] = {}
+            for label in labels.tolist():
+                list_id = self._where.pop(label, None)
+                if list_id is not None:
+                    by_list.setdefault(list_id, []).append(label)
+            for list_id, members in by_list.items():
+                self._lists[list_id], count = self._lists[list_id].without(np.asarray(members, dtype=np.int64))
+                removed += count
+        return removed
+
+    def search(self, queries, k=1, allowed=None, nprobe: Optional[int] = None):
+        if not self.is_trained:
+            return self._flat.search(queries, k=k, allowed=allowed)
+        queries = _as_queries(queries)
+        nprobe = min(nprobe or self.nprobe, self.centroids.shape[0])
+        lists = self._lists
+        allowed = None if allowed is None else np.asarray(allowed, dtype=np.int64).ravel()
+        probed_rows = nprobe * len(self) / self.centroids.shape[0]
+        if allowed is not None and allowed.size * self.EXACT_ALLOWED_COST <= probed_rows:
+            # A small allowed set (a room): scoring exactly its rows costs less than scanning the
+            # probed lists, and can't miss a face whose list wasn't probed
+            labels, vectors = self._gather(allowed)
+            return _top_k_rows(queries @ vectors.T, labels, k)
+
+        coarse = queries @ self.centroids.T
+        probes = np.argpartition(-coarse, nprobe - 1, axis=1)[:, :nprobe]
+
+        out_scores = np.empty((queries.shape[0], k), dtype=np.float32)
+        out_labels = np.empty((queries.shape[0], k), dtype=np.int64)
+        for i, query in enumerate(queries):
+            scores, labels = [], []
+            for list_id in probes[i]:
+                block = lists[list_id]
+                if block.size == 0:
+                    continue
+                scores.append(block.vectors[:block.size] @ query)
+                labels.append(block.labels[:block.size])
+            if scores:
+                cand_scores, cand_labels = np.concatenate(scores), np.concatenate(labels)
+                if allowed is not None:
+                    mask = np.isin(cand_labels, allowed)
+                    cand_scores, cand_labels = cand_scores[mask], cand_labels[mask]
+            else:
+                cand_scores, cand_labels = np.zeros(0, np.float32), np.zeros(0, np.int64)
+            out_scores[i], out_labels[i] = _top_k(cand_scores, cand_labels, k)
+        return out_scores, out_labels
+
+    def save(self, path: str) -> None:
+        params = dict(kind=self.kind, dim=self.dim, nlist=self.nlist, nprobe=self.nprobe,
+                      min_train=self.min_train, kmeans_iters=self.kmeans_iters,
+                      max_train_points=self.max_train_points, seed=self.seed)
+        if not self.is_trained:
+            block = self._flat._block
+            np.savez(path, trained=False, vectors=block.vectors[:block.size],
+                     labels=block.labels[:block.size], **params)
+            return
+        lists = self._lists
+        sizes = np.asarray([b.size for b in lists], dtype=np.int64)
+        np.savez(path, trained=True, centroids=self.centroids, list_sizes=sizes,
+                 vectors=np.concatenate([b.vectors[:b.size] for b in lists]),
+                 labels=np.concatenate([b.labels[:b.size] for b in lists]), **params)
+
+    @classmethod
+    def load(cls, path: str) -> "IVFIndex":
+        with np.load(path) as data:
+            index = cls(int(data["dim"]), nlist=int(data["nlist"]), nprobe=int(data["nprobe"]),
+                        min_train=int(data["min_train"]), kmeans_iters=int(data["kmeans_iters"]),
+                        max_train_points=int(data["max_train_points"]), seed=int(data["seed"]))
+            if not bool(data["trained"]):
+                index._flat.add(data["labels"], data["vectors"])
+                return index
+            index.centroids = data["centroids"]
+            vectors, labels = data["vectors"], data["labels"]
+            offsets = np.concatenate(([0], np.cumsum(data["list_sizes"])))
+            index._lists = [
+                _Block(vectors[offsets[i]:offsets[i + 1]].copy(), labels[offsets[i]:offsets[i + 1]].copy(),
+                       int(offsets[i + 1] - offsets[i]))
+                for i in range(index.centroids.shape[0])
+            ]
+            for list_id in range(len(index._lists)):
+                index._where.update(dict.fromkeys(index._lists[list_id].labels.tolist(), list_id))
+        return index
+
+
+class QuantizedIndex(SearchIndex):
+    """
+    Compressed index: faces are kept only as uint8 codes (see app.services.quantization)
+    and scored with asymmetric distance computation, so searching never decompresses a
+    stored vector. The `rerank` best candidates of that pass are re-scored on a finer
+    copy of their vectors (`refine`: "sq8" or "float16" codes, "none" = no copy, no re-rank),
+    which recovers the exact ranking at a fraction of the float32 memory. The copy is
+    what dominates memory (PQ64 + sq8 = 576 B, + float16 = 1088 B, float32 = 2048 B),
+    so the default is the 8-bit one.
+
+    Like IVFIndex it scans a flat float32 buffer until `min_train` vectors have been
+    added, then trains its codecs on them and switches to codes.
+    """
+
+    lossless = False
+
+    def __init__(self, dim: int = 512, rerank: int = 64, refine: str = "sq8", min_train: int = 10000,
+                 max_train_points: int = 16384, seed: int = 0):
+        """
+        :param rerank: candidates of the compressed pass re-scored on the refine copy
+        :param refine: codec of the re-rank copy, "float16", "sq8" or "none"
+        :param min_train: vectors needed before the codecs are trained
+        :param max_train_points: training sample size
+        """
+        super().__init__(dim)
+        if refine != "none" and refine not in REFINE_CODECS:
+            raise ValueError(f"Unknown refine codec: {refine!r} (expected none or one of {sorted(REFINE_CODECS)})")
+        self.rerank = rerank if refine != "none" else 0
+        self.refine = refine if self.rerank else "none"
+        self.min_train = min_train
+        self.max_train_points = max_train_points
+        self.seed = seed
+        self._flat = BruteForceIndex(dim)  # holds vectors while untrained
+        # (codec, refine codec, block of codes, argsort of its labels, sorted labels), None until trained
+        self._state: Optional[Tuple] = None
+        self._train_lock = threading.RLock()
+
+    def _codec(self):
+        raise NotImplementedError
+
+    def params(self) -> Dict:
+        """Constructor arguments, as saved with the index"""
+        return {"rerank": self.rerank, "refine": self.refine, "min_train": self.min_train,
+                "max_train_points": self.max_train_points, "seed": self.seed}
+
+    @property
+    def is_trained(self) -> bool:
+        return self._state is not None
+
+    @property
+    def code_size(self) -> int:
+        """Bytes stored per vector (labels excluded)"""
+        codec = self._codec()
+        refine = REFINE_CODECS[self.refine](self.dim).code_size if self.refine != "none" else 0
+        return codec.code_size + refine
+
+    def __len__(self) -> int:
+        state = self._state
+        return state[2].size if state is not None else len(self._flat)
+
+    def _encode(self, codec, refiner, vectors: np.ndarray) -> np.ndarray:
+        codes = codec.encode(vectors)
+        if refiner is None:
+            return codes
+        return np.concatenate([codes, refiner.encode(vectors)], axis=1)
+
+    def _publish(self, codec, refiner, block: _Block) -> None:
+        order = np.argsort(block.labels[:block.size], kind="stable")
+        self._state = (codec, refiner, block, order, block.labels[:block.size][order])
+
+    def _decode(self, codec, refiner, codes: np.ndarray) -> np.ndarray:
+        if refiner is not None:
+            return refiner.decode(codes[:, codec.code_size:])
+        return codec.decode(codes[:, :codec.code_size])
+
+    def train(self, vectors: Optional[np.ndarray] = None) -> None:
+        """
+        Fit the codecs and encode every stored vector.
+        :param vectors: training sample; defaults to the vectors already in the index
+        """
+        with self._train_lock:
+            if vectors is None:
+                vectors = self._flat.stored()[1]
+            vectors = normalize_rows(np.asarray(vectors, dtype=np.float32).reshape(-1, self.dim))
+            if vectors.shape[0] > self.max_train_points:
+                rng = np.random.default_rng(self.seed)
+                vectors = vectors[rng.choice(vectors.shape[0], self.max_train_points, replace=False)]
+            codec = self._codec()
+            codec.train(vectors)
+            refiner = REFINE_CODECS[self.refine](self.dim) if self.refine != "none" else None
+            if refiner is not None:
+                refiner.train(vectors)
+
+            with self._lock:
+                labels, stored = self._flat.stored()
+                block = _Block.empty(codec.code_size + (refiner.code_size if refiner else 0), 0, np.uint8)
+                if labels.shape[0]:
+                    block = block.appended(labels, self._encode(codec, refiner, stored))
+                # Publish codes before dropping the flat buffer: readers pick a path on `_state`
+                self._publish(codec, refiner, block)
+                self._flat = BruteForceIndex(self.dim)
+
+    def add(self, labels, vectors) -> None:
+        labels, vectors = self._check(labels, vectors)
+        if labels.shape[0] == 0:
+            return
+        with self._lock:
+            state = self._state
+            if state is not None:
+                codec, refiner, block = state[:3]
+                self._publish(codec, refiner, block.appended(labels, self._encode(codec, refiner, vectors)))
+                return
+            self._flat.add(labels, vectors)
+            needs_training = len(self._flat) >= self.min_train
+        if needs_training:
+            with self._train_lock:
+                if not self.is_trained:
+                    self.train()
+
+    def remove(self, labels) -> int:
+        labels = np.asarray(labels, dtype=np.int64).ravel()
+        with self._lock:
+            state = self._state
+            if state is None:
+                return self._flat.remove(labels)
+            block, removed = state[2].without(labels)
+            if removed:
+                self._publish(state[0], state[1], block)
+        return removed
+
+    def search(self, queries, k=1, allowed=None):
+        queries = _as_queries(queries)
+        # Flat buffer first: it is only emptied after the trained state is published
+        flat, state = self._flat, self._state
+        if state is None:
+            return flat.search(queries, k=k, allowed=allowed)
+        codec, refiner, block, order, sorted_labels = state
+        if allowed is not None:
+            rows = BruteForceIndex._rows_for(block, order, sorted_labels, np.asarray(allowed, dtype=np.int64).ravel())
+            codes, labels = block.vectors[rows], block.labels[rows]
+        else:
+            codes, labels = block.vectors[:block.size], block.labels[:block.size]
+
+        scores = codec.adc(queries, codes[:, :codec.code_size])
+        out_scores = np.empty((queries.shape[0], k), dtype=np.float32)
+        out_labels = np.empty((queries.shape[0], k), dtype=np.int64)
+        positions = np.arange(labels.shape[0])
+        for i, query in enumerate(queries):
+            if refiner is None:
+                out_scores[i], out_labels[i] = _top_k(scores[i], labels, k)
+                continue
+            # Shortlist on the compressed scores, final order on the refine copy
+            _, shortlist = _top_k(scores[i], positions, max(k, self.rerank))
+            shortlist = shortlist[shortlist >= 0]
+            exact = refiner.decode(codes[shortlist, codec.code_size:]) @ query
+            out_scores[i], out_labels[i] = _top_k(exact, labels[shortlist], k)
+        return out_scores, out_labels
+
+    def stored(self) -> Tuple[np.ndarray, np.ndarray]:
+        """All (labels, vectors); once trained the vectors are decoded from the codes"""
+        state = self._state
+        if state is None:
+            return self._flat.stored()
+        codec, refiner, block = state[:3]
+        return block.labels[:block.size], self._decode(codec, refiner, block.vectors[:block.size])
+
+    def reconstruct(self, labels) -> Tuple[np.ndarray, np.ndarray]:
+        state = self._state
+        if state is None:
+            return self._flat.reconstruct(labels)
+        codec, refiner, block, order, sorted_labels = state
+        rows = BruteForceIndex._rows_for(block, order, sorted_labels, np.asarray(labels, dtype=np.int64).ravel())
+        return block.labels[rows], self._decode(codec, refiner, block.vectors[rows])
+
+    def save(self, path: str) -> None:
+        params = dict(kind=self.kind, dim=self.dim, **self.params())
+        state = self._state
+        if state is None:
+            block = self._flat._block
+            np.savez(path, trained=False, vectors=block.vectors[:block.size],
+                     labels=block.labels[:block.size], **params)
+            return
+        codec, refiner, block = state[:3]
+        tables = {f"codec_{k}": v for k, v in codec.state().items()}
+        if refiner is not None:
+            tables.update({f"refine_{k}": v for k, v in refiner.state().items()})
+        np.savez(path, trained=True, codes=block.vectors[:block.size], labels=block.labels[:block.size],
+                 **tables, **params)
+
+    @classmethod
+    def load(cls, path: str) -> "QuantizedIndex":
+        with np.load(path) as data:
+            params = {key: data[key].item() for key in data.files if key in cls._param_names()}
+            index = cls(int(data["dim"]), **params)
+            if not bool(data["trained"]):
+                index._flat.add(data["labels"], data["vectors"])
+                return index
+            codec = index._codec()
+            codec.load_state({key[6:]: data[key] for key in data.files if key.startswith("codec_")})
+            refiner = None
+            if index.refine != "none":
+                refiner = REFINE_CODECS[index.refine](index.dim)
+                refiner.load_state({key[7:]: data[key] for key in data.files if key.startswith("refine_")})
+            codes = data["codes"]
+            index._publish(codec, refiner, _Block(codes.copy(), data["labels"].copy(), codes.shape[0]))
+        return index
+
+    @classmethod
+    def _param_names(cls) -> Tuple[str, ...]:
+        return ("rerank", "refine", "min_train", "max_train_points", "seed")
+
+
+class PQIndex(QuantizedIndex):
+    """Product-quantized index: `m` bytes per face (64 by default, 32x smaller than float32)"""
+
+    kind = "pq"
+
+    def __init__(self, dim: int = 512, m: int = 64, **params):
+        """:param m: sub-quantizers, i.e. bytes per face; must divide dim"""
+        self.m = m
+        super().__init__(dim, **params)
+        self._codec()  # fail early on a bad m
+
+    def _codec(self) -> ProductQuantizer:
+        return ProductQuantizer(self.dim, self.m, seed=self.seed)
+
+    def params(self) -> Dict:
+        return {**super().params(), "m": self.m}
+
+    @classmethod
+    def _param_names(cls) -> Tuple[str, ...]:
+        return super()._param_names() + ("m",)
+
+
+class SQ8Index(QuantizedIndex):
+    """
+    8-bit scalar-quantized index: one byte per dimension (4x smaller than float32).
+    Its scores are already within ~1e-3 of exact, so it keeps no refine copy by default.
+    """
+
+    kind = "sq8"
+
+    def __init__(self, dim: int = 512, refine: str = "none", **params):
+        super().__init__(dim, refine=refine, **params)
+
+    def _codec(self) -> ScalarQuantizer:
+        return ScalarQuantizer(self.dim)
+
+
+INDEX_TYPES = {
+    BruteForceIndex.kind: BruteForceIndex,
+    IVFIndex.kind: IVFIndex,
+    PQIndex.kind: PQIndex,
+    SQ8Index.kind: SQ8Index,
+}
+
+
+def create_index(kind: str = "brute", dim: int = 512, **params) -> SearchIndex:
+    """Build an empty index of the given kind ("brute", "ivf", "pq" or "sq8")."""
+    if kind not in INDEX_TYPES:
+        raise ValueError(f"Unknown index backend: {kind!r} (expected one of {sorted(INDEX_TYPES)})")
+    return INDEX_TYPES[kind](dim, **params)
+
+
+def load_index(path: str) -> SearchIndex:
+    """Load an index written by `SearchIndex.save`, whatever its kind."""
+    with np.load(path) as data:
+        kind = str(data["kind"])
+    return INDEX_TYPES[kind].load(path)
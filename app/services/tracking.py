@@ -0,0 +1,187 @@
+import itertools
+import time
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+# Aligned ArcFace input side; faces smaller than this lose detail when warped up
+_EMBED_SIZE = 112
+
+
+def box_iou(boxes_a: np.ndarray, boxes_b: np.ndarray) -> np.ndarray:
+    """Pairwise IoU of (n, 4) and (m, 4) [x1, y1, x2, y2] boxes -> (n, m)"""
+    a = np.asarray(boxes_a, dtype=np.float32).reshape(-1, 4)[:, None, :]
+    b = np.asarray(boxes_b, dtype=np.float32).reshape(-1, 4)[None, :, :]
+    w = np.clip(np.minimum(a[..., 2], b[..., 2]) - np.maximum(a[..., 0], b[..., 0]), 0, None)
+    h = np.clip(np.minimum(a[..., 3], b[..., 3]) - np.maximum(a[..., 1], b[..., 1]), 0, None)
+    inter = w * h
+    area_a = (a[..., 2] - a[..., 0]) * (a[..., 3] - a[..., 1])
+    area_b = (b[..., 2] - b[..., 0]) * (b[..., 3] - b[..., 1])
+    union = area_a + area_b - inter
+    return np.where(union > 0, inter / np.maximum(union, 1e-9), 0.0)
+
+
+def face_quality(detection: Dict) -> float:
+    """Detection confidence scaled down for faces smaller than the 112px ArcFace input"""
+    x1, y1, x2, y2 = detection["box"]
+    side = min(x2 - x1, y2 - y1)
+    return float(detection["conf"]) * min(1.0, max(side, 0) / _EMBED_SIZE)
+
+
+class Track:
+    """One face followed across frames, with the identity cached from its last embedding."""
+
+    __slots__ = ("track_id", "detection", "quality", "misses", "user_id", "similarity",
+                 "embedded_at", "embedded_quality")
+
+    def __init__(self, track_id: int, detection: Dict):
+        self.track_id = track_id
+        self.detection = detection
+        self.quality = face_quality(detection)
+        self.misses = 0
+        self.user_id: Optional[str] = None
+        self.similarity = 0.0
+        self.embedded_at: Optional[float] = None
+        self.embedded_quality = 0.0
+
+    def update(self, detection: Dict) -> None:
+        self.detection = detection
+        self.quality = face_quality(detection)
+        self.misses = 0
+
+
+class FaceTracker:
+    """
+    Greedy IoU association of detections to existing tracks. Unmatched detections
+    open new tracks; tracks unseen for more than `max_missed` frames are dropped.
+    """
+
+    def __init__(self, iou_threshold: float = 0.3, max_missed: int = 5):
+        self.iou_threshold = iou_threshold
+        self.max_missed = max_missed
+        self.tracks: List[Track] = []
+        self._ids = itertools.count(1)
+
+    def update(self, detections: List[Dict]) -> List[Track]:
+        """:return: the track of every detection, in detection order"""
+        assigned: List[Optional[Track]] = [None] * len(detections)
+        matched = set()
+        if self.tracks and detections:
+            iou = box_iou([t.detection["box"] for t in self.tracks], [d["box"] for d in detections])
+            # Best pairs first
+            for flat in np.argsort(-iou, axis=None):
+                ti, di = np.unravel_index(flat, iou.shape)
+                if iou[ti, di] < self.iou_threshold:
+                    break
+                if ti in matched or assigned[di] is not None:
+                    continue
+                matched.add(ti)
+                self.tracks[ti].update(detections[di])
+                assigned[di] = self.tracks[ti]
+
+        survivors = []
+        for i, track in enumerate(self.tracks):
+            if i not in matched:
+                track.misses += 1
+                if track.misses > self.max_missed:
+                    continue
+            survivors.append(track)
+        for di, detection in enumerate(detections):
+            if assigned[di] is None:
+                assigned[di] = Track(next(self._ids), detection)
+                survivors.append(assigned[di])
+        self.tracks = survivors
+        return assigned
+
+
+class StreamRecognizer:
+    """
+    Recognition over a sequence of frames from one camera.
+
+    Every frame runs the detector only; faces are tracked across frames and the
+    identity is cached per track. Embedding + gallery search re-run only for a new
+    track, when the face quality improved by more than `quality_gain` over the
+    embedded one, or when `reverify_s` has passed since the last embedding.
+    With `tracking=False` every face is embedded on every frame (the /recognize cost).
+
+    :param detector: FaceDetection, BatchingFaceDetector or InferencePool
+        (needs detect_boxes() and embed_faces())
+    :param search: embedding -> (user_id, similarity) or None, e.g. a bound gallery.search
+    """
+
+    def __init__(self, detector, search: Callable[[np.ndarray], Optional[Tuple[str, float]]],
+                 threshold: float = 0.7, iou_threshold: float = 0.3, max_missed: int = 5,
+                 reverify_s: float = 2.0, quality_gain: float = 0.2, tracking: bool = True,
+                 clock: Callable[[], float] = time.monotonic):
+        self.detector = detector
+        self.search = search
+        self.threshold = threshold
+        self.reverify_s = reverify_s
+        self.quality_gain = quality_gain
+        self.tracking = tracking
+        self.clock = clock
+        self.tracker = FaceTracker(iou_threshold, max_missed)
+        self.frames = 0
+        self.faces = 0
+        self.embedded = 0
+
+    def _needs_embedding(self, track: Track, now: float) -> bool:
+        if not self.tracking or track.embedded_at is None:
+            return True
+        if now - track.embedded_at >= self.reverify_s:
+            return True
+        return track.quality > track.embedded_quality * (1.0 + self.quality_gain)
+
+    def process(self, frame: np.ndarray, timestamp: Optional[float] = None) -> Dict:
+        """
+        :param timestamp: frame time in seconds (defaults to the clock), drives re-verification
+        :return: {"frame": n, "faces": [{"track_id", "box", "conf", "landmarks", "user_id",
+                 "similarity", "recognized", "cached"}]}
+        """
+        now = self.clock() if timestamp is None else timestamp
+        detections = self.detector.detect_boxes(frame)
+        if self.tracking:
+            tracks = self.tracker.update(detections)
+        else:
+            tracks = [Track(0, d) for d in detections]
+
+        stale = [t for t in tracks if self._needs_embedding(t, now)]
+        if stale:
+            embeddings = self.detector.embed_faces(frame, [t.detection["landmarks"] for t in stale])
+            for track, embedding in zip(stale, embeddings):
+                match = self.search(embedding)
+                track.user_id, track.similarity = match if match else (None, 0.0)
+                track.embedded_at = now
+                track.embedded_quality = track.quality
+
+        fresh = {id(t) for t in stale}
+        faces = []
+        for track in tracks:
+            recognized = track.user_id is not None and track.similarity >= self.threshold
+            faces.append({
+                **track.detection,
+                "track_id": track.track_id,
+                "user_id": track.user_id if recognized else None,
+                "similarity": round(track.similarity, 4),
+                "recognized": recognized,
+                "cached": id(track) not in fresh,
+            })
+        result = {"frame": self.frames, "faces": faces}
+        self.frames += 1
+        self.faces += len(tracks)
+        self.embedded += len(stale)
+        return result
+
+    def run(self, frames: Iterable[np.ndarray]) -> Iterator[Dict]:
+        """Generator API: yields process() results frame by frame."""
+        for frame in frames:
+            yield self.process(frame)
+
+    def stats(self) -> Dict:
+        return {
+            "frames": self.frames,
+            "detections": self.faces,
+            "embedded": self.embedded,
+            "embed_ratio": round(self.embedded / self.faces, 4) if self.faces else 0.0,
+            "active_tracks": len(self.tracker.tracks),
+        }
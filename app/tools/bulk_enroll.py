@@ -0,0 +1,95 @@
+"""
+Bulk enrollment of a class roster from a directory or zip of images plus a CSV.
+
+The CSV needs a header with `student_id` and optionally name, class, department, room
+and `images` (file names separated by ";"). Without an `images` column a student's
+images are `<student_id>.jpg`, `<student_id>_<n>.jpg` or anything under `<student_id>/`.
+
+Students already in the database are skipped, so after a crash just run the same
+command again. Accepted faces are stored as aligned chips in FACE_STORE_DIR (originals
+only with --keep-uploads). Rejected rows/images are written to --report. With --duplicates warn or
+reject (default DUPLICATE_CHECK), faces are also compared with the enrolled gallery and
+with the rest of the import; see app.tools.dedup_report for a full-collection check.
+
+    python -m app.tools.bulk_enroll --source roster_photos.zip --roster roster.csv --workers 4
+
+Running API processes pick the new students up within GALLERY_SYNC_INTERVAL_S
+(their in-memory galleries poll the collection).
+"""
+import argparse
+
+from app import config
+from app.services.enrollment import BulkEnrollment, ImageSource, read_roster, write_error_report
+from app.services.image_io import ImageWriter
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--source", required=True, help="directory or .zip with the images")
+    parser.add_argument("--roster", required=True, help="CSV of profile fields")
+    parser.add_argument("--workers", type=int, default=config.ENROLL_WORKERS, help="decode/detect/embed threads")
+    parser.add_argument("--inference-workers", type=int, default=config.INFERENCE_WORKERS,
+                        help="run the model in this many processes (0 = in this process)")
+    parser.add_argument("--batch-size", type=int, default=config.ENROLL_BATCH_SIZE, help="documents per bulk write")
+    parser.add_argument("--report", default="enrollment_errors.csv", help="per-row error report (CSV)")
+    parser.add_argument("--no-resume", action="store_true", help="do not skip students already enrolled")
+    parser.add_argument("--upload-folder", default="uploads")
+    parser.add_argument("--keep-uploads", action="store_true", default=config.KEEP_UPLOADS,
+                        help="also copy the original images to --upload-folder")
+    parser.add_argument("--duplicates", choices=["off", "warn", "reject"], default=config.DUPLICATE_CHECK,
+                        help="faces already enrolled under another student_id")
+    parser.add_argument("--duplicate-threshold", type=float, default=config.DUPLICATE_THRESHOLD)
+    args = parser.parse_args()
+
+    from app.db.mongo import get_db
+    from app.runtime import build_face_store
+    from app.services.face_detection import FaceDetection
+    from app.services.inference_pool import InferencePool
+
+    if args.inference_workers > 0:
+        detector = InferencePool(workers=args.inference_workers, threads_per_worker=config.INFERENCE_THREADS_PER_WORKER,
+                                 detector_kwargs=config.detector_kwargs(),
+                                 slot_bytes=int(config.INFERENCE_SLOT_MB * 1024 * 1024), acquire_timeout=60.0)
+    else:
+        detector = FaceDetection(**config.detector_kwargs())
+
+    def progress(stats):
+        print(f"  enrolled {stats['enrolled']}, failed {stats['failed']}, skipped {stats['skipped']} "
+              f"- {stats['images']} images, {stats['images_per_s']:.1f} img/s", flush=True)
+
+    db = get_db()
+    # The existing gallery is only needed to check new faces against it
+    gallery = None
+    if args.duplicates != "off":
+        from app.runtime import load_gallery
+        gallery = load_gallery(db)
+
+    source = ImageSource(args.source)
+    writer = ImageWriter(asynchronous=True, max_workers=args.workers)
+    try:
+        enrollment = BulkEnrollment(db["users"], detector, source, read_roster(args.roster),
+                                    gallery=gallery, face_store=build_face_store(writer),
+                                    image_writer=writer if args.keep_uploads else None,
+                                    upload_folder=args.upload_folder,
+                                    workers=args.workers, batch_size=args.batch_size,
+                                    embedding_dtype=config.EMBEDDING_DTYPE,
+                                    embedding_version=config.EMBEDDING_VERSION, resume=not args.no_resume,
+                                    duplicate_check=args.duplicates, duplicate_threshold=args.duplicate_threshold,
+                                    progress=progress)
+        report = enrollment.run()
+    finally:
+        source.close()
+        if isinstance(detector, InferencePool):
+            detector.close()
+
+    errors = report.pop("errors")
+    write_error_report(errors, args.report)
+    print(f"rows {report['rows']}: enrolled {report['enrolled']}, skipped {report['skipped']}, "
+          f"failed {report['failed']}")
+    print(f"{report['images']} images, {report['faces']} faces in {report['elapsed_s']:.1f}s "
+          f"-> {report['images_per_s']:.1f} images/s")
+    print(f"{len(errors)} errors written to {args.report}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""
+Offline duplicate-identity report: every pair of users whose faces are at least
+--threshold similar, i.e. probably one person enrolled twice.
+
+Loads the gallery the way the API does (snapshot or MongoDB), compares all faces
+with each other in --block x --block tiles of the similarity matrix and writes one
+CSV row per user pair, most similar first. Pairs with the same student_id are
+re-registrations of one student; the others need a human to merge or delete one
+of the users.
+
+    python -m app.tools.dedup_report --threshold 0.7 --output duplicates.csv
+"""
+import argparse
+import csv
+import time
+
+from app import config
+from app.services.dedup import duplicate_users
+
+FIELDS = ["user_a", "student_id_a", "name_a", "user_b", "student_id_b", "name_b",
+          "same_student_id", "similarity", "face_pairs"]
+
+
+def profiles_of(users_col, user_ids):
+    profiles = {}
+    user_ids = list(user_ids)
+    for start in range(0, len(user_ids), 1000):
+        chunk = user_ids[start:start + 1000]
+        for doc in users_col.find({"user_id": {"$in": chunk}},
+                                  {"_id": 0, "user_id": 1, "profile.student_id": 1, "profile.name": 1}):
+            profiles[doc["user_id"]] = doc.get("profile") or {}
+    return profiles
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--threshold", type=float, default=config.DUPLICATE_THRESHOLD)
+    parser.add_argument("--block", type=int, default=config.DUPLICATE_REPORT_BLOCK,
+                        help="rows per similarity tile (memory: block^2 * 4 bytes)")
+    parser.add_argument("--output", default="duplicates.csv", help="CSV report")
+    args = parser.parse_args()
+
+    from app.db.mongo import get_db
+    from app.runtime import load_gallery
+
+    db = get_db()
+    start = time.perf_counter()
+    gallery = load_gallery(db)
+    owners, vectors = gallery.faces()
+    loaded_s = time.perf_counter() - start
+
+    start = time.perf_counter()
+    pairs = duplicate_users(owners, vectors, args.threshold, args.block)
+    compared_s = time.perf_counter() - start
+
+    profiles = profiles_of(db["users"], {p["user_a"] for p in pairs} | {p["user_b"] for p in pairs})
+    with open(args.output, "w", newline="", encoding="utf-8") as f:
+        writer = csv.DictWriter(f, fieldnames=FIELDS)
+        writer.writeheader()
+        for pair in pairs:
+            a, b = profiles.get(pair["user_a"], {}), profiles.get(pair["user_b"], {})
+            writer.writerow({**pair, "student_id_a": a.get("student_id"), "name_a": a.get("name"),
+                             "student_id_b": b.get("student_id"), "name_b": b.get("name"),
+                             "same_student_id": a.get("student_id") is not None
+                             and a.get("student_id") == b.get("student_id")})
+
+    print(f"{gallery.user_count} users, {len(owners)} faces loaded in {loaded_s:.1f}s, "
+          f"compared in {compared_s:.1f}s")
+    print(f"{len(pairs)} user pairs at similarity >= {args.threshold}, written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+"""
+Maintain the face chip store (FACE_STORE_DIR).
+
+--backfill gives faces enrolled before chips were stored their aligned chip: the
+original at `image_path` is read back, its best face detected and aligned with the
+current model, and the chip key saved as `faces.<i>.chip`. With --delete-uploads
+the original is deleted afterwards and `image_path` cleared, which is where the
+disk goes from megabytes to tens of kilobytes per face. Faces that already have a
+chip are skipped, so an interrupted run is simply started again.
+
+--pack writes every chip into FACE_STORE_DIR/chips.pack, memory-mapped by bulk jobs
+(app.tools.reembed) instead of opening and decoding one PNG per face. Re-run it
+after large enrollments; chips added since are read from their files meanwhile.
+
+    python -m app.tools.face_chips --backfill --delete-uploads --pack
+"""
+import argparse
+import os
+import time
+
+from pymongo import UpdateOne
+
+from app import config
+
+
+def backfill(users_col, detector, face_store, page_size: int, batch_size: int, delete_uploads: bool) -> dict:
+    from app.services.image_io import decode_image
+
+    stats = {"faces": 0, "failed": 0, "deleted_uploads": 0}
+    query = {"faces": {"$elemMatch": {"chip": None, "image_path": {"$nin": [None, ""]}}}}
+    last_id = None
+    while True:
+        page_query = {"$and": [query, {"_id": {"$gt": last_id}}]} if last_id is not None else query
+        page = list(users_col.find(page_query, {"user_id": 1, "uuid": 1, "faces.chip": 1, "faces.image_path": 1})
+                    .sort("_id", 1).limit(page_size))
+        if not page:
+            break
+        last_id = page[-1]["_id"]
+        owners = {doc["_id"]: doc.get("user_id") or doc.get("uuid") or str(doc["_id"]) for doc in page}
+        pending = [(doc["_id"], i, face["image_path"]) for doc in page
+                   for i, face in enumerate(doc.get("faces") or [])
+                   if not face.get("chip") and face.get("image_path")]
+        updates, done_paths = {}, []
+        for start in range(0, len(pending), batch_size):
+            chunk, images = [], []
+            for _id, i, path in pending[start:start + batch_size]:
+                try:
+                    with open(path, "rb") as f:
+                        image = decode_image(f.read())
+                except OSError:
+                    image = None
+                if image is None:
+                    stats["failed"] += 1
+                    continue
+                chunk.append((_id, i, path))
+                images.append(image)
+            # Enrolled already: the quality gate must not decide which faces get a chip
+            for (_id, i, path), image, face in zip(chunk, images,
+                                                   detector.get_best_faces(images, check_quality=False)):
+                if face is None:
+                    stats["failed"] += 1
+                    continue
+                fields = updates.setdefault(_id, {})
+                fields[f"faces.{i}.chip"] = face_store.put(face["chip"], owners[_id], image, face["box"])
+                if delete_uploads:
+                    fields[f"faces.{i}.image_path"] = None
+                    done_paths.append(path)
+                stats["faces"] += 1
+        if updates:
+            users_col.bulk_write([UpdateOne({"_id": _id}, {"$set": fields}) for _id, fields in updates.items()],
+                                 ordered=False)
+        # Originals go only once the documents point at their chips
+        for path in done_paths:
+            try:
+                os.remove(path)
+                stats["deleted_uploads"] += 1
+            except OSError:
+                pass
+        print(f"  {stats['faces']} faces backfilled, {stats['failed']} failed", flush=True)
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backfill", action="store_true", help="store chips of faces that only have an image_path")
+    parser.add_argument("--delete-uploads", action="store_true", help="with --backfill: delete the originals")
+    parser.add_argument("--pack", action="store_true", help="(re)build chips.pack")
+    parser.add_argument("--page-size", type=int, default=config.REEMBED_PAGE_SIZE, help="users per page")
+    parser.add_argument("--batch-size", type=int, default=config.REEMBED_BATCH_SIZE, help="images per model call")
+    args = parser.parse_args()
+    if not args.backfill and not args.pack:
+        parser.error("nothing to do: pass --backfill and/or --pack")
+
+    from app.runtime import build_face_store
+
+    face_store = build_face_store()
+    if args.backfill:
+        from app.db.mongo import get_db
+        from app.services.face_detection import FaceDetection
+
+        detector = FaceDetection(**{**config.detector_kwargs(), "mode": "recognition", "quality": None})
+        start = time.perf_counter()
+        stats = backfill(get_db()["users"], detector, face_store, args.page_size, args.batch_size,
+                         args.delete_uploads)
+        print(f"{stats['faces']} chips stored, {stats['failed']} faces failed, "
+              f"{stats['deleted_uploads']} originals deleted in {time.perf_counter() - start:.1f}s")
+    if args.pack:
+        start = time.perf_counter()
+        stats = face_store.build_pack()
+        size_mb = os.path.getsize(face_store.pack_path) / 1e6
+        print(f"{stats['chips']} chips packed into {face_store.pack_path} ({size_mb:.1f} MB), "
+              f"{stats['skipped']} skipped in {time.perf_counter() - start:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
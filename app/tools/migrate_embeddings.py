@@ -0,0 +1,70 @@
+"""
+Convert stored face embeddings from BSON arrays of doubles to compact BSON Binary.
+
+Streams the users collection with a cursor (only `faces.embedding` is fetched) and
+rewrites each legacy embedding in place with `$set` on `faces.<i>.embedding`, sent in
+unordered bulk batches. Already converted faces are left alone, so the job can be
+stopped and re-run at any time; the API reads both formats while it runs.
+
+    python -m app.tools.migrate_embeddings --dtype float32 --batch-size 500
+"""
+import argparse
+import time
+from typing import Dict
+
+from pymongo import UpdateOne
+
+from app.models.embedding import encode_embedding, is_legacy_embedding
+
+
+def migrate_embeddings(users_col, dtype: str = "float32", batch_size: int = 500) -> Dict[str, int]:
+    """
+    :param users_col: pymongo collection holding user documents
+    :param dtype: target storage, "float32" or "float16"
+    :param batch_size: updates per bulk_write
+    :return: counts of scanned/updated documents and converted faces
+    """
+    if dtype not in ("float32", "float16"):
+        raise ValueError("dtype must be float32 or float16")
+    stats = {"scanned": 0, "updated": 0, "faces": 0}
+    ops = []
+
+    def flush():
+        if ops:
+            stats["updated"] += users_col.bulk_write(ops, ordered=False).modified_count
+            ops.clear()
+
+    cursor = users_col.find({}, {"faces.embedding": 1}, batch_size=batch_size)
+    for doc in cursor:
+        stats["scanned"] += 1
+        updates = {}
+        for i, face in enumerate(doc.get("faces") or []):
+            embedding = face.get("embedding")
+            if is_legacy_embedding(embedding):
+                updates[f"faces.{i}.embedding"] = encode_embedding(embedding, dtype)
+        if not updates:
+            continue
+        stats["faces"] += len(updates)
+        ops.append(UpdateOne({"_id": doc["_id"]}, {"$set": updates}))
+        if len(ops) >= batch_size:
+            flush()
+    flush()
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dtype", choices=["float32", "float16"], default="float32")
+    parser.add_argument("--batch-size", type=int, default=500)
+    args = parser.parse_args()
+
+    from app.db.mongo import get_db
+
+    start = time.perf_counter()
+    stats = migrate_embeddings(get_db()["users"], args.dtype, args.batch_size)
+    print(f"scanned {stats['scanned']} users, converted {stats['faces']} faces in {stats['updated']} documents "
+          f"({time.perf_counter() - start:.1f}s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+"""
+Fill in missing registered_at / updated_at on old user records.
+
+registered_at falls back to the first face's added_at (or now), updated_at to
+registered_at. Only records missing a timestamp are read, with a cursor, and the
+fixes are sent in unordered bulk batches.
+
+    python -m app.tools.migrate_timestamps
+"""
+import argparse
+import datetime
+
+from pymongo import UpdateOne
+
+MISSING = [None, ""]
+
+
+def migrate_timestamps(users_col, batch_size: int = 500) -> int:
+    """:return: number of records updated"""
+    updated, ops = 0, []
+    query = {"$or": [{"registered_at": {"$in": MISSING}}, {"updated_at": {"$in": MISSING}}]}
+    cursor = users_col.find(query, {"registered_at": 1, "updated_at": 1, "faces.added_at": 1}, batch_size=batch_size)
+    for user in cursor:
+        update_fields = {}
+        # Check if registered_at or updated_at is missing
+        if not user.get("registered_at"):
+            # Try to get from first face's added_at, or use current time as fallback
+            faces = user.get("faces", [])
+            if faces and faces[0].get("added_at"):
+                update_fields["registered_at"] = faces[0]["added_at"]
+            else:
+                update_fields["registered_at"] = datetime.datetime.now().isoformat()
+        if not user.get("updated_at"):
+            # Use registered_at if available, otherwise current time
+            update_fields["updated_at"] = (user.get("registered_at") or update_fields.get("registered_at")
+                                           or datetime.datetime.now().isoformat())
+        if update_fields:
+            ops.append(UpdateOne({"_id": user["_id"]}, {"$set": update_fields}))
+        if len(ops) >= batch_size:
+            users_col.bulk_write(ops, ordered=False)
+            updated += len(ops)
+            ops = []
+    if ops:
+        users_col.bulk_write(ops, ordered=False)
+        updated += len(ops)
+    return updated
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--batch-size", type=int, default=500)
+    args = parser.parse_args()
+
+    from app.db.mongo import get_db
+
+    print(f"Updated {migrate_timestamps(get_db()['users'], args.batch_size)} records.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""
+Offline INT8 dynamic quantization of an InsightFace model pack.
+
+Writes a sibling pack `<model>_int8` next to the original one, with the detection and
+recognition ONNX models quantized (weights to INT8, activations quantized at runtime)
+and every other model copied as-is. Load it with `FaceDetection(quantized=True)` or
+`MODEL_QUANTIZED=true`.
+
+    python -m app.tools.quantize_models --model buffalo_l
+"""
+import argparse
+import glob
+import os
+import shutil
+import tempfile
+
+import onnx
+from onnxruntime.quantization import QuantType, quantize_dynamic
+
+from app.services.face_detection import MODEL_ROOT, QUANTIZED_SUFFIX
+
+QUANTIZED_TASKS = ("detection", "recognition")
+
+
+def model_task(onnx_file: str) -> str:
+    """Classify a pack model the same way insightface's model router does."""
+    model = onnx.load_model(onnx_file, load_external_data=False)
+    if len(model.graph.output) >= 5:
+        return "detection"
+    dims = [d.dim_value for d in model.graph.input[0].type.tensor_type.shape.dim]
+    if len(dims) == 4 and dims[2] == dims[3] and dims[2] >= 112 and dims[2] % 16 == 0:
+        return "recognition"
+    return "other"
+
+
+def quantize_pack(model_name: str, root: str = MODEL_ROOT, weight_type: str = "qint8",
+                  per_channel: bool = True, preprocess: bool = True) -> str:
+    """
+    :param weight_type: "qint8" or "quint8"
+    :param per_channel: per-channel weight scales (better accuracy for conv nets)
+    :param preprocess: run ORT's shape inference / graph cleanup before quantizing
+    :return: path of the quantized pack
+    """
+    src = os.path.join(root, model_name)
+    dst = os.path.join(root, f"{model_name}{QUANTIZED_SUFFIX}")
+    onnx_files = sorted(glob.glob(os.path.join(src, "*.onnx")))
+    if not onnx_files:
+        raise SystemExit(f"No ONNX models in {src}; run the API once so insightface downloads {model_name}")
+    os.makedirs(dst, exist_ok=True)
+
+    qtype = QuantType.QUInt8 if weight_type == "quint8" else QuantType.QInt8
+    for onnx_file in onnx_files:
+        name = os.path.basename(onnx_file)
+        out = os.path.join(dst, name)
+        task = model_task(onnx_file)
+        if task not in QUANTIZED_TASKS:
+            shutil.copyfile(onnx_file, out)
+            print(f"copied     {name} ({task})")
+            continue
+
+        source = onnx_file
+        with tempfile.TemporaryDirectory() as tmp:
+            if preprocess:
+                from onnxruntime.quantization.shape_inference import quant_pre_process
+                source = os.path.join(tmp, name)
+                quant_pre_process(onnx_file, source, skip_symbolic_shape=True)
+            quantize_dynamic(source, out, weight_type=qtype, per_channel=per_channel)
+        before, after = os.path.getsize(onnx_file), os.path.getsize(out)
+        print(f"quantized  {name} ({task}): {before / 1e6:.1f} MB -> {after / 1e6:.1f} MB")
+    return dst
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", default="buffalo_l", help="model pack name under --root")
+    parser.add_argument("--root", default=MODEL_ROOT)
+    parser.add_argument("--weight-type", choices=["qint8", "quint8"], default="qint8")
+    parser.add_argument("--per-tensor", action="store_true", help="one weight scale per tensor instead of per channel")
+    parser.add_argument("--no-preprocess", action="store_true", help="skip ORT quantization pre-processing")
+    args = parser.parse_args()
+    dst = quantize_pack(args.model, args.root, args.weight_type,
+                        per_channel=not args.per_tensor, preprocess=not args.no_preprocess)
+    print(f"wrote {dst}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+"""
+Re-embed the whole gallery with another model pack before switching the API to it.
+
+Feeds every stored face chip (FACE_STORE_DIR, from chips.pack when one was built
+with app.tools.face_chips --pack) to the new model in batches, without detection;
+faces enrolled before chips existed are read back from their `image_path` and
+re-detected. The vector is stored next to the current one as
+`faces.<i>.embeddings.<version>`. The running API only serves vectors of its own
+EMBEDDING_VERSION, so it keeps recognizing from the old vectors while this runs.
+Progress is checkpointed in the `reembed_jobs` collection after every page: after
+a crash just run the same command again.
+
+    python -m app.tools.reembed --model antelopev2 --page-size 200 --batch-size 16
+
+Then run it once more (only faces added since are embedded), set
+MODEL_NAME=antelopev2 (EMBEDDING_VERSION=insightface-antelopev2-v1) and restart the API.
+"""
+import argparse
+
+from app import config
+from app.services.reembedding import Reembedding
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", required=True, help="InsightFace model pack to embed with")
+    parser.add_argument("--version", help="embedding_version tag (default insightface-<model>-v1)")
+    parser.add_argument("--quantized", action="store_true", help="use the INT8 pack from app.tools.quantize_models")
+    parser.add_argument("--page-size", type=int, default=config.REEMBED_PAGE_SIZE, help="users per page/checkpoint")
+    parser.add_argument("--batch-size", type=int, default=config.REEMBED_BATCH_SIZE, help="images per model call")
+    parser.add_argument("--workers", type=int, default=4, help="image read/decode threads")
+    parser.add_argument("--dtype", choices=["float32", "float16", "list"], default=config.EMBEDDING_DTYPE)
+    parser.add_argument("--no-resume", action="store_true", help="ignore the checkpoint of an interrupted run")
+    args = parser.parse_args()
+
+    from app.db.mongo import get_db
+    from app.runtime import build_face_store
+    from app.services.face_detection import FaceDetection
+
+    version = args.version or f"insightface-{args.model}-v1"
+    if version == config.EMBEDDING_VERSION:
+        raise SystemExit(f"{version} is the version the API serves already")
+    detector = FaceDetection(**{**config.detector_kwargs(), "model_name": args.model,
+                                "quantized": args.quantized, "mode": "recognition", "quality": None})
+
+    def progress(stats):
+        print(f"  {stats['users']} users: {stats['faces']} faces re-embedded ({stats['chips']} from chips), "
+              f"{stats['skipped']} skipped, {stats['failed']} failed - {stats['faces_per_s']:.1f} faces/s", flush=True)
+
+    face_store = build_face_store()
+    packed = face_store.load_pack()
+    if packed is not None:
+        print(f"{packed} chips memory-mapped from {face_store.pack_path}")
+
+    db = get_db()
+    job = Reembedding(db["users"], db["reembed_jobs"], detector, version, embedding_dtype=args.dtype,
+                      page_size=args.page_size, batch_size=args.batch_size, workers=args.workers,
+                      face_store=face_store, progress=progress)
+    report = job.run(resume=not args.no_resume)
+    errors = report.pop("errors")
+    print(f"{version}: {report['faces']} faces re-embedded ({report['chips']} from chips), "
+          f"{report['skipped']} already done, {report['failed']} failed in {report['elapsed_s']:.1f}s")
+    for error in errors[:20]:
+        print(f"  {error['reason']}: user {error['user_id']} face {error['face']} ({error['image_path']})")
+    if len(errors) > 20:
+        print(f"  ... {len(errors) - 20} more in reembed_jobs.{job.job_id}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""
+Throughput and latency of per-request inference vs. the micro-batching scheduler.
+
+C client threads each push R images (cycling over images/*.png) through
+`get_best_face`, once calling FaceDetection directly and once through
+BatchingFaceDetector for every (max_batch_size, max_wait_ms) setting.
+
+    python -m benchmarks.batching --clients 8 --requests 20 --batch 4 8 16 --wait-ms 2 5 10
+"""
+import argparse
+import glob
+import json
+import threading
+import time
+
+import cv2
+
+from app.services.batching import BatchingFaceDetector, LatencyStats
+from app.services.face_detection import FaceDetection
+
+
+def load_images(pattern: str):
+    images = [cv2.imread(p) for p in sorted(glob.glob(pattern))]
+    images = [img for img in images if img is not None]
+    if not images:
+        raise SystemExit(f"no images match {pattern}")
+    return images
+
+
+def run_clients(get_best_face, images, clients: int, requests: int):
+    stats = LatencyStats()
+
+    def client(offset: int):
+        for i in range(requests):
+            img = images[(offset + i) % len(images)]
+            start = time.perf_counter()
+            get_best_face(img)
+            stats.record((time.perf_counter() - start) * 1000)
+
+    threads = [threading.Thread(target=client, args=(c,)) for c in range(clients)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+    return {"images_per_s": round(clients * requests / elapsed, 2), **stats.summary()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--images", default="images/*.png")
+    parser.add_argument("--clients", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=20, help="requests per client")
+    parser.add_argument("--batch", type=int, nargs="+", default=[4, 8, 16])
+    parser.add_argument("--wait-ms", type=float, nargs="+", default=[2.0, 5.0, 10.0])
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    images = load_images(args.images)
+    detector = FaceDetection(model_name="buffalo_l", det_size=(640, 640))
+    detector.get_best_face(images[0])  # warm up ONNX Runtime
+
+    rows = [{"mode": "direct", "batch": 1, "wait_ms": 0.0,
+             **run_clients(detector.get_best_face, images, args.clients, args.requests)}]
+    for batch in args.batch:
+        for wait_ms in args.wait_ms:
+            batcher = BatchingFaceDetector(detector, max_batch_size=batch, max_wait_ms=wait_ms)
+            result = run_clients(batcher.get_best_face, images, args.clients, args.requests)
+            result["avg_batch_size"] = batcher.stats()["avg_batch_size"]
+            batcher.close()
+            rows.append({"mode": "batched", "batch": batch, "wait_ms": wait_ms, **result})
+
+    base = rows[0]["images_per_s"]
+    print(f"{args.clients} clients x {args.requests} requests over {len(images)} sample images")
+    print(f"{'mode':<8} {'batch':>5} {'wait':>6} {'img/s':>8} {'gain':>6} {'p50 ms':>8} {'p99 ms':>8} {'avg batch':>9}")
+    for row in rows:
+        print(f"{row['mode']:<8} {row['batch']:>5} {row['wait_ms']:>6.1f} {row['images_per_s']:>8.2f} "
+              f"{row['images_per_s'] / base:>5.2f}x {row['p50_ms']:>8.1f} {row['p99_ms']:>8.1f} "
+              f"{row.get('avg_batch_size', 1.0):>9.2f}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"clients": args.clients, "requests": args.requests, "results": rows}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""
+Diff two benchmarks.suite reports and flag regressions.
+
+Every numeric result present in both reports is compared. Latencies and durations
+(`*_ms`, `*_s`) regress when they grow, throughputs (`*_per_s`) when they shrink;
+a change beyond --threshold (relative, default 10%) in the bad direction is a
+regression, and the exit status is 1 if there is any, so CI can gate on it.
+Latency changes smaller than --min-delta-ms are timer noise and never count.
+Only the p50/p99/min/mean figures are compared (p90 and counts are informational).
+
+    python -m benchmarks.compare bench/base.json bench/head.json --threshold 0.15
+"""
+import argparse
+import json
+import sys
+from typing import Dict, Iterator, Optional, Tuple
+
+COMPARED = ("p50_ms", "p99_ms", "mean_ms", "min_s", "mean_s", "requests_per_s", "add_per_s")
+
+
+def flatten(results: Dict, prefix: str = "") -> Iterator[Tuple[str, float]]:
+    for key, value in results.items():
+        path = f"{prefix}.{key}" if prefix else key
+        if isinstance(value, dict):
+            yield from flatten(value, path)
+        elif isinstance(value, (int, float)) and key in COMPARED:
+            yield path, float(value)
+
+
+def change(metric: str, base: float, head: float) -> Optional[float]:
+    """Relative change, positive = worse"""
+    if base == 0:
+        return None
+    delta = (head - base) / base
+    return -delta if metric.endswith("_per_s") else delta
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("base")
+    parser.add_argument("head")
+    parser.add_argument("--threshold", type=float, default=0.10)
+    parser.add_argument("--min-delta-ms", type=float, default=0.05, help="ignore smaller latency changes")
+    parser.add_argument("--all", action="store_true", help="list unchanged metrics too")
+    args = parser.parse_args()
+
+    with open(args.base) as f:
+        base_report = json.load(f)
+    with open(args.head) as f:
+        head_report = json.load(f)
+    base = dict(flatten(base_report["results"]))
+    head = dict(flatten(head_report["results"]))
+
+    print(f"base {base_report['environment'].get('commit')}  head {head_report['environment'].get('commit')}  "
+          f"threshold {args.threshold:.0%}")
+    print(f"{'metric':<42} {'base':>11} {'head':>11} {'change':>8}")
+    regressions = 0
+    for name in sorted(base.keys() & head.keys()):
+        worse = change(name, base[name], head[name])
+        if worse is None:
+            continue
+        if name.endswith("_ms") and abs(head[name] - base[name]) < args.min_delta_ms:
+            worse = 0.0
+        status = ""
+        if worse > args.threshold:
+            status = "REGRESSION"
+            regressions += 1
+        elif worse < -args.threshold:
+            status = "improved"
+        if status or args.all:
+            raw = (head[name] - base[name]) / base[name]
+            print(f"{name:<42} {base[name]:>11.3f} {head[name]:>11.3f} {raw:>+7.1%} {status}")
+    for name in sorted(base.keys() ^ head.keys()):
+        print(f"{name:<42} only in {'base' if name in base else 'head'}")
+
+    print(f"{regressions} regression(s)")
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
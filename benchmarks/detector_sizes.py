@@ -0,0 +1,104 @@
+"""
+Throughput and detection rate of fixed detector sizes vs. small-first cascades.
+
+A strategy is a list of detector input sizes: "640" is the fixed full-size scan the API
+has always done, "320" a fixed small scan, "320,640" a cascade that only rescans at 640
+when the 320 pass finds no face above the confidence threshold or the face is smaller
+than --min-face (same rule as FaceDetection(det_cascade=...)).
+
+Reported per strategy: images/s, detection rate, average detector passes per image and
+the mean IoU of the best box against the fixed 640 scan.
+
+    python -m benchmarks.detector_sizes --strategies 640 320 160 320,640 160,320,640
+"""
+import argparse
+import glob
+import json
+import time
+from typing import List, Tuple
+
+import cv2
+import numpy as np
+
+from app.services.face_detection import FaceDetection
+
+
+def _parse(strategy: str) -> List[Tuple[int, int]]:
+    return [(int(s), int(s)) for s in strategy.split(",")]
+
+
+def _detect(detector: FaceDetection, image: np.ndarray, sizes: List[Tuple[int, int]]):
+    """:return: (bboxes, detector passes)"""
+    det_model = detector.app.det_model
+    for passes, size in enumerate(sizes, start=1):
+        bboxes, _ = det_model.detect(image, input_size=size, max_num=0, metric="default")
+        if passes == len(sizes) or detector._accepts(bboxes):
+            return bboxes, passes
+
+
+def _best_box(bboxes: np.ndarray, conf_threshold: float):
+    if bboxes.shape[0] == 0 or bboxes[:, 4].max() < conf_threshold:
+        return None
+    return bboxes[int(np.argmax(bboxes[:, 4])), :4]
+
+
+def _iou(a: np.ndarray, b: np.ndarray) -> float:
+    x1, y1 = np.maximum(a[:2], b[:2])
+    x2, y2 = np.minimum(a[2:], b[2:])
+    inter = max(0.0, x2 - x1) * max(0.0, y2 - y1)
+    union = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - inter
+    return float(inter / union) if union > 0 else 0.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--images", default="images/*.png")
+    parser.add_argument("--model", default="buffalo_l")
+    parser.add_argument("--strategies", nargs="+", default=["640", "320", "160", "320,640", "160,320,640"])
+    parser.add_argument("--min-face", type=int, default=48, help="min face side (px) accepted by a cascade step")
+    parser.add_argument("--conf", type=float, default=0.5)
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    paths = sorted(glob.glob(args.images))
+    images = [img for img in (cv2.imread(p) for p in paths) if img is not None]
+    if not images:
+        raise SystemExit(f"No images match {args.images}")
+    detector = FaceDetection(args.model, conf_threshold=args.conf, mode="detection", min_face_size=args.min_face)
+
+    reference = [_best_box(_detect(detector, img, [(640, 640)])[0], args.conf) for img in images]
+    rows = []
+    for strategy in args.strategies:
+        sizes = _parse(strategy)
+        results = [_detect(detector, img, sizes) for img in images]  # also warms up this input size
+        start = time.perf_counter()
+        for _ in range(args.repeats):
+            for img in images:
+                _detect(detector, img, sizes)
+        elapsed = time.perf_counter() - start
+
+        boxes = [_best_box(bboxes, args.conf) for bboxes, _ in results]
+        ious = [_iou(box, ref) for box, ref in zip(boxes, reference) if box is not None and ref is not None]
+        rows.append({
+            "strategy": strategy,
+            "images_per_s": round(len(images) * args.repeats / elapsed, 2),
+            "detection_rate": round(sum(box is not None for box in boxes) / len(images), 3),
+            "avg_passes": round(float(np.mean([passes for _, passes in results])), 2),
+            "mean_iou_vs_640": round(float(np.mean(ious)), 3) if ious else None,
+        })
+
+    print(f"{len(images)} images, {args.repeats} repeats, min face {args.min_face}px, conf {args.conf}")
+    print(f"{'strategy':<14} {'img/s':>8} {'detected':>9} {'passes':>7} {'IoU vs 640':>11}")
+    for r in rows:
+        iou = f"{r['mean_iou_vs_640']:.3f}" if r["mean_iou_vs_640"] is not None else "-"
+        print(f"{r['strategy']:<14} {r['images_per_s']:>8.1f} {r['detection_rate']:>9.1%} "
+              f"{r['avg_passes']:>7.2f} {iou:>11}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(rows, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""
+Document size and gallery load time per embedding storage format.
+
+Builds synthetic user documents (--faces-per-user 512-D faces each) stored as
+  list     legacy BSON array of doubles
+  float32  BSON Binary, 4 bytes per value
+  float16  BSON Binary, 2 bytes per value
+and reports the average BSON document size, the time to decode the raw BSON and the
+time to build the resident gallery from it, plus the cosine error float16 introduces.
+With --mongo-uri the documents also round-trip through a scratch collection, so the
+load time includes the wire and the server.
+
+    python -m benchmarks.embedding_storage --users 20000 --faces-per-user 3
+"""
+import argparse
+import json
+import time
+import uuid
+
+import bson
+import numpy as np
+
+from app.models.embedding import decode_embedding, encode_embedding
+from app.services.gallery import EmbeddingGallery
+
+FORMATS = ("list", "float32", "float16")
+
+
+def _documents(vectors: np.ndarray, faces_per_user: int, dtype: str):
+    for start in range(0, vectors.shape[0], faces_per_user):
+        yield {
+            "user_id": str(uuid.UUID(int=start)),
+            "profile": {"room": str(start % 50)},
+            "faces": [{"embedding": encode_embedding(v, dtype), "confidence": 0.9}
+                      for v in vectors[start:start + faces_per_user]],
+        }
+
+
+def _load(docs, dim: int) -> float:
+    gallery = EmbeddingGallery(dim=dim)
+    start = time.perf_counter()
+    gallery.load_documents(docs)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=20000)
+    parser.add_argument("--faces-per-user", type=int, default=3)
+    parser.add_argument("--dim", type=int, default=512)
+    parser.add_argument("--mongo-uri", help="also measure a find() + gallery load against this server")
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    vectors = rng.standard_normal((args.users * args.faces_per_user, args.dim)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+
+    rows = []
+    for fmt in FORMATS:
+        blobs = [bson.encode(doc) for doc in _documents(vectors, args.faces_per_user, fmt)]
+        start = time.perf_counter()
+        docs = [bson.decode(blob) for blob in blobs]
+        decode_s = time.perf_counter() - start
+        row = {
+            "format": fmt,
+            "avg_doc_bytes": round(float(np.mean([len(b) for b in blobs])), 1),
+            "total_mb": round(sum(len(b) for b in blobs) / 1e6, 2),
+            "bson_decode_s": round(decode_s, 3),
+            "gallery_load_s": round(_load(docs, args.dim), 3),
+        }
+        stored = np.stack([decode_embedding(f["embedding"]) for d in docs for f in d["faces"]]).astype(np.float32)
+        cos = np.sum(stored * vectors, axis=1) / np.linalg.norm(stored, axis=1)
+        row["max_cosine_error"] = float(np.max(np.abs(1.0 - cos)))
+
+        if args.mongo_uri:
+            from pymongo import MongoClient
+
+            col = MongoClient(args.mongo_uri)["face_recognition_bench"][f"users_{fmt}"]
+            col.drop()
+            col.insert_many(_documents(vectors, args.faces_per_user, fmt))
+            start = time.perf_counter()
+            cursor = col.find({}, {"_id": 0, "user_id": 1, "profile.room": 1, "faces.embedding": 1})
+            _load(cursor, args.dim)
+            row["mongo_load_s"] = round(time.perf_counter() - start, 3)
+            col.drop()
+        rows.append(row)
+
+    print(f"{args.users} users x {args.faces_per_user} faces, dim {args.dim}")
+    print(f"{'format':<8} {'doc bytes':>10} {'total MB':>9} {'decode s':>9} {'gallery s':>10} "
+          f"{'max cos err':>12}" + (f" {'mongo s':>8}" if args.mongo_uri else ""))
+    for r in rows:
+        print(f"{r['format']:<8} {r['avg_doc_bytes']:>10.0f} {r['total_mb']:>9.1f} {r['bson_decode_s']:>9.3f} "
+              f"{r['gallery_load_s']:>10.3f} {r['max_cosine_error']:>12.2e}"
+              + (f" {r['mongo_load_s']:>8.3f}" if args.mongo_uri else ""))
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(rows, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""
+Recall-vs-latency report for the gallery search indexes.
+
+Builds a synthetic gallery of clustered 512-d embeddings (several noisy faces per
+identity, like real enrollments), then compares every IVF setting against exact
+brute force on held-out probes.
+
+    python -m benchmarks.index_recall --faces 200000 --nlist 1024 --nprobe 4 8 16 32 64
+"""
+import argparse
+import json
+import time
+
+import numpy as np
+
+from app.services.search_index import BruteForceIndex, IVFIndex, normalize_rows
+
+
+def synthetic_gallery(n_faces: int, faces_per_id: int, dim: int, noise: float, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    n_ids = max(n_faces // faces_per_id, 1)
+    centers = normalize_rows(rng.standard_normal((n_ids, dim)).astype(np.float32))
+    owners = np.repeat(np.arange(n_ids), faces_per_id)[:n_faces]
+    faces = normalize_rows(centers[owners] + noise * rng.standard_normal((owners.shape[0], dim)).astype(np.float32))
+    return centers, faces
+
+
+def probes_for(centers: np.ndarray, n_queries: int, noise: float, seed: int = 1) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    ids = rng.integers(0, centers.shape[0], n_queries)
+    return normalize_rows(centers[ids] + noise * rng.standard_normal((n_queries, centers.shape[1])).astype(np.float32))
+
+
+def time_search(index, queries: np.ndarray, k: int, **kwargs):
+    """Search one probe at a time (like /recognize) and return (labels, per-query latencies in ms)"""
+    labels = np.empty((queries.shape[0], k), dtype=np.int64)
+    latencies = np.empty(queries.shape[0])
+    for i, q in enumerate(queries):
+        start = time.perf_counter()
+        _, labels[i] = index.search(q, k=k, **kwargs)
+        latencies[i] = (time.perf_counter() - start) * 1000
+    return labels, latencies
+
+
+def recall_at(truth: np.ndarray, found: np.ndarray, k: int) -> float:
+    """Fraction of the exact top-k that the approximate top-k recovered"""
+    hits = sum(len(set(t[:k]) & set(f[:k])) for t, f in zip(truth, found))
+    return hits / (truth.shape[0] * k)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--faces", type=int, default=100000)
+    parser.add_argument("--faces-per-id", type=int, default=3)
+    parser.add_argument("--dim", type=int, default=512)
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--noise", type=float, default=0.05, help="per-dimension noise around each identity")
+    parser.add_argument("--nlist", type=int, default=1024)
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[1, 4, 8, 16, 32, 64])
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    centers, faces = synthetic_gallery(args.faces, args.faces_per_id, args.dim, args.noise)
+    queries = probes_for(centers, args.queries, args.noise)
+    labels = np.arange(faces.shape[0])
+
+    brute = BruteForceIndex(args.dim)
+    brute.add(labels, faces)
+    truth, brute_ms = time_search(brute, queries, args.k)
+
+    start = time.perf_counter()
+    ivf = IVFIndex(args.dim, nlist=args.nlist, min_train=faces.shape[0])
+    ivf.add(labels, faces)
+    build_s = time.perf_counter() - start
+
+    rows = [{"index": "brute", "nprobe": None, "recall@1": 1.0, f"recall@{args.k}": 1.0,
+             "p50_ms": float(np.percentile(brute_ms, 50)), "p99_ms": float(np.percentile(brute_ms, 99))}]
+    for nprobe in args.nprobe:
+        found, ms = time_search(ivf, queries, args.k, nprobe=nprobe)
+        rows.append({"index": "ivf", "nprobe": nprobe,
+                     "recall@1": recall_at(truth, found, 1), f"recall@{args.k}": recall_at(truth, found, args.k),
+                     "p50_ms": float(np.percentile(ms, 50)), "p99_ms": float(np.percentile(ms, 99))})
+
+    print(f"{faces.shape[0]} faces x {args.dim}-d, {args.queries} probes, IVF nlist={args.nlist} "
+          f"(build {build_s:.1f}s)")
+    print(f"{'index':<6} {'nprobe':>6} {'recall@1':>9} {f'recall@{args.k}':>10} {'p50 ms':>8} {'p99 ms':>8} {'speedup':>8}")
+    brute_p50 = rows[0]["p50_ms"]
+    for row in rows:
+        print(f"{row['index']:<6} {row['nprobe'] or '-':>6} {row['recall@1']:>9.4f} {row[f'recall@{args.k}']:>10.4f} "
+              f"{row['p50_ms']:>8.3f} {row['p99_ms']:>8.3f} {brute_p50 / row['p50_ms']:>7.1f}x")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"faces": faces.shape[0], "dim": args.dim, "nlist": args.nlist,
+                       "build_seconds": build_s, "results": rows}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
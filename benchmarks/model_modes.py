@@ -0,0 +1,84 @@
+"""
+Startup time, resident memory and per-frame latency of each FaceDetection mode.
+
+Every mode is measured in a fresh process so load time and RSS aren't polluted by
+the previous one:
+  full         every model in the pack (landmarks 2d/3d, genderage, ...), app.get()
+  recognition  detector + ArcFace only, get_best_face()
+  detection    detector only, detect_boxes()
+
+    python -m benchmarks.model_modes --repeats 10
+"""
+import argparse
+import glob
+import json
+import multiprocessing
+import time
+
+import cv2
+import numpy as np
+
+
+def _rss_mb() -> float:
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024
+    return float("nan")
+
+
+def _measure(mode: str, model: str, pattern: str, repeats: int, out) -> None:
+    from app.services.face_detection import FaceDetection
+
+    images = [img for img in (cv2.imread(p) for p in sorted(glob.glob(pattern))) if img is not None]
+    rss_before = _rss_mb()
+    start = time.perf_counter()
+    detector = FaceDetection(model, mode=mode)
+    load_s = time.perf_counter() - start
+    rss_loaded = _rss_mb()
+
+    run = detector.detect_boxes if mode == "detection" else detector.get_best_face
+    for img in images:
+        run(img)  # warm up
+    latencies = []
+    for _ in range(repeats):
+        for img in images:
+            t = time.perf_counter()
+            run(img)
+            latencies.append((time.perf_counter() - t) * 1000)
+    out.put({"mode": mode, "models": sorted(detector.app.models), "load_s": round(load_s, 3),
+             "model_rss_mb": round(rss_loaded - rss_before, 1), "total_rss_mb": round(_rss_mb(), 1),
+             "p50_ms": round(float(np.percentile(latencies, 50)), 2),
+             "p99_ms": round(float(np.percentile(latencies, 99)), 2)})
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--images", default="images/*.png")
+    parser.add_argument("--model", default="buffalo_l")
+    parser.add_argument("--modes", nargs="+", default=["full", "recognition", "detection"])
+    parser.add_argument("--repeats", type=int, default=10)
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    ctx = multiprocessing.get_context("spawn")
+    rows = []
+    for mode in args.modes:
+        out = ctx.Queue()
+        p = ctx.Process(target=_measure, args=(mode, args.model, args.images, args.repeats, out))
+        p.start()
+        rows.append(out.get())
+        p.join()
+
+    print(f"{'mode':<12} {'load s':>7} {'model MB':>9} {'RSS MB':>8} {'p50 ms':>8} {'p99 ms':>8}  models")
+    for r in rows:
+        print(f"{r['mode']:<12} {r['load_s']:>7.2f} {r['model_rss_mb']:>9.1f} {r['total_rss_mb']:>8.1f} "
+              f"{r['p50_ms']:>8.1f} {r['p99_ms']:>8.1f}  {', '.join(r['models'])}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(rows, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,164 @@
+"""
+Latency of the API's Mongo queries on a synthetic users collection, before and after
+ensure_indexes(), and of listing users in full vs. in keyset-paginated pages.
+
+Generates --users documents shaped like the real ones (profile, one face with a
+2 KB float32 Binary embedding, landmarks) in a scratch database, then times:
+  student_id      find_one on profile.student_id        (/users/student/<id>, enrollment resume)
+  legacy_student  find_one on top-level student_id       (the legacy fallback, usually a miss)
+  user_id         find_one on user_id                    (/users/userid/<id>, recognized profile)
+  room            find on profile.room                   (room filter)
+  list_all        GET /users without parameters: every document
+  page_first      first page of --page-size with the response-field projection
+  page_deep       a page near the end by _id cursor
+  page_skip       the same deep page with skip() for comparison
+
+Runs against a local mongod (--uri) or, with --mongomock, an in-process stand-in.
+mongomock ignores indexes, so there only the listing rows are meaningful.
+
+    python -m benchmarks.mongo_queries --users 100000 --uri mongodb://localhost:27017/
+    python -m benchmarks.mongo_queries --users 100000 --mongomock
+"""
+import argparse
+import json
+import time
+import uuid
+
+import numpy as np
+
+from app.db.mongo import ensure_indexes, paginate
+from app.models.embedding import encode_embedding
+
+LIST_PROJECTION = {"_id": 0, "user_id": 1, "uuid": 1, "profile": 1, "registered_at": 1, "updated_at": 1,
+                   "embedding_version": 1, "faces.added_at": 1}
+
+
+def synthetic_users(n: int, rooms: int, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    embedding = encode_embedding(rng.standard_normal(512).astype(np.float32))
+    for i in range(n):
+        yield {
+            "user_id": str(uuid.UUID(int=int(rng.integers(0, 2 ** 63)) << 64 | i)),
+            "profile": {"name": f"Student {i}", "student_id": f"S{i:07d}", "department": "CS",
+                        "class": f"K{i % 40}", "room": str(i % rooms)},
+            "faces": [{"image_path": f"uploads/S{i:07d}.jpg", "embedding": embedding, "confidence": 0.9,
+                       "landmarks": [[10, 20], [30, 20], [20, 30], [12, 40], [28, 40]],
+                       "added_at": "2024-01-01T00:00:00"}],
+            "embedding_version": "insightface-buffalo_l-v1",
+            "registered_at": "2024-01-01T00:00:00",
+            "updated_at": "2024-01-01T00:00:00",
+        }
+
+
+def timed(fn, repeat: int):
+    latencies = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        fn(i)
+        latencies.append((time.perf_counter() - start) * 1000)
+    return np.percentile(latencies, [50, 99])
+
+
+def plan_stage(col, query) -> str:
+    """Winning plan stage (IXSCAN / COLLSCAN) as reported by mongod"""
+    try:
+        plan = col.find(query).explain()["queryPlanner"]["winningPlan"]
+    except Exception:
+        return "-"
+    while "inputStage" in plan:
+        plan = plan["inputStage"]
+    return plan.get("stage", "-")
+
+
+def run_queries(col, args, rng):
+    ids = [d["user_id"] for d in col.find({}, {"_id": 0, "user_id": 1}).limit(args.queries)]
+    students = [f"S{i:07d}" for i in rng.integers(0, args.users, args.queries)]
+    rooms = [str(r) for r in rng.integers(0, args.rooms, args.queries)]
+    cases = {
+        "student_id": ({"profile.student_id": students[0]}, lambda i: col.find_one({"profile.student_id": students[i]})),
+        "legacy_student": ({"student_id": students[0]}, lambda i: col.find_one({"student_id": students[i]})),
+        "user_id": ({"user_id": ids[0]}, lambda i: col.find_one({"user_id": ids[i % len(ids)]})),
+        "room": ({"profile.room": rooms[0]},
+                 lambda i: list(col.find({"profile.room": rooms[i]}, {"_id": 0, "user_id": 1}))),
+    }
+    rows = []
+    for name, (query, fn) in cases.items():
+        p50, p99 = timed(fn, args.queries)
+        rows.append({"query": name, "plan": plan_stage(col, query), "p50_ms": round(float(p50), 3),
+                     "p99_ms": round(float(p99), 3)})
+    return rows
+
+
+def run_listing(col, args):
+    rows = []
+    p50, _ = timed(lambda i: list(col.find({}, {"_id": 0, "faces.embedding": 0})), 1)
+    rows.append({"query": "list_all", "plan": "-", "p50_ms": round(float(p50), 3), "p99_ms": None})
+    deep = col.find({}, {"_id": 1}).sort("_id", 1).skip(max(0, args.users - args.page_size * 2)).limit(1)
+    deep_cursor = str(next(iter(deep))["_id"])
+    for name, fn in (
+        ("page_first", lambda i: paginate(col, {}, LIST_PROJECTION, args.page_size)),
+        ("page_deep", lambda i: paginate(col, {}, LIST_PROJECTION, args.page_size, after=deep_cursor)),
+        ("page_skip", lambda i: list(col.find({}, LIST_PROJECTION).sort("_id", 1)
+                                     .skip(args.users - args.page_size * 2).limit(args.page_size))),
+    ):
+        p50, p99 = timed(fn, args.pages)
+        rows.append({"query": name, "plan": "-", "p50_ms": round(float(p50), 3), "p99_ms": round(float(p99), 3)})
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--uri", default="mongodb://localhost:27017/")
+    parser.add_argument("--mongomock", action="store_true", help="use mongomock instead of a mongod")
+    parser.add_argument("--db", default="face_recognition_bench", help="scratch database (dropped first)")
+    parser.add_argument("--users", type=int, default=100000)
+    parser.add_argument("--rooms", type=int, default=200)
+    parser.add_argument("--queries", type=int, default=200, help="lookups timed per query type")
+    parser.add_argument("--page-size", type=int, default=100)
+    parser.add_argument("--pages", type=int, default=20, help="pages timed per pagination case")
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    if args.mongomock:
+        import mongomock
+        client = mongomock.MongoClient()
+    else:
+        from pymongo import MongoClient
+        client = MongoClient(args.uri, serverSelectionTimeoutMS=5000)
+    client.drop_database(args.db)
+    db = client[args.db]
+    col = db["users"]
+
+    start = time.perf_counter()
+    batch = []
+    for doc in synthetic_users(args.users, args.rooms):
+        batch.append(doc)
+        if len(batch) == 5000:
+            col.insert_many(batch, ordered=False)
+            batch = []
+    if batch:
+        col.insert_many(batch, ordered=False)
+    print(f"inserted {args.users} users in {time.perf_counter() - start:.1f}s "
+          f"({'mongomock' if args.mongomock else args.uri})")
+
+    rng = np.random.default_rng(1)
+    rows = [{"indexes": False, **r} for r in run_queries(col, args, rng)]
+    start = time.perf_counter()
+    ensure_indexes(db)
+    print(f"ensure_indexes: {time.perf_counter() - start:.1f}s")
+    rows += [{"indexes": True, **r} for r in run_queries(col, args, np.random.default_rng(1))]
+    rows += [{"indexes": True, **r} for r in run_listing(col, args)]
+
+    print(f"{'query':<15} {'indexes':>8} {'plan':>9} {'p50 ms':>10} {'p99 ms':>10}")
+    for r in rows:
+        p99 = f"{r['p99_ms']:>10.3f}" if r["p99_ms"] is not None else f"{'-':>10}"
+        print(f"{r['query']:<15} {str(r['indexes']):>8} {r['plan']:>9} {r['p50_ms']:>10.3f} {p99}")
+
+    client.drop_database(args.db)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(rows, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
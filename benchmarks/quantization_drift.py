@@ -0,0 +1,96 @@
+"""
+Embedding drift and CPU latency of the INT8 model pack against FP32.
+
+For every sample image, embeds the best face with both packs and reports the cosine
+similarity between the FP32 and INT8 embeddings, plus the same-/different-identity
+similarity margins (sample names are <person><n>.png, e.g. tai1.png / thuy2.png)
+and per-image latency. Create the INT8 pack first:
+
+    python -m app.tools.quantize_models --model buffalo_l
+    python -m benchmarks.quantization_drift --threads 4
+"""
+import argparse
+import glob
+import json
+import os
+import re
+import time
+
+import cv2
+import numpy as np
+
+from app.services.face_detection import FaceDetection
+
+
+def embed_all(detector: FaceDetection, images, repeats: int):
+    embeddings, latencies = {}, []
+    for name, img in images.items():
+        detector.get_best_face(img)  # warm up per shape
+        start = time.perf_counter()
+        for _ in range(repeats):
+            face = detector.get_best_face(img)
+        latencies.append((time.perf_counter() - start) * 1000 / repeats)
+        if face:
+            emb = np.asarray(face["embedding"], dtype=np.float32)
+            embeddings[name] = emb / np.linalg.norm(emb)
+    return embeddings, float(np.median(latencies))
+
+
+def identity(name: str) -> str:
+    return re.sub(r"\d+$", "", name)
+
+
+def margins(embeddings):
+    """(min same-identity similarity, max different-identity similarity)"""
+    names = sorted(embeddings)
+    same, diff = [], []
+    for i, a in enumerate(names):
+        for b in names[i + 1:]:
+            sim = float(embeddings[a] @ embeddings[b])
+            (same if identity(a) == identity(b) else diff).append(sim)
+    return (min(same) if same else None), (max(diff) if diff else None)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--images", default="images/*.png")
+    parser.add_argument("--model", default="buffalo_l")
+    parser.add_argument("--threads", type=int, default=None, help="ORT intra-op threads for both packs")
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    images = {os.path.splitext(os.path.basename(p))[0]: cv2.imread(p) for p in sorted(glob.glob(args.images))}
+    images = {k: v for k, v in images.items() if v is not None}
+
+    fp32, fp32_ms = embed_all(FaceDetection(args.model, intra_op_threads=args.threads), images, args.repeats)
+    int8, int8_ms = embed_all(FaceDetection(args.model, intra_op_threads=args.threads, quantized=True),
+                              images, args.repeats)
+
+    print(f"{'image':<10} {'cos(fp32, int8)':>16}")
+    drift = {}
+    for name in sorted(fp32):
+        if name in int8:
+            drift[name] = float(fp32[name] @ int8[name])
+            print(f"{name:<10} {drift[name]:>16.4f}")
+        else:
+            print(f"{name:<10} {'no face (int8)':>16}")
+
+    fp32_same, fp32_diff = margins(fp32)
+    int8_same, int8_diff = margins(int8)
+    if drift:
+        print(f"\nmin cos(fp32, int8): {min(drift.values()):.4f}")
+    print(f"{'':<6} {'min same-id':>12} {'max diff-id':>12} {'ms/image':>9}")
+    for label, same, diff, ms in (("fp32", fp32_same, fp32_diff, fp32_ms), ("int8", int8_same, int8_diff, int8_ms)):
+        print(f"{label:<6} {same if same is not None else float('nan'):>12.4f} "
+              f"{diff if diff is not None else float('nan'):>12.4f} {ms:>9.1f}")
+    print(f"speedup: {fp32_ms / int8_ms:.2f}x")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"drift": drift, "fp32": {"min_same": fp32_same, "max_diff": fp32_diff, "ms": fp32_ms},
+                       "int8": {"min_same": int8_same, "max_diff": int8_diff, "ms": int8_ms}}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+"""
+Memory / latency / accuracy report of the compressed gallery indexes (PQ and SQ8)
+against exact brute force.
+
+Uses the synthetic gallery of benchmarks.index_recall (several noisy faces per
+identity) plus two probe sets: genuine probes of enrolled identities and impostor
+probes of identities that were never enrolled. For every index setting it reports
+  bytes/face    resident bytes per face (codes + refine copy + int64 label)
+  MB/1M faces   the same for a million faces
+  x smaller     float32 bytes/face divided by the index's
+  p50/p99 ms    one probe at a time, like /recognize
+  recall@1      top-1 equal to the exact top-1
+  match         genuine probes whose top-1 is the right identity with a score >= --threshold
+  false match   impostor probes with a top-1 score >= --threshold
+  max |d score| largest top-1 score error vs exact (what threshold decisions see)
+with the match / false-match deltas relative to brute force.
+
+    python -m benchmarks.quantized_index --faces 200000 --threshold 0.7
+"""
+import argparse
+import json
+import time
+
+import numpy as np
+
+from app.services.search_index import BruteForceIndex, create_index, normalize_rows
+from benchmarks.index_recall import probes_for, synthetic_gallery
+
+# name -> (backend, parameters); "sq8" and "pq64+sq8" are the defaults of INDEX_BACKEND=sq8 / pq
+SETTINGS = {
+    "sq8": ("sq8", {"refine": "none"}),
+    "sq8+f16": ("sq8", {"refine": "float16"}),
+    "pq64": ("pq", {"m": 64, "refine": "none"}),
+    "pq64+sq8": ("pq", {"m": 64, "refine": "sq8"}),
+    "pq64+f16": ("pq", {"m": 64, "refine": "float16"}),
+    "pq32+sq8": ("pq", {"m": 32, "refine": "sq8"}),
+}
+
+
+def top1(index, queries: np.ndarray):
+    """Search one probe at a time (like /recognize). :return: (labels, scores, latencies ms) of the best match"""
+    labels = np.empty(queries.shape[0], dtype=np.int64)
+    scores = np.empty(queries.shape[0], dtype=np.float32)
+    latencies = np.empty(queries.shape[0])
+    for i, q in enumerate(queries):
+        start = time.perf_counter()
+        s, l = index.search(q, k=1)
+        latencies[i] = (time.perf_counter() - start) * 1000
+        scores[i], labels[i] = s[0, 0], l[0, 0]
+    return labels, scores, latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--faces", type=int, default=100000)
+    parser.add_argument("--faces-per-id", type=int, default=3)
+    parser.add_argument("--dim", type=int, default=512)
+    parser.add_argument("--queries", type=int, default=300)
+    parser.add_argument("--noise", type=float, default=0.025, help="per-dimension noise around each identity")
+    parser.add_argument("--threshold", type=float, default=0.70, help="similarity counted as a match")
+    parser.add_argument("--rerank", type=int, default=64)
+    parser.add_argument("--settings", nargs="+", default=list(SETTINGS), choices=list(SETTINGS))
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    centers, faces = synthetic_gallery(args.faces, args.faces_per_id, args.dim, args.noise)
+    n_ids = centers.shape[0]
+    owners = np.repeat(np.arange(n_ids), args.faces_per_id)[:faces.shape[0]]
+    rng = np.random.default_rng(2)
+    genuine_ids = rng.integers(0, n_ids, args.queries)
+    genuine = normalize_rows(centers[genuine_ids]
+                             + args.noise * rng.standard_normal((args.queries, args.dim)).astype(np.float32))
+    impostor_centers, _ = synthetic_gallery(args.queries, 1, args.dim, args.noise, seed=4)
+    impostors = probes_for(impostor_centers, args.queries, args.noise, seed=5)
+    labels = np.arange(faces.shape[0])
+
+    def evaluate(name, index, build_s, bytes_per_face, exact=None):
+        found, scores, ms = top1(index, genuine)
+        _, impostor_scores, _ = top1(index, impostors)
+        row = {
+            "index": name, "build_s": round(build_s, 2), "bytes_per_face": bytes_per_face,
+            "mb_per_million": round(bytes_per_face * 1e6 / 2 ** 20, 1),
+            "x_smaller": round((4 * args.dim + 8) / bytes_per_face, 2),
+            "p50_ms": float(np.percentile(ms, 50)), "p99_ms": float(np.percentile(ms, 99)),
+            "match_rate": float(np.mean((owners[found] == genuine_ids) & (scores >= args.threshold))),
+            "false_match_rate": float(np.mean(impostor_scores >= args.threshold)),
+        }
+        if exact is not None:
+            row["recall@1"] = float(np.mean(found == exact["found"]))
+            row["max_score_error"] = float(np.abs(scores - exact["scores"]).max())
+            row["match_delta"] = row["match_rate"] - exact["row"]["match_rate"]
+            row["false_match_delta"] = row["false_match_rate"] - exact["row"]["false_match_rate"]
+        return row, found, scores
+
+    start = time.perf_counter()
+    brute = BruteForceIndex(args.dim)
+    brute.add(labels, faces)
+    brute_row, brute_found, brute_scores = evaluate("brute", brute, time.perf_counter() - start, 4 * args.dim + 8)
+    exact = {"row": brute_row, "found": brute_found, "scores": brute_scores}
+    brute_row.update({"recall@1": 1.0, "max_score_error": 0.0, "match_delta": 0.0, "false_match_delta": 0.0})
+    rows = [brute_row]
+
+    for name in args.settings:
+        backend, params = SETTINGS[name]
+        start = time.perf_counter()
+        index = create_index(backend, dim=args.dim, rerank=args.rerank, min_train=faces.shape[0], **params)
+        index.add(labels, faces)
+        row, _, _ = evaluate(name, index, time.perf_counter() - start, index.code_size + 8, exact)
+        rows.append(row)
+
+    print(f"{faces.shape[0]} faces x {args.dim}-d, {args.queries} genuine + {args.queries} impostor probes, "
+          f"threshold {args.threshold}, re-rank {args.rerank}")
+    print(f"{'index':<10} {'B/face':>6} {'MB/1M':>7} {'x smaller':>9} {'build s':>7} {'p50 ms':>7} {'p99 ms':>7} {'recall@1':>8} "
+          f"{'match':>6} {'d match':>8} {'false':>6} {'d false':>8} {'max |d score|':>13}")
+    for row in rows:
+        print(f"{row['index']:<10} {row['bytes_per_face']:>6} {row['mb_per_million']:>7.1f} {row['x_smaller']:>9.2f} "
+              f"{row['build_s']:>7.1f} "
+              f"{row['p50_ms']:>7.2f} {row['p99_ms']:>7.2f} {row['recall@1']:>8.4f} {row['match_rate']:>6.3f} "
+              f"{row['match_delta']:>+8.3f} {row['false_match_rate']:>6.3f} {row['false_match_delta']:>+8.3f} "
+              f"{row['max_score_error']:>13.4f}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"faces": faces.shape[0], "dim": args.dim, "threshold": args.threshold,
+                       "rerank": args.rerank, "results": rows}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
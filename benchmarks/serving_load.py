@@ -0,0 +1,154 @@
+"""
+Load test of running API deployments: the gunicorn (sync Flask) and uvicorn (ASGI)
+servers under the same concurrent mix of recognitions and user lookups.
+
+Start the deployments to compare against the same database, e.g.
+
+    gunicorn -w 4 -b 127.0.0.1:8000 app:app
+    uvicorn app.asgi:app --workers 4 --host 127.0.0.1 --port 8001
+
+then point one --target at each:
+
+    python -m benchmarks.serving_load --target sync=http://127.0.0.1:8000 \\
+        --target asgi=http://127.0.0.1:8001 --clients 16 --requests 50 --recognize 0.5
+
+Every client thread sends --requests requests, a --recognize fraction of them
+`POST /recognize` uploads (cycling over images/*.png) and the rest
+`GET /users/userid/<id>` lookups of registered users. Each request opens its own
+connection (http.client, stdlib only), so both servers pay the same connection cost.
+Reports requests/s and p50/p99 per target, overall and per endpoint.
+"""
+import argparse
+import glob
+import http.client
+import json
+import threading
+import time
+import urllib.parse
+import uuid
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+from app.services.batching import LatencyStats
+
+
+def load_uploads(pattern: str) -> List[Tuple[bytes, str]]:
+    """Multipart bodies (and their content type) for /recognize, one per sample image"""
+    uploads = []
+    for path in sorted(glob.glob(pattern)):
+        with open(path, "rb") as f:
+            data = f.read()
+        boundary = uuid.uuid4().hex
+        body = (f"--{boundary}\r\nContent-Disposition: form-data; name=\"image\"; filename=\"{path}\"\r\n"
+                f"Content-Type: application/octet-stream\r\n\r\n").encode() + data + f"\r\n--{boundary}--\r\n".encode()
+        uploads.append((body, f"multipart/form-data; boundary={boundary}"))
+    if not uploads:
+        raise SystemExit(f"no images match {pattern}")
+    return uploads
+
+
+def request(base: urllib.parse.SplitResult, method: str, path: str, body: bytes = None,
+            headers: Dict = None, timeout: float = 60.0) -> Tuple[int, bytes]:
+    conn = http.client.HTTPConnection(base.hostname, base.port or 80, timeout=timeout)
+    try:
+        conn.request(method, base.path.rstrip("/") + path, body=body, headers=headers or {})
+        response = conn.getresponse()
+        return response.status, response.read()
+    finally:
+        conn.close()
+
+
+def user_ids(base: urllib.parse.SplitResult, limit: int) -> List[str]:
+    status, body = request(base, "GET", f"/users?limit={limit}&fields=user_id")
+    if status != 200:
+        raise SystemExit(f"{base.geturl()}/users answered {status}")
+    return [u["user_id"] for u in json.loads(body)["users"] if u.get("user_id")]
+
+
+def run_target(base: urllib.parse.SplitResult, uploads, ids: List[str], clients: int, requests: int,
+               recognize: float, seed: int) -> Dict:
+    stats = {"all": LatencyStats(), "recognize": LatencyStats(), "lookup": LatencyStats()}
+    errors = {"count": 0}
+    lock = threading.Lock()
+
+    def client(c: int):
+        rng = np.random.default_rng(seed + c)
+        for i in range(requests):
+            if not ids or rng.random() < recognize:
+                kind = "recognize"
+                body, content_type = uploads[(c + i) % len(uploads)]
+                args = ("POST", "/recognize", body, {"Content-Type": content_type})
+            else:
+                kind = "lookup"
+                args = ("GET", f"/users/userid/{ids[int(rng.integers(len(ids)))]}")
+            start = time.perf_counter()
+            try:
+                status, _ = request(base, *args)
+                failed = status >= 500
+            except OSError:
+                failed = True
+            ms = (time.perf_counter() - start) * 1000
+            if failed:
+                with lock:
+                    errors["count"] += 1
+                continue
+            stats["all"].record(ms)
+            stats[kind].record(ms)
+
+    threads = [threading.Thread(target=client, args=(c,)) for c in range(clients)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+    return {
+        "requests_per_s": round(stats["all"].count / elapsed, 2),
+        "errors": errors["count"],
+        **{kind: s.summary() for kind, s in stats.items()},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--target", action="append", required=True, metavar="NAME=URL",
+                        help="deployment to load, repeatable")
+    parser.add_argument("--images", default="images/*.png")
+    parser.add_argument("--clients", type=int, default=16)
+    parser.add_argument("--requests", type=int, default=50, help="requests per client")
+    parser.add_argument("--recognize", type=float, default=0.5, help="fraction of requests that are /recognize")
+    parser.add_argument("--users", type=int, default=500, help="registered users sampled for lookups")
+    parser.add_argument("--warmup", type=int, default=5, help="untimed recognitions per target")
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    uploads = load_uploads(args.images)
+    rows = []
+    for target in args.target:
+        name, _, url = target.partition("=")
+        base = urllib.parse.urlsplit(url or name)
+        ids = user_ids(base, args.users)
+        for i in range(args.warmup):
+            body, content_type = uploads[i % len(uploads)]
+            request(base, "POST", "/recognize", body, {"Content-Type": content_type})
+        result = run_target(base, uploads, ids, args.clients, args.requests, args.recognize, seed=0)
+        rows.append({"target": name, "url": base.geturl(), **result})
+
+    print(f"{args.clients} clients x {args.requests} requests, {args.recognize:.0%} /recognize")
+    print(f"{'target':<10} {'req/s':>8} {'errors':>6} {'p50 ms':>8} {'p99 ms':>8} "
+          f"{'recog p50':>9} {'recog p99':>9} {'lookup p50':>10} {'lookup p99':>10}")
+    for row in rows:
+        print(f"{row['target']:<10} {row['requests_per_s']:>8.2f} {row['errors']:>6} "
+              f"{row['all']['p50_ms']:>8.1f} {row['all']['p99_ms']:>8.1f} "
+              f"{row['recognize']['p50_ms']:>9.1f} {row['recognize']['p99_ms']:>9.1f} "
+              f"{row['lookup']['p50_ms']:>10.1f} {row['lookup']['p99_ms']:>10.1f}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"clients": args.clients, "requests": args.requests, "recognize": args.recognize,
+                       "results": rows}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+"""
+Frames-per-second capacity of streaming recognition with and without face tracking.
+
+Simulates a kiosk camera: a clip of --frames frames cut from one sample image with a
+small random drift (the person standing still in front of the camera), at the
+camera resolution. The enrolled gallery holds that person plus --gallery random
+identities. ONNX Runtime is pinned to --threads threads, so with the default of 1 the
+numbers are per core.
+
+  no tracking   detector + ArcFace + gallery search on every frame (the /recognize cost)
+  tracking      detector every frame, embedding only for new / improved / stale tracks
+
+    python -m benchmarks.stream_tracking --image images/tai1.png --frames 300 --reverify-s 2
+"""
+import argparse
+import json
+import time
+
+import cv2
+import numpy as np
+
+from app.services.face_detection import FaceDetection
+from app.services.gallery import EmbeddingGallery
+from app.services.tracking import StreamRecognizer
+
+
+def synthetic_clip(image: np.ndarray, n_frames: int, size, drift: int, seed: int = 0):
+    """Crops of `image` whose window wanders by up to `drift` px, resized to the camera size"""
+    rng = np.random.default_rng(seed)
+    h, w = image.shape[:2]
+    margin = min(drift * 4, h // 8, w // 8)
+    x, y = margin, margin
+    frames = []
+    for _ in range(n_frames):
+        x = int(np.clip(x + rng.integers(-drift, drift + 1), 0, 2 * margin))
+        y = int(np.clip(y + rng.integers(-drift, drift + 1), 0, 2 * margin))
+        frames.append(cv2.resize(image[y:h - 2 * margin + y, x:w - 2 * margin + x], size))
+    return frames
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--image", default="images/tai1.png")
+    parser.add_argument("--model", default="buffalo_l")
+    parser.add_argument("--frames", type=int, default=200)
+    parser.add_argument("--camera", default="1280x720", help="frame size WxH")
+    parser.add_argument("--drift", type=int, default=4, help="max camera drift per frame in px")
+    parser.add_argument("--fps", type=float, default=15.0, help="camera frame rate used for frame timestamps")
+    parser.add_argument("--reverify-s", type=float, default=2.0)
+    parser.add_argument("--gallery", type=int, default=10000, help="random distractor identities")
+    parser.add_argument("--threads", type=int, default=1, help="ONNX Runtime intra-op threads")
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    image = cv2.imread(args.image)
+    if image is None:
+        raise SystemExit(f"Cannot read {args.image}")
+    size = tuple(int(v) for v in args.camera.lower().split("x"))
+    frames = synthetic_clip(image, args.frames, size, args.drift)
+
+    detector = FaceDetection(args.model, mode="recognition", intra_op_threads=args.threads)
+    enrolled = detector.get_best_face(frames[0])
+    if enrolled is None:
+        raise SystemExit(f"No face found in {args.image}")
+    rng = np.random.default_rng(1)
+    docs = [{"user_id": f"distractor-{i}", "faces": [{"embedding": v}]}
+            for i, v in enumerate(rng.standard_normal((args.gallery, 512)).astype(np.float32))]
+    docs.append({"user_id": "enrolled", "faces": [{"embedding": enrolled["embedding"]}]})
+    gallery = EmbeddingGallery(dim=512)
+    gallery.load_documents(docs)
+
+    rows = []
+    for tracking in (False, True):
+        recognizer = StreamRecognizer(detector, gallery.search, reverify_s=args.reverify_s, tracking=tracking)
+        recognizer.process(frames[0], timestamp=0.0)  # warm up
+        recognizer = StreamRecognizer(detector, gallery.search, reverify_s=args.reverify_s, tracking=tracking)
+        recognized, track_ids = 0, set()
+        start = time.perf_counter()
+        for i, frame in enumerate(frames):
+            result = recognizer.process(frame, timestamp=i / args.fps)
+            recognized += any(f["user_id"] == "enrolled" for f in result["faces"])
+            track_ids.update(f["track_id"] for f in result["faces"])
+        elapsed = time.perf_counter() - start
+        stats = recognizer.stats()
+        rows.append({
+            "tracking": tracking,
+            "fps": round(len(frames) / elapsed, 2),
+            "ms_per_frame": round(elapsed / len(frames) * 1000, 2),
+            "embed_ratio": stats["embed_ratio"],
+            "recognized_frames": round(recognized / len(frames), 4),
+            "tracks": len(track_ids) if tracking else None,
+        })
+
+    print(f"{len(frames)} frames {size[0]}x{size[1]}, {args.threads} ORT thread(s), gallery {len(gallery)}, "
+          f"re-verify every {args.reverify_s}s at {args.fps} fps")
+    print(f"{'tracking':<9} {'fps':>8} {'ms/frame':>9} {'embedded':>9} {'recognized':>11} {'tracks':>7}")
+    for r in rows:
+        print(f"{str(r['tracking']):<9} {r['fps']:>8.1f} {r['ms_per_frame']:>9.1f} {r['embed_ratio']:>9.1%} "
+              f"{r['recognized_frames']:>11.1%} {r['tracks'] if r['tracks'] is not None else '-':>7}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(rows, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
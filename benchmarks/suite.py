@@ -0,0 +1,261 @@
+"""
+End-to-end benchmark suite of the detection and recognition pipeline, written as
+machine-readable JSON so runs on two commits can be diffed with benchmarks.compare.
+
+  load       FaceDetection construction (model files -> ready ONNX sessions), seconds
+  stages     per-stage latency on the sample images (images/*.png):
+               decode  cv2.imdecode of the uploaded bytes
+               detect  detector pass, best face
+               align   5-point alignment to the 112x112 ArcFace crop
+               embed   one ArcFace forward pass
+               search  resident gallery search (--stage-gallery faces)
+  gallery    search latency of the resident gallery grown from 1k to 1M synthetic
+             embeddings (--gallery-sizes), with and without a room filter, and
+             of a 1:1 /verify check against one user (flat across sizes)
+  http       /register and /recognize through the Flask app with an in-process
+             mongomock database (needs `mongomock`; response caches disabled),
+             requests/s and latency
+
+Everything runs single process; ONNX Runtime uses the ORT_* settings of app.config.
+The 1M-face gallery step needs about 3 GB of memory; --quick runs a smaller profile
+meant for CI.
+
+    python -m benchmarks.suite --out bench/$(git rev-parse --short HEAD).json
+    python -m benchmarks.suite --quick --skip http --out bench/quick.json
+    python -m benchmarks.compare bench/base.json bench/head.json
+"""
+import argparse
+import datetime
+import glob
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Callable, Dict, List
+
+import numpy as np
+
+from app import config, runtime
+from app.services.batching import LatencyStats
+from app.services.face_detection import FaceDetection
+from app.services.image_io import decode_image
+from app.services.search_index import normalize_rows
+
+SUITES = ("load", "stages", "gallery", "http")
+FULL = {"repeat": 50, "load_repeat": 3, "gallery_sizes": [1000, 10000, 100000, 1000000], "queries": 200,
+        "http_users": 50, "http_requests": 200}
+QUICK = {"repeat": 10, "load_repeat": 1, "gallery_sizes": [1000, 10000, 100000], "queries": 50,
+         "http_users": 10, "http_requests": 30}
+
+
+def measure(fn: Callable[[int], object], repeat: int, warmup: int = 2) -> Dict:
+    for i in range(warmup):
+        fn(i)
+    stats = LatencyStats()
+    for i in range(repeat):
+        start = time.perf_counter()
+        fn(i)
+        stats.record((time.perf_counter() - start) * 1000)
+    return stats.summary()
+
+
+def read_samples(pattern: str) -> List[bytes]:
+    samples = []
+    for path in sorted(glob.glob(pattern)):
+        with open(path, "rb") as f:
+            samples.append(f.read())
+    if not samples:
+        raise SystemExit(f"no images match {pattern}")
+    return samples
+
+
+def synthetic_users(n: int, rooms: int, seed: int = 0, chunk: int = 10000):
+    """User documents with one random normalized embedding each, generated a chunk at a time"""
+    rng = np.random.default_rng(seed)
+    for start in range(0, n, chunk):
+        vectors = normalize_rows(rng.standard_normal((min(chunk, n - start), 512)).astype(np.float32))
+        for i, vector in enumerate(vectors, start):
+            yield {"user_id": str(i), "profile": {"room": str(i % rooms)},
+                   "faces": [{"embedding": vector, "confidence": 1.0}]}
+
+
+def bench_load(args) -> Dict:
+    seconds = []
+    for _ in range(args.load_repeat):
+        start = time.perf_counter()
+        FaceDetection(**config.detector_kwargs())
+        seconds.append(time.perf_counter() - start)
+    return {"face_detection": {"count": len(seconds), "min_s": round(min(seconds), 3),
+                               "mean_s": round(float(np.mean(seconds)), 3)}}
+
+
+def bench_stages(args, detector: FaceDetection, samples: List[bytes]) -> Dict:
+    images = [decode_image(data) for data in samples]
+    detections = [detector.detect_best(image) for image in images]
+    faces = [(image, det[2]) for image, det in zip(images, detections) if det is not None]
+    if not faces:
+        raise SystemExit("no face found in the sample images")
+    crops = [detector.align_face(image, kps) for image, kps in faces]
+    probes = normalize_rows(detector.embed_aligned(crops))
+
+    gallery = runtime.build_gallery()
+    for doc in synthetic_users(args.stage_gallery, args.rooms):
+        gallery.add_user(doc)
+
+    n = len(images)
+    return {
+        "decode": measure(lambda i: decode_image(samples[i % n]), args.repeat),
+        "detect": measure(lambda i: detector.detect_best(images[i % n]), args.repeat),
+        "align": measure(lambda i: detector.align_face(*faces[i % len(faces)]), args.repeat),
+        "embed": measure(lambda i: detector.embed_aligned([crops[i % len(crops)]]), args.repeat),
+        "search": measure(lambda i: gallery.search(probes[i % len(probes)]), args.repeat),
+    }
+
+
+def verify(gallery, probe: np.ndarray, user_id: str) -> float:
+    """Score of /verify: best similarity over the claimed user's faces"""
+    return max((FaceDetection.compare_faces_with_distance(probe, face, config.VERIFY_THRESHOLD)[1]
+                for face in gallery.user_vectors(user_id)), default=0.0)
+
+
+def bench_gallery(args) -> Dict:
+    """One gallery grown through every size, so the 1M step doesn't hold several copies"""
+    rng = np.random.default_rng(1)
+    probes = normalize_rows(rng.standard_normal((args.queries, 512)).astype(np.float32))
+    gallery = runtime.build_gallery()
+    docs = synthetic_users(max(args.gallery_sizes), args.rooms)
+    results = {}
+    for size in sorted(args.gallery_sizes):
+        added = size - len(gallery)
+        start = time.perf_counter()
+        while len(gallery) < size:
+            gallery.add_user(next(docs))
+        add_s = time.perf_counter() - start
+        results[str(size)] = {
+            "add_per_s": round(added / max(add_s, 1e-9), 1),
+            "search": measure(lambda i: gallery.search(probes[i % args.queries]), args.queries),
+            "search_room": measure(lambda i: gallery.search(probes[i % args.queries], room=str(i % args.rooms)),
+                                   args.queries),
+            "verify": measure(lambda i: verify(gallery, probes[i % args.queries], str(i % size)), args.queries),
+        }
+    return results
+
+
+def bench_http(args, samples: List[bytes]) -> Dict:
+    """Flask app on mongomock: model, gallery and routes are real, the database is not"""
+    import mongomock
+
+    from app.db import mongo
+
+    config.RECOGNIZE_CACHE_SIZE = config.PROFILE_CACHE_SIZE = 0
+    mongo.MongoClient = mongomock.MongoClient
+    mongo._client = None
+    # uploads/ of the registrations goes to a scratch directory
+    workdir = tempfile.mkdtemp(prefix="face-bench-")
+    os.chdir(workdir)
+    from app.main import app
+
+    client = app.test_client()
+    n = len(samples)
+    register_stats, recognize_stats = LatencyStats(), LatencyStats()
+
+    start = time.perf_counter()
+    for i in range(args.http_users):
+        t0 = time.perf_counter()
+        response = client.post("/register", data={
+            "name": f"Bench {i}", "student_id": f"B{i:06d}", "room": str(i % args.rooms),
+            "image": (io.BytesIO(samples[i % n]), "face.png"),
+        }, content_type="multipart/form-data")
+        register_stats.record((time.perf_counter() - t0) * 1000)
+        if response.status_code >= 500:
+            raise SystemExit(f"/register failed: {response.get_json()}")
+    register_s = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for i in range(args.http_requests):
+        t0 = time.perf_counter()
+        client.post("/recognize", data={"image": (io.BytesIO(samples[i % n]), "face.png")},
+                    content_type="multipart/form-data")
+        recognize_stats.record((time.perf_counter() - t0) * 1000)
+    recognize_s = time.perf_counter() - start
+
+    return {
+        "register": {"requests_per_s": round(args.http_users / register_s, 2), **register_stats.summary()},
+        "recognize": {"requests_per_s": round(args.http_requests / recognize_s, 2), **recognize_stats.summary()},
+    }
+
+
+def environment(args) -> Dict:
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                                check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    try:
+        import onnxruntime
+        ort_version = onnxruntime.__version__
+    except ImportError:
+        ort_version = None
+    return {
+        "commit": commit,
+        "created_at": datetime.datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "onnxruntime": ort_version,
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "model": config.MODEL_NAME,
+        "quantized": config.MODEL_QUANTIZED,
+        "argv": sys.argv[1:],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--out", help="write the results to this JSON file (default: stdout)")
+    parser.add_argument("--quick", action="store_true", help="smaller profile for CI")
+    parser.add_argument("--skip", nargs="+", default=[], choices=SUITES)
+    parser.add_argument("--images", default="images/*.png")
+    parser.add_argument("--repeat", type=int, help="timed runs per stage")
+    parser.add_argument("--load-repeat", type=int, help="model loads timed")
+    parser.add_argument("--gallery-sizes", type=int, nargs="+")
+    parser.add_argument("--queries", type=int, help="searches timed per gallery size")
+    parser.add_argument("--stage-gallery", type=int, default=10000, help="gallery size of the search stage")
+    parser.add_argument("--rooms", type=int, default=50)
+    parser.add_argument("--http-users", type=int, help="users registered over HTTP")
+    parser.add_argument("--http-requests", type=int, help="/recognize requests")
+    args = parser.parse_args()
+    for key, value in (QUICK if args.quick else FULL).items():
+        if getattr(args, key) is None:
+            setattr(args, key, value)
+
+    # The http suite changes directory
+    out = os.path.abspath(args.out) if args.out else None
+    samples = read_samples(os.path.abspath(args.images))
+    report = {"environment": environment(args), "results": {}}
+    results = report["results"]
+    if "load" not in args.skip:
+        results["load"] = bench_load(args)
+    if "stages" not in args.skip:
+        results["stages"] = bench_stages(args, FaceDetection(**config.detector_kwargs()), samples)
+    if "gallery" not in args.skip:
+        results["gallery"] = bench_gallery(args)
+    if "http" not in args.skip:
+        results["http"] = bench_http(args, samples)
+
+    text = json.dumps(report, indent=2, sort_keys=True)
+    if out:
+        os.makedirs(os.path.dirname(out), exist_ok=True)
+        with open(out, "w") as f:
+            f.write(text + "\n")
+        print(f"wrote {args.out}")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""
+Two-stage template search vs. exhaustive face search in the resident gallery.
+
+Builds a synthetic gallery (several noisy faces per identity with random detection
+confidences) and runs held-out probes through
+  exhaustive   every enrolled face (GALLERY_TEMPLATES=false)
+  templates    one template per user, then the faces of the top-K users
+reporting top-1 identification accuracy, agreement with the exhaustive result,
+vectors compared per query and p50/p99 latency.
+
+    python -m benchmarks.template_search --users 20000 --faces-per-user 5 --rerank-k 5 10 20
+"""
+import argparse
+import json
+import time
+
+import numpy as np
+
+from app.services.gallery import EmbeddingGallery
+from app.services.search_index import BruteForceIndex, normalize_rows
+
+
+def synthetic_users(n_users: int, faces_per_user: int, dim: int, noise: float, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    centers = normalize_rows(rng.standard_normal((n_users, dim)).astype(np.float32))
+    docs = []
+    for u in range(n_users):
+        faces = centers[u] + noise * rng.standard_normal((faces_per_user, dim)).astype(np.float32)
+        docs.append({
+            "user_id": str(u),
+            "faces": [{"embedding": f, "confidence": float(c)}
+                      for f, c in zip(faces, rng.uniform(0.5, 1.0, faces_per_user))],
+        })
+    return centers, docs
+
+
+def run(gallery: EmbeddingGallery, probes: np.ndarray, truth: np.ndarray):
+    found, latencies = [], []
+    for q in probes:
+        start = time.perf_counter()
+        match = gallery.search(q)
+        latencies.append((time.perf_counter() - start) * 1000)
+        found.append(match[0] if match else None)
+    accuracy = float(np.mean([f == str(t) for f, t in zip(found, truth)]))
+    return found, accuracy, np.percentile(latencies, [50, 99])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=20000)
+    parser.add_argument("--faces-per-user", type=int, default=5)
+    parser.add_argument("--dim", type=int, default=512)
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--noise", type=float, default=0.05, help="per-dimension noise around each identity")
+    parser.add_argument("--rerank-k", type=int, nargs="+", default=[1, 5, 10, 20])
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    centers, docs = synthetic_users(args.users, args.faces_per_user, args.dim, args.noise)
+    rng = np.random.default_rng(1)
+    truth = rng.integers(0, args.users, args.queries)
+    probes = normalize_rows(centers[truth] + args.noise * rng.standard_normal((args.queries, args.dim)).astype(np.float32))
+    n_faces = args.users * args.faces_per_user
+
+    exhaustive = EmbeddingGallery(dim=args.dim)
+    exhaustive.load_documents(docs)
+    reference, accuracy, (p50, p99) = run(exhaustive, probes, truth)
+    rows = [{"search": "exhaustive", "rerank_k": None, "accuracy": round(accuracy, 4), "agreement": 1.0,
+             "compared": n_faces, "p50_ms": round(float(p50), 3), "p99_ms": round(float(p99), 3)}]
+
+    for k in args.rerank_k:
+        gallery = EmbeddingGallery(dim=args.dim, template_index=BruteForceIndex(args.dim), rerank_k=k)
+        gallery.load_documents(docs)
+        found, accuracy, (p50, p99) = run(gallery, probes, truth)
+        rows.append({
+            "search": "templates", "rerank_k": k, "accuracy": round(accuracy, 4),
+            "agreement": round(float(np.mean([f == r for f, r in zip(found, reference)])), 4),
+            "compared": args.users + min(k, args.users) * args.faces_per_user,
+            "p50_ms": round(float(p50), 3), "p99_ms": round(float(p99), 3),
+        })
+
+    print(f"{args.users} users x {args.faces_per_user} faces, {args.queries} probes, noise {args.noise}")
+    print(f"{'search':<11} {'k':>4} {'top-1 acc':>10} {'agree':>7} {'compared':>9} {'p50 ms':>8} {'p99 ms':>8}")
+    for r in rows:
+        print(f"{r['search']:<11} {r['rerank_k'] or '-':>4} {r['accuracy']:>10.4f} {r['agreement']:>7.4f} "
+              f"{r['compared']:>9} {r['p50_ms']:>8.3f} {r['p99_ms']:>8.3f}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(rows, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
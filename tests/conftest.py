@@ -0,0 +1,48 @@
+import datetime
+
+import numpy as np
+import pytest
+
+from app.models.embedding import encode_embedding
+
+
+def _bulk_write(collection, ops, ordered=True, **kwargs):
+    """bulk_write applied one operation at a time: mongomock doesn't accept current pymongo's UpdateOne"""
+    from pymongo import InsertOne, UpdateOne
+
+    class Result:
+        modified_count = 0
+
+    result = Result()
+    for op in ops:
+        if isinstance(op, UpdateOne):
+            result.modified_count += collection.update_one(op._filter, op._doc, upsert=op._upsert).modified_count
+        elif isinstance(op, InsertOne):
+            collection.insert_one(op._doc)
+        else:
+            raise NotImplementedError(type(op).__name__)
+    return result
+
+
+@pytest.fixture
+def db(monkeypatch):
+    """In-memory MongoDB database (mongomock)"""
+    mongomock = pytest.importorskip("mongomock")
+    monkeypatch.setattr(mongomock.collection.Collection, "bulk_write", _bulk_write)
+    return mongomock.MongoClient().get_database("face_test")
+
+
+@pytest.fixture
+def user_doc():
+    """Builds a user document as the API stores it: (user_id, vectors, room=None, **fields) -> dict"""
+    def build(user_id, vectors, room=None, **fields):
+        vectors = np.atleast_2d(np.asarray(vectors, dtype=np.float32))
+        return {
+            "user_id": user_id,
+            "profile": {"student_id": user_id, "room": room},
+            "faces": [{"embedding": encode_embedding(v), "confidence": 0.9, "image_path": None}
+                      for v in vectors],
+            "updated_at": datetime.datetime.now().isoformat(),
+            **fields,
+        }
+    return build
@@ -0,0 +1,58 @@
+import io
+import sys
+import threading
+
+import cv2
+import numpy as np
+import pytest
+
+from app import config
+from app.services.gallery import EmbeddingGallery
+from app.services.lifecycle import Deferred
+
+
+class FakeDetector:
+    def get_best_face(self, image):
+        return {"embedding": np.ones(4, np.float32) / 2, "conf": 0.9, "box": [0, 0, 8, 8]}
+
+
+@pytest.fixture
+def main(monkeypatch, tmp_path):
+    """app.main imported afresh, on mongomock, with nothing loaded at startup"""
+    mongomock = pytest.importorskip("mongomock")
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr("app.db.mongo.MongoClient", mongomock.MongoClient)
+    monkeypatch.setattr("app.db.mongo._client", None)
+    for name, value in {"STARTUP_MODE": "lazy", "GALLERY_SYNC_INTERVAL_S": 0, "GALLERY_SNAPSHOT": "",
+                        "FACE_STORE_DIR": str(tmp_path / "store"), "READY_WAIT_S": 0.05}.items():
+        monkeypatch.setattr(config, name, value)
+    monkeypatch.delitem(sys.modules, "app.main", raising=False)
+    from app import main
+    return main
+
+
+def test_recognize_while_the_gallery_loads(main, monkeypatch):
+    loaded = threading.Event()
+
+    def load_gallery():
+        loaded.wait(5)
+        return EmbeddingGallery(dim=4)
+
+    monkeypatch.setattr(main, "face_detector", Deferred("model", FakeDetector))
+    monkeypatch.setattr(main, "gallery", Deferred("gallery", load_gallery).start())
+    image = cv2.imencode(".jpg", np.zeros((32, 32, 3), np.uint8))[1].tobytes()
+    client = main.app.test_client()
+
+    def recognize():
+        return client.post("/recognize", data={"image": (io.BytesIO(image), "probe.jpg")})
+
+    response = recognize()
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == str(config.READY_RETRY_AFTER_S)
+    assert "gallery is still loading" in response.get_json()["error"]
+
+    loaded.set()
+    main.gallery.get(timeout=5)
+    response = recognize()
+    assert response.status_code == 404
+    assert response.get_json()["recognized"] is False
@@ -0,0 +1,86 @@
+import numpy as np
+
+from app.services.cache import TTLCache, image_digest
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_entries_expire_after_ttl():
+    clock = Clock()
+    cache = TTLCache(max_size=10, ttl_s=5, clock=clock)
+    cache.set("a", 1)
+
+    clock.now = 4.9
+    assert cache.get("a") == 1
+    clock.now = 5.0
+    assert cache.get("a", "gone") == "gone"
+    assert len(cache) == 0
+    assert cache.stats()["expirations"] == 1
+
+
+def test_least_recently_used_is_evicted():
+    cache = TTLCache(max_size=2, ttl_s=60)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)
+
+    assert cache.get("b") is None
+    assert cache.get("a") == 1 and cache.get("c") == 3
+    assert cache.stats()["evictions"] == 1
+
+
+def test_zero_size_disables_caching():
+    cache = TTLCache(max_size=0)
+    cache.set("a", 1)
+
+    assert cache.get("a") is None
+    assert len(cache) == 0
+
+
+def test_pop_clear_and_stats():
+    cache = TTLCache(max_size=10, ttl_s=60)
+    for key in "abc":
+        cache.set(key, key)
+    cache.pop("a", "missing")
+    assert cache.get("a") is None and cache.get("b") == "b"
+
+    cache.clear()
+
+    stats = cache.stats()
+    assert stats["size"] == 0
+    assert stats["invalidations"] == 3
+    assert (stats["hits"], stats["misses"], stats["hit_ratio"]) == (1, 1, 0.5)
+
+
+def test_image_digest_depends_on_pixels_and_shape():
+    image = np.zeros((4, 6, 3), dtype=np.uint8)
+
+    assert image_digest(image) == image_digest(image.copy())
+    assert image_digest(image) != image_digest(image.reshape(6, 4, 3))
+    changed = image.copy()
+    changed[0, 0, 0] = 1
+    assert image_digest(image) != image_digest(changed)
+    # Views hash their pixels, not the underlying buffer
+    assert image_digest(np.zeros((8, 6, 3), dtype=np.uint8)[::2]) == image_digest(image)
+
+
+def test_set_is_skipped_after_an_invalidation():
+    cache = TTLCache(max_size=10, ttl_s=60)
+    generation = cache.generation
+    cache.clear()  # e.g. a registration while the value was being computed
+
+    cache.set("a", "stale", generation=generation)
+    assert cache.get("a") is None
+
+    generation = cache.generation
+    cache.set("a", "fresh", generation=generation)
+    assert cache.get("a") == "fresh"
+    cache.pop("b")
+    assert cache.generation == generation + 1
@@ -0,0 +1,33 @@
+from app.services.enrollment import _images_by_student, read_roster
+
+
+def test_images_by_student():
+    index = _images_by_student(["S1.jpg", "S1_2.jpg", "photos/S2/front.png", "photos\\S3\\a.jpg"])
+
+    assert index["S1"] == ["S1.jpg", "S1_2.jpg"]
+    assert index["S2"] == ["photos/S2/front.png"]
+    assert index["S3"] == ["photos\\S3\\a.jpg"]
+
+
+def test_only_numeric_suffixes_are_stripped():
+    index = _images_by_student(["CS_2021_001.jpg", "CS_2021_001_2.jpg", "A_front.jpg"])
+
+    assert index["CS_2021_001"] == ["CS_2021_001.jpg", "CS_2021_001_2.jpg"]
+    assert "CS" not in index
+    assert "A" not in index
+
+
+def test_exact_stem_match_is_preferred():
+    names = ["A.jpg", "A_1.jpg", "A_2.jpg"]
+
+    assert _images_by_student(names)["A"] == names
+    index = _images_by_student(names, ["A", "A_1"])
+    assert index["A"] == ["A.jpg", "A_2.jpg"]
+    assert index["A_1"] == ["A_1.jpg"]
+
+
+def test_read_roster_normalizes_headers(tmp_path):
+    path = tmp_path / "roster.csv"
+    path.write_text("\ufeffStudent_ID, Name ,Room\nS1, An ,A101\n", encoding="utf-8")
+
+    assert read_roster(str(path)) == [{"student_id": "S1", "name": "An", "room": "A101"}]
@@ -0,0 +1,81 @@
+import cv2
+import numpy as np
+import pytest
+
+from app.services.face_quality import (BLURRY, FACE_TOO_SMALL, HEAD_TILTED, HEAD_TURNED, TOO_BRIGHT, TOO_DARK,
+                                       QualityGate, estimate_pose)
+
+# Frontal landmarks: left eye, right eye, nose, left and right mouth corner
+FRONTAL = np.array([[40, 50], [80, 50], [60, 70], [45, 90], [75, 90]], dtype=np.float32)
+BOX = (10, 10, 110, 130)
+
+
+def textured(mean=128, size=160, seed=0):
+    """Sharp synthetic face: noise around `mean`"""
+    noise = np.random.default_rng(seed).normal(0, 30, (size, size)).astype(np.float32)
+    gray = np.clip(mean + noise, 0, 255).astype(np.uint8)
+    return cv2.cvtColor(gray, cv2.COLOR_GRAY2BGR)
+
+
+def rotate(points, degrees, center=(60, 70)):
+    angle = np.radians(degrees)
+    rotation = np.array([[np.cos(angle), -np.sin(angle)], [np.sin(angle), np.cos(angle)]], dtype=np.float32)
+    return (points - center) @ rotation.T + center
+
+
+def test_frontal_pose():
+    yaw, roll = estimate_pose(FRONTAL)
+
+    assert yaw == pytest.approx(0, abs=1e-4)
+    assert roll == pytest.approx(0, abs=1e-4)
+
+
+def test_roll_follows_the_eye_line():
+    yaw, roll = estimate_pose(rotate(FRONTAL, 30))
+
+    assert roll == pytest.approx(30, abs=0.01)
+    assert yaw == pytest.approx(0, abs=0.01)
+
+
+def test_yaw_from_nose_offset():
+    turned = FRONTAL.copy()
+    turned[2, 0] += 20  # nose moved by half the eye distance
+
+    yaw, _ = estimate_pose(turned)
+
+    assert yaw == pytest.approx(45, abs=0.01)
+    assert estimate_pose(FRONTAL[[0, 0, 2, 3, 4]])[0] == 90.0
+
+
+def test_good_face_passes():
+    reason, measures = QualityGate().assess(textured(), BOX, FRONTAL)
+
+    assert reason is None
+    assert set(measures) == {"size", "yaw", "roll", "brightness", "sharpness"}
+
+
+@pytest.mark.parametrize("image,box,kps,expected", [
+    (textured(), (10, 10, 40, 40), FRONTAL, FACE_TOO_SMALL),
+    (textured(), BOX, np.array([[40, 50], [80, 50], [85, 70], [45, 90], [75, 90]], np.float32), HEAD_TURNED),
+    (textured(), BOX, rotate(FRONTAL, 60), HEAD_TILTED),
+    (textured(mean=15), BOX, FRONTAL, TOO_DARK),
+    (textured(mean=245), BOX, FRONTAL, TOO_BRIGHT),
+    (np.full((160, 160, 3), 128, np.uint8), BOX, FRONTAL, BLURRY),
+])
+def test_rejection_reasons(image, box, kps, expected):
+    reason, _ = QualityGate().assess(image, box, kps)
+
+    assert reason == expected
+
+
+def test_zero_threshold_disables_check():
+    flat = np.full((160, 160, 3), 128, np.uint8)
+    gate = QualityGate(min_sharpness=0, max_yaw=0)
+
+    assert gate.assess(flat, BOX, None) == (None, {"size": 100.0, "brightness": 128.0})
+
+
+def test_box_outside_the_image():
+    reason, _ = QualityGate(min_size=10).assess(textured(size=50), (60, 60, 120, 120), None)
+
+    assert reason == FACE_TOO_SMALL
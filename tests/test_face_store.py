@@ -0,0 +1,60 @@
+import numpy as np
+import pytest
+
+from app import handlers
+from app.services.face_store import FaceStore
+
+
+@pytest.fixture
+def store(tmp_path):
+    return FaceStore(str(tmp_path / "store"))
+
+
+@pytest.fixture
+def chip():
+    return np.random.default_rng(0).integers(0, 256, (112, 112, 3), dtype=np.uint8)
+
+
+def enroll(users_col, user_id, key):
+    users_col.insert_one({"user_id": user_id, "faces": [{"chip": key, "image_path": None}]})
+
+
+def test_chip_round_trip(store, chip):
+    key = store.put(chip, "alice")
+
+    assert key == FaceStore.key(chip, "alice")
+    assert store.put(chip, "alice") == key
+    assert np.array_equal(store.get(key), chip)
+    assert list(store.keys()) == [key]
+
+
+def test_deleting_a_user_keeps_the_chip_of_another_with_the_same_face(db, store, chip):
+    users = db["users"]
+    alice, bob = store.put(chip, "alice"), store.put(chip, "bob")
+    assert alice != bob
+    enroll(users, "alice", alice)
+    # bob's chip is on disk, the document not inserted yet (enrollment in flight)
+
+    user = users.find_one_and_delete({"user_id": "alice"})
+    files = handlers.remove_user_files(users, store, user)
+
+    assert files["deleted_chips"] == 1
+    assert store.get(alice) is None
+    assert np.array_equal(store.get(bob), chip)
+
+
+def test_shared_legacy_chip_is_kept_while_referenced(db, store, chip):
+    users = db["users"]
+    # Stored before chips had an owner: both users refer to the pixel digest
+    legacy = FaceStore.key(chip)
+    store._write(store._path("chips", legacy, "png"), store._encode(chip, "png"))
+    enroll(users, "alice", legacy)
+    enroll(users, "bob", legacy)
+
+    files = handlers.remove_user_files(users, store, users.find_one_and_delete({"user_id": "alice"}))
+    assert files["deleted_chips"] == 0
+    assert store.get(legacy) is not None
+
+    files = handlers.remove_user_files(users, store, users.find_one_and_delete({"user_id": "bob"}))
+    assert files["deleted_chips"] == 1
+    assert store.get(legacy) is None
@@ -0,0 +1,235 @@
+import datetime
+
+import numpy as np
+import pytest
+
+from app import config
+from app.models.embedding import version_key
+from app.runtime import collection_fingerprint
+from app.services.gallery import EmbeddingGallery, assign_one_to_one
+from app.services.gallery_sync import (CHANGED_FIELD, STAMP, TOMBSTONES, GallerySync, change_marks,
+                                      insert_stamped, tombstone)
+from app.services.search_index import BruteForceIndex, normalize_rows
+
+DIM = 64
+
+
+def unit_vectors(n, seed=0):
+    return normalize_rows(np.random.default_rng(seed).standard_normal((n, DIM)).astype(np.float32))
+
+
+def new_gallery(templates=False):
+    return EmbeddingGallery(dim=DIM, index=BruteForceIndex(DIM),
+                            template_index=BruteForceIndex(DIM) if templates else None, rerank_k=2)
+
+
+@pytest.fixture
+def faces():
+    return unit_vectors(6)
+
+
+@pytest.fixture
+def docs(user_doc, faces):
+    return [user_doc("alice", faces[0:2], room="A101"),
+            user_doc("bob", faces[2:4], room="A101"),
+            user_doc("carol", faces[4:6], room="B202")]
+
+
+@pytest.mark.parametrize("templates", [False, True])
+def test_search_finds_owner(docs, faces, templates):
+    gallery = new_gallery(templates)
+    assert gallery.load_documents(docs) == 6
+    assert gallery.user_count == 3
+
+    for i, owner in enumerate(["alice", "alice", "bob", "bob", "carol", "carol"]):
+        user_id, similarity = gallery.search(faces[i])
+        assert user_id == owner
+        assert similarity == pytest.approx(1.0, abs=1e-5)
+
+
+@pytest.mark.parametrize("templates", [False, True])
+def test_search_restricted_to_room(docs, faces, templates):
+    gallery = new_gallery(templates)
+    gallery.load_documents(docs)
+
+    user_id, similarity = gallery.search(faces[4], room="A101")
+    assert user_id in ("alice", "bob") and similarity < 0.99
+    assert gallery.search(faces[4], room="B202")[0] == "carol"
+    assert gallery.search(faces[4], room="nowhere") is None
+
+
+def test_add_update_remove(docs, faces, user_doc):
+    gallery = new_gallery(templates=True)
+    gallery.load_documents(docs[:2])
+    assert gallery.search(faces[4])[0] != "carol"
+
+    assert gallery.add_user(docs[2]) == 2
+    assert gallery.search(faces[4])[0] == "carol"
+
+    assert gallery.update_user(user_doc("carol", faces[5], room="B202")) == 1
+    assert len(gallery) == 5
+    assert gallery.search(faces[4], room="B202")[1] < 0.99
+
+    assert gallery.remove_user("carol") == 1
+    assert gallery.remove_user("carol") == 0
+    assert "carol" not in gallery.user_ids()
+    assert gallery.search(faces[5], room="B202") is None
+    assert len(gallery) == 4
+
+
+def test_search_many_and_similar_users(docs, faces):
+    gallery = new_gallery()
+    gallery.load_documents(docs)
+
+    results = gallery.search_many(faces[[0, 5]], k=3)
+    assert [r[0][0] for r in results] == ["alice", "carol"]
+    assert len({user_id for user_id, _ in results[0]}) == len(results[0])
+
+    similar = gallery.similar_users(faces[[2]], threshold=0.99)
+    assert [user_id for user_id, _ in similar] == ["bob"]
+    assert gallery.similar_users(unit_vectors(1, seed=42), threshold=0.99) == []
+
+
+def test_assign_one_to_one():
+    candidates = [[("alice", 0.9)], [("alice", 0.8), ("bob", 0.75)], [("bob", 0.5)]]
+
+    # The closer face gets alice, the other falls back to bob; below the threshold stays unmatched
+    assert assign_one_to_one(candidates, threshold=0.7) == [("alice", 0.9), ("bob", 0.75), None]
+
+
+def test_version_filter(user_doc, faces):
+    gallery = EmbeddingGallery(dim=DIM, version="model-b")
+    doc = user_doc("dave", faces[0], embedding_version="model-a")
+    doc["faces"][0]["embeddings"] = {version_key("model-b"): doc["faces"][0]["embedding"]}
+    other = user_doc("erin", faces[1], embedding_version="model-a")
+
+    gallery.load_documents([doc, other])
+
+    assert gallery.user_ids() == ["dave"]
+
+
+@pytest.mark.parametrize("templates", [False, True])
+def test_snapshot_round_trip(tmp_path, docs, faces, templates):
+    gallery = new_gallery(templates)
+    gallery.load_documents(docs)
+    path = str(tmp_path / "gallery.snap")
+    fingerprint = {"count": 3, "last_id": "x", "updated_at": "y"}
+    assert gallery.save_snapshot(path, fingerprint) == 6
+
+    restored = new_gallery(templates)
+    assert restored.load_snapshot(path, fingerprint) == 6
+
+    assert sorted(restored.user_ids()) == ["alice", "bob", "carol"]
+    for i, owner in enumerate(["alice", "alice", "bob", "bob", "carol", "carol"]):
+        assert restored.search(faces[i])[0] == owner
+    assert restored.search(faces[0], room="B202")[0] == "carol"
+
+
+def test_snapshot_rejected_when_stale(tmp_path, docs):
+    gallery = new_gallery()
+    gallery.load_documents(docs)
+    path = str(tmp_path / "gallery.snap")
+    gallery.save_snapshot(path, {"count": 3})
+
+    assert new_gallery().load_snapshot(path, {"count": 4}) is None
+    assert new_gallery(templates=True).load_snapshot(path, {"count": 3}) is None
+    assert new_gallery().load_snapshot(str(tmp_path / "missing.snap")) is None
+
+
+class Recorded:
+    """A collection recording the filter of every find()"""
+
+    def __init__(self, col):
+        self.col, self.queries = col, []
+
+    def find(self, query=None, *args, **kwargs):
+        self.queries.append(query)
+        return self.col.find(query, *args, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self.col, name)
+
+
+def test_sync_applies_writes_of_other_processes(db, docs, faces):
+    users, tombstones = Recorded(db["users"]), db[TOMBSTONES]
+    for doc in docs[:2]:
+        users.update_one(*insert_stamped(doc), upsert=True)
+    gallery = new_gallery()
+    gallery.change_marks = change_marks(users, tombstones)
+    gallery.load_from_collection(users.col)
+    changes = []
+    sync = GallerySync(users, tombstones, gallery, interval_s=0, on_change=lambda: changes.append(1))
+
+    # The first poll re-reads the overlap before the load, later ones skip what was applied
+    sync.poll()
+    changes.clear()
+    assert sync.poll() is False
+
+    users.update_one(*insert_stamped(docs[2]), upsert=True)
+    assert sync.poll() is True
+    assert gallery.search(faces[4])[0] == "carol"
+
+    users.delete_one({"user_id": "alice"})
+    tombstones.update_one(*tombstone("alice"), upsert=True)
+    assert sync.poll() is True
+    assert sorted(gallery.user_ids()) == ["bob", "carol"]
+    assert sync.poll() is False
+    assert len(changes) == 2
+    assert sync.stats["removed"] == 1
+    # Only ranges of the change stamps, never the whole collection
+    assert all(CHANGED_FIELD in query for query in users.queries)
+
+
+def test_sync_reads_writes_committed_late(db, docs, faces):
+    users, tombstones = db["users"], db[TOMBSTONES]
+    t0 = datetime.datetime(2024, 1, 1, 12, 0, 0)
+    users.insert_one(dict(docs[0], **{CHANGED_FIELD: t0}))
+    gallery = new_gallery()
+    gallery.change_marks = change_marks(users, tombstones)
+    gallery.load_from_collection(users)
+    sync = GallerySync(users, tombstones, gallery, interval_s=0, overlap_s=30)
+    sync.poll()
+    users.insert_one(dict(docs[1], **{CHANGED_FIELD: t0 + datetime.timedelta(seconds=10)}))
+    assert sync.poll() is True
+
+    # Stamped before bob by the server, committed after the poll that read bob
+    users.insert_one(dict(docs[2], **{CHANGED_FIELD: t0 + datetime.timedelta(seconds=5)}))
+    assert sync.poll() is True
+    assert sorted(gallery.user_ids()) == ["alice", "bob", "carol"]
+    assert sync.poll() is False
+
+
+def test_sync_reapplies_rewritten_embeddings(db, docs, faces, user_doc):
+    users, tombstones = db["users"], db[TOMBSTONES]
+    users.update_one(*insert_stamped(docs[2]), upsert=True)
+    gallery = new_gallery()
+    gallery.change_marks = change_marks(users, tombstones)
+    gallery.load_from_collection(users)
+    sync = GallerySync(users, tombstones, gallery, interval_s=0)
+
+    # A re-embedding job rewrites the vectors and the server stamp
+    rewritten = user_doc("carol", faces[5], room="B202")
+    users.update_one({"user_id": "carol"}, {"$set": {"faces": rewritten["faces"]}, **STAMP})
+    assert sync.poll() is True
+    assert len(gallery) == 1
+
+
+def test_fingerprint_covers_model_and_index_settings(db, monkeypatch):
+    users = db["users"]
+    users.insert_one({"user_id": "alice", CHANGED_FIELD: datetime.datetime(2024, 1, 1)})
+    monkeypatch.setattr(config, "INDEX_BACKEND", "ivf")
+    monkeypatch.setattr(config, "IVF_NPROBE", 8)
+    base = collection_fingerprint(users)
+
+    assert collection_fingerprint(users) == base
+    monkeypatch.setattr(config, "IVF_NPROBE", 16)
+    assert collection_fingerprint(users) != base
+    monkeypatch.setattr(config, "IVF_NPROBE", 8)
+    monkeypatch.setattr(config, "EMBEDDING_VERSION", "model-b")
+    assert collection_fingerprint(users) != base
+    monkeypatch.setattr(config, "EMBEDDING_VERSION", base["embedding_version"])
+    monkeypatch.setattr(config, "INDEX_BACKEND", "brute")
+    assert collection_fingerprint(users) != base
+    monkeypatch.setattr(config, "INDEX_BACKEND", "ivf")
+    users.update_one({"user_id": "alice"}, STAMP)
+    assert collection_fingerprint(users) != base
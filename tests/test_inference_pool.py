@@ -0,0 +1,49 @@
+import queue
+import threading
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy as np
+import pytest
+
+from app.services.inference_pool import InferencePool, PoolBusyError
+
+
+@pytest.fixture
+def pool():
+    """One-slot pool whose worker is the test: tasks and answers go through plain queues"""
+    pool = InferencePool(workers=1, slots=1, slot_bytes=64, acquire_timeout=0.05, request_timeout=0.05)
+    pool._shm = [SharedMemory(create=True, size=pool.slot_bytes)]
+    pool._free_slots.put(0)
+    pool._tasks, pool._results = queue.Queue(), queue.Queue()
+    pool._listener = threading.Thread(target=pool._collect_results, daemon=True)
+    pool._listener.start()
+    pool._started = True
+    yield pool
+    pool.close()
+    pool._listener.join(timeout=1)
+
+
+def test_timed_out_request_keeps_its_slot_until_answered(pool):
+    image = np.zeros((4, 4, 3), np.uint8)
+    with pytest.raises(TimeoutError):
+        pool.get_best_face(image)
+
+    # The worker may still be reading the image: nobody may overwrite the slot
+    with pytest.raises(PoolBusyError):
+        pool.get_best_face(image)
+    assert pool.queue_depth == 1
+
+    request_id, _, slot, *_ = pool._tasks.get_nowait()
+    pool._results.put((request_id, True, {"late": True}, ()))
+    assert pool._free_slots.get(timeout=1) == slot
+    pool._free_slots.put(slot)
+    assert pool.queue_depth == 0
+
+    def answer():
+        request_id, *_ = pool._tasks.get(timeout=1)
+        pool._results.put((request_id, True, {"box": [1, 2, 3, 4]}, ()))
+
+    worker = threading.Thread(target=answer)
+    worker.start()
+    assert pool.get_best_face(image, timeout=1) == {"box": [1, 2, 3, 4]}
+    worker.join()
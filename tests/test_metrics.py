@@ -0,0 +1,59 @@
+from app.services.metrics import (REGISTRY, MetricsRegistry, capture_model_metrics, model_stage, record_model_metric,
+                                 replay_model_metrics)
+
+
+def stage_count(stage):
+    line = f'face_model_stage_seconds_count{{stage="{stage}"}} '
+    return next((int(l[len(line):]) for l in REGISTRY.render().splitlines() if l.startswith(line)), 0)
+
+
+def test_captured_stages_are_recorded_on_replay():
+    before = stage_count("test_capture")
+    with capture_model_metrics() as events:
+        with model_stage("test_capture"):
+            pass
+
+    assert [(kind, label) for kind, label, _ in events] == [("stage", "test_capture")]
+    assert stage_count("test_capture") == before
+
+    replay_model_metrics(events)
+
+    assert stage_count("test_capture") == before + 1
+
+
+def test_stages_outside_a_capture_are_recorded_directly():
+    before = stage_count("test_direct")
+    with model_stage("test_direct"):
+        pass
+
+    assert stage_count("test_direct") == before + 1
+
+
+def test_histogram_buckets_are_cumulative():
+    registry = MetricsRegistry()
+    histogram = registry.histogram("h", "help", ("route",), buckets=(0.1, 1.0))
+    for value in (0.05, 0.5, 5.0):
+        histogram.observe(value, "r")
+
+    lines = registry.render().splitlines()
+
+    assert 'h_bucket{route="r",le="0.1"} 1' in lines
+    assert 'h_bucket{route="r",le="1.0"} 2' in lines
+    assert 'h_bucket{route="r",le="+Inf"} 3' in lines
+    assert 'h_count{route="r"} 3' in lines
+
+
+def test_captured_quality_checks_are_counted_on_replay():
+    line = 'face_quality_checks_total{result="test_reason"} '
+
+    def count():
+        return next((float(l[len(line):]) for l in REGISTRY.render().splitlines() if l.startswith(line)), 0)
+
+    before = count()
+    with capture_model_metrics() as events:
+        record_model_metric("quality", "test_reason")
+    assert count() == before
+
+    replay_model_metrics(events)
+
+    assert count() == before + 1
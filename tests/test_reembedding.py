@@ -0,0 +1,86 @@
+import numpy as np
+import pytest
+
+from app.models.embedding import decode_embedding, version_key
+from app.services.face_store import FaceStore
+from app.services.reembedding import Reembedding
+
+VERSION = "model-b"
+
+
+class ChipEmbedder:
+    """Embeds a chip as its mean color; fails once `fail_after` chips have been embedded"""
+
+    chip_size = 112
+
+    def __init__(self, fail_after=None):
+        self.fail_after = fail_after
+        self.embedded = 0
+
+    def embed_aligned(self, chips):
+        if self.fail_after is not None and self.embedded + len(chips) > self.fail_after:
+            raise RuntimeError("model crashed")
+        self.embedded += len(chips)
+        return [np.full(4, chip.mean(), dtype=np.float32) for chip in chips]
+
+    def get_best_faces(self, images, check_quality=True):
+        return [None for _ in images]
+
+
+@pytest.fixture
+def users(db, tmp_path):
+    store = FaceStore(str(tmp_path / "store"))
+    users_col = db["users"]
+    for i in range(6):
+        chip = np.full((112, 112, 3), 10 * i, dtype=np.uint8)
+        users_col.insert_one({"_id": i, "user_id": f"u{i}", "updated_at": "2024-01-01T00:00:00",
+                              "faces": [{"chip": store.put(chip, f"u{i}"), "image_path": None}]})
+    return users_col, store
+
+
+def run(db, users, detector, **kwargs):
+    users_col, store = users
+    return Reembedding(users_col, db["jobs"], detector, VERSION, page_size=2, batch_size=2, workers=1,
+                       face_store=store).run(**kwargs)
+
+
+def test_reembeds_every_chip(db, users):
+    stats = run(db, users, ChipEmbedder())
+
+    assert (stats["faces"], stats["chips"], stats["failed"], stats["pages"]) == (6, 6, 0, 3)
+    doc = users[0].find_one({"_id": 3})
+    assert decode_embedding(doc["faces"][0]["embeddings"][version_key(VERSION)])[0] == pytest.approx(30)
+    # Moves the collection fingerprint, so snapshots and other processes' galleries catch up,
+    # without touching the profile's updated_at
+    assert doc["embeddings_updated_at"]
+    assert doc["updated_at"] == "2024-01-01T00:00:00"
+
+
+def test_resumes_after_the_last_written_page(db, users):
+    with pytest.raises(RuntimeError):
+        run(db, users, ChipEmbedder(fail_after=3))
+    job = db["jobs"].find_one({"job_id": version_key(VERSION)})
+    assert job["status"] == "failed" and job["last_id"] == 1
+    assert job["progress"]["faces"] == 2
+
+    detector = ChipEmbedder()
+    stats = run(db, users, detector)
+
+    assert detector.embedded == 4
+    assert stats["faces"] == 6
+    assert users[0].count_documents({f"faces.embeddings.{version_key(VERSION)}": {"$exists": True}}) == 6
+
+
+def test_completed_job_only_embeds_new_faces(db, users):
+    run(db, users, ChipEmbedder())
+    users_col, store = users
+    users_col.insert_one({"_id": 6, "user_id": "u6",
+                          "faces": [{"chip": store.put(np.zeros((112, 112, 3), np.uint8), "u6"), "image_path": None},
+                                    {"chip": None, "image_path": "/missing.jpg"}]})
+
+    detector = ChipEmbedder()
+    stats = run(db, users, detector)
+
+    assert detector.embedded == 1
+    assert stats["skipped"] == 6
+    assert stats["errors"][0]["reason"] == "missing_image"
@@ -0,0 +1,179 @@
+import numpy as np
+import pytest
+
+from app.services.search_index import BruteForceIndex, IVFIndex, create_index, load_index, normalize_rows
+
+DIM = 64
+
+
+def unit_vectors(n, seed=0, dim=DIM):
+    return normalize_rows(np.random.default_rng(seed).standard_normal((n, dim)).astype(np.float32))
+
+
+def noisy(vectors, scale=0.1, seed=1):
+    return normalize_rows(vectors + scale * np.random.default_rng(seed).standard_normal(vectors.shape).astype(np.float32))
+
+
+def trained(kind, n=2000, **params):
+    index = create_index(kind, dim=DIM, min_train=n, **params)
+    vectors = unit_vectors(n)
+    index.add(np.arange(n), vectors)
+    return index, vectors
+
+
+def test_brute_force_returns_exact_top_k():
+    vectors = unit_vectors(300)
+    index = BruteForceIndex(DIM)
+    index.add(np.arange(300), vectors)
+    queries = unit_vectors(5, seed=7)
+
+    scores, labels = index.search(queries, k=3)
+
+    expected = np.argsort(-(queries @ vectors.T), axis=1)[:, :3]
+    np.testing.assert_array_equal(labels, expected)
+    np.testing.assert_allclose(scores, np.take_along_axis(queries @ vectors.T, expected, axis=1), rtol=1e-5)
+
+
+def test_brute_force_pads_missing_results():
+    index = BruteForceIndex(DIM)
+    index.add([4], unit_vectors(1))
+
+    scores, labels = index.search(unit_vectors(1, seed=3), k=3)
+
+    assert labels[0].tolist() == [4, -1, -1]
+    assert np.isneginf(scores[0, 1:]).all()
+
+
+def test_brute_force_allowed_and_remove():
+    vectors = unit_vectors(50)
+    index = BruteForceIndex(DIM)
+    index.add(np.arange(100, 150), vectors)
+
+    _, labels = index.search(vectors[3], k=1, allowed=[110, 120])
+    assert labels[0, 0] in (110, 120)
+
+    assert index.remove([103, 999]) == 1
+    assert len(index) == 49
+    _, labels = index.search(vectors[3], k=1)
+    assert labels[0, 0] != 103
+
+
+def test_reconstruct_by_label():
+    vectors = unit_vectors(20)
+    index = BruteForceIndex(DIM)
+    index.add(np.arange(20), vectors)
+
+    labels, found = index.reconstruct([5, 2, 77])
+
+    assert sorted(labels.tolist()) == [2, 5]
+    np.testing.assert_allclose(found[labels.tolist().index(5)], vectors[5], atol=1e-6)
+
+
+def test_ivf_scans_exactly_until_trained():
+    index = IVFIndex(DIM, nlist=8, nprobe=1, min_train=100)
+    vectors = unit_vectors(50)
+    index.add(np.arange(50), vectors)
+    assert not index.is_trained
+
+    _, labels = index.search(vectors[:10], k=1)
+    assert labels[:, 0].tolist() == list(range(10))
+
+
+def test_ivf_matches_brute_force_when_probing_every_list():
+    index, vectors = trained("ivf", nlist=16, nprobe=16)
+    assert index.is_trained and len(index) == 2000
+    brute = BruteForceIndex(DIM)
+    brute.add(np.arange(2000), vectors)
+    queries = unit_vectors(20, seed=5)
+
+    scores, labels = index.search(queries, k=5)
+    brute_scores, brute_labels = brute.search(queries, k=5)
+
+    np.testing.assert_array_equal(labels, brute_labels)
+    np.testing.assert_allclose(scores, brute_scores, rtol=1e-5)
+
+
+def test_ivf_finds_near_duplicates_with_few_probes():
+    index, vectors = trained("ivf", nlist=16, nprobe=4)
+    queries = noisy(vectors[:100])
+
+    _, labels = index.search(queries, k=1)
+
+    assert (labels[:, 0] == np.arange(100)).mean() >= 0.9
+
+
+def test_ivf_scores_a_small_allowed_set_exactly():
+    index, vectors = trained("ivf", nlist=16, nprobe=1)
+    brute = BruteForceIndex(DIM)
+    brute.add(np.arange(2000), vectors)
+    room = np.arange(0, 2000, 200)  # 10 faces, well under the 125 a probed list holds
+    queries = unit_vectors(20, seed=5)
+
+    scores, labels = index.search(queries, k=3, allowed=room)
+    brute_scores, brute_labels = brute.search(queries, k=3, allowed=room)
+
+    # One probed list would miss most of the room; the allowed rows are scored directly
+    np.testing.assert_array_equal(labels, brute_labels)
+    np.testing.assert_allclose(scores, brute_scores, rtol=1e-5)
+    _, labels = index.search(queries[0], k=1, allowed=[room[0], 99999])
+    assert labels[0, 0] == room[0]
+
+
+def test_ivf_add_and_remove_after_training():
+    index, _ = trained("ivf", nlist=16, nprobe=16)
+    extra = unit_vectors(3, seed=9)
+    index.add([5000, 5001, 5002], extra)
+
+    _, labels = index.search(extra, k=1)
+    assert labels[:, 0].tolist() == [5000, 5001, 5002]
+
+    assert index.remove([5001, 0]) == 2
+    assert len(index) == 2001
+    _, labels = index.search(extra[1], k=1)
+    assert labels[0, 0] != 5001
+
+
+@pytest.mark.parametrize("kind,params", [("sq8", {}), ("pq", {"m": 8}),
+                                         ("pq", {"m": 8, "refine": "none"})])
+def test_quantized_recall(kind, params):
+    index, vectors = trained(kind, **params)
+    assert index.is_trained and not index.lossless
+    queries = noisy(vectors[:100])
+
+    _, labels = index.search(queries, k=1)
+
+    assert (labels[:, 0] == np.arange(100)).mean() >= 0.9
+
+
+def test_quantized_defaults_keep_an_8_bit_refine_copy_at_most():
+    assert create_index("sq8", dim=DIM).code_size == DIM
+    assert create_index("pq", dim=DIM, m=8).code_size == 8 + DIM
+
+
+def test_quantized_code_size():
+    assert create_index("sq8", dim=DIM, refine="none").code_size == DIM
+    assert create_index("pq", dim=DIM, m=8, refine="none").code_size == 8
+    assert create_index("pq", dim=DIM, m=8, refine="sq8").code_size == 8 + DIM
+
+
+@pytest.mark.parametrize("kind,params", [("brute", {}), ("ivf", {"nlist": 16, "nprobe": 16}),
+                                         ("sq8", {}), ("pq", {"m": 8})])
+def test_save_and_load_round_trip(tmp_path, kind, params):
+    if kind == "brute":
+        index, vectors = create_index("brute", dim=DIM), unit_vectors(2000)
+        index.add(np.arange(2000), vectors)
+    else:
+        index, vectors = trained(kind, **params)
+    path = str(tmp_path / "index.npz")
+    index.save(path)
+
+    loaded = load_index(path)
+
+    assert type(loaded) is type(index) and len(loaded) == len(index)
+    queries = unit_vectors(10, seed=4)
+    np.testing.assert_array_equal(loaded.search(queries, k=3)[1], index.search(queries, k=3)[1])
+
+
+def test_unknown_backend():
+    with pytest.raises(ValueError):
+        create_index("hnsw")
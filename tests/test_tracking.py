@@ -0,0 +1,90 @@
+import numpy as np
+import pytest
+
+from app.services.tracking import FaceTracker, StreamRecognizer, box_iou, face_quality
+
+
+def detection(x, y, side=120, conf=0.9):
+    return {"box": [x, y, x + side, y + side], "conf": conf, "landmarks": [[x + 10, y + 10]] * 5}
+
+
+def test_box_iou():
+    iou = box_iou([[0, 0, 10, 10]], [[0, 0, 10, 10], [5, 0, 15, 10], [20, 20, 30, 30]])
+
+    np.testing.assert_allclose(iou, [[1.0, 1 / 3, 0.0]], rtol=1e-6)
+
+
+def test_face_quality_penalizes_small_faces():
+    assert face_quality(detection(0, 0, side=224)) == pytest.approx(0.9)
+    assert face_quality(detection(0, 0, side=56)) == pytest.approx(0.45)
+
+
+def test_tracker_keeps_ids_across_frames():
+    tracker = FaceTracker(iou_threshold=0.3, max_missed=1)
+    first = tracker.update([detection(0, 0), detection(300, 0)])
+
+    moved = tracker.update([detection(305, 2), detection(4, 3)])
+    assert [t.track_id for t in moved] == [first[1].track_id, first[0].track_id]
+
+    # A far-away face opens a new track
+    third = tracker.update([detection(600, 0)])
+    assert third[0].track_id not in {t.track_id for t in first}
+
+
+def test_tracker_drops_tracks_after_max_missed():
+    tracker = FaceTracker(max_missed=1)
+    tracker.update([detection(0, 0)])
+    tracker.update([])
+    assert len(tracker.tracks) == 1
+
+    tracker.update([])
+    assert tracker.tracks == []
+
+
+class FakeDetector:
+    def __init__(self, frames):
+        self.frames = iter(frames)
+        self.embedded = 0
+
+    def detect_boxes(self, frame):
+        return next(self.frames)
+
+    def embed_faces(self, frame, landmarks):
+        self.embedded += len(landmarks)
+        return [np.ones(4, dtype=np.float32) for _ in landmarks]
+
+
+def test_stream_embeds_each_track_once_until_reverify():
+    frames = [[detection(0, 0)], [detection(2, 1)], [detection(4, 2)], [detection(6, 3)]]
+    detector = FakeDetector(frames)
+    recognizer = StreamRecognizer(detector, search=lambda embedding: ("alice", 0.9),
+                                  threshold=0.7, reverify_s=2.0)
+
+    results = [recognizer.process(None, timestamp=t) for t in (0.0, 0.5, 1.0, 2.5)]
+
+    assert [r["faces"][0]["cached"] for r in results] == [False, True, True, False]
+    assert all(r["faces"][0]["user_id"] == "alice" for r in results)
+    assert detector.embedded == 2
+    assert recognizer.stats()["embed_ratio"] == 0.5
+
+
+def test_stream_reembeds_when_quality_improves():
+    frames = [[detection(0, 0, side=40)], [detection(0, 0, side=112)]]
+    detector = FakeDetector(frames)
+    recognizer = StreamRecognizer(detector, search=lambda embedding: None, iou_threshold=0.1)
+
+    results = [recognizer.process(None, timestamp=t) for t in (0.0, 0.1)]
+
+    assert [r["faces"][0]["cached"] for r in results] == [False, False]
+    assert results[1]["faces"][0]["recognized"] is False
+
+
+def test_stream_without_tracking_embeds_every_face():
+    detector = FakeDetector([[detection(0, 0)], [detection(0, 0)]])
+    recognizer = StreamRecognizer(detector, search=lambda embedding: ("bob", 0.5), tracking=False)
+
+    results = list(recognizer.run([None, None]))
+
+    assert detector.embedded == 2
+    # Below the threshold: not reported as recognized
+    assert results[0]["faces"][0]["user_id"] is None